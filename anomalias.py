@@ -0,0 +1,206 @@
+"""
+Deteccion de anomalias en streaming por equipo.
+
+Cada equipo ocupa una fila de un arreglo NumPy con un numero fijo de
+floats. Por cada sensor (temperatura, humedad, corriente) se guarda:
+
+- media y varianza exponenciales (actualizacion O(1)),
+- ultimo valor y variacion por segundo respecto a la lectura anterior,
+- un buffer circular de las ultimas VENTANA lecturas para el minimo y
+  maximo recientes.
+
+Con eso se detectan picos (desvio grande respecto a la media o variacion
+por segundo excesiva) y sensores congelados (rango reciente casi nulo).
+Nunca se consulta el historial por lectura; el estado se reconstruye una
+vez al arrancar a partir de las lecturas recientes.
+
+Como en flota.py, el estado vive en el proceso, pero aca no
+se resincroniza con la BD: cada proceso ve solo las lecturas que recibe.
+Si las lecturas de un equipo se reparten entre varios procesos (workers
+de gunicorn que atienden /api/ingest, o un equipo que manda por HTTP y
+por servidor_ingesta.py), cada uno evalua una parte del stream: las
+variaciones por segundo salen de lecturas no consecutivas (se pierden
+picos) y la media tarda mas en estabilizarse. La deteccion es fiel
+cuando cada equipo entra por un solo proceso, p. ej. todos por
+servidor_ingesta.py (un proceso) o la ingesta HTTP en un worker aparte.
+"""
+import math
+import threading
+import time
+
+import numpy as np
+
+from config import ANOMALY_CONFIG
+import models
+
+CANALES = ('temperature', 'humidity', 'current')
+NOMBRES_CANAL = {'temperature': 'temperatura', 'humidity': 'humedad', 'current': 'corriente'}
+
+# Lecturas recordadas para el minimo/maximo recientes
+VENTANA = 16
+
+# Columnas generales de cada fila
+COL_N = 0           # lecturas vistas
+COL_TS = 1          # timestamp de la ultima lectura (epoch s)
+COL_POS = 2         # posicion en el buffer circular
+GENERALES = 3
+
+# Columnas de cada canal (relativas al inicio del canal)
+C_MEDIA = 0
+C_VAR = 1
+C_ULTIMO = 2
+C_TASA = 3
+C_BUFFER = 4
+POR_CANAL = C_BUFFER + VENTANA
+
+COLUMNAS = GENERALES + len(CANALES) * POR_CANAL
+
+_lock = threading.Lock()
+_filas = {}                                   # equipo_id -> fila
+_estado = np.zeros((64, COLUMNAS), dtype=np.float64)
+_reconstruido = False
+
+
+def _fila(equipo_id):
+    """Retorna la fila del equipo, creandola si hace falta"""
+    global _estado
+    fila = _filas.get(equipo_id)
+    if fila is None:
+        fila = len(_filas)
+        if fila >= len(_estado):
+            _estado = np.vstack([_estado, np.zeros_like(_estado)])
+        _filas[equipo_id] = fila
+    return fila
+
+
+def _actualizar(fila, valores, ts, evaluar):
+    """
+    Actualiza el estado de un equipo con una lectura
+    Si evaluar es True retorna la lista de anomalias detectadas
+    """
+    cfg = ANOMALY_CONFIG
+    alpha = cfg['alpha']
+    estado = _estado[fila]
+    n = int(estado[COL_N])
+    dt = ts - estado[COL_TS] if n else 0.0
+    pos = int(estado[COL_POS])
+    anomalias = []
+
+    for i, canal in enumerate(CANALES):
+        base = GENERALES + i * POR_CANAL
+        x = valores[i]
+
+        if n == 0:
+            estado[base + C_MEDIA] = x
+            estado[base + C_VAR] = 0.0
+            estado[base + C_TASA] = 0.0
+            estado[base + C_BUFFER:base + POR_CANAL] = x
+        else:
+            media = estado[base + C_MEDIA]
+            var = estado[base + C_VAR]
+            tasa = (x - estado[base + C_ULTIMO]) / dt if dt > 0 else 0.0
+
+            if evaluar and n >= cfg['warmup']:
+                desvio = abs(x - media)
+                if desvio >= cfg['min_delta'][canal] and (
+                    desvio > cfg['z_max'] * math.sqrt(var) or abs(tasa) > cfg['max_rate'][canal]
+                ):
+                    anomalias.append(('spike', canal, x, media))
+
+            diff = x - media
+            incremento = alpha * diff
+            estado[base + C_MEDIA] = media + incremento
+            estado[base + C_VAR] = (1 - alpha) * (var + diff * incremento)
+            estado[base + C_TASA] = tasa
+            estado[base + C_BUFFER + pos] = x
+
+        estado[base + C_ULTIMO] = x
+
+        if evaluar and n + 1 >= VENTANA:
+            buffer = estado[base + C_BUFFER:base + POR_CANAL]
+            if buffer.max() - buffer.min() < cfg['flat_range'][canal]:
+                anomalias.append(('flatline', canal, x, None))
+
+    estado[COL_N] = n + 1
+    estado[COL_TS] = ts
+    estado[COL_POS] = (pos + 1) % VENTANA
+    return anomalias
+
+
+def _alerta(tipo, canal, valor, media):
+    nombre = NOMBRES_CANAL[canal]
+    if tipo == 'spike':
+        return {
+            'type': f'anomaly_spike_{canal}',
+            'message': f'Cambio brusco de {nombre}: {valor} (media {media:.2f})',
+            'severity': 'warning',
+            'value': valor
+        }
+    return {
+        'type': f'anomaly_flatline_{canal}',
+        'message': f'Sensor de {nombre} sin variacion (valor {valor})',
+        'severity': 'warning',
+        'value': valor
+    }
+
+
+def reconstruir(minutos=None):
+    """Reconstruye el estado a partir de las lecturas recientes"""
+    global _reconstruido
+    minutos = minutos or ANOMALY_CONFIG['rebuild_minutes']
+    lecturas = models.get_recent_readings_since(minutos)
+    if lecturas is None:
+        return False
+
+    with _lock:
+        for r in lecturas:
+            ts = r['timestamp'].timestamp() if r['timestamp'] else time.time()
+            _actualizar(
+                _fila(r['sensor_id']),
+                (float(r['temperatura']), float(r['humedad']), float(r['corriente'])),
+                ts, evaluar=False
+            )
+        _reconstruido = True
+
+    print(f"[Anomalias] Estado reconstruido con {len(lecturas)} lecturas de {len(_filas)} equipos")
+    return True
+
+
+def evaluar(equipo_id, temperature, humidity, current, timestamp=None):
+    """
+    Actualiza el estado del equipo con una lectura y retorna las alertas
+    de anomalia (mismo formato que predictor.check_alerts)
+    """
+    global _reconstruido
+    if not _reconstruido:
+        # Un solo intento: sin BD se arranca con el estado vacio
+        _reconstruido = True
+        reconstruir()
+
+    ts = timestamp.timestamp() if timestamp else time.time()
+    with _lock:
+        anomalias = _actualizar(_fila(equipo_id), (temperature, humidity, current), ts, evaluar=True)
+
+    return [_alerta(*a) for a in anomalias]
+
+
+def estadisticas(equipo_id):
+    """Retorna el estado actual de un equipo (media, desvio, min, max, tasa por sensor)"""
+    with _lock:
+        fila = _filas.get(equipo_id)
+        if fila is None:
+            return None
+        estado = _estado[fila].copy()
+
+    resultado = {'lecturas': int(estado[COL_N])}
+    for i, canal in enumerate(CANALES):
+        base = GENERALES + i * POR_CANAL
+        buffer = estado[base + C_BUFFER:base + POR_CANAL]
+        resultado[canal] = {
+            'media': round(float(estado[base + C_MEDIA]), 3),
+            'desvio': round(math.sqrt(max(estado[base + C_VAR], 0.0)), 3),
+            'minimo': float(buffer.min()),
+            'maximo': float(buffer.max()),
+            'tasa': round(float(estado[base + C_TASA]), 4)
+        }
+    return resultado
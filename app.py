@@ -1,67 +1,261 @@
-from flask import Flask, request, jsonify
+import functools
+import math
+from datetime import datetime
+from flask import Flask, g, request, jsonify
 from flask_cors import CORS
-from config import SERVER_CONFIG
+from config import FLEET_CONFIG, SERVER_CONFIG, SESSION_CONFIG
+import flota
+import formatos
+import incidentes
+import ingesta
+import limites
 import models
+import notificaciones
+import perfilador
 import predictor
+import protocolo_binario
+import registros
+import reglas
+import replicas
+import resiliencia
+import rollup
+import shards
+import sesiones
+import spool
+import versiones
 
 app = Flask(__name__)
 CORS(app)
 
+# Reenviar lecturas que quedaron en el spool de una caida anterior de la BD
+spool.reanudar()
+
+def _cliente():
+    """Identifica al cliente del request (para leer lo propio desde el primario)"""
+    reenviado = request.headers.get('X-Forwarded-For')
+    if reenviado:
+        return reenviado.split(',')[0].strip()
+    return request.remote_addr
+
+
+# Rutas de consulta que se rechazan primero cuando la ingesta esta al limite
+RUTAS_SIN_PRIORIDAD = ('/api/dashboard', '/api/history', '/api/historial', '/api/explicacion',
+                       '/api/alertas', '/api/equipos', '/api/fleet', '/api/perfiles')
+
+
+@app.before_request
+def _priorizar_ingesta():
+    """Bajo sobrecarga de ingesta las consultas responden 503 para que las lecturas sigan entrando"""
+    if (request.method == 'GET' and request.path.startswith(RUTAS_SIN_PRIORIDAD)
+            and limites.ingesta_saturada()):
+        respuesta = jsonify({'error': 'Ingesta al limite, reintente la consulta mas tarde'})
+        respuesta.status_code = 503
+        respuesta.headers['Retry-After'] = '2'
+        return respuesta
+
+
+@app.before_request
+def _enrutar_lecturas():
+    replicas.iniciar_request(_cliente())
+
+
+@app.before_request
+def _autenticar():
+    """Verifica el token de sesion, si el request trae uno"""
+    g.sesion = None
+    encabezado = request.headers.get('Authorization', '')
+    if encabezado.startswith('Bearer '):
+        g.sesion = sesiones.verificar(encabezado[7:].strip())
+        if g.sesion is None:
+            return jsonify({'error': 'Token invalido o vencido'}), 401
+
+
+@app.before_request
+def _iniciar_perfil():
+    """Perfila el request si lo pide un rol de gestion o si le toca en el muestreo"""
+    g.perfil = None
+    try:
+        modo = perfilador.modo_pedido(
+            request.headers.get('X-Perfilar') or request.args.get('perfilar')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if modo is not None and not sesiones.puede_gestionar(g.sesion):
+        return jsonify({'error': 'Perfilado solo para roles de gestion'}), 403
+    g.perfil = perfilador.iniciar(modo)
+
+
+@app.after_request
+def _terminar_perfil(respuesta):
+    """El perfil se cierra con la respuesta (despues de enviar el cuerpo si es streaming)"""
+    perfil = g.pop('perfil', None)
+    if perfil is not None:
+        respuesta.headers['X-Perfil'] = perfil.modo
+        respuesta.call_on_close(functools.partial(
+            perfil.terminar, request.method, request.path, respuesta.status_code
+        ))
+    return respuesta
+
+
+def _sin_sesion():
+    """Respuesta para un request sin token cuando SESSION_CONFIG['requerida']"""
+    return jsonify({'error': 'Sesion requerida'}), 401
+
+
+# Con SESSION_REQUIRED=0 (solo desarrollo) un request sin token pasa como
+# si fuera de gestion: en ese modo los roles no protegen nada, porque
+# basta con no mandar el token.
+
+def _requiere_gestion(vista):
+    """Solo roles de gestion (SESSION_CONFIG['roles_gestion'])"""
+    @functools.wraps(vista)
+    def envoltura(*args, **kwargs):
+        if g.sesion is None:
+            if SESSION_CONFIG['requerida']:
+                return _sin_sesion()
+        elif not sesiones.puede_gestionar(g.sesion):
+            return jsonify({'error': 'No autorizado'}), 403
+        return vista(*args, **kwargs)
+    return envoltura
+
+
+def _equipo_autorizado(equipo_id):
+    """
+    Equipo que puede consultar la sesion del request
+    Un usuario sin rol de gestion solo ve su equipo asignado
+    Retorna (equipo_id, None) o (None, respuesta de error)
+    """
+    if g.sesion is None:
+        if SESSION_CONFIG['requerida']:
+            return None, _sin_sesion()
+        return equipo_id, None
+    if sesiones.puede_gestionar(g.sesion):
+        return equipo_id, None
+    propio = g.sesion['equipo_id']
+    if not propio or (equipo_id and equipo_id != propio):
+        return None, (jsonify({'error': 'No autorizado para este equipo'}), 403)
+    return propio, None
+
+
+def _no_modificado(etag):
+    """Retorna True si el cliente ya tiene la version indicada (sin ETag, nunca)"""
+    return etag is not None and request.if_none_match.contains(etag)
+
+
+def _respuesta_304(etag):
+    """Respuesta vacia 304 con el ETag vigente"""
+    respuesta = app.response_class(status=304)
+    respuesta.set_etag(etag)
+    respuesta.headers['Cache-Control'] = 'no-cache'
+    return respuesta
+
+
+def _con_etag(respuesta, etag):
+    """Agrega el ETag a una respuesta exitosa"""
+    if etag is None:
+        return respuesta
+    respuesta.set_etag(etag)
+    respuesta.headers['Cache-Control'] = 'no-cache'
+    return respuesta
+
+
+def _con_control_de_carga(vista):
+    """Descarta requests de ingesta con 503 si el proceso esta saturado"""
+    @functools.wraps(vista)
+    def envoltura(*args, **kwargs):
+        if not limites.entrar():
+            respuesta = jsonify({'error': 'Servidor saturado, reintente mas tarde'})
+            respuesta.status_code = 503
+            respuesta.headers['Retry-After'] = '1'
+            return respuesta
+        try:
+            return vista(*args, **kwargs)
+        finally:
+            limites.salir()
+    return envoltura
+
+
+def _respuesta_429(equipo_id, espera):
+    """Respuesta para un equipo que supero su limite de lecturas"""
+    respuesta = jsonify({
+        'error': 'Limite de lecturas excedido',
+        'equipo_id': equipo_id,
+        'retry_after': round(espera, 3)
+    })
+    respuesta.status_code = 429
+    respuesta.headers['Retry-After'] = str(max(1, math.ceil(espera)))
+    return respuesta
+
+
+def _respuesta_202(equipo_id):
+    """Lectura aceptada en el spool local mientras la BD no esta disponible"""
+    return jsonify({
+        'success': True,
+        'equipo_id': equipo_id,
+        'spooled': True,
+        'message': 'BD no disponible, lectura guardada para reenviar'
+    }), 202
+
+
+def _respuesta_historial(payload):
+    """JSON del historial, comprimido en streaming si el cliente acepta gzip"""
+    if not formatos.acepta_gzip(request.headers.get('Accept-Encoding')):
+        return jsonify(payload)
+    
+    respuesta = app.response_class(
+        formatos.json_gzip_stream(payload, app.json.default),
+        mimetype='application/json'
+    )
+    respuesta.headers['Content-Encoding'] = 'gzip'
+    respuesta.headers['Vary'] = 'Accept-Encoding'
+    return respuesta
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Endpoint para verificar que el servidor está funcionando"""
     return jsonify({'status': 'ok', 'message': 'Backend funcionando correctamente'})
 
+
+@app.route('/api/metricas', methods=['GET'])
+def get_metricas():
+    """Tiempos por etapa de la ingesta y estado de BD, shards, spool, replicas, notificaciones y perfilador (de este proceso)"""
+    return jsonify({
+        'ingesta': ingesta.INGESTA.metricas(),
+        'bd': resiliencia.bd.como_dict(),
+        'shards': shards.estado() if shards.activo() else [],
+        'spool': spool.estado(),
+        'replicas': replicas.estado(),
+        'notificaciones': notificaciones.estado(),
+        'perfilador': perfilador.estado()
+    })
+
 @app.route('/api/ingest', methods=['POST'])
+@_con_control_de_carga
 def ingest_data():
     """Recibe datos del ESP32 y los procesa"""
     try:
-        data = request.get_json()
-        
-        temperature = float(data.get('temperature', 0))
-        humidity = float(data.get('humidity', 0))
-        current = float(data.get('current', 0))
-        
-        print(f"[Datos recibidos] Temp: {temperature}°C, Hum: {humidity}%, Corriente: {current}A")
+        permitido, espera = limites.permitir('ESP32_001')
+        if not permitido:
+            return _respuesta_429('ESP32_001', espera)
         
-        reading_id = models.insert_sensor_reading(temperature, humidity, current)
+        resultado = ingesta.procesar_json(request.get_json(), 'ESP32_001')
         
-        if not reading_id:
+        if not resultado:
             return jsonify({'error': 'Error guardando datos'}), 500
         
-        prediction = predictor.make_prediction(temperature, humidity, current)
-        
-        prediction_id = models.insert_prediction(
-            reading_id,
-            prediction['risk_level'],
-            prediction['failure_probability'],
-            prediction['influential_factors']
-        )
-        
-        alerts = predictor.check_alerts(
-            temperature, humidity, current, prediction['risk_level']
-        )
-        
-        for alert in alerts:
-            models.insert_alert(
-                prediction_id,
-                alert['type'],
-                alert['message'],
-                alert['severity']
-            )
-
-            # <NUEVO> Auto-resolver alertas si los valores volvieron a la normalidad
-        models.auto_resolve_alerts(temperature, current)
-        
-        print(f"[Predicción] Riesgo: {prediction['risk_level']} ({prediction['failure_probability']*100:.1f}%)")
+        if resultado.get('spooled'):
+            return _respuesta_202('ESP32_001')
         
         return jsonify({
             'success': True,
-            'reading_id': reading_id,
-            'prediction': prediction,
-            'alerts': alerts
+            'reading_id': resultado['reading_id'],
+            'prediction': resultado.get('prediction'),
+            'alerts': resultado.get('alerts', [])
         })
         
+    except ingesta.LecturaInvalida as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f"[Error] {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -73,86 +267,96 @@ def get_dashboard_data():
     try:
         # <CHANGE> Obtener equipo_id de los query parameters
         equipo_id = request.args.get('equipo_id')
+        equipo_id, error = _equipo_autorizado(equipo_id)
+        if error:
+            return error
+        
+        etag = versiones.etag(
+            'dashboard',
+            versiones.token_lecturas(equipo_id),
+            versiones.token_alertas(equipo_id)
+        )
+        if _no_modificado(etag):
+            return _respuesta_304(etag)
         
         print(f"[API Dashboard] Solicitado para equipo_id: {equipo_id}")
         
-        connection = models.get_db_connection()
-        if not connection:
+        # <CHANGE> Filtrar por equipo_id si se especifica
+        # (con equipo se consulta su shard; sin equipo, todos y se mezclan)
+        if equipo_id:
+            sql = """
+                SELECT ls.*, p.nivel_riesgo, p.riesgo_predicho
+                FROM lecturas_sensores ls
+                LEFT JOIN predicciones p ON ls.id = p.lectura_id
+                WHERE ls.sensor_id = %s
+                ORDER BY ls.timestamp DESC
+                LIMIT 1
+            """
+            lecturas = models.consultar_shards(
+                sql, (equipo_id,), equipo_id=equipo_id, registro=registros.Lectura
+            )
+            print(f"[API Dashboard] Filtrando por sensor_id: {equipo_id}")
+        else:
+            sql = """
+                SELECT ls.*, p.nivel_riesgo, p.riesgo_predicho
+                FROM lecturas_sensores ls
+                LEFT JOIN predicciones p ON ls.id = p.lectura_id
+                ORDER BY ls.timestamp DESC
+                LIMIT 1
+            """
+            lecturas = models.consultar_shards(
+                sql, orden='timestamp', limite=1, registro=registros.Lectura
+            )
+            print(f"[API Dashboard] Sin filtro")
+        
+        if lecturas is None:
             return jsonify({'error': 'No hay conexion'}), 500
         
-        with connection.cursor() as cursor:
-            # <CHANGE> Filtrar por equipo_id si se especifica
-            if equipo_id:
-                sql = """
-                    SELECT ls.*, p.nivel_riesgo, p.riesgo_predicho
-                    FROM lecturas_sensores ls
-                    LEFT JOIN predicciones p ON ls.id = p.lectura_id
-                    WHERE ls.sensor_id = %s
-                    ORDER BY ls.timestamp DESC
-                    LIMIT 1
-                """
-                cursor.execute(sql, (equipo_id,))
-                print(f"[API Dashboard] Filtrando por sensor_id: {equipo_id}")
-            else:
-                sql = """
-                    SELECT ls.*, p.nivel_riesgo, p.riesgo_predicho
-                    FROM lecturas_sensores ls
-                    LEFT JOIN predicciones p ON ls.id = p.lectura_id
-                    ORDER BY ls.timestamp DESC
-                    LIMIT 1
-                """
-                cursor.execute(sql)
-                print(f"[API Dashboard] Sin filtro")
-            
-            current_reading = cursor.fetchone()
-            
-            if not current_reading:
-                return jsonify({'error': 'No hay datos disponibles'}), 404
-            
-            print(f"[API Dashboard] Lectura obtenida - Sensor: {current_reading.get('sensor_id')}, Temp: {current_reading.get('temperatura')}, Riesgo: {current_reading.get('nivel_riesgo')}")
-            
-            # <CHANGE> Filtrar alertas por equipo_id si se especifica
-            if equipo_id:
-                sql_alerts = """
-                    SELECT * FROM alertas 
-                    WHERE equipo_id = %s AND (estado != 'resuelto' OR estado IS NULL)
-                    ORDER BY timestamp DESC LIMIT 10
-                """
-                cursor.execute(sql_alerts, (equipo_id,))
-            else:
-                sql_alerts = """
-                    SELECT * FROM alertas 
-                    WHERE estado != 'resuelto' OR estado IS NULL
-                    ORDER BY timestamp DESC LIMIT 10
-                """
-                cursor.execute(sql_alerts)
-            
-            alerts_raw = cursor.fetchall()
+        current_reading = lecturas[0] if lecturas else None
         
-        connection.close()
+        if not current_reading:
+            return jsonify({'error': 'No hay datos disponibles'}), 404
         
-        # Formatear alertas
-        formatted_alerts = []
-        for a in alerts_raw:
-            formatted_alerts.append({
-                'id': a['id'],
-                'alert_type': a.get('tipo', ''),
-                'message': a.get('mensaje', ''),
-                'severity': a.get('severidad', 'warning'),
-                'timestamp': a['timestamp'].isoformat() if a.get('timestamp') else None,
-                'status': a.get('estado', 'pendiente')
-            })
+        print(f"[API Dashboard] Lectura obtenida - Sensor: {current_reading.equipo_id}, Temp: {current_reading.temperatura}, Riesgo: {current_reading.nivel_riesgo}")
         
-        return jsonify({
+        # <CHANGE> Filtrar alertas por equipo_id si se especifica
+        if equipo_id:
+            sql_alerts = """
+                SELECT * FROM alertas 
+                WHERE equipo_id = %s AND (estado != 'resuelto' OR estado IS NULL)
+                ORDER BY timestamp DESC LIMIT 10
+            """
+            alerts_raw = models.consultar_shards(
+                sql_alerts, (equipo_id,), equipo_id=equipo_id, registro=registros.Alerta
+            )
+        else:
+            sql_alerts = """
+                SELECT * FROM alertas 
+                WHERE estado != 'resuelto' OR estado IS NULL
+                ORDER BY timestamp DESC LIMIT 10
+            """
+            alerts_raw = models.consultar_shards(
+                sql_alerts, orden='timestamp', limite=10, registro=registros.Alerta
+            )
+        alerts_raw = alerts_raw or []
+        
+        formatted_alerts = [a.como_json_dashboard() for a in alerts_raw]
+        
+        # Pronostico de cruce de umbrales (estado en memoria; relee la ventana del equipo si esta vieja)
+        sensor_id = current_reading.equipo_id
+        forecast = predictor.forecast_time_to_threshold(sensor_id, reglas.perfil_para(sensor_id))
+        
+        return _con_etag(jsonify({
             'current': {
-                'temperature': float(current_reading['temperatura']),
-                'humidity': float(current_reading['humedad']),
-                'current': float(current_reading['corriente']),
-                'risk_level': current_reading.get('nivel_riesgo', 'bajo'),
-                'failure_probability': float(current_reading.get('riesgo_predicho', 0))
+                'temperature': float(current_reading.temperatura),
+                'humidity': float(current_reading.humedad),
+                'current': float(current_reading.corriente),
+                'risk_level': current_reading.nivel_riesgo,
+                'failure_probability': float(current_reading.riesgo_predicho or 0)
             },
-            'alerts': formatted_alerts
-        })
+            'alerts': formatted_alerts,
+            'forecast': forecast
+        }), etag)
         
     except Exception as e:
         print(f"[Error Dashboard] {str(e)}")
@@ -166,24 +370,18 @@ def get_dashboard_data():
 
 @app.route('/api/history', methods=['GET'])
 def get_history():
-    """Obtiene el historial de lecturas"""
+    """Obtiene el historial de lecturas (solo del equipo propio sin rol de gestion)"""
     try:
+        equipo_id, error = _equipo_autorizado(request.args.get('equipo_id'))
+        if error:
+            return error
         limit = int(request.args.get('limit', 100))
-        readings = models.get_latest_readings(limit=limit)
-        
-        formatted_readings = []
-        for r in readings:
-            formatted_readings.append({
-                'id': r['id'],
-                'temperature': r['temperatura'],
-                'humidity': r['humedad'],
-                'current': r['corriente'],
-                'timestamp': r['timestamp'].isoformat() if r['timestamp'] else None,
-                'risk_level': r.get('nivel_riesgo'),
-                'failure_probability': r.get('riesgo_predicho')
-            })
+        readings = models.get_latest_readings(limit=limit, equipo_id=equipo_id)
         
-        return jsonify({'readings': formatted_readings})
+        if request.args.get('format') == 'columnar':
+            return _respuesta_historial({'readings': formatos.lecturas_columnar(readings)})
+        
+        return _respuesta_historial({'readings': [r.como_json() for r in readings]})
         
     except Exception as e:
         print(f"[Error Historial] {str(e)}")
@@ -215,14 +413,18 @@ def login():
         
         # <CHANGE> Usar password_hash en lugar de password
         if user and user['password_hash'] == password:
+            equipo_id = user.get('equipo_id', None)
+            sesiones.recordar(user['id'], user['rol'], equipo_id)
             return jsonify({
                 'success': True,
+                'token': sesiones.crear_token(user['id'], user['rol'], equipo_id),
+                'expires_in': SESSION_CONFIG['ttl'],
                 'user': {
                     'id': user['id'],
                     'name': user['nombre'],
                     'email': user['email'],
                     'role': user['rol'],
-                    'equipo_id': user.get('equipo_id', None)
+                    'equipo_id': equipo_id
                 }
             })
         else:
@@ -242,104 +444,163 @@ def get_historial():
         start_date = request.args.get('start_date')
         end_date = request.args.get('end_date')
         equipo_id = request.args.get('equipo_id')  # <CHANGE> Agregar filtro por equipo
+        equipo_id, error = _equipo_autorizado(equipo_id)
+        if error:
+            return error
         
         print(f"[API Historial] Filtros - Inicio: {start_date}, Fin: {end_date}, Equipo: {equipo_id}")
         
-        connection = models.get_db_connection()
-        if not connection:
+        sql = """
+            SELECT r.id, r.sensor_id, r.temperatura, r.humedad, r.corriente, r.timestamp,
+                   p.nivel_riesgo, p.riesgo_predicho
+            FROM lecturas_sensores r
+            LEFT JOIN predicciones p ON r.id = p.lectura_id
+            WHERE 1=1
+        """
+        params = []
+        
+        # <CHANGE> Filtrar por equipo si se especifica
+        if equipo_id:
+            sql += " AND r.sensor_id = %s"
+            params.append(equipo_id)
+        
+        if start_date:
+            sql += " AND r.timestamp >= %s"
+            params.append(start_date + ' 00:00:00')
+        
+        if end_date:
+            sql += " AND r.timestamp <= %s"
+            params.append(end_date + ' 23:59:59')
+        
+        sql += " ORDER BY r.timestamp DESC LIMIT 500"
+        
+        readings = models.consultar_shards(
+            sql, params if params else None, orden='timestamp', limite=500, equipo_id=equipo_id,
+            registro=registros.Lectura
+        )
+        if readings is None:
             return jsonify({'error': 'No hay conexion'}), 500
         
-        with connection.cursor() as cursor:
-            sql = """
-                SELECT r.*, p.nivel_riesgo, p.riesgo_predicho, r.sensor_id as equipo_id
-                FROM lecturas_sensores r
-                LEFT JOIN predicciones p ON r.id = p.lectura_id
-                WHERE 1=1
-            """
-            params = []
-            
-            # <CHANGE> Filtrar por equipo si se especifica
-            if equipo_id:
-                sql += " AND r.sensor_id = %s"
-                params.append(equipo_id)
-            
-            if start_date:
-                sql += " AND r.timestamp >= %s"
-                params.append(start_date + ' 00:00:00')
-            
-            if end_date:
-                sql += " AND r.timestamp <= %s"
-                params.append(end_date + ' 23:59:59')
-            
-            sql += " ORDER BY r.timestamp DESC LIMIT 500"
-            
-            cursor.execute(sql, params if params else None)
-            readings = cursor.fetchall()
-        
-        connection.close()
-        
-        formatted_readings = []
-        for r in readings:
-            # <CHANGE> Obtener nombre del equipo
-            equipo_nombre = r.get('sensor_id', 'Desconocido')
-            if equipo_nombre == 'ESP32_001':
-                equipo_nombre = 'Laptop RRHH'
-            elif equipo_nombre == 'ESP32_002':
-                equipo_nombre = 'Laptop Contabilidad'
-            elif equipo_nombre == 'ESP32_003':
-                equipo_nombre = 'Laptop Administracion'
-            
-            formatted_readings.append({
-                'id': r['id'],
-                'temperature': r['temperatura'],
-                'humidity': r['humedad'],
-                'current': r['corriente'],
-                'timestamp': r['timestamp'].isoformat() if r['timestamp'] else None,
-                'risk_level': r.get('nivel_riesgo'),
-                'failure_probability': r.get('riesgo_predicho'),
-                'equipo_id': r.get('sensor_id'),
-                'equipo_nombre': equipo_nombre
+        if request.args.get('format') == 'columnar':
+            print(f"[API Historial] Devolviendo {len(readings)} registros (columnar)")
+            return _respuesta_historial({
+                'readings': formatos.lecturas_columnar(readings, incluir_equipo=True)
             })
         
+        formatted_readings = [r.como_json(incluir_equipo=True) for r in readings]
+        
         print(f"[API Historial] Devolviendo {len(formatted_readings)} registros")
         
-        return jsonify({'readings': formatted_readings})
+        return _respuesta_historial({'readings': formatted_readings})
         
     except Exception as e:
         print(f"[Error Historial] {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+# Ventana maxima de /api/explicacion?window= (7 dias o 7 dias de lecturas por minuto)
+MAX_MINUTOS_EXPLICACION = 7 * 24 * 60
+MAX_LECTURAS_EXPLICACION = 100000
+_UNIDADES_VENTANA = {'m': 1, 'h': 60, 'd': 24 * 60}
+
+
+def _parsear_ventana(texto):
+    """
+    window=30m / 2h / 1d son minutos; window=500 son las ultimas lecturas
+    Retorna ('minutos' | 'lecturas', n) o None si no es valida
+    """
+    texto = texto.strip().lower()
+    unidad = _UNIDADES_VENTANA.get(texto[-1:])
+    numero = texto[:-1] if unidad else texto
+    if not numero.isdigit() or not int(numero):
+        return None
+    if unidad:
+        minutos = int(numero) * unidad
+        return ('minutos', minutos) if minutos <= MAX_MINUTOS_EXPLICACION else None
+    lecturas = int(numero)
+    return ('lecturas', lecturas) if lecturas <= MAX_LECTURAS_EXPLICACION else None
+
+
+def _explicacion_ventana(equipo_id, tipo, n):
+    """Factores promedio de una ventana, sumados desde el rollup por minuto (ver rollup.py)"""
+    if tipo == 'minutos':
+        resumen = rollup.ventana_minutos(n, equipo_id)
+        descripcion = f"los ultimos {n} minutos"
+    else:
+        resumen = rollup.ventana_lecturas(n, equipo_id)
+        descripcion = f"las ultimas {n} lecturas"
+    if resumen is None:
+        return jsonify({'error': 'No hay conexion'}), 500
+    
+    respuesta = {
+        'equipo_id': equipo_id,
+        'equipo_nombre': formatos.nombre_equipo(equipo_id) if equipo_id else 'Todos los equipos',
+        'ventana': {tipo: n},
+        'lecturas': resumen['lecturas'],
+        'minutos_con_datos': resumen['minutos']
+    }
+    if not resumen['lecturas']:
+        respuesta['razon_principal'] = f"No hay predicciones en {descripcion}"
+        respuesta['factores_influyentes'] = []
+        return jsonify(respuesta)
+    
+    factores = sorted(
+        ({'factor': f, 'importancia': resumen[f]} for f in ('Temperatura', 'Humedad', 'Corriente')),
+        key=lambda x: x['importancia'], reverse=True
+    )
+    principal = factores[0]
+    respuesta['razon_principal'] = (
+        f"En {descripcion} el factor de mayor peso fue "
+        f"{principal['factor'].lower()} ({principal['importancia']}% de su umbral en promedio)."
+    )
+    respuesta['factores_influyentes'] = factores
+    respuesta['riesgo_promedio'] = resumen['riesgo']
+    return jsonify(respuesta)
+
+
 # Agregar endpoint para explicabilidad por equipo
 @app.route('/api/explicacion', methods=['GET'])
 def get_explicacion():
     """Obtiene la explicacion del modelo, filtrada por equipo si se especifica"""
     try:
         equipo_id = request.args.get('equipo_id')  # <CHANGE> Agregar filtro por equipo
+        equipo_id, error = _equipo_autorizado(equipo_id)
+        if error:
+            return error
+        
+        # Con window=N (lecturas) o window=30m/2h/1d: promedio de los
+        # factores que el predictor calculo en esa ventana. minutos=N se
+        # acepta como window=Nm
+        if 'window' in request.args or 'minutos' in request.args:
+            if 'window' in request.args:
+                ventana = _parsear_ventana(request.args['window'])
+            else:
+                ventana = _parsear_ventana(request.args['minutos'] + 'm')
+            if ventana is None:
+                return jsonify({'error': (
+                    f'window debe ser un numero de lecturas (1-{MAX_LECTURAS_EXPLICACION}) '
+                    f'o de minutos, horas o dias (30m, 2h, 1d; hasta {MAX_MINUTOS_EXPLICACION // (24 * 60)}d)'
+                )}), 400
+            return _explicacion_ventana(equipo_id, *ventana)
+        
+        # Ultima lectura con los factores que guardo el predictor
+        sql = """
+            SELECT l.sensor_id, l.temperatura, l.humedad, l.corriente, l.timestamp,
+                   p.factor_temperatura, p.factor_humedad, p.factor_corriente
+            FROM lecturas_sensores l
+            LEFT JOIN predicciones p ON p.lectura_id = l.id
+        """
+        if equipo_id:
+            sql += " WHERE l.sensor_id = %s ORDER BY l.timestamp DESC LIMIT 1"
+            lecturas = models.consultar_shards(sql, (equipo_id,), equipo_id=equipo_id)
+        else:
+            # La ultima lectura de cualquier equipo
+            sql += " ORDER BY l.timestamp DESC LIMIT 1"
+            lecturas = models.consultar_shards(sql, orden='timestamp', limite=1)
         
-        connection = models.get_db_connection()
-        if not connection:
+        if lecturas is None:
             return jsonify({'error': 'No hay conexion'}), 500
         
-        with connection.cursor() as cursor:
-            if equipo_id:
-                # Obtener ultima lectura del equipo especifico
-                sql = """
-                    SELECT * FROM lecturas_sensores 
-                    WHERE sensor_id = %s 
-                    ORDER BY timestamp DESC LIMIT 1
-                """
-                cursor.execute(sql, (equipo_id,))
-            else:
-                # Obtener la ultima lectura de cualquier equipo
-                sql = """
-                    SELECT * FROM lecturas_sensores 
-                    ORDER BY timestamp DESC LIMIT 1
-                """
-                cursor.execute(sql)
-            
-            current = cursor.fetchone()
-        
-        connection.close()
+        current = lecturas[0] if lecturas else None
         
         if not current:
             return jsonify({
@@ -353,32 +614,22 @@ def get_explicacion():
         humidity = current['humedad']
         corriente = current['corriente']
         
-        # Calcular importancia de cada factor
-        factores = []
-        
-        # Temperatura (importancia 0-35%)
-        temp_importance = min(abs(temp - 25) * 2, 35)
-        factores.append({
-            'factor': 'Temperatura',
-            'importancia': round(temp_importance, 1)
-        })
-        
-        # Humedad (importancia 0-25%)
-        humidity_importance = min(abs(humidity - 50) * 0.5, 25)
-        factores.append({
-            'factor': 'Humedad',
-            'importancia': round(humidity_importance, 1)
-        })
-        
-        # Corriente (importancia 0-40%)
-        current_importance = min(abs(corriente) * 8, 40)
-        factores.append({
-            'factor': 'Corriente',
-            'importancia': round(current_importance, 1)
-        })
-        
-        # Ordenar por importancia descendente
-        factores.sort(key=lambda x: x['importancia'], reverse=True)
+        # Importancia de cada factor: la misma que uso el predictor (sin
+        # prediccion guardada se calcula con el perfil del equipo)
+        if current['factor_temperatura'] is not None:
+            importancia = {
+                'Temperatura': current['factor_temperatura'],
+                'Humedad': current['factor_humedad'],
+                'Corriente': current['factor_corriente']
+            }
+        else:
+            importancia = predictor.calculate_influential_factors(
+                temp, humidity, corriente, reglas.perfil_para(current['sensor_id'])
+            )
+        factores = sorted(
+            ({'factor': f, 'importancia': round(v, 1)} for f, v in importancia.items()),
+            key=lambda x: x['importancia'], reverse=True
+        )
         
         # Generar razon principal
         factor_principal = factores[0]
@@ -423,13 +674,23 @@ def get_explicacion():
 
 @app.route('/api/alertas', methods=['GET'])
 def get_alertas():
-    """Obtiene las alertas activas del sistema"""
+    """Obtiene las alertas activas del sistema (solo del equipo propio sin rol de gestion)"""
     try:
-        alertas = models.get_recent_alerts(limit=10)
+        equipo_id, error = _equipo_autorizado(request.args.get('equipo_id'))
+        if error:
+            return error
         
-        return jsonify({
+        etag = versiones.etag(
+            'alertas', versiones.token_alertas(equipo_id)
+        )
+        if _no_modificado(etag):
+            return _respuesta_304(etag)
+        
+        alertas = models.get_recent_alerts(limit=10, equipo_id=equipo_id)
+        
+        return _con_etag(jsonify({
             'alertas': alertas
-        })
+        }), etag)
         
     except Exception as e:
         print(f"[Error Alertas] {str(e)}")
@@ -439,16 +700,26 @@ def get_alertas():
 
 
 @app.route('/api/alertas/<int:alerta_id>/estado', methods=['PUT'])
+@_requiere_gestion
 def update_alert_status(alerta_id):
     """Actualiza el estado de una alerta (solo para admin/TI)"""
     try:
         data = request.get_json()
         nuevo_estado = data.get('estado')
         notas = data.get('notas', '')
+        equipo_id = data.get('equipo_id')   # opcional: ubica el shard de la alerta
         
         print(f"[Alertas] Actualizando alerta {alerta_id} a estado: {nuevo_estado}")
         
-        result = models.update_alert_status(alerta_id, nuevo_estado, notas)
+        result = models.update_alert_status(alerta_id, nuevo_estado, notas, equipo_id)
+        
+        if result and nuevo_estado == 'resuelto':
+            incidentes.olvidar_alerta(alerta_id)
+            flota.cerrar_alerta(alerta_id)
+        
+        if result:
+            # Sus proximas lecturas van al primario (las replicas pueden ir atrasadas)
+            replicas.registrar_escritura(_cliente())
         
         if result:
             return jsonify({'success': True, 'message': 'Alerta actualizada'})
@@ -466,58 +737,42 @@ def get_all_alerts():
     """Obtiene todas las alertas, filtradas por equipo si se especifica"""
     try:
         equipo_id = request.args.get('equipo_id')  # <CHANGE> Agregar filtro por equipo
+        equipo_id, error = _equipo_autorizado(equipo_id)
+        if error:
+            return error
         
-        connection = models.get_db_connection()
-        if not connection:
+        etag = versiones.etag(
+            'alertas-todas', versiones.token_alertas(equipo_id)
+        )
+        if _no_modificado(etag):
+            return _respuesta_304(etag)
+        
+        sql = """
+            SELECT a.id, a.prediccion_id, a.tipo, a.mensaje, a.severidad, 
+                   a.timestamp, a.leida, a.estado, a.notas, a.equipo_id
+            FROM alertas a
+            WHERE 1=1
+        """
+        params = []
+        
+        # <CHANGE> Filtrar por equipo si se especifica
+        if equipo_id:
+            sql += " AND a.equipo_id = %s"
+            params.append(equipo_id)
+        
+        sql += " ORDER BY a.timestamp DESC LIMIT 50"
+        
+        # Sin equipo: en paralelo en todos los shards, mezcladas por fecha
+        alertas = models.consultar_shards(
+            sql, params if params else None, orden='timestamp', limite=50, equipo_id=equipo_id,
+            registro=registros.Alerta
+        )
+        if alertas is None:
             return jsonify({'error': 'No hay conexion'}), 500
         
-        with connection.cursor() as cursor:
-            sql = """
-                SELECT a.id, a.prediccion_id, a.tipo, a.mensaje, a.severidad, 
-                       a.timestamp, a.leida, a.estado, a.notas, a.equipo_id
-                FROM alertas a
-                WHERE 1=1
-            """
-            params = []
-            
-            # <CHANGE> Filtrar por equipo si se especifica
-            if equipo_id:
-                sql += " AND a.equipo_id = %s"
-                params.append(equipo_id)
-            
-            sql += " ORDER BY a.timestamp DESC LIMIT 50"
-            
-            cursor.execute(sql, params if params else None)
-            alertas = cursor.fetchall()
+        formatted_alerts = [a.como_json() for a in alertas]
         
-        connection.close()
-        
-        formatted_alerts = []
-        for a in alertas:
-            # <CHANGE> Obtener nombre del equipo
-            eq_id = a.get('equipo_id', 'Desconocido')
-            equipo_nombre = eq_id
-            if eq_id == 'ESP32_001':
-                equipo_nombre = 'Laptop RRHH'
-            elif eq_id == 'ESP32_002':
-                equipo_nombre = 'Laptop Contabilidad'
-            elif eq_id == 'ESP32_003':
-                equipo_nombre = 'Laptop Administracion'
-            
-            formatted_alerts.append({
-                'id': a['id'],
-                'tipo': a.get('tipo', ''),
-                'mensaje': a.get('mensaje', ''),
-                'severidad': a.get('severidad', ''),
-                'timestamp': a['timestamp'].isoformat() if a.get('timestamp') else None,
-                'estado': a.get('estado', 'pendiente'),
-                'notas': a.get('notas', ''),
-                'leida': a.get('leida', False),
-                'equipo_id': eq_id,
-                'equipo_nombre': equipo_nombre
-            })
-        
-        return jsonify({'alertas': formatted_alerts})
+        return _con_etag(jsonify({'alertas': formatted_alerts}), etag)
         
     except Exception as e:
         print(f"[Error Todas Alertas] {str(e)}")
@@ -531,6 +786,7 @@ def get_all_alerts():
 # =============================================
 
 @app.route('/api/ingest/v2', methods=['POST'])
+@_con_control_de_carga
 def ingest_data_v2():
     """Recibe datos del ESP32 con ID de equipo"""
     try:
@@ -538,125 +794,169 @@ def ingest_data_v2():
         
         # Obtener equipo_id del request (obligatorio en v2)
         equipo_id = data.get('equipo_id', 'ESP32_001')
-        temperature = float(data.get('temperature', 0))
-        humidity = float(data.get('humidity', 0))
-        current = float(data.get('current', 0))
         
-        print(f"[Equipo: {equipo_id}] Temp: {temperature}°C, Hum: {humidity}%, Corriente: {current}A")
+        permitido, espera = limites.permitir(equipo_id)
+        if not permitido:
+            return _respuesta_429(equipo_id, espera)
         
-        # Usar funciones multi-equipo
-        reading_id = models.insert_sensor_reading_multi(equipo_id, temperature, humidity, current)
+        resultado = ingesta.procesar_json(data, equipo_id)
         
-        if not reading_id:
+        if not resultado:
             return jsonify({'error': 'Error guardando datos'}), 500
         
-        prediction = predictor.make_prediction(temperature, humidity, current)
+        if resultado.get('spooled'):
+            return _respuesta_202(equipo_id)
         
-        prediction_id = models.insert_prediction_multi(
-            reading_id,
-            equipo_id,
-            prediction['risk_level'],
-            prediction['failure_probability'],
-            prediction['influential_factors']
-        )
+        return jsonify({'success': True, **resultado})
         
-        alerts = predictor.check_alerts(
-            temperature, humidity, current, prediction['risk_level']
-        )
-        
-        for alert in alerts:
-            models.insert_alert_multi(
-                prediction_id,
-                equipo_id,
-                alert['type'],
-                alert['message'],
-                alert['severity']
+    except ingesta.LecturaInvalida as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"[Error] {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/ingest/bin', methods=['POST'])
+@_con_control_de_carga
+def ingest_data_bin():
+    """Recibe una o varias tramas binarias del ESP32 (ver protocolo_binario.py)"""
+    try:
+        try:
+            tramas = protocolo_binario.parsear_tramas(request.get_data(cache=False))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # Se validan todas las tramas antes de guardar ninguna, igual que el cuerpo
+        for i, (equipo_id, seq, timestamp, temperature, humidity, current) in enumerate(tramas):
+            try:
+                ingesta.validar(ingesta.Lectura(equipo_id, temperature, humidity, current, timestamp, seq))
+            except ingesta.LecturaInvalida as e:
+                return jsonify({'error': f'Trama {i}: {e}'}), 400
+        
+        print(f"[Ingesta binaria] {len(tramas)} tramas recibidas")
+        
+        resultados = []
+        errores = 0
+        limitadas = 0
+        en_spool = 0
+        espera_max = 0.0
+        for equipo_id, seq, timestamp, temperature, humidity, current in tramas:
+            permitido, espera = limites.permitir(equipo_id)
+            if not permitido:
+                limitadas += 1
+                espera_max = max(espera_max, espera)
+                resultados.append({'equipo_id': equipo_id, 'seq': seq, 'error': 'rate_limited'})
+                continue
+            
+            resultado = ingesta.procesar_lectura(
+                equipo_id, temperature, humidity, current, timestamp, seq
             )
+            if not resultado:
+                errores += 1
+                resultados.append({'equipo_id': equipo_id, 'seq': seq, 'error': 'Error guardando datos'})
+                continue
+            
+            if resultado.get('duplicate'):
+                resultados.append({
+                    'equipo_id': equipo_id,
+                    'seq': seq,
+                    'reading_id': resultado['reading_id'],
+                    'duplicate': True
+                })
+                continue
+            
+            if resultado.get('spooled'):
+                en_spool += 1
+                resultados.append({'equipo_id': equipo_id, 'seq': seq, 'spooled': True})
+                continue
+            
+            resultados.append({
+                'equipo_id': equipo_id,
+                'seq': seq,
+                'reading_id': resultado['reading_id'],
+                'risk_level': resultado['prediction']['risk_level'],
+                'alerts': len(resultado['alerts'])
+            })
         
-        # Auto-resolver alertas si valores normales
-        models.auto_resolve_alerts(temperature, current)
-        
-        print(f"[{equipo_id}] Riesgo: {prediction['risk_level']} ({prediction['failure_probability']*100:.1f}%)")
+        if limitadas == len(tramas):
+            return _respuesta_429(tramas[0][0], espera_max)
         
+        if errores == len(tramas) - limitadas:
+            status = 500
+        elif en_spool:
+            status = 202
+        else:
+            status = 200
         return jsonify({
-            'success': True,
-            'equipo_id': equipo_id,
-            'reading_id': reading_id,
-            'prediction': prediction,
-            'alerts': alerts
-        })
+            'success': errores == 0 and limitadas == 0,
+            'frames': len(tramas),
+            'errors': errores,
+            'rate_limited': limitadas,
+            'spooled': en_spool,
+            'results': resultados
+        }), status
         
     except Exception as e:
-        print(f"[Error] {str(e)}")
+        print(f"[Error Ingesta Binaria] {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 
 @app.route('/api/equipos/todos', methods=['GET'])
+@_requiere_gestion
 def get_all_equipos():
     """Obtiene todos los equipos con su estado actual (para TI)"""
     try:
+        etag = versiones.etag(
+            'equipos',
+            versiones.token_equipos(),
+            versiones.token_lecturas(),
+            versiones.token_alertas(),
+            versiones.token_conectados()
+        )
+        if _no_modificado(etag):
+            return _respuesta_304(etag)
+        
         equipos = models.get_all_equipos()
+        # Ultima lectura de todos los equipos de una vez (en paralelo por shard)
+        ultimas = models.get_ultimas_lecturas()
         
-        result = []
-        for eq in equipos:
-            # Obtener estado actual del equipo
-            status = models.get_equipo_status(eq['equipo_id'])
-            
-            equipo_data = {
-                'id': eq['id'],
-                'equipo_id': eq['equipo_id'],
-                'nombre': eq['nombre'],
-                'ubicacion': eq['ubicacion'],
-                'area': eq['area'],
-                'operador': eq.get('operador_nombre', 'Sin asignar'),
-                'alertas_activas': eq.get('alertas_activas', 0),
-                'ultima_conexion': eq['ultima_conexion'].isoformat() if eq.get('ultima_conexion') else None,
-                'activo': eq['activo']
-            }
-            
-            # Agregar datos de sensores si hay lectura reciente
-            if status and status.get('lectura'):
-                lectura = status['lectura']
-                equipo_data['temperatura'] = lectura.get('temperatura')
-                equipo_data['humedad'] = lectura.get('humedad')
-                equipo_data['corriente'] = lectura.get('corriente')
-                equipo_data['nivel_riesgo'] = lectura.get('nivel_riesgo', 'unknown')
-                equipo_data['riesgo_predicho'] = lectura.get('riesgo_predicho', 0)
-                
-                # Determinar si esta online (ultima lectura < 30 segundos)
-                if lectura.get('timestamp'):
-                    from datetime import datetime, timedelta
-                    ahora = datetime.now()
-                    ultima = lectura['timestamp']
-                    equipo_data['online'] = (ahora - ultima).total_seconds() < 30
-                else:
-                    equipo_data['online'] = False
-            else:
-                equipo_data['online'] = False
-                equipo_data['temperatura'] = None
-                equipo_data['humedad'] = None
-                equipo_data['corriente'] = None
-                equipo_data['nivel_riesgo'] = 'unknown'
-                equipo_data['riesgo_predicho'] = 0
-            
-            result.append(equipo_data)
+        ahora = datetime.now()
+        result = [eq.como_json(ultimas.get(eq.equipo_id), ahora) for eq in equipos]
         
-        return jsonify({'equipos': result})
+        return _con_etag(jsonify({'equipos': result}), etag)
         
     except Exception as e:
         print(f"[Error Equipos] {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/fleet/summary', methods=['GET'])
+@_requiere_gestion
+def get_fleet_summary():
+    """Conteos de la flota por riesgo, conexion y alertas abiertas (contadores en memoria, sin SQL)"""
+    top = request.args.get('top', type=int)
+    if top is not None and not 0 < top <= FLEET_CONFIG['max_top']:
+        return jsonify({'error': f"top debe estar entre 1 y {FLEET_CONFIG['max_top']}"}), 400
+    return jsonify(flota.resumen(top))
+
+
 @app.route('/api/equipos/<equipo_id>', methods=['GET'])
 def get_equipo_detail(equipo_id):
     """Obtiene el detalle de un equipo especifico"""
     try:
+        _, error = _equipo_autorizado(equipo_id)
+        if error:
+            return error
+        
         status = models.get_equipo_status(equipo_id)
         
         if not status:
             return jsonify({'error': 'Equipo no encontrado'}), 404
         
+        status['forecast'] = predictor.forecast_time_to_threshold(
+            equipo_id, reglas.perfil_para(equipo_id)
+        )
+        
         return jsonify(status)
         
     except Exception as e:
@@ -665,6 +965,7 @@ def get_equipo_detail(equipo_id):
 
 
 @app.route('/api/equipos/registrar', methods=['POST'])
+@_requiere_gestion
 def registrar_equipo():
     """Registra un nuevo equipo"""
     try:
@@ -682,6 +983,13 @@ def registrar_equipo():
         result = models.registrar_equipo(equipo_id, nombre, ubicacion, area, operador_id)
         
         if result:
+            # El area del equipo define que perfil de umbrales le aplica
+            reglas.invalidar()
+            flota.registrar_equipo(equipo_id, area)
+            if operador_id:
+                # Cambio el equipo asignado del operador
+                sesiones.invalidar()
+            replicas.registrar_escritura(_cliente())
             return jsonify({'success': True, 'message': 'Equipo registrado'})
         else:
             return jsonify({'error': 'Error registrando equipo'}), 500
@@ -691,6 +999,73 @@ def registrar_equipo():
         return jsonify({'error': str(e)}), 500
 
 
+# =============================================
+# ENDPOINTS PARA PERFILES DE UMBRALES
+# =============================================
+
+@app.route('/api/perfiles/<equipo_id>', methods=['GET'])
+def get_perfil_equipo(equipo_id):
+    """Obtiene el perfil de umbrales que aplica a un equipo"""
+    try:
+        _, error = _equipo_autorizado(equipo_id)
+        if error:
+            return error
+        return jsonify({
+            'equipo_id': equipo_id,
+            'perfil': reglas.perfil_para(equipo_id).como_dict()
+        })
+        
+    except Exception as e:
+        print(f"[Error Perfil] {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/perfiles', methods=['PUT'])
+@_requiere_gestion
+def guardar_perfil():
+    """Crea o actualiza el perfil de umbrales de un equipo o de un area"""
+    try:
+        data = request.get_json()
+        
+        equipo_id = data.get('equipo_id')
+        area = data.get('area')
+        
+        if bool(equipo_id) == bool(area):
+            return jsonify({'error': 'Se requiere equipo_id o area (solo uno)'}), 400
+        
+        # Los valores no enviados se toman del perfil global
+        base = reglas.PERFIL_GLOBAL
+        pesos = data.get('weights', {})
+        try:
+            valores = {
+                'temperature_max': float(data.get('temperature_max', base.temperature_max)),
+                'humidity_max': float(data.get('humidity_max', base.humidity_max)),
+                'current_max': float(data.get('current_max', base.current_max)),
+                'risk_critical': float(data.get('risk_critical', base.risk_critical)),
+                'risk_high': float(data.get('risk_high', base.risk_high)),
+                'peso_temperatura': float(pesos.get('temperature', base.peso_temperatura)),
+                'peso_humedad': float(pesos.get('humidity', base.peso_humedad)),
+                'peso_corriente': float(pesos.get('current', base.peso_corriente))
+            }
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Valores de umbral invalidos'}), 400
+        
+        if min(valores['temperature_max'], valores['humidity_max'], valores['current_max']) <= 0:
+            return jsonify({'error': 'Los umbrales deben ser mayores que 0'}), 400
+        
+        if not models.upsert_perfil_umbral(valores, equipo_id, area):
+            return jsonify({'error': 'Error guardando perfil'}), 500
+        
+        reglas.invalidar()
+        print(f"[Perfiles] Perfil actualizado: {equipo_id or 'area ' + area}")
+        
+        return jsonify({'success': True, 'message': 'Perfil guardado'})
+        
+    except Exception as e:
+        print(f"[Error Guardar Perfil] {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
 
 if __name__ == '__main__':
     print("=" * 50)
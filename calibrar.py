@@ -0,0 +1,221 @@
+"""
+Calibra los pesos y los cortes de riesgo de calculate_risk_score contra
+el historial.
+
+Cada lectura se etiqueta con los incidentes criticos resueltos de su
+equipo, o con un CSV de fallos (--fallos), como en
+entrenar_modelo.cargar_historial (ver alli la limitacion de las
+etiquetas que salen de los incidentes). Para cada combinacion de
+pesos de una grilla sobre el simplex se calculan de una vez los puntajes
+de todas las lecturas (producto matricial lecturas x candidatos) y,
+con un histograma por candidato, las metricas de todos los cortes:
+
+- risk_critical: el corte que maximiza F1 de 'critical' contra las etiquetas,
+- risk_high: el corte menor que maximiza F2 (prioriza no perder fallos).
+
+Los candidatos se reparten entre los nucleos y las lecturas se recorren
+por bloques para acotar la memoria. El resultado es un perfil en JSON con
+el mismo formato que acepta PUT /api/perfiles (y opcionalmente se guarda
+para un equipo o un area).
+
+Uso:
+    python calibrar.py [--equipo ESP32_001 | --area RRHH] [--desde 2024-01-01]
+                       [--fallos fallos.csv] [--paso 0.05] [--procesos 4]
+                       [--salida perfil_calibrado.json] [--guardar]
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import entrenar_modelo
+import models
+import reglas
+
+# Cortes evaluados para risk_high / risk_critical
+CORTES = np.round(np.arange(0.30, 0.951, 0.01), 2)
+
+# Lecturas por bloque en el producto matricial
+FILAS_BLOQUE = 200000
+
+_normalizadas = None
+_etiquetas = None
+
+
+def grilla_pesos(paso):
+    """Combinaciones de pesos (temperatura, humedad, corriente) que suman 1"""
+    n = int(round(1 / paso))
+    return np.array([
+        (i / n, j / n, (n - i - j) / n)
+        for i in range(n + 1)
+        for j in range(n + 1 - i)
+    ])
+
+
+def normalizar(df, perfil):
+    """Matriz (n, 3) de valores normalizados por los umbrales del perfil"""
+    return np.column_stack([
+        np.minimum(df['temperatura'].astype(float).to_numpy() / perfil.temperature_max, reglas.NORM_MAX),
+        np.minimum(df['humedad'].astype(float).to_numpy() / perfil.humidity_max, reglas.NORM_MAX),
+        np.minimum(df['corriente'].astype(float).abs().to_numpy() / perfil.current_max, reglas.NORM_MAX)
+    ])
+
+
+def _iniciar_proceso(normalizadas, etiquetas):
+    global _normalizadas, _etiquetas
+    _normalizadas = normalizadas
+    _etiquetas = etiquetas
+
+
+def contar(pesos):
+    """
+    Para cada candidato de pesos cuenta lecturas y positivos por intervalo
+    de corte. Retorna (totales, positivos), ambos de forma (k, len(CORTES) + 1)
+    """
+    k = len(pesos)
+    columnas = len(CORTES) + 1
+    desplazamiento = (np.arange(k) * columnas)[None, :]
+    totales = np.zeros(k * columnas)
+    positivos = np.zeros(k * columnas)
+
+    for inicio in range(0, len(_normalizadas), FILAS_BLOQUE):
+        bloque = _normalizadas[inicio:inicio + FILAS_BLOQUE]
+        etiquetas = _etiquetas[inicio:inicio + FILAS_BLOQUE]
+
+        puntajes = np.clip(bloque @ pesos.T, 0, 1)                # (n, k)
+        indices = np.searchsorted(CORTES, puntajes, side='right') + desplazamiento
+        indices = indices.ravel()
+        totales += np.bincount(indices, minlength=k * columnas)
+        positivos += np.bincount(indices, weights=np.repeat(etiquetas, k), minlength=k * columnas)
+
+    return totales.reshape(k, columnas), positivos.reshape(k, columnas)
+
+
+def metricas(totales, positivos, total_positivos):
+    """
+    Para cada candidato y cada corte j: lecturas con puntaje >= CORTES[j]
+    Retorna matrices (k, len(CORTES)) de precision, recall, F1 y F2
+    """
+    # Suma acumulada desde el final: intervalo j+1 en adelante es puntaje >= CORTES[j]
+    predichos = np.cumsum(totales[:, ::-1], axis=1)[:, ::-1][:, 1:]
+    verdaderos = np.cumsum(positivos[:, ::-1], axis=1)[:, ::-1][:, 1:]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(predichos > 0, verdaderos / predichos, 0.0)
+        recall = verdaderos / total_positivos if total_positivos else np.zeros_like(verdaderos)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+        f2 = np.where(4 * precision + recall > 0, 5 * precision * recall / (4 * precision + recall), 0.0)
+    return precision, recall, f1, f2
+
+
+def buscar(normalizadas, etiquetas, paso=0.05, procesos=None):
+    """Busca los mejores pesos y cortes; retorna un dict con el resultado"""
+    pesos = grilla_pesos(paso)
+    procesos = procesos or os.cpu_count()
+    partes = [p for p in np.array_split(pesos, procesos * 4) if len(p)]
+
+    with ProcessPoolExecutor(max_workers=procesos, initializer=_iniciar_proceso,
+                             initargs=(normalizadas, etiquetas)) as pool:
+        resultados = list(pool.map(contar, partes))
+
+    totales = np.vstack([t for t, _ in resultados])
+    positivos = np.vstack([p for _, p in resultados])
+    precision, recall, f1, f2 = metricas(totales, positivos, float(etiquetas.sum()))
+
+    # Mejor candidato y corte critico por F1
+    mejor = np.unravel_index(np.argmax(f1), f1.shape)
+    candidato, j_critico = int(mejor[0]), int(mejor[1])
+
+    # Corte alto: menor que el critico, maximizando F2
+    if j_critico > 0:
+        j_alto = int(np.argmax(f2[candidato, :j_critico]))
+    else:
+        j_alto = j_critico
+
+    return {
+        'weights': {
+            'temperature': round(float(pesos[candidato, 0]), 4),
+            'humidity': round(float(pesos[candidato, 1]), 4),
+            'current': round(float(pesos[candidato, 2]), 4)
+        },
+        'risk_critical': float(CORTES[j_critico]),
+        'risk_high': float(CORTES[j_alto]),
+        'metricas': {
+            'candidatos': int(len(pesos) * len(CORTES)),
+            'critical': {
+                'precision': round(float(precision[candidato, j_critico]), 4),
+                'recall': round(float(recall[candidato, j_critico]), 4),
+                'f1': round(float(f1[candidato, j_critico]), 4)
+            },
+            'high': {
+                'precision': round(float(precision[candidato, j_alto]), 4),
+                'recall': round(float(recall[candidato, j_alto]), 4),
+                'f2': round(float(f2[candidato, j_alto]), 4)
+            }
+        }
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Calibra pesos y cortes de riesgo')
+    grupo = parser.add_mutually_exclusive_group()
+    grupo.add_argument('--equipo', help='Calibrar solo con el historial de un equipo')
+    grupo.add_argument('--area', help='Guardar el perfil para esta area (con --guardar)')
+    parser.add_argument('--desde', help='Fecha minima de las lecturas (YYYY-MM-DD)')
+    parser.add_argument('--limite', type=int, help='Maximo de lecturas a usar')
+    parser.add_argument('--fallos', help='CSV de fallos (equipo_id,desde,hasta) en lugar de los incidentes')
+    parser.add_argument('--paso', type=float, default=0.05, help='Paso de la grilla de pesos')
+    parser.add_argument('--procesos', type=int, help='Procesos (por defecto, nucleos)')
+    parser.add_argument('--salida', default='perfil_calibrado.json')
+    parser.add_argument('--guardar', action='store_true',
+                        help='Guardar el perfil en perfiles_umbral (requiere --equipo o --area)')
+    args = parser.parse_args()
+
+    inicio = time.monotonic()
+    perfil = reglas.perfil_para(args.equipo) if args.equipo else reglas.PERFIL_GLOBAL
+
+    fallos = entrenar_modelo.cargar_fallos(args.fallos) if args.fallos else None
+    df = entrenar_modelo.cargar_historial(
+        args.desde, args.limite, args.equipo, solo_resueltas=True, fallos=fallos
+    )
+    etiquetas = df['fallo'].astype(float).to_numpy()
+    if not len(df) or etiquetas.sum() == 0:
+        raise SystemExit('[Calibrar] No hay incidentes resueltos en el historial seleccionado')
+    print(f"[Calibrar] {len(df)} lecturas, {int(etiquetas.sum())} dentro de incidentes")
+
+    resultado = buscar(normalizar(df, perfil), etiquetas, args.paso, args.procesos)
+
+    salida = {
+        'temperature_max': perfil.temperature_max,
+        'humidity_max': perfil.humidity_max,
+        'current_max': perfil.current_max,
+        **resultado
+    }
+    if args.equipo:
+        salida['equipo_id'] = args.equipo
+    if args.area:
+        salida['area'] = args.area
+
+    with open(args.salida, 'w') as f:
+        json.dump(salida, f, indent=2)
+    print(f"[Calibrar] Perfil escrito en {args.salida} ({time.monotonic() - inicio:.1f}s): "
+          f"{json.dumps(resultado)}")
+
+    if args.guardar:
+        if not (args.equipo or args.area):
+            raise SystemExit('[Calibrar] --guardar requiere --equipo o --area')
+        valores = {
+            'temperature_max': salida['temperature_max'],
+            'humidity_max': salida['humidity_max'],
+            'current_max': salida['current_max'],
+            'risk_critical': salida['risk_critical'],
+            'risk_high': salida['risk_high'],
+            'peso_temperatura': salida['weights']['temperature'],
+            'peso_humedad': salida['weights']['humidity'],
+            'peso_corriente': salida['weights']['current']
+        }
+        if models.upsert_perfil_umbral(valores, args.equipo, args.area):
+            print("[Calibrar] Perfil guardado en perfiles_umbral")
@@ -8,10 +8,64 @@ DB_CONFIG = {
     'port': int(os.getenv('MYSQLPORT', 3306))
 }
 
+# Replicas de solo lectura: MYSQL_REPLICAS="host1:3306,host2:3306"
+# (mismo usuario, contraseña y base que el primario)
+DB_REPLICAS = [
+    (host, int(port or DB_CONFIG['port']))
+    for host, _, port in (
+        r.strip().partition(':') for r in os.getenv('MYSQL_REPLICAS', '').split(',') if r.strip()
+    )
+]
+
+# Shards adicionales por equipo: MYSQL_SHARDS="host1:3306/iot1,host2:3306/iot2"
+# (el shard 0 es DB_CONFIG; mismo usuario y contraseña)
+DB_SHARDS = [
+    {
+        **DB_CONFIG,
+        'host': direccion.partition(':')[0],
+        'port': int(direccion.partition(':')[2] or DB_CONFIG['port']),
+        'database': base or DB_CONFIG['database']
+    }
+    for direccion, _, base in (
+        s.strip().partition('/') for s in os.getenv('MYSQL_SHARDS', '').split(',') if s.strip()
+    )
+]
+
+SHARD_CONFIG = {
+    'vnodes': int(os.getenv('SHARD_VNODES', 64)),            # nodos virtuales por shard en el anillo
+    'id_stride': int(os.getenv('SHARD_ID_STRIDE', 16)),      # maximo de shards (ids intercalados)
+    'id_base': int(os.getenv('SHARD_ID_BASE', 0)),           # mayor id anterior a los shards (esos quedan en el shard 0)
+    'ttl': float(os.getenv('SHARD_CACHE_TTL', 30)),          # segundos de cache de ubicacion_equipos
+    'connect_timeout': int(os.getenv('SHARD_CONNECT_TIMEOUT', 3)),
+    'failure_threshold': int(os.getenv('SHARD_FAILURE_THRESHOLD', 3)),
+    'cooldown': float(os.getenv('SHARD_COOLDOWN', 10))
+}
+
+REPLICA_CONFIG = {
+    'max_lag': int(os.getenv('REPLICA_MAX_LAG', 5)),                      # segundos de atraso tolerados
+    'lag_check_interval': float(os.getenv('REPLICA_LAG_CHECK_INTERVAL', 2)),  # segundos entre mediciones
+    'read_your_writes': float(os.getenv('REPLICA_READ_YOUR_WRITES', 10)),  # segundos leyendo del primario
+    'connect_timeout': int(os.getenv('REPLICA_CONNECT_TIMEOUT', 2)),
+    'failure_threshold': int(os.getenv('REPLICA_FAILURE_THRESHOLD', 3)),
+    'cooldown': float(os.getenv('REPLICA_COOLDOWN', 10))
+}
+
 SERVER_CONFIG = {
     'host': '0.0.0.0',
     'port': int(os.getenv('PORT', 5000)),
-    'debug': False
+    'debug': False,
+    'workers': int(os.getenv('WEB_CONCURRENCY', 1))   # workers de gunicorn (la misma variable que lee gunicorn)
+}
+
+# Servidor de ingesta asyncio (UDP/TCP, protocolo de lineas)
+INGEST_SERVER_CONFIG = {
+    'host': os.getenv('INGEST_HOST', '0.0.0.0'),
+    'udp_port': int(os.getenv('INGEST_UDP_PORT', 5001)),
+    'tcp_port': int(os.getenv('INGEST_TCP_PORT', 5002)),
+    'batch_size': int(os.getenv('INGEST_BATCH_SIZE', 100)),    # lecturas por lote
+    'batch_interval': float(os.getenv('INGEST_BATCH_INTERVAL', 0.5)),  # segundos
+    'queue_max': int(os.getenv('INGEST_QUEUE_MAX', 10000)),
+    'workers': int(os.getenv('INGEST_WORKERS', 4))             # hilos para la BD
 }
 
 
@@ -24,3 +78,162 @@ THRESHOLDS = {
     'risk_high': 0.5          # 50% de probabilidad de fallo
 }
 
+# Pesos de cada factor en el puntaje de riesgo
+RISK_WEIGHTS = {
+    'temperature': 0.35,
+    'humidity': 0.25,
+    'current': 0.40
+}
+
+# Perfiles de umbrales por equipo/area (tabla perfiles_umbral)
+PROFILE_CONFIG = {
+    'ttl': float(os.getenv('PROFILE_CACHE_TTL', 60))  # segundos antes de releer los perfiles
+}
+
+
+# Respuestas condicionales (ETag, ver versiones.py)
+ETAG_CONFIG = {
+    'archivo': os.getenv('ETAG_FILE', 'versiones_etag.bin'),   # contadores compartidos por los procesos del host
+    'max_equipos': int(os.getenv('ETAG_MAX_EQUIPOS', 10000))
+}
+
+
+# Deduplicacion de lecturas reenviadas por los dispositivos
+DEDUP_CONFIG = {
+    'window': int(os.getenv('DEDUP_WINDOW', 512)),          # secuencias recordadas por equipo
+    'ventana_segundos': int(os.getenv('DEDUP_WINDOW_SECONDS', 300)),  # un seq repetido despues es otra lectura
+    'max_equipos': int(os.getenv('DEDUP_MAX_EQUIPOS', 10000))
+}
+
+
+# Limite de lecturas por equipo (token bucket) y control de carga de la ingesta
+RATE_LIMIT_CONFIG = {
+    'rate': float(os.getenv('INGEST_RATE', 5.0)),             # lecturas por segundo por equipo
+    'burst': float(os.getenv('INGEST_BURST', 20.0)),          # rafaga maxima por equipo
+    'global_rate': float(os.getenv('INGEST_GLOBAL_RATE', 1000.0)),   # lecturas por segundo de la flota (0: sin limite)
+    'global_burst': float(os.getenv('INGEST_GLOBAL_BURST', 2000.0)),
+    'prioridad_lecturas': float(os.getenv('INGEST_READ_SHED_BELOW', 0.25)),  # fraccion del balde global bajo la que se rechazan consultas
+    'archivo': os.getenv('INGEST_LIMITS_FILE', 'limites_ingesta.bin'),  # baldes compartidos por los procesos del host
+    'max_en_vuelo': int(os.getenv('INGEST_MAX_EN_VUELO', 32)),  # requests de ingesta simultaneos
+    'max_equipos': int(os.getenv('INGEST_RATE_MAX_EQUIPOS', 10000))
+}
+
+
+# Incidentes: alertas repetidas de un equipo se agrupan en una sola fila
+INCIDENT_CONFIG = {
+    'flush_interval': float(os.getenv('INCIDENT_FLUSH_INTERVAL', 10))  # segundos entre escrituras
+}
+
+
+# Deteccion de anomalias en streaming (por equipo y por sensor)
+ANOMALY_CONFIG = {
+    'alpha': float(os.getenv('ANOMALY_ALPHA', 0.1)),          # peso de la media/varianza exponencial
+    'z_max': float(os.getenv('ANOMALY_Z_MAX', 4.0)),          # desviaciones para considerar un pico
+    'warmup': int(os.getenv('ANOMALY_WARMUP', 20)),           # lecturas antes de evaluar picos
+    'rebuild_minutes': int(os.getenv('ANOMALY_REBUILD_MINUTES', 60)),  # historial usado al arrancar
+    # Cambio minimo para un pico, maxima variacion por segundo y rango
+    # por debajo del cual el sensor se considera congelado
+    'min_delta': {'temperature': 2.0, 'humidity': 5.0, 'current': 1.0},
+    'max_rate': {'temperature': 2.0, 'humidity': 5.0, 'current': 5.0},
+    'flat_range': {'temperature': 0.01, 'humidity': 0.01, 'current': 0.001}
+}
+
+
+# Pronostico de tiempo hasta el umbral (tendencia lineal por equipo)
+FORECAST_CONFIG = {
+    'window': int(os.getenv('FORECAST_WINDOW', 60)),          # lecturas en la ventana
+    'min_points': int(os.getenv('FORECAST_MIN_POINTS', 10)),  # minimo para pronosticar
+    'horizon': float(os.getenv('FORECAST_HORIZON', 86400)),   # segundos; mas alla no se reporta
+    'max_equipos': int(os.getenv('FORECAST_MAX_EQUIPOS', 10000)),  # tendencias en memoria
+    'refresh': float(os.getenv('FORECAST_REFRESH', 30))       # segundos sin lecturas locales antes de releer la BD
+}
+
+
+# Modelo de riesgo entrenado (scikit-learn); sin archivo se usa la heuristica
+MODEL_CONFIG = {
+    'path': os.getenv('MODEL_PATH', 'modelo_riesgo.joblib'),
+    'preload': os.getenv('MODEL_PRELOAD', '0') == '1',      # cargar al importar la app
+    'batch_max': int(os.getenv('MODEL_BATCH_MAX', 64)),      # lecturas por predict_proba
+    'batch_wait_ms': float(os.getenv('MODEL_BATCH_WAIT_MS', 2)),  # espera para juntar lecturas
+    'timeout': float(os.getenv('MODEL_TIMEOUT', 0.5))        # segundos antes de usar la heuristica
+}
+
+
+# Circuit breaker de MySQL y spool local de lecturas durante una caida
+RESILIENCE_CONFIG = {
+    'connect_timeout': int(os.getenv('MYSQL_CONNECT_TIMEOUT', 3)),      # segundos
+    'failure_threshold': int(os.getenv('DB_FAILURE_THRESHOLD', 3)),   # fallos seguidos para abrir
+    'cooldown': float(os.getenv('DB_COOLDOWN', 10)),                  # segundos antes de reintentar
+    'spool_dir': os.getenv('SPOOL_DIR', 'spool'),
+    'fsync_every': int(os.getenv('SPOOL_FSYNC_EVERY', 100)),          # lecturas entre fsync
+    'fsync_interval': float(os.getenv('SPOOL_FSYNC_INTERVAL', 1.0)),  # segundos entre fsync
+    'replay_batch': int(os.getenv('SPOOL_REPLAY_BATCH', 500)),        # lecturas por INSERT
+    'replay_interval': float(os.getenv('SPOOL_REPLAY_INTERVAL', 5.0))  # segundos entre intentos
+}
+
+
+# Pipeline de ingesta (etapas con tiempos; las marcadas en_hilo van a un pool)
+PIPELINE_CONFIG = {
+    'workers': int(os.getenv('PIPELINE_WORKERS', 4)),              # hilos para etapas en segundo plano
+    'max_pendientes': int(os.getenv('PIPELINE_MAX_PENDIENTES', 1000))  # cola antes de ejecutar en linea
+}
+
+
+# Notificaciones de alertas (webhook y/o correo); sin destinos no se envia nada
+NOTIFY_CONFIG = {
+    'webhooks': [u.strip() for u in os.getenv('NOTIFY_WEBHOOKS', '').split(',') if u.strip()],
+    'smtp_host': os.getenv('NOTIFY_SMTP_HOST', ''),
+    'smtp_port': int(os.getenv('NOTIFY_SMTP_PORT', 25)),
+    'smtp_user': os.getenv('NOTIFY_SMTP_USER', ''),
+    'smtp_password': os.getenv('NOTIFY_SMTP_PASSWORD', ''),
+    'smtp_starttls': os.getenv('NOTIFY_SMTP_STARTTLS', '0') == '1',
+    'email_from': os.getenv('NOTIFY_EMAIL_FROM', 'alertas@localhost'),
+    'email_to': [d.strip() for d in os.getenv('NOTIFY_EMAIL_TO', '').split(',') if d.strip()],
+    'severidades': os.getenv('NOTIFY_SEVERIDADES', 'critical').split(','),  # severidades que se notifican
+    'max_cola': int(os.getenv('NOTIFY_MAX_COLA', 10000)),     # alertas en cola por destino
+    'lote': int(os.getenv('NOTIFY_LOTE', 20)),                # alertas por mensaje (resumen)
+    'intervalo': float(os.getenv('NOTIFY_INTERVALO', 30)),    # segundos maximos antes de enviar
+    'reintentos': int(os.getenv('NOTIFY_REINTENTOS', 5)),
+    'backoff': float(os.getenv('NOTIFY_BACKOFF', 1.0)),       # espera inicial entre reintentos
+    'backoff_max': float(os.getenv('NOTIFY_BACKOFF_MAX', 60.0)),
+    'timeout': float(os.getenv('NOTIFY_TIMEOUT', 5.0)),       # segundos por envio
+    'dead_letter': os.getenv('NOTIFY_DEAD_LETTER', 'notificaciones_fallidas.jsonl')
+}
+
+
+# Sesiones con token firmado (HMAC). Sin SESSION_SECRET se genera uno por
+# proceso: los tokens no sirven entre workers ni despues de reiniciar
+SESSION_CONFIG = {
+    'secret': os.getenv('SESSION_SECRET', ''),
+    'ttl': int(os.getenv('SESSION_TTL', 12 * 3600)),            # segundos de validez del token
+    'cache_ttl': float(os.getenv('SESSION_CACHE_TTL', 60)),     # segundos de cache de rol/equipo
+    'requerida': os.getenv('SESSION_REQUIRED', '1') == '1',     # 0: sin control de acceso (solo desarrollo)
+    'roles_gestion': [r.strip() for r in os.getenv('SESSION_ROLES_GESTION', 'admin,ti').split(',')]
+}
+
+
+# Rollup por minuto de los factores influyentes (explicacion por ventana)
+ROLLUP_CONFIG = {
+    'flush_interval': float(os.getenv('ROLLUP_FLUSH_INTERVAL', 10)),  # segundos entre escrituras
+    'max_buckets': int(os.getenv('ROLLUP_MAX_BUCKETS', 7 * 24 * 60))  # minutos maximos por consulta
+}
+
+
+# Resumen de la flota (GET /api/fleet/summary) con contadores en memoria
+FLEET_CONFIG = {
+    'online_segundos': float(os.getenv('FLEET_ONLINE_SEGUNDOS', 30)),  # sin lecturas por mas tiempo: offline
+    'top': int(os.getenv('FLEET_TOP', 10)),                             # equipos de mayor riesgo por defecto
+    'max_top': int(os.getenv('FLEET_MAX_TOP', 100)),
+    'resync': float(os.getenv('FLEET_RESYNC', 300))                     # segundos entre recargas desde la BD
+}
+
+
+# Perfilado de requests (ver perfilador.py); a pedido de un rol de gestion o por muestreo
+PROFILER_CONFIG = {
+    'muestreo': int(os.getenv('PROFILER_SAMPLE_EVERY', 0)),            # 1 de cada N requests (0: solo a pedido)
+    'max_por_minuto': int(os.getenv('PROFILER_MAX_PER_MINUTE', 6)),    # tope de perfiles sorteados
+    'modo': os.getenv('PROFILER_MODE', 'cprofile'),                    # 'cprofile' o 'pila'
+    'intervalo': float(os.getenv('PROFILER_INTERVAL', 0.005)),         # segundos entre muestras de pila
+    'directorio': os.getenv('PROFILER_DIR', 'perfiles'),
+    'max_bytes': int(os.getenv('PROFILER_MAX_BYTES', 200 * 1024 * 1024))
+}
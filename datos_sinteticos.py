@@ -0,0 +1,572 @@
+"""
+Datos sinteticos de una flota para probar a escala las consultas, y
+benchmark de las rutas de lectura.
+
+SOLO PARA UNA BD LOCAL DE PRUEBA: con --vaciar se truncan
+lecturas_sensores, predicciones, alertas y rollup_factores. Si DB_CONFIG
+no apunta a localhost hay que pasar --forzar.
+
+Los datos (equipos SIM_0001, SIM_0002, ... repartidos en AREAS):
+- temperatura: base por equipo, ciclo diario (maximo a media tarde),
+  ciclo anual, carga en horario laboral (lunes a viernes de 8 a 18) y ruido,
+- humedad: ciclo anual, baja cuando sube la temperatura, y ruido,
+- corriente: en uso o en reposo, con picos cortos (Poisson por equipo),
+- episodios por area (p. ej. falla del aire acondicionado): rampa de
+  temperatura, humedad y corriente en todos los equipos del area a la
+  vez, que dispara rafagas de alertas correlacionadas,
+- predicciones y factores con la version vectorizada del predictor
+  (heuristica del perfil de cada equipo),
+- alertas agrupadas en incidentes como recalcular.py (una fila por racha
+  de cada tipo; la racha que llega al final de los datos queda abierta),
+- rollup_factores por minuto (explicacion por ventana).
+
+Es determinista: cada (equipo, dia) tiene su propio generador aleatorio,
+asi que la misma semilla y las mismas fechas dan los mismos datos, y
+generar por partes (escalar) da lo mismo que generar de una vez.
+
+La carga usa ids explicitos (intercalados por shard, ver shards.py),
+INSERT multi-fila (executemany de pymysql), unique_checks y
+foreign_key_checks desactivados en la sesion y un commit por bloque.
+
+Uso:
+    python datos_sinteticos.py generar --equipos 100 --dias 30 [--intervalo 60]
+                                       [--semilla 1] [--hasta 2025-01-01] [--vaciar]
+    python datos_sinteticos.py medir [--repeticiones 20] [--equipo SIM_0001] [--salida medicion.json]
+    python datos_sinteticos.py escalar --equipos 100 --escalas 1e5,1e6,1e7,1e8 --vaciar
+                                       [--salida escalas.json]
+
+medir llama cada ruta GET con el cliente de prueba de Flask (sin red) y
+muestra p50/p95/max en ms junto con las filas aproximadas de cada tabla.
+"""
+import argparse
+import contextlib
+import io
+import json
+import math
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+from config import DB_CONFIG, SESSION_CONFIG, SHARD_CONFIG
+import models
+import predictor
+import reglas
+import shards
+import versiones
+
+AREAS = ('RRHH', 'Contabilidad', 'TI', 'Logistica', 'Direccion')
+PREFIJO = 'SIM_'
+TABLAS = ('lecturas_sensores', 'predicciones', 'alertas', 'rollup_factores')
+
+# Probabilidad diaria de un episodio en un area y su duracion (minutos)
+PROB_EPISODIO = 0.04
+DURACION_EPISODIO = (20, 180)
+
+# Dias por bloque de carga (un commit por equipo y bloque)
+DIAS_POR_BLOQUE = 7
+
+
+# =============================================
+# GENERACION (sin BD)
+# =============================================
+
+def nombre_equipo(indice):
+    return f'{PREFIJO}{indice + 1:04d}'
+
+
+def parametros_equipo(semilla, indice):
+    """Caracteristicas fijas de un equipo"""
+    rng = np.random.default_rng([semilla, indice])
+    return {
+        'area': AREAS[indice % len(AREAS)],
+        'temperatura': rng.uniform(22, 29),
+        'amplitud': rng.uniform(2, 5),
+        'humedad': rng.uniform(40, 60),
+        'corriente': rng.uniform(1.5, 4),
+        'picos_por_dia': rng.uniform(0.5, 4)
+    }
+
+
+def episodios_area(semilla, area, dia):
+    """Episodios de un area en un dia: [(segundo de inicio, duracion en segundos, intensidad)]"""
+    rng = np.random.default_rng([semilla, 1000000 + AREAS.index(area), dia.toordinal()])
+    if rng.random() >= PROB_EPISODIO:
+        return []
+    return [(
+        int(rng.integers(0, 86400)),
+        int(rng.integers(*DURACION_EPISODIO)) * 60,
+        rng.uniform(0.6, 1.0)
+    )]
+
+
+def generar_dia(semilla, indice, parametros, dia, intervalo):
+    """
+    Lecturas de un equipo en un dia
+    Retorna (segundos desde la medianoche, temperatura, humedad, corriente)
+    """
+    rng = np.random.default_rng([semilla, indice, dia.toordinal()])
+    n = 86400 // intervalo
+    segundos = np.arange(n) * intervalo
+    if intervalo > 1:
+        segundos += rng.integers(0, max(1, intervalo // 4), n)
+    hora = segundos / 3600.0
+    anual = 2 * math.pi * (dia.timetuple().tm_yday - 100) / 365.0
+
+    en_uso = np.zeros(n, dtype=bool)
+    if dia.weekday() < 5:
+        en_uso = (hora >= 8) & (hora < 18) & (rng.random(n) > 0.1)
+
+    temperatura = (
+        parametros['temperatura']
+        + parametros['amplitud'] * np.sin(2 * math.pi * (hora - 9) / 24)
+        + 3 * math.sin(anual)
+        + 2.5 * en_uso
+        + rng.normal(0, 0.4, n)
+    )
+    humedad = (
+        parametros['humedad']
+        + 8 * math.cos(anual)
+        - 0.8 * (temperatura - parametros['temperatura'])
+        + rng.normal(0, 1.5, n)
+    )
+    corriente = np.where(en_uso, parametros['corriente'], 0.3) + rng.normal(0, 0.1, n)
+
+    for _ in range(rng.poisson(parametros['picos_por_dia'])):
+        inicio = int(rng.integers(0, n))
+        corriente[inicio:inicio + int(rng.integers(1, 4))] += rng.uniform(6, 16)
+
+    for inicio, duracion, intensidad in episodios_area(semilla, parametros['area'], dia):
+        # Sube en 10 minutos, se mantiene y se corta al final del episodio
+        dentro = (segundos >= inicio) & (segundos < inicio + duracion)
+        subida = np.clip((segundos - inicio) / 600.0, 0, 1) * intensidad * dentro
+        temperatura += 18 * subida
+        humedad += 10 * subida
+        corriente += 6 * subida
+
+    return (
+        segundos,
+        np.round(temperatura, 1),
+        np.round(np.clip(humedad, 5, 99), 1),
+        np.round(np.abs(corriente), 2)
+    )
+
+
+def _rachas(activa):
+    """Indices de inicio y fin (inclusive) de cada racha de True"""
+    cambios = np.diff(np.concatenate(([0], activa.astype(np.int8), [0])))
+    return np.flatnonzero(cambios == 1), np.flatnonzero(cambios == -1) - 1
+
+
+def _texto_fechas(base, segundos):
+    """'YYYY-MM-DD HH:MM:SS' de cada segundo desde base (vectorizado)"""
+    fechas = np.datetime64(base, 's') + segundos.astype('timedelta64[s]')
+    return np.char.replace(np.datetime_as_string(fechas, unit='s'), 'T', ' ').tolist()
+
+
+# =============================================
+# CARGA
+# =============================================
+
+class Cargador:
+    """Conexiones por shard, ids explicitos y escritura de los bloques"""
+
+    def __init__(self):
+        self.conexiones = {}
+        self.siguiente = {}      # (shard, tabla) -> proximo id libre del shard
+        self.filas = 0
+        self.alertas = 0
+
+    def conexion(self, shard):
+        connection = self.conexiones.get(shard)
+        if connection is None:
+            connection = models.get_db_connection(shard=shard)
+            if not connection:
+                raise RuntimeError(f'No hay conexion al shard {shard}')
+            with connection.cursor() as cursor:
+                cursor.execute("SET SESSION unique_checks = 0, foreign_key_checks = 0")
+            self.conexiones[shard] = connection
+        return connection
+
+    def ids(self, shard, tabla, n):
+        """n ids libres de una tabla en un shard, con el intercalado de shards.py"""
+        paso = SHARD_CONFIG['id_stride'] if shards.activo() else 1
+        clave = (shard, tabla)
+        if clave not in self.siguiente:
+            with self.conexion(shard).cursor() as cursor:
+                cursor.execute(f"SELECT COALESCE(MAX(id), 0) AS maximo FROM {tabla}")
+                maximo = cursor.fetchone()['maximo']
+            if shard:
+                # Los ids hasta la base son del shard 0 (shards.shard_de_id)
+                maximo = max(maximo, SHARD_CONFIG['id_base'])
+            desplazamiento = shard if shards.activo() else 0
+            # Primer id > maximo con (id - 1) % paso == desplazamiento
+            self.siguiente[clave] = maximo + 1 + (desplazamiento - maximo) % paso
+        inicio = self.siguiente[clave]
+        self.siguiente[clave] = inicio + n * paso
+        return np.arange(n, dtype=np.int64) * paso + inicio
+
+    def vaciar(self):
+        for shard in range(shards.TOTAL):
+            with self.conexion(shard).cursor() as cursor:
+                for tabla in TABLAS:
+                    cursor.execute(f"TRUNCATE TABLE {tabla}")
+        with self.conexion(0).cursor() as cursor:
+            cursor.execute("DELETE FROM equipos WHERE equipo_id LIKE %s", (PREFIJO.replace('_', r'\_') + '%',))
+        self.conexion(0).commit()
+        self.siguiente.clear()
+        print(f"[Sinteticos] Tablas vaciadas en {shards.TOTAL} shard(s)")
+
+    def equipos(self, equipos, ultima_conexion):
+        connection = self.conexion(0)
+        with connection.cursor() as cursor:
+            cursor.executemany("""
+                INSERT INTO equipos (equipo_id, nombre, ubicacion, area, ultima_conexion)
+                VALUES (%s, %s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE
+                    area = VALUES(area),
+                    ultima_conexion = VALUES(ultima_conexion)
+            """, [
+                (equipo_id, f'Equipo {equipo_id[len(PREFIJO):]} ({p["area"]})',
+                 'Sede simulada', p['area'], ultima_conexion)
+                for equipo_id, p in equipos
+            ])
+        connection.commit()
+
+    def bloque(self, equipo_id, base, segundos, t, h, c, abierto_al_final):
+        """Escribe lecturas, predicciones, alertas y rollup de un equipo en un bloque de dias"""
+        n = len(segundos)
+        shard = shards.shard_de(equipo_id, models.get_db_connection)
+        perfil = reglas.perfil_para(equipo_id)
+        perfiles = [perfil] * n
+
+        scores, niveles = predictor.calculate_risk_scores(t, h, c, perfiles)
+        scores = np.round(scores, 3)
+        factores = predictor.calculate_influential_factors_batch(t, h, c, perfiles)
+        fechas = _texto_fechas(base, segundos)
+        ids_lecturas = self.ids(shard, 'lecturas_sensores', n)
+        ids_predicciones = self.ids(shard, 'predicciones', n)
+
+        connection = self.conexion(shard)
+        with connection.cursor() as cursor:
+            cursor.executemany("""
+                INSERT INTO lecturas_sensores (id, sensor_id, temperatura, humedad, corriente, timestamp)
+                VALUES (%s, %s, %s, %s, %s, %s)
+            """, list(zip(ids_lecturas.tolist(), [equipo_id] * n,
+                          t.tolist(), h.tolist(), c.tolist(), fechas)))
+
+            cursor.executemany("""
+                INSERT INTO predicciones (id, lectura_id, equipo_id, nivel_riesgo, riesgo_predicho,
+                                       factor_temperatura, factor_humedad, factor_corriente,
+                                       timestamp)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """, list(zip(ids_predicciones.tolist(), ids_lecturas.tolist(), [equipo_id] * n,
+                          niveles.tolist(), scores.tolist(), factores[:, 0].tolist(),
+                          factores[:, 1].tolist(), factores[:, 2].tolist(), fechas)))
+
+            alertas = self._incidentes(
+                equipo_id, perfil, ids_predicciones, fechas, t, h, c, niveles, abierto_al_final
+            )
+            if alertas:
+                cursor.executemany("""
+                    INSERT INTO alertas (prediccion_id, equipo_id, tipo, mensaje, severidad,
+                                      timestamp, leida, estado, ocurrencias, primera_vez,
+                                      ultima_vez, valor_pico)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                """, alertas)
+
+            minutos, inverso = np.unique(segundos // 60, return_inverse=True)
+            sumas = [np.bincount(inverso, weights=w) for w in
+                     (factores[:, 0], factores[:, 1], factores[:, 2], scores)]
+            cursor.executemany("""
+                INSERT INTO rollup_factores (equipo_id, minuto, lecturas, suma_temperatura,
+                                             suma_humedad, suma_corriente, suma_riesgo)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE
+                    lecturas = lecturas + VALUES(lecturas),
+                    suma_temperatura = suma_temperatura + VALUES(suma_temperatura),
+                    suma_humedad = suma_humedad + VALUES(suma_humedad),
+                    suma_corriente = suma_corriente + VALUES(suma_corriente),
+                    suma_riesgo = suma_riesgo + VALUES(suma_riesgo)
+            """, list(zip([equipo_id] * len(minutos), _texto_fechas(base, minutos * 60),
+                          np.bincount(inverso).tolist(), *(s.tolist() for s in sumas))))
+        connection.commit()
+        self.filas += n
+        self.alertas += len(alertas)
+
+    def _incidentes(self, equipo_id, perfil, ids_predicciones, fechas, t, h, c, niveles,
+                    abierto_al_final):
+        """Una alerta por racha de cada tipo (como recalcular.py), cortadas en el borde del bloque"""
+        activas = (
+            (t > perfil.temperature_max, t),
+            (h > perfil.humidity_max, h),
+            (c > perfil.current_max, c),
+            (niveles == 'critical', None)
+        )
+        filas = []
+        for (tipo, severidad, plantilla), (activa, valores) in zip(reglas.ALERTAS, activas):
+            inicios, fines = _rachas(activa)
+            for inicio, fin in zip(inicios.tolist(), fines.tolist()):
+                abierto = abierto_al_final and fin == len(fechas) - 1
+                if valores is None:
+                    mensaje, pico = plantilla, None
+                else:
+                    mensaje = plantilla.format(float(valores[inicio]))
+                    pico = float(valores[inicio:fin + 1].max())
+                filas.append((
+                    int(ids_predicciones[inicio]), equipo_id, tipo, mensaje, severidad,
+                    fechas[inicio], not abierto, None if abierto else 'resuelto',
+                    fin - inicio + 1, fechas[inicio], fechas[fin], pico
+                ))
+        return filas
+
+    def cerrar(self):
+        for connection in self.conexiones.values():
+            connection.close()
+        self.conexiones.clear()
+
+
+def generar(equipos, desde, hasta, intervalo=60, semilla=1, ultimo_dia=None, cargador=None):
+    """
+    Carga los dias [desde, hasta) de los equipos 0..equipos-1
+    ultimo_dia: ultimo dia de todos los datos; sus rachas abiertas quedan sin resolver
+    Retorna las lecturas escritas
+    """
+    propio = cargador is None
+    cargador = cargador or Cargador()
+    ultimo_dia = ultimo_dia or hasta - timedelta(days=1)
+    parametros = [(nombre_equipo(i), parametros_equipo(semilla, i)) for i in range(equipos)]
+    inicio = time.monotonic()
+    escritas = cargador.filas
+
+    try:
+        cargador.equipos(parametros, datetime.combine(ultimo_dia, datetime.max.time()).replace(microsecond=0))
+        bloque = desde
+        while bloque < hasta:
+            fin = min(bloque + timedelta(days=DIAS_POR_BLOQUE), hasta)
+            dias = [bloque + timedelta(days=d) for d in range((fin - bloque).days)]
+            for i, (equipo_id, p) in enumerate(parametros):
+                partes = [generar_dia(semilla, i, p, dia, intervalo) for dia in dias]
+                segundos = np.concatenate([s + d * 86400 for d, (s, _, _, _) in enumerate(partes)])
+                cargador.bloque(
+                    equipo_id, bloque, segundos,
+                    *(np.concatenate([parte[k] for parte in partes]) for k in (1, 2, 3)),
+                    abierto_al_final=dias[-1] == ultimo_dia
+                )
+            bloque = fin
+
+            transcurrido = time.monotonic() - inicio
+            filas = cargador.filas - escritas
+            print(f"[Sinteticos] Hasta {bloque} - {filas} lecturas, {cargador.alertas} alertas, "
+                  f"{filas / transcurrido if transcurrido else 0:.0f} lecturas/s")
+    finally:
+        if propio:
+            cargador.cerrar()
+        versiones.registrar_cambio_general()
+    return cargador.filas - escritas
+
+
+# =============================================
+# BENCHMARK
+# =============================================
+
+def filas_aproximadas():
+    """Filas de cada tabla segun information_schema (sin COUNT(*)), sumadas entre shards"""
+    total = dict.fromkeys(TABLAS + ('equipos',), 0)
+    for shard in range(shards.TOTAL):
+        connection = models.get_db_connection(shard=shard)
+        if not connection:
+            continue
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("""
+                    SELECT TABLE_NAME AS tabla, TABLE_ROWS AS filas
+                    FROM information_schema.TABLES
+                    WHERE TABLE_SCHEMA = DATABASE()
+                """)
+                for row in cursor.fetchall():
+                    if row['tabla'] in total:
+                        total[row['tabla']] += int(row['filas'] or 0)
+        finally:
+            connection.close()
+    return total
+
+
+def _rutas(equipo_id, ultimo_dia):
+    """Rutas GET a medir"""
+    dia = ultimo_dia.isoformat()
+    semana = (ultimo_dia - timedelta(days=7)).isoformat()
+    return [
+        '/health',
+        '/api/dashboard',
+        f'/api/dashboard?equipo_id={equipo_id}',
+        '/api/history?limit=100',
+        '/api/history?limit=100&format=columnar',
+        '/api/historial',
+        f'/api/historial?equipo_id={equipo_id}',
+        f'/api/historial?equipo_id={equipo_id}&start_date={semana}&end_date={dia}',
+        f'/api/historial?start_date={dia}&end_date={dia}&format=columnar',
+        '/api/alertas',
+        '/api/alertas/todas',
+        f'/api/alertas/todas?equipo_id={equipo_id}',
+        '/api/equipos/todos',
+        f'/api/equipos/{equipo_id}',
+        f'/api/explicacion?equipo_id={equipo_id}',
+        f'/api/explicacion?equipo_id={equipo_id}&window=1d',
+        f'/api/explicacion?equipo_id={equipo_id}&window=1000',
+        '/api/explicacion?window=7d',
+        '/api/fleet/summary',
+        f'/api/perfiles/{equipo_id}',
+        '/api/metricas',
+    ]
+
+
+def medir(repeticiones=20, equipo_id=None):
+    """
+    Mide cada ruta GET (una llamada de calentamiento y luego repeticiones)
+    Retorna {'filas': {...}, 'rutas': [{'ruta', 'status', 'bytes', 'p50_ms', 'p95_ms', 'max_ms'}]}
+    """
+    import app
+    import sesiones
+
+    ultimos = [
+        row['timestamp'] for row in
+        models.consultar_shards("SELECT MAX(timestamp) AS timestamp FROM lecturas_sensores") or []
+        if row['timestamp'] is not None
+    ]
+    if not ultimos:
+        raise RuntimeError('No hay lecturas: primero python datos_sinteticos.py generar')
+    equipo_id = equipo_id or nombre_equipo(0)
+
+    # Usuario ficticio (no esta en usuarios): recordado sin vencimiento
+    rol = SESSION_CONFIG['roles_gestion'][0]
+    SESSION_CONFIG['cache_ttl'] = float('inf')
+    sesiones.recordar(0, rol)
+    token = sesiones.crear_token(0, rol)
+    cliente = app.app.test_client()
+    encabezados = {'Authorization': f'Bearer {token}'}
+    resultados = []
+
+    for ruta in _rutas(equipo_id, max(ultimos).date()):
+        tiempos = []
+        # Las rutas imprimen cada consulta: se descarta la salida
+        with contextlib.redirect_stdout(io.StringIO()):
+            respuesta = cliente.get(ruta, headers=encabezados)
+            for _ in range(repeticiones):
+                inicio = time.perf_counter()
+                respuesta = cliente.get(ruta, headers=encabezados)
+                tiempos.append((time.perf_counter() - inicio) * 1000)
+        tiempos = np.array(tiempos)
+        resultados.append({
+            'ruta': ruta,
+            'status': respuesta.status_code,
+            'bytes': len(respuesta.data),
+            'p50_ms': round(float(np.percentile(tiempos, 50)), 2),
+            'p95_ms': round(float(np.percentile(tiempos, 95)), 2),
+            'max_ms': round(float(tiempos.max()), 2)
+        })
+    return {'filas': filas_aproximadas(), 'rutas': resultados}
+
+
+def imprimir(medicion):
+    filas = medicion['filas']
+    print("\nFilas aprox.: " + ', '.join(f"{t}={n:,}" for t, n in filas.items()))
+    print(f"{'ruta':<70} {'status':>6} {'bytes':>9} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}")
+    for r in medicion['rutas']:
+        print(f"{r['ruta']:<70} {r['status']:>6} {r['bytes']:>9} "
+              f"{r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f} {r['max_ms']:>9.2f}")
+
+
+def escalar(equipos, escalas, intervalo=60, semilla=1, repeticiones=20):
+    """
+    Crece los datos hasta cada escala (lecturas totales) y mide en cada una
+    Los dias se agregan hacia adelante desde una fecha fija, asi cada
+    escala contiene a la anterior
+    """
+    por_dia = equipos * (86400 // intervalo)
+    dias = [max(1, math.ceil(escala / por_dia)) for escala in escalas]
+    hasta = date.today()
+    inicio = hasta - timedelta(days=dias[-1])
+    ultimo_dia = hasta - timedelta(days=1)
+
+    cargador = Cargador()
+    mediciones = []
+    hechos = 0
+    try:
+        for escala, total_dias in zip(escalas, dias):
+            if total_dias > hechos:
+                generar(equipos, inicio + timedelta(days=hechos), inicio + timedelta(days=total_dias),
+                        intervalo, semilla, ultimo_dia, cargador)
+                hechos = total_dias
+            medicion = medir(repeticiones)
+            medicion['escala'] = escala
+            imprimir(medicion)
+            mediciones.append(medicion)
+    finally:
+        cargador.cerrar()
+    return mediciones
+
+
+def _verificar_local(forzar):
+    if DB_CONFIG['host'] not in ('localhost', '127.0.0.1', '::1') and not forzar:
+        raise SystemExit(f"DB_CONFIG apunta a {DB_CONFIG['host']}: use una BD local o pase --forzar")
+
+
+def _guardar(path, datos):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(datos, f, indent=2)
+    print(f"[Sinteticos] Resultados en {path}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Datos sinteticos y benchmark de las rutas de lectura')
+    sub = parser.add_subparsers(dest='comando', required=True)
+
+    gen = sub.add_parser('generar', help='Cargar datos sinteticos')
+    gen.add_argument('--equipos', type=int, default=20)
+    gen.add_argument('--dias', type=int, default=30)
+    gen.add_argument('--hasta', type=date.fromisoformat, default=date.today(),
+                     help='Dia siguiente al ultimo generado (fijarlo para repetir los mismos datos)')
+
+    med = sub.add_parser('medir', help='Medir las rutas de lectura con los datos actuales')
+    med.add_argument('--equipo', help='Equipo de las rutas por equipo (por defecto el primero)')
+
+    esc = sub.add_parser('escalar', help='Generar y medir en cada escala')
+    esc.add_argument('--equipos', type=int, default=100)
+    esc.add_argument('--escalas', default='1e5,1e6,1e7,1e8',
+                     help='Lecturas totales de cada medicion, separadas por coma')
+
+    for p in (gen, esc):
+        p.add_argument('--intervalo', type=int, default=60, help='Segundos entre lecturas')
+        p.add_argument('--semilla', type=int, default=1)
+        p.add_argument('--vaciar', action='store_true', help='Truncar las tablas de datos antes de cargar')
+        p.add_argument('--forzar', action='store_true', help='Permitir una BD que no es local')
+    for p in (med, esc):
+        p.add_argument('--repeticiones', type=int, default=20)
+        p.add_argument('--salida', help='Archivo JSON con los resultados')
+    args = parser.parse_args()
+
+    if args.comando in ('generar', 'escalar'):
+        _verificar_local(args.forzar)
+        if args.vaciar:
+            cargador = Cargador()
+            try:
+                cargador.vaciar()
+            finally:
+                cargador.cerrar()
+
+    if args.comando == 'generar':
+        inicio = time.monotonic()
+        total = generar(args.equipos, args.hasta - timedelta(days=args.dias), args.hasta,
+                        args.intervalo, args.semilla)
+        print(f"[Sinteticos] {total} lecturas en {time.monotonic() - inicio:.1f}s")
+    elif args.comando == 'medir':
+        medicion = medir(args.repeticiones, args.equipo)
+        imprimir(medicion)
+        if args.salida:
+            _guardar(args.salida, medicion)
+    else:
+        escalas = [int(float(e)) for e in args.escalas.split(',')]
+        mediciones = escalar(args.equipos, escalas, args.intervalo, args.semilla, args.repeticiones)
+        if args.salida:
+            _guardar(args.salida, mediciones)
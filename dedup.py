@@ -0,0 +1,63 @@
+"""
+Indice en memoria de lecturas recientes por equipo para descartar
+reenvios (el ESP32 reintenta cuando vence el timeout).
+
+Solo se deduplican las lecturas que traen seq. Cada equipo guarda una
+ventana deslizante seq -> reading_id de los ultimos
+DEDUP_CONFIG['ventana_segundos'] segundos (y a lo sumo 'window'
+secuencias). Pasada la ventana la misma seq es una lectura nueva: el
+seq del ESP32 vuelve a 0 al reiniciarse.
+
+Lo que llega a otro proceso lo detecta la clave unica
+(sensor_id, seq, seq_ventana) de lecturas_sensores, donde seq_ventana es
+el bloque de 'ventana_segundos' del timestamp de la lectura (el del
+dispositivo, que un reintento repite, o la hora de recepcion).
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from config import DEDUP_CONFIG
+
+_lock = threading.Lock()
+
+# equipo_id -> OrderedDict(seq -> (reading_id, monotonic)), del mas antiguo al mas reciente
+_ventanas = OrderedDict()
+
+
+def ventana(timestamp):
+    """Bloque de tiempo de la clave unica (sensor_id, seq, seq_ventana)"""
+    return int(timestamp.timestamp()) // DEDUP_CONFIG['ventana_segundos']
+
+
+def buscar(equipo_id, seq):
+    """Retorna el reading_id original si la lectura ya se recibio dentro de la ventana"""
+    with _lock:
+        ventana_equipo = _ventanas.get(equipo_id)
+        if ventana_equipo is None:
+            return None
+        guardada = ventana_equipo.get(seq)
+        if guardada is None or time.monotonic() - guardada[1] > DEDUP_CONFIG['ventana_segundos']:
+            return None
+        return guardada[0]
+
+
+def registrar(equipo_id, seq, reading_id):
+    """Recuerda una lectura guardada"""
+    ahora = time.monotonic()
+    with _lock:
+        ventana_equipo = _ventanas.get(equipo_id)
+        if ventana_equipo is None:
+            ventana_equipo = _ventanas[equipo_id] = OrderedDict()
+            if len(_ventanas) > DEDUP_CONFIG['max_equipos']:
+                _ventanas.popitem(last=False)
+        else:
+            _ventanas.move_to_end(equipo_id)
+
+        ventana_equipo.pop(seq, None)
+        ventana_equipo[seq] = (reading_id, ahora)
+        # Descartar por la punta lo vencido y lo que excede el tamano
+        limite = ahora - DEDUP_CONFIG['ventana_segundos']
+        while ventana_equipo and (len(ventana_equipo) > DEDUP_CONFIG['window'] or
+                                  next(iter(ventana_equipo.values()))[1] < limite):
+            ventana_equipo.popitem(last=False)
@@ -0,0 +1,216 @@
+"""
+Entrena el modelo de riesgo a partir del historial.
+
+Cada lectura de lecturas_sensores se etiqueta como fallo (1) si cae dentro
+de un intervalo de fallo de su equipo. Los intervalos salen de:
+
+- un CSV con fallos registrados fuera del sistema (--fallos, columnas
+  equipo_id,desde,hasta; p. ej. el registro de mantenimiento), o
+- por defecto, los incidentes criticos resueltos de alertas (entre su
+  primera y ultima ocurrencia).
+
+Limitacion: los incidentes criticos los abren las reglas de umbral sobre
+las mismas variables que usa el modelo, asi que con esas etiquetas el
+modelo aprende sobre todo a reproducir la heuristica. Para que aprenda
+algo mas hacen falta fallos independientes de los sensores (--fallos).
+
+Las lecturas se leen de todos los shards, en bloques por id, y se
+etiquetan en memoria contra los intervalos (una busqueda binaria por
+lectura, sin subconsulta por fila). El modelo se serializa con joblib
+junto con su version y las columnas que espera; modelo_riesgo.py lo
+carga al servir.
+
+Uso:
+    python entrenar_modelo.py [--salida modelo_riesgo.joblib] [--desde 2024-01-01]
+                              [--fallos fallos.csv]
+"""
+import argparse
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from config import MODEL_CONFIG
+import modelo_riesgo
+import models
+
+# Lecturas leidas por consulta (paginado por clave primaria)
+CHUNK = 50000
+
+
+def cargar_fallos(ruta):
+    """Intervalos de fallo de un CSV con columnas equipo_id,desde,hasta"""
+    fallos = pd.read_csv(ruta, parse_dates=['desde', 'hasta'])
+    return fallos[['equipo_id', 'desde', 'hasta']]
+
+
+def intervalos_incidentes(equipo_id=None, solo_resueltas=False):
+    """Intervalos (primera a ultima ocurrencia) de los incidentes criticos de todos los shards"""
+    sql = """
+        SELECT equipo_id, COALESCE(primera_vez, timestamp) AS desde,
+               COALESCE(ultima_vez, timestamp) AS hasta
+        FROM alertas
+        WHERE severidad = 'critical'
+    """
+    params = []
+    if solo_resueltas:
+        sql += " AND estado = 'resuelto'"
+    if equipo_id:
+        sql += " AND equipo_id = %s"
+        params.append(equipo_id)
+
+    filas = models.consultar_shards(sql, params, equipo_id=equipo_id)
+    if filas is None:
+        raise RuntimeError('No hay conexion a la base de datos')
+    return pd.DataFrame(filas, columns=['equipo_id', 'desde', 'hasta'])
+
+
+def _por_equipo(intervalos):
+    """
+    equipo_id -> (inicios ordenados, maximo acumulado de los finales)
+    Una lectura en t cae en algun intervalo si el mayor inicio <= t tiene
+    un final acumulado >= t (vale aunque los intervalos se solapen)
+    """
+    indice = {}
+    for equipo, grupo in intervalos.groupby('equipo_id'):
+        grupo = grupo.sort_values('desde')
+        indice[equipo] = (
+            grupo['desde'].to_numpy('datetime64[ns]'),
+            np.maximum.accumulate(grupo['hasta'].to_numpy('datetime64[ns]'))
+        )
+    return indice
+
+
+def _etiquetar(df, indice):
+    """Columna fallo de un bloque de lecturas (sensor_id, timestamp)"""
+    fallo = np.zeros(len(df), dtype=bool)
+    for equipo, posiciones in df.groupby('sensor_id').indices.items():
+        intervalos = indice.get(equipo)
+        if intervalos is None:
+            continue
+        inicios, finales = intervalos
+        ts = df['timestamp'].to_numpy('datetime64[ns]')[posiciones]
+        i = np.searchsorted(inicios, ts, side='right') - 1
+        fallo[posiciones] = (i >= 0) & (ts <= finales[np.maximum(i, 0)])
+    return fallo
+
+
+def cargar_historial(desde=None, limite=None, equipo_id=None, solo_resueltas=False, fallos=None):
+    """
+    Lee lecturas de todos los shards en bloques por id, las etiqueta y
+    retorna un DataFrame
+    solo_resueltas: etiquetar solo con incidentes ya resueltos (confirmados)
+    fallos: DataFrame de intervalos (equipo_id, desde, hasta) a usar en
+    lugar de los incidentes (ver cargar_fallos)
+    """
+    if fallos is None:
+        fallos = intervalos_incidentes(equipo_id, solo_resueltas)
+    indice = _por_equipo(fallos)
+
+    bloques = []
+    ultimo_id = 0
+    total = 0
+    while True:
+        sql = """
+            SELECT id, sensor_id, timestamp, temperatura, humedad, corriente
+            FROM lecturas_sensores
+            WHERE id > %s
+        """
+        params = [ultimo_id]
+        if equipo_id:
+            sql += " AND sensor_id = %s"
+            params.append(equipo_id)
+        if desde:
+            sql += " AND timestamp >= %s"
+            params.append(desde)
+        sql += " ORDER BY id LIMIT %s"
+        params.append(CHUNK)
+
+        # Cada shard da sus CHUNK primeros ids; la mezcla se corta en CHUNK
+        filas = models.consultar_shards(
+            sql, params, orden='id', descendente=False, limite=CHUNK, equipo_id=equipo_id
+        )
+        if filas is None:
+            raise RuntimeError('No hay conexion a la base de datos')
+        if not filas:
+            break
+        bloque = pd.DataFrame(filas)
+        bloque['fallo'] = _etiquetar(bloque, indice)
+        bloques.append(bloque[['id', 'temperatura', 'humedad', 'corriente', 'fallo']])
+        ultimo_id = filas[-1]['id']
+        total += len(filas)
+        print(f"[Entrenamiento] {total} lecturas leidas")
+        if limite and total >= limite:
+            break
+
+    if not bloques:
+        return pd.DataFrame(columns=['id', 'temperatura', 'humedad', 'corriente', 'fallo'])
+    return pd.concat(bloques, ignore_index=True)
+
+
+def preparar(df):
+    """Matriz de entrada (en el orden de modelo_riesgo.FEATURES) y etiquetas"""
+    X = np.column_stack([
+        df['temperatura'].astype(float).to_numpy(),
+        df['humedad'].astype(float).to_numpy(),
+        df['corriente'].astype(float).abs().to_numpy()
+    ])
+    y = df['fallo'].astype(int).to_numpy()
+    return X, y
+
+
+def entrenar(X, y):
+    """Entrena el clasificador y retorna (modelo, metricas)"""
+    from sklearn.ensemble import HistGradientBoostingClassifier
+    from sklearn.metrics import brier_score_loss, roc_auc_score
+    from sklearn.model_selection import train_test_split
+
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=0.2, random_state=42, stratify=y
+    )
+    modelo = HistGradientBoostingClassifier(max_iter=200, learning_rate=0.1, random_state=42)
+    modelo.fit(X_train, y_train)
+
+    probabilidades = modelo.predict_proba(X_test)[:, 1]
+    metricas = {
+        'roc_auc': round(float(roc_auc_score(y_test, probabilidades)), 4),
+        'brier': round(float(brier_score_loss(y_test, probabilidades)), 4),
+        'lecturas': int(len(y)),
+        'positivos': int(y.sum())
+    }
+    return modelo, metricas
+
+
+def guardar(modelo, metricas, salida, version=None):
+    """Serializa el modelo con su version"""
+    import joblib
+
+    version = version or f"hgb-{datetime.now():%Y%m%d%H%M%S}"
+    joblib.dump({
+        'version': version,
+        'features': modelo_riesgo.FEATURES,
+        'modelo': modelo,
+        'entrenado': datetime.now().isoformat(),
+        'metricas': metricas
+    }, salida)
+    return version
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Entrena el modelo de riesgo')
+    parser.add_argument('--salida', default=MODEL_CONFIG['path'])
+    parser.add_argument('--desde', help='Fecha minima de las lecturas (YYYY-MM-DD)')
+    parser.add_argument('--limite', type=int, help='Maximo de lecturas a usar')
+    parser.add_argument('--version', help='Etiqueta de version (por defecto hgb-<fecha>)')
+    parser.add_argument('--fallos', help='CSV de fallos (equipo_id,desde,hasta) en lugar de los incidentes')
+    args = parser.parse_args()
+
+    fallos = cargar_fallos(args.fallos) if args.fallos else None
+    df = cargar_historial(args.desde, args.limite, solo_resueltas=True, fallos=fallos)
+    X, y = preparar(df)
+    if len(np.unique(y)) < 2:
+        raise SystemExit('[Entrenamiento] El historial necesita lecturas con y sin fallo')
+
+    modelo, metricas = entrenar(X, y)
+    version = guardar(modelo, metricas, args.salida, args.version)
+    print(f"[Entrenamiento] Modelo {version} guardado en {args.salida}: {metricas}")
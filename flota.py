@@ -0,0 +1,278 @@
+"""
+Resumen de la flota (GET /api/fleet/summary) con contadores en memoria.
+
+En lugar de agregar con SQL sobre lecturas_sensores y alertas en cada
+consulta, los contadores se mantienen al escribir:
+
+- ingesta (etapa 'contar' de ingesta.py): nivel y riesgo de la ultima
+  lectura de cada equipo y hora en que se lo vio (online/offline),
+- incidentes.py y PUT /api/alertas/<id>/estado: alertas abiertas por
+  severidad y por area,
+- POST /api/equipos/registrar: equipos del catalogo y su area.
+
+resumen() no recorre la flota: los conteos ya estan hechos, los equipos
+que dejaron de reportar salen por la punta de un OrderedDict ordenado
+por hora de la ultima lectura y los de mayor riesgo se leen de un heap
+(las entradas viejas de un equipo se descartan al aparecer).
+
+El estado vive en el proceso: las escrituras de otro
+proceso (servidor_ingesta.py, otros workers, rebalancear.py) se ven al
+recargar desde la BD, cada FLEET_CONFIG['resync'] segundos y en segundo
+plano (la primera carga si es en linea). Los cambios que llegan durante
+una recarga se anotan y se vuelven a aplicar sobre el estado nuevo.
+"""
+import heapq
+import threading
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime
+
+from config import FLEET_CONFIG
+import formatos
+import models
+
+SIN_AREA = 'sin_area'
+SIN_NIVEL = 'unknown'
+
+
+class _Equipo:
+    """Estado de un equipo para el resumen"""
+    __slots__ = ('nivel', 'riesgo', 'visto', 'area', 'version')
+
+    def __init__(self, area=None):
+        self.nivel = SIN_NIVEL
+        self.riesgo = None
+        self.visto = None       # time.time() de la ultima lectura
+        self.area = area
+        self.version = 0        # cambia con el riesgo; invalida sus entradas viejas del heap
+
+
+class _Estado:
+    """Todos los contadores; una recarga arma uno nuevo y lo reemplaza entero"""
+
+    def __init__(self):
+        self.equipos = {}                 # equipo_id -> _Equipo
+        self.por_nivel = Counter()
+        self.en_linea = OrderedDict()     # equipo_id -> visto, del mas antiguo al mas reciente
+        self.alertas = {}                 # alert_id -> (severidad, area, (equipo_id, tipo))
+        self.por_tipo = {}                # (equipo_id, tipo) -> {alert_id}
+        self.por_severidad = Counter()
+        self.por_area = Counter()
+        self.heap = []                    # (-riesgo, equipo_id, version)
+
+    def equipo(self, equipo_id, area=None):
+        equipo = self.equipos.get(equipo_id)
+        if equipo is None:
+            equipo = self.equipos[equipo_id] = _Equipo(area)
+            self.por_nivel[SIN_NIVEL] += 1
+        return equipo
+
+    def lectura(self, equipo_id, nivel, riesgo, visto):
+        equipo = self.equipo(equipo_id)
+        if nivel != equipo.nivel:
+            self.por_nivel[equipo.nivel] -= 1
+            self.por_nivel[nivel] += 1
+            equipo.nivel = nivel
+        if riesgo is not None and riesgo != equipo.riesgo:
+            equipo.riesgo = riesgo
+            equipo.version += 1
+            heapq.heappush(self.heap, (-riesgo, equipo_id, equipo.version))
+            # Compactar cuando las entradas viejas superan a las vigentes
+            if len(self.heap) > 2 * len(self.equipos) + 64:
+                self.heap = [(-e.riesgo, i, e.version) for i, e in self.equipos.items()
+                             if e.riesgo is not None]
+                heapq.heapify(self.heap)
+        if visto is not None and (equipo.visto is None or visto >= equipo.visto):
+            equipo.visto = visto
+            self.en_linea[equipo_id] = visto
+            self.en_linea.move_to_end(equipo_id)
+
+    def area(self, equipo_id, area):
+        self.equipo(equipo_id).area = area
+
+    def abrir_alerta(self, alert_id, equipo_id, tipo, severidad):
+        if alert_id in self.alertas:
+            return
+        equipo = self.equipos.get(equipo_id)
+        area = (equipo.area if equipo else None) or SIN_AREA
+        self.alertas[alert_id] = (severidad, area, (equipo_id, tipo))
+        self.por_tipo.setdefault((equipo_id, tipo), set()).add(alert_id)
+        self.por_severidad[severidad] += 1
+        self.por_area[area] += 1
+
+    def cerrar_alerta(self, alert_id):
+        alerta = self.alertas.pop(alert_id, None)
+        if alerta is None:
+            return
+        severidad, area, clave = alerta
+        ids = self.por_tipo[clave]
+        ids.discard(alert_id)
+        if not ids:
+            del self.por_tipo[clave]
+        for contador, clave in ((self.por_severidad, severidad), (self.por_area, area)):
+            contador[clave] -= 1
+            if not contador[clave]:
+                del contador[clave]
+
+    def cerrar_tipos(self, equipo_id, tipos):
+        for tipo in tipos:
+            for alert_id in list(self.por_tipo.get((equipo_id, tipo), ())):
+                self.cerrar_alerta(alert_id)
+
+    def vencer(self, ahora):
+        """Saca de en_linea los equipos sin lecturas en FLEET_CONFIG['online_segundos']"""
+        limite = ahora - FLEET_CONFIG['online_segundos']
+        while self.en_linea:
+            equipo_id, visto = next(iter(self.en_linea.items()))
+            if visto >= limite:
+                break
+            self.en_linea.popitem(last=False)
+
+    def top(self, n):
+        """Los n equipos de mayor riesgo; descarta las entradas viejas que encuentra"""
+        vigentes = []
+        while self.heap and len(vigentes) < n:
+            entrada = heapq.heappop(self.heap)
+            equipo = self.equipos.get(entrada[1])
+            if equipo is not None and equipo.version == entrada[2]:
+                vigentes.append(entrada)
+        for entrada in vigentes:
+            heapq.heappush(self.heap, entrada)
+        return [(equipo_id, self.equipos[equipo_id]) for _, equipo_id, _ in vigentes]
+
+
+_lock = threading.Lock()
+_estado = _Estado()
+_cargado_en = None
+_diario = None        # cambios durante una recarga: [(metodo, args)]
+
+
+def _leer_estado():
+    """Arma un estado desde la BD; retorna None si no hay BD"""
+    areas = models.get_areas_equipos()
+    ultimas = models.get_ultimas_lecturas()
+    alertas = models.get_alertas_abiertas()
+    if areas is None or alertas is None:
+        return None
+
+    nuevo = _Estado()
+    for equipo_id, area in areas.items():
+        nuevo.equipo(equipo_id, area)
+    for lectura in sorted((ultimas or {}).values(), key=lambda l: l.timestamp or datetime.min):
+        nuevo.lectura(
+            lectura.equipo_id, lectura.nivel_riesgo or SIN_NIVEL,
+            float(lectura.riesgo_predicho) if lectura.riesgo_predicho is not None else None,
+            lectura.timestamp.timestamp() if lectura.timestamp else None
+        )
+    for fila in alertas:
+        nuevo.abrir_alerta(fila['id'], fila['equipo_id'], fila['tipo'], fila['severidad'])
+    return nuevo
+
+
+def _cargar():
+    """Arma el estado desde la BD y reemplaza el actual"""
+    global _estado, _cargado_en, _diario
+    inicio = time.monotonic()
+    nuevo = None
+    try:
+        nuevo = _leer_estado()
+    except Exception as e:
+        print(f"[Flota] Error cargando el estado: {e}")
+    finally:
+        # Sin BD o con error se siguen los contadores actuales y se reintenta
+        # al vencer; el diario se cierra siempre (abierto, no habria mas
+        # recargas y creceria sin limite)
+        with _lock:
+            try:
+                if nuevo is not None:
+                    for metodo, args in _diario:
+                        getattr(nuevo, metodo)(*args)
+                    _estado = nuevo
+            finally:
+                _cargado_en = time.monotonic()
+                _diario = None
+
+    if nuevo is not None:
+        print(f"[Flota] Estado cargado: {len(nuevo.equipos)} equipos, "
+              f"{len(nuevo.alertas)} alertas abiertas ({time.monotonic() - inicio:.2f}s)")
+
+
+def _asegurar_cargado():
+    """Primera carga en linea; las recargas periodicas en un hilo"""
+    global _diario
+    if _cargado_en is not None and time.monotonic() - _cargado_en < FLEET_CONFIG['resync']:
+        return
+    with _lock:
+        if _diario is not None:
+            return
+        _diario = []
+        primera = _cargado_en is None
+    if primera:
+        _cargar()
+    else:
+        threading.Thread(target=_cargar, name='flota-recarga', daemon=True).start()
+
+
+def _aplicar(metodo, *args):
+    with _lock:
+        getattr(_estado, metodo)(*args)
+        if _diario is not None:
+            _diario.append((metodo, args))
+
+
+def registrar_lectura(equipo_id, nivel, riesgo):
+    """Ultima lectura de un equipo (ingesta)"""
+    _aplicar('lectura', equipo_id, nivel, riesgo, time.time())
+
+
+def registrar_equipo(equipo_id, area=None):
+    """Equipo nuevo o con area cambiada (sus alertas ya abiertas conservan el area anterior)"""
+    _aplicar('area', equipo_id, area)
+
+
+def abrir_alerta(alert_id, equipo_id, tipo, severidad):
+    _aplicar('abrir_alerta', alert_id, equipo_id, tipo, severidad)
+
+
+def cerrar_alerta(alert_id):
+    """Alerta resuelta a mano (PUT /api/alertas/<id>/estado)"""
+    _aplicar('cerrar_alerta', alert_id)
+
+
+def cerrar_tipos(equipo_id, tipos):
+    """Alertas abiertas de un equipo resueltas por tipo (como models.resolve_incidentes)"""
+    _aplicar('cerrar_tipos', equipo_id, tipos)
+
+
+def resumen(top=None):
+    """Conteos de la flota y los top equipos de mayor riesgo"""
+    _asegurar_cargado()
+    ahora = time.time()
+    with _lock:
+        estado = _estado
+        estado.vencer(ahora)
+        total = len(estado.equipos)
+        online = len(estado.en_linea)
+        mayores = estado.top(top or FLEET_CONFIG['top'])
+        datos = {
+            'equipos': total,
+            'online': online,
+            'offline': total - online,
+            'por_nivel': {nivel: n for nivel, n in estado.por_nivel.items() if n},
+            'alertas_abiertas': len(estado.alertas),
+            'alertas_por_severidad': dict(estado.por_severidad),
+            'alertas_por_area': dict(estado.por_area),
+            'top_riesgo': [
+                {
+                    'equipo_id': equipo_id,
+                    'equipo_nombre': formatos.nombre_equipo(equipo_id),
+                    'area': equipo.area,
+                    'nivel_riesgo': equipo.nivel,
+                    'riesgo_predicho': equipo.riesgo,
+                    'online': equipo_id in estado.en_linea
+                }
+                for equipo_id, equipo in mayores
+            ]
+        }
+    datos['segundos_desde_recarga'] = round(time.monotonic() - _cargado_en, 1) if _cargado_en else None
+    return datos
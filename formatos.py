@@ -0,0 +1,152 @@
+"""
+Formatos de respuesta para los endpoints de historial.
+
+- Formato columnar: arreglos paralelos en lugar de un objeto por fila
+  (timestamps en epoch-ms, floats y columnas de baja cardinalidad
+  codificadas con diccionario).
+- Compresion gzip en streaming segun Accept-Encoding.
+"""
+import json
+import zlib
+
+# Nombres legibles de los equipos conocidos
+NOMBRES_EQUIPO = {
+    'ESP32_001': 'Laptop RRHH',
+    'ESP32_002': 'Laptop Contabilidad',
+    'ESP32_003': 'Laptop Administracion'
+}
+
+# Tamaño de bloque que se acumula antes de comprimir
+GZIP_BLOQUE = 16 * 1024
+GZIP_NIVEL = 6
+# Elementos de una lista larga que se serializan con un json.dumps
+FILAS_POR_BLOQUE = 500
+
+
+def nombre_equipo(equipo_id):
+    """Retorna el nombre legible de un equipo"""
+    return NOMBRES_EQUIPO.get(equipo_id, equipo_id)
+
+
+def _float_o_none(valor):
+    return float(valor) if valor is not None else None
+
+
+def _codificar_diccionario(valores):
+    """Codifica una columna repetitiva como (diccionario, codigos)"""
+    diccionario = []
+    indices = {}
+    codigos = []
+    for v in valores:
+        codigo = indices.get(v)
+        if codigo is None:
+            codigo = indices[v] = len(diccionario)
+            diccionario.append(v)
+        codigos.append(codigo)
+    return diccionario, codigos
+
+
+def lecturas_columnar(lecturas, incluir_equipo=False):
+    """
+    Convierte lecturas (registros.Lectura) en un objeto de arreglos paralelos
+    """
+    columnas = {
+        'format': 'columnar',
+        'count': len(lecturas),
+        'id': [r.id for r in lecturas],
+        'timestamp': [
+            int(r.timestamp.timestamp() * 1000) if r.timestamp else None
+            for r in lecturas
+        ],
+        'temperature': [_float_o_none(r.temperatura) for r in lecturas],
+        'humidity': [_float_o_none(r.humedad) for r in lecturas],
+        'current': [_float_o_none(r.corriente) for r in lecturas],
+        'failure_probability': [_float_o_none(r.riesgo_predicho) for r in lecturas]
+    }
+
+    niveles, codigos_nivel = _codificar_diccionario(r.nivel_riesgo for r in lecturas)
+    columnas['risk_level'] = {'dict': niveles, 'codes': codigos_nivel}
+
+    if incluir_equipo:
+        equipos, codigos_equipo = _codificar_diccionario(r.equipo_id for r in lecturas)
+        columnas['equipo'] = {
+            'dict': equipos,
+            'nombres': [nombre_equipo(e) for e in equipos],
+            'codes': codigos_equipo
+        }
+
+    return columnas
+
+
+def _calidad(parametros):
+    """Valor q de una codificacion de Accept-Encoding (1 si no se indica)"""
+    for parametro in parametros:
+        nombre, _, valor = parametro.partition('=')
+        if nombre.strip().lower() == 'q':
+            try:
+                return float(valor)
+            except ValueError:
+                return 0.0
+    return 1.0
+
+
+def acepta_gzip(accept_encoding):
+    """Retorna True si el cliente acepta respuestas gzip (respeta q=0 y *)"""
+    calidades = {}
+    for elemento in (accept_encoding or '').split(','):
+        codificacion, *parametros = elemento.split(';')
+        codificacion = codificacion.strip().lower()
+        if codificacion:
+            calidades[codificacion] = _calidad(parametros)
+    for codificacion in ('gzip', 'x-gzip', '*'):
+        if codificacion in calidades:
+            return calidades[codificacion] > 0
+    return False
+
+
+def _fragmentos_json(valor, codificar):
+    """
+    JSON de valor en fragmentos: las listas largas por bloques de
+    FILAS_POR_BLOQUE elementos, cada bloque con un solo json.dumps
+    """
+    if isinstance(valor, dict):
+        yield '{'
+        for i, (clave, v) in enumerate(valor.items()):
+            yield (',' if i else '') + codificar(str(clave)) + ':'
+            yield from _fragmentos_json(v, codificar)
+        yield '}'
+    elif isinstance(valor, list) and len(valor) > FILAS_POR_BLOQUE:
+        yield '['
+        for i in range(0, len(valor), FILAS_POR_BLOQUE):
+            yield (',' if i else '') + codificar(valor[i:i + FILAS_POR_BLOQUE])[1:-1]
+        yield ']'
+    else:
+        yield codificar(valor)
+
+
+def json_gzip_stream(payload, default):
+    """
+    Serializa el payload a JSON y lo comprime en gzip por bloques,
+    sin armar el documento completo en memoria
+    """
+    # encode() usa el encoder en C; iterencode() en fragmentos usa el de Python
+    codificar = json.JSONEncoder(default=default, separators=(',', ':'), ensure_ascii=False).encode
+    compresor = zlib.compressobj(GZIP_NIVEL, zlib.DEFLATED, 31)
+
+    buffer = []
+    tamano = 0
+    for fragmento in _fragmentos_json(payload, codificar):
+        buffer.append(fragmento)
+        tamano += len(fragmento)
+        if tamano >= GZIP_BLOQUE:
+            bloque = compresor.compress(''.join(buffer).encode('utf-8'))
+            buffer = []
+            tamano = 0
+            if bloque:
+                yield bloque
+
+    if buffer:
+        bloque = compresor.compress(''.join(buffer).encode('utf-8'))
+        if bloque:
+            yield bloque
+    yield compresor.flush()
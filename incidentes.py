@@ -0,0 +1,198 @@
+"""
+Incidentes: agrupa las alertas repetidas de un equipo.
+
+Mientras un valor sigue fuera de rango, cada lectura genera la misma
+alerta. En lugar de insertar una fila por lectura, se mantiene un
+incidente abierto por (equipo_id, tipo) con el numero de ocurrencias,
+primera y ultima vez y valor pico.
+
+La BD dice si un incidente esta abierto (la web y servidor_ingesta.py
+son procesos distintos y cualquiera puede abrirlo o resolverlo):
+
+- la primera ocurrencia en este proceso busca la alerta abierta de
+  (equipo_id, tipo) y le suma una ocurrencia, o la inserta si no hay
+  (models.abrir_incidente, con bloqueo sobre el indice de la 002),
+- las siguientes solo se cuentan en memoria y se suman a la fila como
+  maximo cada INCIDENT_CONFIG['flush_interval'] segundos (con la ingesta
+  o, si dejan de llegar lecturas, desde un hilo); en cada escritura se
+  olvidan los incidentes que otro proceso ya resolvio, y la proxima
+  ocurrencia abre uno nuevo,
+- cuando el valor vuelve a la normalidad el incidente se cierra (se
+  escriben las ocurrencias pendientes y la alerta queda resuelta).
+
+Las consultas a la BD se hacen fuera del lock.
+"""
+import atexit
+import os
+import threading
+import time
+from datetime import datetime
+
+from config import INCIDENT_CONFIG
+import flota
+import models
+
+
+class Incidente:
+    """Ocurrencias de un incidente abierto aun no escritas a la BD"""
+    __slots__ = ('alert_id', 'nuevas', 'ultima_vez', 'valor_pico')
+
+    def __init__(self, alert_id):
+        self.alert_id = alert_id
+        self.nuevas = 0
+        self.ultima_vez = None
+        self.valor_pico = None
+
+    def registrar(self, valor, ahora):
+        self.nuevas += 1
+        self.ultima_vez = ahora
+        if valor is not None and (self.valor_pico is None or valor > self.valor_pico):
+            self.valor_pico = valor
+
+    def fila(self, equipo_id):
+        """Fila para models.update_incidentes; vacia las ocurrencias pendientes"""
+        fila = (self.alert_id, equipo_id, self.nuevas, self.ultima_vez, self.valor_pico)
+        self.nuevas = 0
+        self.valor_pico = None
+        return fila
+
+
+_lock = threading.Lock()
+
+# equipo_id -> {tipo: Incidente}
+_abiertos = {}
+_ultimo_flush = time.monotonic()
+_hilo_pid = None
+
+
+def procesar(equipo_id, prediction_id, alerts, ahora=None):
+    """
+    Registra las alertas de una lectura y cierra los incidentes del equipo
+    que ya no se disparan
+    Retorna la lista de alertas que abrieron un incidente nuevo
+    """
+    _asegurar_hilo()
+    ahora = ahora or datetime.now()
+    nuevas = []
+    por_abrir = []
+    cerrados = []
+
+    with _lock:
+        abiertos = _abiertos.setdefault(equipo_id, {})
+        activos = {alert['type'] for alert in alerts}
+        for alert in alerts:
+            incidente = abiertos.get(alert['type'])
+            if incidente:
+                incidente.registrar(alert.get('value'), ahora)
+            else:
+                por_abrir.append(alert)
+        for tipo in [t for t in abiertos if t not in activos]:
+            cerrados.append((tipo, abiertos.pop(tipo)))
+
+    for alert in por_abrir:
+        tipo = alert['type']
+        resultado = models.abrir_incidente(
+            prediction_id, equipo_id, tipo, alert['message'],
+            alert['severity'], alert.get('value'), ahora
+        )
+        if not resultado:
+            continue
+        alert_id, nueva = resultado
+        with _lock:
+            _abiertos.setdefault(equipo_id, {}).setdefault(tipo, Incidente(alert_id))
+        if nueva:
+            flota.abrir_alerta(alert_id, equipo_id, tipo, alert['severity'])
+            nuevas.append(alert)
+
+    if cerrados:
+        pendientes = [inc.fila(equipo_id) for _, inc in cerrados if inc.nuevas]
+        if pendientes:
+            models.update_incidentes(pendientes)
+        models.resolve_incidentes(equipo_id, [tipo for tipo, _ in cerrados])
+        flota.cerrar_tipos(equipo_id, [tipo for tipo, _ in cerrados])
+
+    if time.monotonic() - _ultimo_flush >= INCIDENT_CONFIG['flush_interval']:
+        flush()
+
+    return nuevas
+
+
+def flush():
+    """
+    Escribe a la BD las ocurrencias pendientes y olvida los incidentes que
+    otro proceso resolvio
+    """
+    global _ultimo_flush
+    with _lock:
+        _ultimo_flush = time.monotonic()
+        filas = []
+        cargados = []
+        for equipo_id, abiertos in _abiertos.items():
+            for incidente in abiertos.values():
+                cargados.append((incidente.alert_id, equipo_id))
+                if incidente.nuevas:
+                    filas.append(incidente.fila(equipo_id))
+    if filas:
+        models.update_incidentes(filas)
+    if not cargados:
+        return
+
+    siguen = models.get_incidentes_abiertos(cargados)
+    if siguen is None:
+        return
+    resueltos = {alert_id for alert_id, _ in cargados} - siguen
+    if resueltos:
+        with _lock:
+            for abiertos in _abiertos.values():
+                for tipo in [t for t, inc in abiertos.items() if inc.alert_id in resueltos]:
+                    del abiertos[tipo]
+        print(f"[Incidentes] {len(resueltos)} incidentes resueltos por otro proceso")
+
+
+def _escritor():
+    """Hilo que escribe las ocurrencias pendientes aunque no lleguen lecturas"""
+    while True:
+        time.sleep(INCIDENT_CONFIG['flush_interval'])
+        if time.monotonic() - _ultimo_flush < INCIDENT_CONFIG['flush_interval']:
+            continue
+        try:
+            flush()
+        except Exception as e:
+            print(f"[Incidentes] Error escribiendo ocurrencias: {e}")
+
+
+def _asegurar_hilo():
+    """Arranca el hilo de escritura en este proceso (los hilos no sobreviven a un fork)"""
+    global _hilo_pid
+    if _hilo_pid == os.getpid():
+        return
+    with _lock:
+        if _hilo_pid != os.getpid():
+            threading.Thread(target=_escritor, name='incidentes-flush', daemon=True).start()
+            _hilo_pid = os.getpid()
+
+
+def olvidar_alerta(alert_id):
+    """
+    Descarta el incidente asociado a una alerta cerrada manualmente,
+    para que una nueva ocurrencia abra otro incidente
+    """
+    encontrado = None
+    with _lock:
+        for equipo_id, abiertos in _abiertos.items():
+            for tipo, incidente in list(abiertos.items()):
+                if incidente.alert_id == alert_id:
+                    del abiertos[tipo]
+                    encontrado = (equipo_id, incidente)
+                    break
+            if encontrado:
+                break
+    if encontrado is None:
+        return False
+    equipo_id, incidente = encontrado
+    if incidente.nuevas:
+        models.update_incidentes([incidente.fila(equipo_id)])
+    return True
+
+
+atexit.register(flush)
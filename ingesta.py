@@ -0,0 +1,329 @@
+"""
+Procesamiento comun de una lectura de sensores. Lo usan las rutas JSON
+(v1 y v2), la binaria y el servidor UDP/TCP (este por lotes con
+procesar_lote: persistir guarda el lote con un INSERT de varias filas).
+
+La lectura recorre la pipeline INGESTA (ver pipeline.py), una etapa por
+paso y con tiempos por etapa (GET /api/metricas):
+
+    parsear -> validar -> deduplicar -> enriquecer -> puntuar ->
+    persistir -> acumular -> contar -> alertar -> notificar -> publicar
+
+persistir va antes que alertar porque las alertas se guardan con el id
+de la prediccion. acumular suma los factores al rollup por minuto (ver
+rollup.py), contar actualiza el resumen de la flota (ver flota.py) y
+notificar solo encola (ver notificaciones.py). Para
+agregar una etapa sin tocar las rutas: registrar_etapa('exportar',
+funcion, despues='publicar', en_hilo=True).
+
+Si el shard del equipo no esta disponible la lectura se guarda en el
+spool local y se reenvia cuando vuelva (ver spool.py).
+"""
+import math
+from datetime import datetime
+
+import anomalias
+import dedup
+import flota
+import incidentes
+import models
+import notificaciones
+import pipeline
+import predictor
+import reglas
+import rollup
+import shards
+import spool
+
+# Largo maximo de equipo_id (columna VARCHAR(50))
+MAX_EQUIPO_ID = 50
+
+
+class LecturaInvalida(ValueError):
+    """Lectura con campos faltantes o fuera de formato (la ruta responde 400)"""
+
+
+class Lectura(pipeline.Contexto):
+    """Estado de una lectura mientras recorre la pipeline"""
+    __slots__ = (
+        'datos', 'equipo_id', 'temperature', 'humidity', 'current', 'timestamp', 'seq',
+        'perfil', 'prediction', 'reading_id', 'prediction_id', 'alerts', 'nuevas'
+    )
+
+    def __init__(self, equipo_id=None, temperature=None, humidity=None, current=None,
+                 timestamp=None, seq=None, datos=None):
+        super().__init__()
+        self.datos = datos
+        self.equipo_id = equipo_id
+        self.temperature = temperature
+        self.humidity = humidity
+        self.current = current
+        self.timestamp = timestamp
+        self.seq = seq
+        self.perfil = None
+        self.prediction = None
+        self.reading_id = None
+        self.prediction_id = None
+        self.alerts = []
+        self.nuevas = []
+
+    def como_resultado(self):
+        return {
+            'equipo_id': self.equipo_id,
+            'reading_id': self.reading_id,
+            'prediction': self.prediction,
+            'alerts': self.alerts
+        }
+
+
+def _duplicada(equipo_id, reading_id):
+    print(f"[{equipo_id}] Lectura duplicada, original: {reading_id}")
+    return {
+        'equipo_id': equipo_id,
+        'reading_id': reading_id,
+        'duplicate': True
+    }
+
+
+def _en_spool(l):
+    spool.guardar(l.equipo_id, l.temperature, l.humidity, l.current, l.timestamp, l.seq)
+    l.terminar({
+        'equipo_id': l.equipo_id,
+        'reading_id': None,
+        'spooled': True
+    })
+
+
+# =============================================
+# ETAPAS
+# =============================================
+
+def parsear(l):
+    """Campos del JSON de /api/ingest y /api/ingest/v2 (las demas entradas ya llegan tipadas)"""
+    if l.datos is None:
+        return
+    if not isinstance(l.datos, dict):
+        raise LecturaInvalida('Se esperaba un objeto JSON')
+    datos = l.datos
+    try:
+        l.temperature = float(datos.get('temperature', 0))
+        l.humidity = float(datos.get('humidity', 0))
+        l.current = float(datos.get('current', 0))
+        # Opcionales: seq del dispositivo (descarta reenvios) y su timestamp (epoch s)
+        seq = datos.get('seq')
+        l.seq = int(seq) if seq is not None else None
+        timestamp = datos.get('timestamp')
+        l.timestamp = datetime.fromtimestamp(float(timestamp)) if timestamp else None
+    except (TypeError, ValueError, OverflowError, OSError) as e:
+        raise LecturaInvalida(f'Campo invalido: {e}')
+
+    print(f"[Equipo: {l.equipo_id}] Temp: {l.temperature}°C, Hum: {l.humidity}%, Corriente: {l.current}A")
+
+
+def validar(l):
+    if not isinstance(l.equipo_id, str) or not 0 < len(l.equipo_id) <= MAX_EQUIPO_ID:
+        raise LecturaInvalida(f'equipo_id debe tener entre 1 y {MAX_EQUIPO_ID} caracteres')
+    if not all(math.isfinite(v) for v in (l.temperature, l.humidity, l.current)):
+        raise LecturaInvalida('Valores de sensores no finitos')
+
+
+def _circuito(l):
+    """Circuit breaker del shard donde se guarda la lectura"""
+    return shards.breaker_de(l.equipo_id, models.get_db_connection)
+
+
+def deduplicar(l):
+    """Si la lectura trae seq y ya se recibio dentro de la ventana, retorna el id original"""
+    if not _circuito(l).disponible():
+        _en_spool(l)
+        return
+    # Sin timestamp del dispositivo la hora de recepcion define la ventana de la clave unica
+    l.timestamp = l.timestamp or datetime.now()
+    if l.seq is not None:
+        original = dedup.buscar(l.equipo_id, l.seq)
+        if original:
+            l.terminar(_duplicada(l.equipo_id, original))
+
+
+def enriquecer(l):
+    l.perfil = reglas.perfil_para(l.equipo_id)
+
+
+def puntuar(l):
+    l.prediction = predictor.make_prediction(l.temperature, l.humidity, l.current, l.perfil)
+
+
+def persistir(l):
+    l.reading_id = models.insert_sensor_reading_multi(
+        l.equipo_id, l.temperature, l.humidity, l.current, l.timestamp, l.seq
+    )
+
+    if not l.reading_id:
+        if _circuito(l).fallos:
+            # No se pudo conectar al shard del equipo: la lectura no se guardo
+            _en_spool(l)
+            return
+        if l.seq is not None:
+            # Llego a otro proceso: la clave unica de la BD lo detecta
+            original = models.get_reading_id_by_seq(l.equipo_id, l.seq, l.timestamp)
+            if original:
+                dedup.registrar(l.equipo_id, l.seq, original)
+                l.terminar(_duplicada(l.equipo_id, original))
+                return
+        l.terminar(None)
+        return
+
+    if l.seq is not None:
+        dedup.registrar(l.equipo_id, l.seq, l.reading_id)
+
+    l.prediction_id = models.insert_prediction_multi(
+        l.reading_id,
+        l.equipo_id,
+        l.prediction['risk_level'],
+        l.prediction['failure_probability'],
+        l.prediction['influential_factors']
+    )
+
+
+def persistir_lote(ls):
+    """persistir de varias lecturas: un INSERT de lecturas y uno de predicciones por shard"""
+    resultado = models.insert_sensor_readings_bulk(
+        [(l.equipo_id, l.temperature, l.humidity, l.current, l.timestamp, l.seq) for l in ls]
+    )
+    if resultado is None:
+        # No se guardo nada: cada una por su cuenta (al spool si su shard esta caido)
+        for l in ls:
+            persistir(l)
+        return
+
+    ids, previas = resultado
+    guardadas = []
+    for i, (l, reading_id) in enumerate(zip(ls, ids)):
+        if reading_id is False:
+            _en_spool(l)
+        elif not reading_id:
+            l.terminar(None)
+        elif i in previas:
+            # Reenvio que llego a otro proceso o repetido dentro del lote
+            dedup.registrar(l.equipo_id, l.seq, reading_id)
+            l.terminar(_duplicada(l.equipo_id, reading_id))
+        else:
+            l.reading_id = reading_id
+            if l.seq is not None:
+                dedup.registrar(l.equipo_id, l.seq, reading_id)
+            guardadas.append(l)
+    if not guardadas:
+        return
+
+    models.update_equipos_conexion({l.equipo_id for l in guardadas})
+    ahora = datetime.now()
+    predicciones = []
+    for l in guardadas:
+        factores = l.prediction['influential_factors']
+        predicciones.append((
+            l.reading_id, l.equipo_id, l.prediction['risk_level'], l.prediction['failure_probability'],
+            factores['Temperatura'], factores['Humedad'], factores['Corriente'], ahora
+        ))
+    ids_prediccion = models.insert_predictions_bulk(predicciones)
+    for l in guardadas:
+        l.prediction_id = ids_prediccion.get(l.reading_id)
+
+
+def acumular(l):
+    if l.prediction_id:
+        rollup.registrar(
+            l.equipo_id, l.timestamp,
+            l.prediction['influential_factors'], l.prediction['failure_probability']
+        )
+
+
+def contar(l):
+    if l.prediction_id:
+        flota.registrar_lectura(
+            l.equipo_id, l.prediction['risk_level'], l.prediction['failure_probability']
+        )
+
+
+def alertar(l):
+    l.alerts = predictor.check_alerts(
+        l.temperature, l.humidity, l.current, l.prediction['risk_level'], l.perfil
+    )
+    l.alerts += anomalias.evaluar(l.equipo_id, l.temperature, l.humidity, l.current, l.timestamp)
+
+    # Agrupar alertas repetidas en incidentes; los que dejaron de
+    # dispararse se cierran (auto-resolucion por equipo y tipo)
+    l.nuevas = incidentes.procesar(l.equipo_id, l.prediction_id, l.alerts, l.timestamp)
+
+
+def notificar(l):
+    if l.nuevas:
+        notificaciones.encolar(l.equipo_id, l.nuevas, l.timestamp)
+
+
+def publicar(l):
+    predictor.update_trend(l.equipo_id, l.temperature, l.current, l.timestamp)
+    print(f"[{l.equipo_id}] Riesgo: {l.prediction['risk_level']} ({l.prediction['failure_probability']*100:.1f}%)")
+
+
+INGESTA = pipeline.Pipeline('ingesta')
+# Etapas con version para procesar_lote
+_LOTES = {'persistir': persistir_lote}
+
+for _nombre, _funcion in (
+    ('parsear', parsear),
+    ('validar', validar),
+    ('deduplicar', deduplicar),
+    ('enriquecer', enriquecer),
+    ('puntuar', puntuar),
+    ('persistir', persistir),
+    ('acumular', acumular),
+    ('contar', contar),
+    ('alertar', alertar),
+    ('notificar', notificar),
+    ('publicar', publicar),
+):
+    INGESTA.agregar(_nombre, _funcion, lote=_LOTES.get(_nombre))
+
+
+def registrar_etapa(nombre, funcion, en_hilo=False, antes=None, despues=None, lote=None):
+    """
+    Agrega (o reemplaza) una etapa de la pipeline de ingesta
+    funcion recibe la Lectura; con en_hilo=True ella y las siguientes
+    corren en el pool de la pipeline y la respuesta no las espera
+    lote (opcional) recibe la lista de Lecturas de procesar_lote
+    """
+    INGESTA.agregar(nombre, funcion, en_hilo, antes, despues, lote)
+
+
+def _procesar(lectura):
+    INGESTA.ejecutar(lectura)
+    if lectura.terminado:
+        return lectura.resultado
+    return lectura.como_resultado()
+
+
+def procesar_lectura(equipo_id, temperature, humidity, current, timestamp=None, seq=None):
+    """
+    Procesa una lectura de un equipo
+    Si la lectura trae seq y ya se recibio dentro de la ventana de
+    deduplicacion, no se vuelve a guardar y se retorna el reading_id original
+    Si la BD no esta disponible retorna {'spooled': True, ...}
+    Retorna un diccionario con el resultado o None si no se pudo guardar
+    Lanza LecturaInvalida si los campos no son validos
+    """
+    return _procesar(Lectura(equipo_id, temperature, humidity, current, timestamp, seq))
+
+
+def procesar_lote(lecturas):
+    """
+    Procesa varias lecturas (equipo_id, temperature, humidity, current,
+    timestamp, seq) con una escritura por lote en la BD
+    Retorna la lista de resultados en el mismo orden (None las que fallaron)
+    """
+    contextos = INGESTA.ejecutar_lote([Lectura(*lectura) for lectura in lecturas])
+    return [l.resultado if l.terminado else l.como_resultado() for l in contextos]
+
+
+def procesar_json(datos, equipo_id):
+    """Como procesar_lectura, a partir del JSON recibido por las rutas de ingesta"""
+    return _procesar(Lectura(equipo_id, datos=datos))
@@ -0,0 +1,234 @@
+"""
+Limite de lecturas por equipo y de toda la flota (token bucket) y
+descarte de carga.
+
+- Cada equipo tiene un balde que se recarga a 'rate' lecturas por segundo
+  hasta 'burst'. Una lectura sin fichas se rechaza con un tiempo de
+  reintento sugerido.
+- Toda la flota comparte un balde de 'global_rate' lecturas por segundo
+  hasta 'global_burst' (0 = sin limite global).
+- Cuando al balde global le queda menos de 'prioridad_lecturas' de su
+  rafaga, la ingesta esta al limite y las rutas de consulta se rechazan
+  con 503 (ver app.py): la ingesta sigue pasando.
+- Si hay mas de 'max_en_vuelo' requests de ingesta en curso en el proceso,
+  los nuevos se rechazan de inmediato en lugar de encolarse. Solo sirve
+  con workers de varios hilos (servidor_ingesta.py, gunicorn --threads):
+  un worker sincronico atiende un request a la vez.
+
+Los baldes viven en un archivo mapeado en memoria ('archivo') que
+comparten todos los procesos del host (workers de gunicorn y
+servidor_ingesta.py), asi que la tasa vale para el host y no se
+multiplica por el numero de workers. Cada conjunto de baldes se bloquea
+con fcntl.lockf sobre su rango de bytes: O(1) por lectura y tamano fijo
+('max_equipos' baldes, asociativo de a 4; un equipo nuevo reemplaza al
+menos reciente de su conjunto). Con varios hosts cada uno lleva los
+suyos. Sin fcntl (Windows) o sin el archivo, los baldes son del proceso.
+"""
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:     # Windows: baldes por proceso
+    fcntl = None
+
+from config import RATE_LIMIT_CONFIG
+
+_lock = threading.Lock()
+
+
+class TokenBucket:
+    """Balde de fichas de un equipo"""
+    __slots__ = ('fichas', 'actualizado')
+
+    def __init__(self, capacidad, ahora):
+        self.fichas = capacidad
+        self.actualizado = ahora
+
+    def tomar(self, n, ahora, tasa, capacidad, consumir=True):
+        """
+        Intenta consumir n fichas
+        Retorna 0 si se permitio o los segundos a esperar si no
+        """
+        self.fichas, self.actualizado, espera = _tomar(
+            self.fichas, self.actualizado, n, ahora, tasa, capacidad, consumir
+        )
+        return espera
+
+
+def _tomar(fichas, actualizado, n, ahora, tasa, capacidad, consumir=True):
+    """
+    Recarga y consume n fichas (n negativo las devuelve)
+    Retorna (fichas, actualizado, segundos a esperar o 0)
+    """
+    if actualizado > ahora:
+        fichas = capacidad      # archivo de antes de un reinicio del host
+    else:
+        fichas = min(capacidad, fichas + (ahora - actualizado) * tasa)
+    if fichas < n:
+        return fichas, ahora, (n - fichas) / tasa
+    if consumir:
+        fichas = min(capacidad, fichas - n)
+    return fichas, ahora, 0.0
+
+
+# =============================================
+# BALDES COMPARTIDOS ENTRE PROCESOS
+# =============================================
+
+# Balde: (clave, fichas, actualizado); clave 0 = libre, 1 = balde global
+BALDE = struct.Struct('<Qdd')
+POR_CONJUNTO = 4
+CONJUNTO = BALDE.size * POR_CONJUNTO
+CLAVE_GLOBAL = 1
+
+
+class _Compartidos:
+    """Tabla de baldes en un archivo mapeado; el conjunto 0 es el del balde global"""
+
+    def __init__(self, ruta, conjuntos):
+        self.conjuntos = conjuntos
+        tamano = CONJUNTO * conjuntos
+        self.fd = os.open(ruta, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.lockf(self.fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self.fd).st_size < tamano:
+                os.ftruncate(self.fd, tamano)
+        finally:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN)
+        self.memoria = mmap.mmap(self.fd, tamano)
+        # lockf bloquea entre procesos; los hilos del mismo proceso lo comparten
+        self.hilos = threading.Lock()
+
+    def _conjunto(self, clave):
+        return 0 if clave == CLAVE_GLOBAL else 1 + clave % (self.conjuntos - 1)
+
+    def tomar(self, clave, n, tasa, capacidad, consumir=True):
+        """Consume n fichas del balde de la clave; retorna los segundos a esperar o 0"""
+        inicio = self._conjunto(clave) * CONJUNTO
+        with self.hilos:
+            return self._tomar(inicio, clave, n, tasa, capacidad, consumir)
+
+    def _tomar(self, inicio, clave, n, tasa, capacidad, consumir):
+        fcntl.lockf(self.fd, fcntl.LOCK_EX, CONJUNTO, inicio)
+        try:
+            ahora = time.monotonic()
+            candidato = None
+            for offset in range(inicio, inicio + CONJUNTO, BALDE.size):
+                guardada, fichas, actualizado = BALDE.unpack_from(self.memoria, offset)
+                if guardada == clave:
+                    break
+                # Para una clave nueva: un balde libre o el menos reciente
+                orden = -1.0 if guardada == 0 else actualizado
+                if candidato is None or orden < candidato[1]:
+                    candidato = (offset, orden)
+            else:
+                offset, fichas, actualizado = candidato[0], capacidad, ahora
+            fichas, actualizado, espera = _tomar(fichas, actualizado, n, ahora, tasa, capacidad, consumir)
+            BALDE.pack_into(self.memoria, offset, clave, fichas, actualizado)
+            return espera
+        finally:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN, CONJUNTO, inicio)
+
+    def cerrar(self):
+        self.memoria.close()
+        os.close(self.fd)
+
+
+def _abrir_compartidos():
+    if fcntl is None or not RATE_LIMIT_CONFIG['archivo']:
+        return None
+    try:
+        conjuntos = 1 + max(1, RATE_LIMIT_CONFIG['max_equipos'] // POR_CONJUNTO)
+        return _Compartidos(RATE_LIMIT_CONFIG['archivo'], conjuntos)
+    except OSError as e:
+        print(f"[Limites] Sin baldes compartidos ({e}), se usan los del proceso")
+        return None
+
+
+_compartidos = _abrir_compartidos()
+
+
+def _clave(equipo_id):
+    clave = int.from_bytes(hashlib.blake2b(equipo_id.encode('utf-8'), digest_size=8).digest(), 'little')
+    return clave if clave > CLAVE_GLOBAL else clave + 2
+
+
+# equipo_id -> TokenBucket, en orden de uso (solo sin baldes compartidos)
+_baldes = OrderedDict()
+_global = None
+
+_en_vuelo = 0
+
+
+def _tomar_local(equipo_id, n, tasa, capacidad, consumir):
+    global _global
+    ahora = time.monotonic()
+    with _lock:
+        if equipo_id is None:
+            if _global is None:
+                _global = TokenBucket(capacidad, ahora)
+            return _global.tomar(n, ahora, tasa, capacidad, consumir)
+        balde = _baldes.get(equipo_id)
+        if balde is None:
+            balde = _baldes[equipo_id] = TokenBucket(capacidad, ahora)
+            if len(_baldes) > RATE_LIMIT_CONFIG['max_equipos']:
+                _baldes.popitem(last=False)
+        else:
+            _baldes.move_to_end(equipo_id)
+        return balde.tomar(n, ahora, tasa, capacidad, consumir)
+
+
+def _tomar_balde(equipo_id, n, tasa, capacidad, consumir=True):
+    """Balde de un equipo, o el global con equipo_id None"""
+    if _compartidos is None:
+        return _tomar_local(equipo_id, n, tasa, capacidad, consumir)
+    clave = CLAVE_GLOBAL if equipo_id is None else _clave(equipo_id)
+    return _compartidos.tomar(clave, n, tasa, capacidad, consumir)
+
+
+def permitir(equipo_id, n=1):
+    """
+    Consume n lecturas del balde del equipo y del global
+    Retorna (permitido, segundos_para_reintentar)
+    """
+    espera = _tomar_balde(equipo_id, n, RATE_LIMIT_CONFIG['rate'], RATE_LIMIT_CONFIG['burst'])
+    if espera or not RATE_LIMIT_CONFIG['global_rate']:
+        return espera == 0.0, espera
+
+    espera = _tomar_balde(None, n, RATE_LIMIT_CONFIG['global_rate'], RATE_LIMIT_CONFIG['global_burst'])
+    if espera:
+        # Sin lugar en la flota: el equipo recupera lo que consumio
+        _tomar_balde(equipo_id, -n, RATE_LIMIT_CONFIG['rate'], RATE_LIMIT_CONFIG['burst'])
+    return espera == 0.0, espera
+
+
+def ingesta_saturada():
+    """True si al balde global le queda menos de 'prioridad_lecturas' de su rafaga"""
+    if not RATE_LIMIT_CONFIG['global_rate'] or not RATE_LIMIT_CONFIG['prioridad_lecturas']:
+        return False
+    capacidad = RATE_LIMIT_CONFIG['global_burst']
+    umbral = RATE_LIMIT_CONFIG['prioridad_lecturas'] * capacidad
+    return _tomar_balde(None, umbral, RATE_LIMIT_CONFIG['global_rate'], capacidad, consumir=False) > 0
+
+
+def entrar():
+    """Registra un request de ingesta; retorna False si hay que descartarlo"""
+    global _en_vuelo
+    with _lock:
+        if _en_vuelo >= RATE_LIMIT_CONFIG['max_en_vuelo']:
+            return False
+        _en_vuelo += 1
+        return True
+
+
+def salir():
+    """Libera el lugar de un request de ingesta terminado"""
+    global _en_vuelo
+    with _lock:
+        _en_vuelo -= 1
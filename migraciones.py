@@ -0,0 +1,326 @@
+"""
+Migraciones del esquema MySQL.
+
+Cada migracion se aplica una sola vez y queda registrada en la tabla
+schema_migraciones. Un paso puede ser una sentencia SQL o una funcion
+que recibe la conexion y el numero de shard (para conversiones de datos por bloques, que
+hacen commit por bloque y se pueden retomar). Con varios shards (MYSQL_SHARDS) se aplican en cada
+uno; un shard nuevo necesita antes las tablas base del shard 0
+(mysqldump --no-data).
+
+Uso:
+    python migraciones.py            # aplica las pendientes
+    python migraciones.py --listar   # muestra el estado
+    python migraciones.py --rollup   # rearma rollup_factores (p. ej. despues de recalcular.py)
+"""
+import argparse
+from datetime import timedelta
+
+from config import SHARD_CONFIG
+import models
+import shards
+
+# Filas por UPDATE al convertir datos existentes
+BLOQUE_CONVERSION = 10000
+
+
+def _convertir_factores(connection, shard=0):
+    """
+    Copia el JSON de predicciones.factores a las columnas factor_* por
+    bloques de id (solo las filas que aun no se convirtieron)
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT MIN(id) AS minimo, MAX(id) AS maximo FROM predicciones")
+        rango = cursor.fetchone()
+        if rango['minimo'] is None:
+            return
+        convertidas = 0
+        for desde in range(rango['minimo'], rango['maximo'] + 1, BLOQUE_CONVERSION):
+            convertidas += cursor.execute("""
+                UPDATE predicciones SET
+                    factor_temperatura = JSON_EXTRACT(factores, '$.Temperatura'),
+                    factor_humedad = JSON_EXTRACT(factores, '$.Humedad'),
+                    factor_corriente = JSON_EXTRACT(factores, '$.Corriente')
+                WHERE id >= %s AND id < %s
+                  AND factor_temperatura IS NULL
+                  AND factores IS NOT NULL AND JSON_VALID(factores)
+            """, (desde, desde + BLOQUE_CONVERSION))
+            connection.commit()
+        print(f"[Migraciones] {convertidas} predicciones convertidas")
+
+
+def _llenar_rollup(connection, shard=0):
+    """
+    Arma rollup_factores con las predicciones existentes, un dia por vez
+    (cada minuto cae entero en un dia: repetir un dia no duplica)
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT DATE(MIN(timestamp)) AS primero, DATE(MAX(timestamp)) AS ultimo
+            FROM predicciones WHERE factor_temperatura IS NOT NULL
+        """)
+        rango = cursor.fetchone()
+        if rango['primero'] is None:
+            return
+        dia = rango['primero']
+        while dia <= rango['ultimo']:
+            cursor.execute("""
+                INSERT INTO rollup_factores (equipo_id, minuto, lecturas, suma_temperatura,
+                                             suma_humedad, suma_corriente, suma_riesgo)
+                SELECT equipo_id, DATE_FORMAT(timestamp, '%%Y-%%m-%%d %%H:%%i:00'), COUNT(*),
+                       SUM(factor_temperatura), SUM(factor_humedad),
+                       SUM(factor_corriente), SUM(riesgo_predicho)
+                FROM predicciones
+                WHERE timestamp >= %s AND timestamp < %s + INTERVAL 1 DAY
+                  AND factor_temperatura IS NOT NULL AND equipo_id IS NOT NULL
+                GROUP BY equipo_id, DATE_FORMAT(timestamp, '%%Y-%%m-%%d %%H:%%i:00')
+                ON DUPLICATE KEY UPDATE
+                    lecturas = VALUES(lecturas),
+                    suma_temperatura = VALUES(suma_temperatura),
+                    suma_humedad = VALUES(suma_humedad),
+                    suma_corriente = VALUES(suma_corriente),
+                    suma_riesgo = VALUES(suma_riesgo)
+            """, (dia, dia))
+            connection.commit()
+            dia += timedelta(days=1)
+        print(f"[Migraciones] Rollup de factores armado desde {rango['primero']}")
+
+
+# Tablas con ids intercalados por shard
+TABLAS_POR_SHARD = ('lecturas_sensores', 'predicciones', 'alertas')
+
+
+def _ids_sobre_base(connection, shard=0):
+    """
+    En los shards distintos del 0 los ids empiezan por encima de
+    SHARD_CONFIG['id_base'], para que shards.shard_de_id no confunda una
+    fila nueva con una anterior a los shards (que quedan en el shard 0)
+    """
+    if shard == 0:
+        return
+    base = SHARD_CONFIG['id_base']
+    if not base:
+        anterior = models.get_db_connection(shard=0)
+        if not anterior:
+            raise RuntimeError('Sin conexion al shard 0 para revisar SHARD_ID_BASE')
+        try:
+            with anterior.cursor() as cursor:
+                maximo = 0
+                for tabla in TABLAS_POR_SHARD:
+                    cursor.execute(f"SELECT COALESCE(MAX(id), 0) AS maximo FROM {tabla}")
+                    maximo = max(maximo, cursor.fetchone()['maximo'])
+        finally:
+            anterior.close()
+        if maximo:
+            raise RuntimeError(f'El shard 0 ya tiene filas: configure SHARD_ID_BASE >= {maximo}')
+        return
+    with connection.cursor() as cursor:
+        for tabla in TABLAS_POR_SHARD:
+            cursor.execute(f"ALTER TABLE {tabla} AUTO_INCREMENT = {int(base) + 1}")
+    print(f"[Migraciones] Shard {shard}: ids desde {base + 1}")
+
+
+MIGRACIONES = [
+    (
+        '001_lecturas_seq',
+        [
+            """
+            ALTER TABLE lecturas_sensores
+                ADD COLUMN seq BIGINT NULL,
+                ADD UNIQUE KEY uq_lecturas_sensor_seq (sensor_id, seq)
+            """
+        ]
+    ),
+    (
+        '002_alertas_incidentes',
+        [
+            """
+            ALTER TABLE alertas
+                ADD COLUMN ocurrencias INT NOT NULL DEFAULT 1,
+                ADD COLUMN primera_vez DATETIME NULL,
+                ADD COLUMN ultima_vez DATETIME NULL,
+                ADD COLUMN valor_pico FLOAT NULL,
+                ADD INDEX idx_alertas_equipo_tipo_estado (equipo_id, tipo, estado)
+            """
+        ]
+    ),
+    (
+        '003_perfiles_umbral',
+        [
+            """
+            CREATE TABLE perfiles_umbral (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                equipo_id VARCHAR(50) NULL,
+                area VARCHAR(100) NULL,
+                temperature_max FLOAT NOT NULL,
+                humidity_max FLOAT NOT NULL,
+                current_max FLOAT NOT NULL,
+                risk_critical FLOAT NOT NULL,
+                risk_high FLOAT NOT NULL,
+                peso_temperatura FLOAT NOT NULL DEFAULT 0.35,
+                peso_humedad FLOAT NOT NULL DEFAULT 0.25,
+                peso_corriente FLOAT NOT NULL DEFAULT 0.40,
+                actualizado TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                UNIQUE KEY uq_perfiles_equipo (equipo_id),
+                UNIQUE KEY uq_perfiles_area (area)
+            )
+            """
+        ]
+    ),
+    (
+        '004_predicciones_lectura_unica',
+        [
+            # Una prediccion por lectura: se conserva la mas reciente
+            """
+            DELETE p1 FROM predicciones p1
+            JOIN predicciones p2 ON p1.lectura_id = p2.lectura_id AND p1.id < p2.id
+            """,
+            """
+            ALTER TABLE predicciones
+                ADD UNIQUE KEY uq_predicciones_lectura (lectura_id)
+            """
+        ]
+    ),
+    (
+        '005_ubicacion_equipos',
+        [
+            # Shard fijado para un equipo (solo se lee la del shard 0)
+            """
+            CREATE TABLE ubicacion_equipos (
+                equipo_id VARCHAR(50) PRIMARY KEY,
+                shard INT NOT NULL,
+                actualizado TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+            )
+            """
+        ]
+    ),
+    (
+        '006_predicciones_factores',
+        [
+            # Factores como numeros (antes solo texto JSON en factores)
+            """
+            ALTER TABLE predicciones
+                ADD COLUMN factor_temperatura FLOAT NULL,
+                ADD COLUMN factor_humedad FLOAT NULL,
+                ADD COLUMN factor_corriente FLOAT NULL,
+                MODIFY factores TEXT NULL,
+                ADD INDEX idx_predicciones_equipo_fecha (equipo_id, timestamp)
+            """
+        ]
+    ),
+    (
+        '007_predicciones_factores_datos',
+        [_convertir_factores]
+    ),
+    (
+        '008_rollup_factores',
+        [
+            # Sumas por equipo y minuto de los factores de cada prediccion
+            # (las escribe rollup.py; con ellas se explica una ventana)
+            """
+            CREATE TABLE rollup_factores (
+                equipo_id VARCHAR(50) NOT NULL,
+                minuto DATETIME NOT NULL,
+                lecturas INT NOT NULL,
+                suma_temperatura DOUBLE NOT NULL,
+                suma_humedad DOUBLE NOT NULL,
+                suma_corriente DOUBLE NOT NULL,
+                suma_riesgo DOUBLE NOT NULL,
+                PRIMARY KEY (equipo_id, minuto),
+                INDEX idx_rollup_minuto (minuto)
+            )
+            """,
+            _llenar_rollup
+        ]
+    ),
+    (
+        '009_lecturas_seq_ventana',
+        [
+            # (sensor_id, seq) era permanente: el seq del ESP32 vuelve a 0 al
+            # reiniciarse. Ahora la clave vale dentro de un bloque de tiempo
+            # (dedup.ventana); las filas anteriores quedan sin bloque y no chocan
+            """
+            ALTER TABLE lecturas_sensores
+                ADD COLUMN seq_ventana INT NULL,
+                DROP INDEX uq_lecturas_sensor_seq,
+                ADD UNIQUE KEY uq_lecturas_sensor_seq_ventana (sensor_id, seq, seq_ventana)
+            """
+        ]
+    ),
+    (
+        '010_ids_sobre_base',
+        [_ids_sobre_base]
+    ),
+]
+
+
+def _asegurar_tabla(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migraciones (
+            nombre VARCHAR(100) PRIMARY KEY,
+            aplicada TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def migraciones_aplicadas(connection):
+    """Retorna el conjunto de migraciones ya aplicadas"""
+    with connection.cursor() as cursor:
+        _asegurar_tabla(cursor)
+        cursor.execute("SELECT nombre FROM schema_migraciones")
+        return {row['nombre'] for row in cursor.fetchall()}
+
+
+def aplicar_pendientes(shard=0):
+    """Aplica en orden las migraciones pendientes en un shard"""
+    connection = models.get_db_connection(shard=shard)
+    if not connection:
+        return False
+
+    try:
+        aplicadas = migraciones_aplicadas(connection)
+        for nombre, sentencias in MIGRACIONES:
+            if nombre in aplicadas:
+                continue
+            print(f"[Migraciones] Shard {shard}: aplicando {nombre}")
+            with connection.cursor() as cursor:
+                for paso in sentencias:
+                    if callable(paso):
+                        paso(connection, shard)
+                    else:
+                        cursor.execute(paso)
+                cursor.execute("INSERT INTO schema_migraciones (nombre) VALUES (%s)", (nombre,))
+            connection.commit()
+        print(f"[Migraciones] Shard {shard}: esquema al dia")
+        return True
+    except Exception as e:
+        print(f"Error aplicando migraciones: {e}")
+        return False
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Migraciones del esquema MySQL')
+    parser.add_argument('--listar', action='store_true', help='Solo mostrar el estado')
+    parser.add_argument('--rollup', action='store_true', help='Rearmar el rollup de factores desde predicciones')
+    args = parser.parse_args()
+
+    for shard in range(shards.TOTAL):
+        if args.rollup:
+            connection = models.get_db_connection(shard=shard)
+            if connection:
+                try:
+                    _llenar_rollup(connection, shard)
+                finally:
+                    connection.close()
+        elif args.listar:
+            connection = models.get_db_connection(shard=shard)
+            if connection:
+                aplicadas = migraciones_aplicadas(connection)
+                connection.close()
+                print(f"Shard {shard}:")
+                for nombre, _ in MIGRACIONES:
+                    print(f"  {'[x]' if nombre in aplicadas else '[ ]'} {nombre}")
+        else:
+            aplicar_pendientes(shard)
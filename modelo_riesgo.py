@@ -0,0 +1,140 @@
+"""
+Modelo de riesgo entrenado con scikit-learn (ver entrenar_modelo.py).
+
+- El modelo se carga una sola vez por worker, de forma perezosa en la
+  primera prediccion, o al importar la app si MODEL_CONFIG['preload'].
+- Las predicciones individuales se juntan en lotes: un hilo toma las
+  lecturas encoladas por los requests concurrentes y llama una sola vez a
+  predict_proba por lote.
+- Si no hay modelo (archivo ausente, scikit-learn no instalado, error o
+  timeout) las funciones retornan None y predictor usa la heuristica.
+"""
+import os
+import queue
+import threading
+from concurrent.futures import Future
+
+import numpy as np
+
+from config import MODEL_CONFIG
+
+# Orden de las columnas de entrada del modelo
+FEATURES = ('temperatura', 'humedad', 'corriente_abs')
+
+_lock = threading.Lock()
+_modelo = None
+_version = None
+_cargado = False
+
+_cola = None
+_hilo_pid = None
+
+
+def cargar(path=None):
+    """Carga el modelo serializado; retorna True si quedo disponible"""
+    global _modelo, _version, _cargado
+    path = path or MODEL_CONFIG['path']
+    with _lock:
+        _cargado = True
+        if not os.path.exists(path):
+            print(f"[Modelo] {path} no existe, se usa la heuristica")
+            return False
+        try:
+            import joblib
+            artefacto = joblib.load(path)
+            if tuple(artefacto['features']) != FEATURES:
+                print(f"[Modelo] Features incompatibles: {artefacto['features']}")
+                return False
+            _modelo = artefacto['modelo']
+            _version = artefacto['version']
+            print(f"[Modelo] Cargado {_version} desde {path}")
+            return True
+        except Exception as e:
+            print(f"[Modelo] Error cargando {path}: {e}")
+            _modelo = None
+            _version = None
+            return False
+
+
+def precargar():
+    """Carga el modelo antes de atender requests (p. ej. gunicorn --preload)"""
+    if not _cargado:
+        cargar()
+
+
+def version():
+    """Version del modelo cargado o None"""
+    if not _cargado:
+        cargar()
+    return _version
+
+
+def predecir_lote(matriz):
+    """
+    Probabilidad de fallo para una matriz (n, 3) de
+    [temperatura, humedad, |corriente|]; None si no hay modelo
+    """
+    if not _cargado:
+        cargar()
+    if _modelo is None:
+        return None
+    return _modelo.predict_proba(np.asarray(matriz, dtype=np.float64))[:, 1]
+
+
+def _atender_cola():
+    """Hilo que junta las lecturas encoladas y las predice por lotes"""
+    espera = MODEL_CONFIG['batch_wait_ms'] / 1000.0
+    maximo = MODEL_CONFIG['batch_max']
+    while True:
+        pendientes = [_cola.get()]
+        try:
+            while len(pendientes) < maximo:
+                pendientes.append(_cola.get(timeout=espera) if espera else _cola.get_nowait())
+        except queue.Empty:
+            pass
+
+        try:
+            probabilidades = predecir_lote([fila for fila, _ in pendientes])
+            for (_, futuro), p in zip(pendientes, probabilidades):
+                futuro.set_result(float(p))
+        except Exception as e:
+            for _, futuro in pendientes:
+                if not futuro.done():
+                    futuro.set_exception(e)
+
+
+def _asegurar_hilo():
+    """Arranca el hilo de lotes en este proceso (los hilos no sobreviven a un fork)"""
+    global _cola, _hilo_pid
+    if _hilo_pid == os.getpid():
+        return
+    with _lock:
+        if _hilo_pid != os.getpid():
+            _cola = queue.Queue()
+            threading.Thread(target=_atender_cola, name='modelo-riesgo', daemon=True).start()
+            _hilo_pid = os.getpid()
+
+
+def predecir(temperature, humidity, current):
+    """
+    Probabilidad de fallo de una lectura, agrupada en lote con las de
+    otros requests concurrentes
+    Retorna (probabilidad, version) o None si hay que usar la heuristica
+    """
+    if not _cargado:
+        cargar()
+    if _modelo is None:
+        return None
+
+    _asegurar_hilo()
+    futuro = Future()
+    _cola.put(((temperature, humidity, abs(current)), futuro))
+    try:
+        return futuro.result(timeout=MODEL_CONFIG['timeout']), _version
+    except Exception as e:
+        print(f"[Modelo] Prediccion fallida, se usa la heuristica: {e}")
+        return None
+
+
+if MODEL_CONFIG['preload']:
+    precargar()
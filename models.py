@@ -1,9 +1,32 @@
 import pymysql
-from config import DB_CONFIG
+from config import DB_CONFIG, RESILIENCE_CONFIG
 from datetime import datetime
+import dedup
+import registros
+import replicas
+import resiliencia
+import shards
+import versiones
 
-def get_db_connection():
-    """Crea y retorna una conexión a MySQL"""
+def get_db_connection(lectura=False, equipo_id=None, shard=None):
+    """
+    Crea y retorna una conexión a MySQL
+    equipo_id / shard: conexion al shard con los datos del equipo (por
+    defecto el shard 0, que tiene tambien las tablas comunes)
+    lectura=True: consulta de solo lectura, puede ir a una replica al dia
+    Retorna None de inmediato si el circuito de la BD esta abierto
+    """
+    if shard is None:
+        shard = shards.shard_de(equipo_id, get_db_connection) if equipo_id else 0
+    if shard:
+        return shards.conectar(shard)
+    
+    if lectura:
+        connection = replicas.conexion_lectura()
+        if connection:
+            return connection
+    if not resiliencia.bd.permitir():
+        return None
     try:
         connection = pymysql.connect(
             host=DB_CONFIG['host'],
@@ -11,16 +34,71 @@ def get_db_connection():
             password=DB_CONFIG['password'],
             database=DB_CONFIG['database'],
             port=DB_CONFIG['port'],
+            connect_timeout=RESILIENCE_CONFIG['connect_timeout'],
             cursorclass=pymysql.cursors.DictCursor
         )
+        resiliencia.bd.exito()
+        shards.preparar(connection, 0)
         return connection
     except Exception as e:
         print(f"Error conectando a MySQL: {e}")
+        resiliencia.bd.fallo()
+        return None
+
+
+def consultar_shards(sql, params=None, orden=None, descendente=True, limite=None,
+                     equipo_id=None, lectura=True, registro=None):
+    """
+    Ejecuta una consulta en el shard del equipo o, sin equipo, en todos
+    los shards en paralelo
+    orden: columna por la que ya viene ordenada la consulta; los
+    resultados de los shards se mezclan por ella (y se cortan en limite)
+    registro: clase de registros.py; las filas se leen con el cursor de
+    tuplas y se retornan como esos registros en lugar de dicts
+    Retorna la lista de filas o None si ningun shard respondio
+    """
+    def consultar(shard):
+        connection = get_db_connection(lectura=lectura, shard=shard)
+        if not connection:
+            return None
+        try:
+            if registro is not None:
+                with connection.cursor(pymysql.cursors.Cursor) as cursor:
+                    cursor.execute(sql, params)
+                    return registro.desde_cursor(cursor)
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+                return cursor.fetchall()
+        finally:
+            connection.close()
+    
+    if equipo_id is not None or not shards.activo():
+        return consultar(shards.shard_de(equipo_id, get_db_connection) if equipo_id else 0)
+    
+    resultados = shards.en_paralelo(consultar)
+    if all(r is None for r in resultados):
         return None
+    caidos = [i for i, r in enumerate(resultados) if r is None]
+    if caidos:
+        print(f"[Shards] Resultado parcial, sin respuesta de los shards {caidos}")
+    resultados = [list(r) for r in resultados if r]
+    
+    if orden is None:
+        return [fila for r in resultados for fila in r]
+    if registro is not None:
+        clave = lambda fila: getattr(fila, orden) or datetime.min
+    else:
+        clave = lambda fila: fila[orden] or datetime.min
+    return shards.mezclar(
+        resultados,
+        clave=clave,
+        descendente=descendente,
+        limite=limite
+    )
 
 def insert_sensor_reading(temperature, humidity, current):
     """Guarda una lectura de sensores en la base de datos"""
-    connection = get_db_connection()
+    connection = get_db_connection(equipo_id='ESP32_001')
     if not connection:
         return None
     
@@ -32,6 +110,7 @@ def insert_sensor_reading(temperature, humidity, current):
             """
             cursor.execute(sql, ('ESP32_001', temperature, humidity, current, datetime.now()))
             connection.commit()
+            versiones.registrar_lectura('ESP32_001')
             return cursor.lastrowid
     except Exception as e:
         print(f"Error insertando lectura: {e}")
@@ -40,8 +119,8 @@ def insert_sensor_reading(temperature, humidity, current):
         connection.close()
 
 def insert_prediction(reading_id, risk_level, failure_probability, factors):
-    """Guarda una predicción en la base de datos"""
-    connection = get_db_connection()
+    """Guarda una predicción en la base de datos (factors: dict de calculate_influential_factors)"""
+    connection = get_db_connection(equipo_id='ESP32_001')
     if not connection:
         return None
     
@@ -49,11 +128,12 @@ def insert_prediction(reading_id, risk_level, failure_probability, factors):
         with connection.cursor() as cursor:
             sql = """
                 INSERT INTO predicciones (lectura_id, nivel_riesgo, riesgo_predicho, 
-                                       factores, timestamp)
-                VALUES (%s, %s, %s, %s, %s)
+                                       factor_temperatura, factor_humedad, factor_corriente,
+                                       timestamp)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
             """
             cursor.execute(sql, (reading_id, risk_level, failure_probability, 
-                                factors, datetime.now()))
+                                *_columnas_factores(factors), datetime.now()))
             connection.commit()
             return cursor.lastrowid
     except Exception as e:
@@ -64,7 +144,7 @@ def insert_prediction(reading_id, risk_level, failure_probability, factors):
 
 def insert_alert(prediction_id, alert_type, message, severity):
     """Guarda una alerta en la base de datos"""
-    connection = get_db_connection()
+    connection = get_db_connection(equipo_id='ESP32_001')
     if not connection:
         return None
     
@@ -78,6 +158,7 @@ def insert_alert(prediction_id, alert_type, message, severity):
             cursor.execute(sql, (prediction_id, alert_type, message, severity, 
                                 datetime.now()))
             connection.commit()
+            versiones.registrar_cambio_alertas()
             return cursor.lastrowid
     except Exception as e:
         print(f"Error insertando alerta: {e}")
@@ -85,50 +166,54 @@ def insert_alert(prediction_id, alert_type, message, severity):
     finally:
         connection.close()
 
-def get_latest_readings(limit=10):
-    """Obtiene las últimas lecturas de sensores"""
-    connection = get_db_connection()
-    if not connection:
-        return []
-    
+def get_latest_readings(limit=10, equipo_id=None):
+    """Obtiene las últimas lecturas de sensores (de un equipo o de toda la flota)"""
     try:
-        with connection.cursor() as cursor:
-            sql = """
-                SELECT r.*, p.nivel_riesgo, p.riesgo_predicho
-                FROM lecturas_sensores r
-                LEFT JOIN predicciones p ON r.id = p.lectura_id
-                ORDER BY r.timestamp DESC
-                LIMIT %s
-            """
-            cursor.execute(sql, (limit,))
-            return cursor.fetchall()
+        filtro = "WHERE r.sensor_id = %s" if equipo_id else ""
+        sql = f"""
+            SELECT r.*, p.nivel_riesgo, p.riesgo_predicho
+            FROM lecturas_sensores r
+            LEFT JOIN predicciones p ON r.id = p.lectura_id
+            {filtro}
+            ORDER BY r.timestamp DESC
+            LIMIT %s
+        """
+        params = (equipo_id, limit) if equipo_id else (limit,)
+        return consultar_shards(
+            sql, params, orden='timestamp', limite=limit, equipo_id=equipo_id,
+            registro=registros.Lectura
+        ) or []
     except Exception as e:
         print(f"Error obteniendo lecturas: {e}")
         return []
-    finally:
-        connection.close()
+
+def get_recent_readings_since(minutes):
+    """Obtiene las lecturas de todos los equipos de los ultimos minutos, en orden"""
+    try:
+        sql = """
+            SELECT sensor_id, temperatura, humedad, corriente, timestamp
+            FROM lecturas_sensores
+            WHERE timestamp >= NOW() - INTERVAL %s MINUTE
+            ORDER BY timestamp
+        """
+        return consultar_shards(sql, (minutes,), orden='timestamp', descendente=False, lectura=False)
+    except Exception as e:
+        print(f"Error obteniendo lecturas recientes: {e}")
+        return None
 
 def get_active_alerts():
     """Obtiene las alertas activas"""
-    connection = get_db_connection()
-    if not connection:
-        return []
-    
     try:
-        with connection.cursor() as cursor:
-            sql = """
-                SELECT * FROM alertas
-                WHERE leida = FALSE
-                ORDER BY timestamp DESC
-                LIMIT 50
-            """
-            cursor.execute(sql)
-            return cursor.fetchall()
+        sql = """
+            SELECT * FROM alertas
+            WHERE leida = FALSE
+            ORDER BY timestamp DESC
+            LIMIT 50
+        """
+        return consultar_shards(sql, orden='timestamp', limite=50) or []
     except Exception as e:
         print(f"Error obteniendo alertas: {e}")
         return []
-    finally:
-        connection.close()
 
 def authenticate_user(email, password):
     """Autentica un usuario"""
@@ -158,185 +243,162 @@ def authenticate_user(email, password):
     finally:
         connection.close()
 
-def get_filtered_readings(start_date=None, end_date=None):
-    """Obtiene lecturas filtradas por fecha"""
-    connection = get_db_connection()
+def get_usuario_sesion(usuario_id):
+    """
+    Rol y equipo asignado de un usuario (para las sesiones)
+    Retorna False si el usuario no existe y None si no se pudo consultar
+    """
+    connection = get_db_connection(lectura=True)
     if not connection:
-        return []
+        return None
     
     try:
         with connection.cursor() as cursor:
-            sql = """
-                SELECT r.*, p.nivel_riesgo, p.riesgo_predicho
-                FROM lecturas_sensores r
-                LEFT JOIN predicciones p ON r.id = p.lectura_id
-            """
-            params = []
-            conditions = []
-            
-            if start_date:
-                conditions.append("r.timestamp >= %s")
-                params.append(start_date + ' 00:00:00')
-            
-            if end_date:
-                conditions.append("r.timestamp <= %s")
-                params.append(end_date + ' 23:59:59')
-            
-            if conditions:
-                sql += " WHERE " + " AND ".join(conditions)
-            
-            sql += " ORDER BY r.timestamp DESC LIMIT 500"
-            
-            print(f"[SQL] {sql}")
-            print(f"[Params] {params}")
-            
-            cursor.execute(sql, params if params else None)
-            results = cursor.fetchall()
-            
-            print(f"[Resultados] {len(results)} registros encontrados")
-            
-            return results
+            cursor.execute("""
+                SELECT u.id, u.rol, e.equipo_id
+                FROM usuarios u
+                LEFT JOIN equipos e ON e.operador_id = u.id
+                WHERE u.id = %s
+                LIMIT 1
+            """, (usuario_id,))
+            return cursor.fetchone() or False
     except Exception as e:
-        print(f"Error obteniendo lecturas filtradas: {e}")
-        return []
+        print(f"Error obteniendo usuario de la sesion: {e}")
+        return None
     finally:
         connection.close()
 
-def get_recent_alerts(limit=10):
-    """Obtiene las alertas más recientes"""
-    connection = get_db_connection()
-    if not connection:
-        return []
-    
+def get_filtered_readings(start_date=None, end_date=None):
+    """Obtiene lecturas filtradas por fecha"""
     try:
-        with connection.cursor() as cursor:
-            sql = """
-                SELECT id, prediccion_id, tipo, mensaje, severidad, 
-                       timestamp, leida
-                FROM alertas
-                WHERE leida = FALSE
-                ORDER BY timestamp DESC
-                LIMIT %s
-            """
-            cursor.execute(sql, (limit,))
-            return cursor.fetchall()
+        sql = """
+            SELECT r.*, p.nivel_riesgo, p.riesgo_predicho
+            FROM lecturas_sensores r
+            LEFT JOIN predicciones p ON r.id = p.lectura_id
+        """
+        params = []
+        conditions = []
+        
+        if start_date:
+            conditions.append("r.timestamp >= %s")
+            params.append(start_date + ' 00:00:00')
+        
+        if end_date:
+            conditions.append("r.timestamp <= %s")
+            params.append(end_date + ' 23:59:59')
+        
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        
+        sql += " ORDER BY r.timestamp DESC LIMIT 500"
+        
+        print(f"[SQL] {sql}")
+        print(f"[Params] {params}")
+        
+        results = consultar_shards(
+            sql, params if params else None, orden='timestamp', limite=500
+        ) or []
+        
+        print(f"[Resultados] {len(results)} registros encontrados")
+        
+        return results
     except Exception as e:
-        print(f"Error obteniendo alertas: {e}")
+        print(f"Error obteniendo lecturas filtradas: {e}")
         return []
-    finally:
-        connection.close()
 
-
-def update_alert_status(alert_id, status, notes=''):
-    """Actualiza el estado de una alerta"""
-    connection = get_db_connection()
-    if not connection:
-        return False
-    
+def get_recent_alerts(limit=10, equipo_id=None):
+    """Obtiene las alertas más recientes (de un equipo o de toda la flota)"""
     try:
-        with connection.cursor() as cursor:
-            sql = """
-                UPDATE alertas 
-                SET estado = %s, notas = %s, leida = %s
-                WHERE id = %s
-            """
-            leida = status in ['resuelto', 'en_proceso']
-            cursor.execute(sql, (status, notes, leida, alert_id))
-            connection.commit()
-            print(f"[DB] Alerta {alert_id} actualizada a estado: {status}")
-            return True
+        filtro = "AND equipo_id = %s" if equipo_id else ""
+        sql = f"""
+            SELECT id, prediccion_id, tipo, mensaje, severidad, 
+                   timestamp, leida
+            FROM alertas
+            WHERE leida = FALSE {filtro}
+            ORDER BY timestamp DESC
+            LIMIT %s
+        """
+        params = (equipo_id, limit) if equipo_id else (limit,)
+        return consultar_shards(
+            sql, params, orden='timestamp', limite=limit, equipo_id=equipo_id
+        ) or []
     except Exception as e:
-        print(f"Error actualizando alerta: {e}")
-        return False
-    finally:
-        connection.close()
-
-
-def get_all_alerts(limit=50):
-    """Obtiene todas las alertas (incluyendo leídas)"""
-    connection = get_db_connection()
-    if not connection:
-        return []
-    
-    try:
-        with connection.cursor() as cursor:
-            sql = """
-                SELECT id, prediccion_id, tipo, mensaje, severidad, 
-                       timestamp, leida, estado, notas
-                FROM alertas
-                ORDER BY timestamp DESC
-                LIMIT %s
-            """
-            cursor.execute(sql, (limit,))
-            return cursor.fetchall()
-    except Exception as e:
-        print(f"Error obteniendo todas las alertas: {e}")
+        print(f"Error obteniendo alertas: {e}")
         return []
-    finally:
-        connection.close()
 
 
-
-
-def auto_resolve_alerts(temperature, current):
-    """Resuelve alertas automaticamente cuando los valores vuelven a la normalidad"""
-    connection = get_db_connection()
-    if not connection:
-        return False
+def update_alert_status(alert_id, status, notes='', equipo_id=None):
+    """
+    Actualiza el estado de una alerta
+    El shard sale del id de la alerta (ver shards.shard_de_id); si se
+    indica el equipo, su shard se prueba despues. Si un shard no responde
+    se sigue con el siguiente
+    """
+    candidatos = [shards.shard_de_id(alert_id)]
+    if equipo_id:
+        shard_equipo = shards.shard_de(equipo_id, get_db_connection)
+        if shard_equipo not in candidatos:
+            candidatos.append(shard_equipo)
     
-    try:
-        # Umbrales normales
-        TEMP_MAX = 35.0
-        CURRENT_MAX = 15.0
+    for shard in candidatos:
+        connection = get_db_connection(shard=shard)
+        if not connection:
+            continue
         
-        # Si los valores estan normales, resolver alertas activas
-        if temperature < TEMP_MAX and abs(current) < CURRENT_MAX:
+        try:
             with connection.cursor() as cursor:
                 sql = """
                     UPDATE alertas 
-                    SET estado = 'resuelto', leida = TRUE
-                    WHERE estado != 'resuelto' OR estado IS NULL
+                    SET estado = %s, notas = %s, leida = %s
+                    WHERE id = %s
                 """
-                cursor.execute(sql)
+                leida = status in ['resuelto', 'en_proceso']
+                cursor.execute(sql, (status, notes, leida, alert_id))
                 connection.commit()
-                
-                if cursor.rowcount > 0:
-                    print(f"[Auto-Resolve] {cursor.rowcount} alertas resueltas automaticamente")
+                if cursor.rowcount == 0:
+                    continue
+                versiones.registrar_cambio_alertas()
+                print(f"[DB] Alerta {alert_id} actualizada a estado: {status}")
                 return True
-        return False
-    except Exception as e:
-        print(f"Error auto-resolviendo alertas: {e}")
-        return False
-    finally:
-        connection.close()
+        except Exception as e:
+            print(f"Error actualizando alerta en el shard {shard}: {e}")
+        finally:
+            connection.close()
+    return False
 
 
+def get_all_alerts(limit=50):
+    """Obtiene todas las alertas (incluyendo leídas)"""
+    try:
+        sql = """
+            SELECT id, prediccion_id, tipo, mensaje, severidad, 
+                   timestamp, leida, estado, notas
+            FROM alertas
+            ORDER BY timestamp DESC
+            LIMIT %s
+        """
+        return consultar_shards(sql, (limit,), orden='timestamp', limite=limit) or []
+    except Exception as e:
+        print(f"Error obteniendo todas las alertas: {e}")
+        return []
 
 
 def get_dashboard_alerts():
     """Obtiene alertas activas para el dashboard (no resueltas)"""
-    connection = get_db_connection()
-    if not connection:
-        return []
-    
     try:
-        with connection.cursor() as cursor:
-            # <CHANGE> Obtener alertas que NO estan resueltas
-            sql = """
-                SELECT id, prediccion_id, tipo, mensaje, severidad, 
-                       timestamp, leida, estado, notas
-                FROM alertas
-                WHERE estado != 'resuelto' OR estado IS NULL
-                ORDER BY timestamp DESC
-                LIMIT 10
-            """
-            cursor.execute(sql)
-            return cursor.fetchall()
+        # <CHANGE> Obtener alertas que NO estan resueltas
+        sql = """
+            SELECT id, prediccion_id, tipo, mensaje, severidad, 
+                   timestamp, leida, estado, notas
+            FROM alertas
+            WHERE estado != 'resuelto' OR estado IS NULL
+            ORDER BY timestamp DESC
+            LIMIT 10
+        """
+        return consultar_shards(sql, orden='timestamp', limite=10) or []
     except Exception as e:
         print(f"Error obteniendo alertas dashboard: {e}")
         return []
-    finally:
-        connection.close()
 
 
 
@@ -345,13 +407,17 @@ def get_dashboard_alerts():
 # =============================================
 
 def get_all_equipos():
-    """Obtiene todos los equipos registrados con su estado actual"""
-    connection = get_db_connection()
+    """
+    Obtiene todos los equipos registrados con su estado actual
+    (el catalogo esta en el shard 0; las alertas activas se cuentan en todos)
+    Retorna una lista de registros.Equipo
+    """
+    connection = get_db_connection(lectura=True)
     if not connection:
         return []
     
     try:
-        with connection.cursor() as cursor:
+        with connection.cursor(pymysql.cursors.Cursor) as cursor:
             sql = """
                 SELECT 
                     e.id,
@@ -362,16 +428,24 @@ def get_all_equipos():
                     e.activo,
                     e.ultima_conexion,
                     u.nombre as operador_nombre,
-                    u.email as operador_email,
-                    (SELECT COUNT(*) FROM alertas a 
-                     WHERE a.equipo_id = e.equipo_id 
-                     AND a.estado != 'resuelto') as alertas_activas
+                    u.email as operador_email
                 FROM equipos e
                 LEFT JOIN usuarios u ON e.operador_id = u.id
                 ORDER BY e.nombre
             """
             cursor.execute(sql)
-            return cursor.fetchall()
+            equipos = registros.Equipo.desde_cursor(cursor)
+        
+        sql_alertas = """
+            SELECT equipo_id, COUNT(*) AS total FROM alertas
+            WHERE estado != 'resuelto'
+            GROUP BY equipo_id
+        """
+        activas = {
+            row['equipo_id']: row['total']
+            for row in consultar_shards(sql_alertas) or []
+        }
+        return [e._replace(alertas_activas=activas.get(e.equipo_id, 0)) for e in equipos]
     except Exception as e:
         print(f"Error obteniendo equipos: {e}")
         return []
@@ -379,11 +453,119 @@ def get_all_equipos():
         connection.close()
 
 
+def get_ultimas_lecturas():
+    """
+    Ultima lectura (con su prediccion) de cada equipo
+    Una consulta por shard, en paralelo; retorna {equipo_id: registros.Lectura}
+    """
+    try:
+        sql = """
+            SELECT 
+                ls.sensor_id,
+                ls.temperatura,
+                ls.humedad,
+                ls.corriente,
+                ls.timestamp,
+                p.nivel_riesgo,
+                p.riesgo_predicho
+            FROM lecturas_sensores ls
+            JOIN (
+                SELECT sensor_id, MAX(timestamp) AS timestamp
+                FROM lecturas_sensores
+                GROUP BY sensor_id
+            ) ultimas ON ultimas.sensor_id = ls.sensor_id AND ultimas.timestamp = ls.timestamp
+            LEFT JOIN predicciones p ON ls.id = p.lectura_id
+        """
+        return {l.equipo_id: l for l in consultar_shards(sql, registro=registros.Lectura) or []}
+    except Exception as e:
+        print(f"Error obteniendo ultimas lecturas: {e}")
+        return {}
+
+
+def upsert_rollup_factores(filas):
+    """
+    Suma al rollup por minuto los acumulados de factores
+    filas: (equipo_id, minuto, lecturas, suma_temperatura, suma_humedad,
+    suma_corriente, suma_riesgo)
+    Retorna las filas que no se pudieron escribir (shard sin conexion)
+    """
+    fallidas = []
+    for shard, grupo in shards.agrupar(filas, lambda f: f[0], get_db_connection).items():
+        if not _upsert_rollup_factores_shard(grupo, shard):
+            fallidas.extend(grupo)
+    return fallidas
+
+
+def _upsert_rollup_factores_shard(filas, shard):
+    connection = get_db_connection(shard=shard)
+    if not connection:
+        return False
+    
+    try:
+        with connection.cursor() as cursor:
+            sql = """
+                INSERT INTO rollup_factores (equipo_id, minuto, lecturas, suma_temperatura,
+                                             suma_humedad, suma_corriente, suma_riesgo)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE
+                    lecturas = lecturas + VALUES(lecturas),
+                    suma_temperatura = suma_temperatura + VALUES(suma_temperatura),
+                    suma_humedad = suma_humedad + VALUES(suma_humedad),
+                    suma_corriente = suma_corriente + VALUES(suma_corriente),
+                    suma_riesgo = suma_riesgo + VALUES(suma_riesgo)
+            """
+            cursor.executemany(sql, filas)
+            connection.commit()
+            return True
+    except Exception as e:
+        print(f"Error escribiendo rollup de factores: {e}")
+        return False
+    finally:
+        connection.close()
+
+
+def get_rollup_buckets(equipo_id=None, desde=None, limite=None):
+    """
+    Minutos del rollup de factores, del mas reciente al mas antiguo
+    Sin equipo se suman los equipos de cada minuto (y se mezclan los shards)
+    Retorna una lista de dicts (minuto, lecturas, suma_*) o None si no hay conexion
+    """
+    sql = """
+        SELECT minuto, SUM(lecturas) AS lecturas,
+               SUM(suma_temperatura) AS suma_temperatura,
+               SUM(suma_humedad) AS suma_humedad,
+               SUM(suma_corriente) AS suma_corriente,
+               SUM(suma_riesgo) AS suma_riesgo
+        FROM rollup_factores
+        WHERE 1=1
+    """
+    params = []
+    if equipo_id:
+        sql += " AND equipo_id = %s"
+        params.append(equipo_id)
+    if desde:
+        sql += " AND minuto >= %s"
+        params.append(desde)
+    sql += " GROUP BY minuto ORDER BY minuto DESC"
+    if limite:
+        sql += " LIMIT %s"
+        params.append(limite)
+    
+    try:
+        return consultar_shards(
+            sql, params or None, orden='minuto', limite=limite, equipo_id=equipo_id
+        )
+    except Exception as e:
+        print(f"Error obteniendo rollup de factores: {e}")
+        return None
+
+
 def get_equipo_status(equipo_id):
     """Obtiene el estado actual de un equipo especifico"""
-    connection = get_db_connection()
+    connection = get_db_connection(lectura=True, equipo_id=equipo_id)
     if not connection:
         return None
+    catalogo = None
     
     try:
         with connection.cursor() as cursor:
@@ -405,16 +587,6 @@ def get_equipo_status(equipo_id):
             cursor.execute(sql, (equipo_id,))
             lectura = cursor.fetchone()
             
-            # Obtener info del equipo
-            sql_equipo = """
-                SELECT e.*, u.nombre as operador_nombre
-                FROM equipos e
-                LEFT JOIN usuarios u ON e.operador_id = u.id
-                WHERE e.equipo_id = %s
-            """
-            cursor.execute(sql_equipo, (equipo_id,))
-            equipo = cursor.fetchone()
-            
             # Contar alertas activas
             sql_alertas = """
                 SELECT COUNT(*) as total
@@ -423,6 +595,23 @@ def get_equipo_status(equipo_id):
             """
             cursor.execute(sql_alertas, (equipo_id,))
             alertas = cursor.fetchone()
+        
+        # Obtener info del equipo (catalogo en el shard 0)
+        if shards.shard_de(equipo_id, get_db_connection) == 0:
+            catalogo = connection
+        else:
+            catalogo = get_db_connection(lectura=True)
+            if not catalogo:
+                return None
+        with catalogo.cursor() as cursor:
+            sql_equipo = """
+                SELECT e.*, u.nombre as operador_nombre
+                FROM equipos e
+                LEFT JOIN usuarios u ON e.operador_id = u.id
+                WHERE e.equipo_id = %s
+            """
+            cursor.execute(sql_equipo, (equipo_id,))
+            equipo = cursor.fetchone()
             
             if equipo:
                 return {
@@ -436,6 +625,8 @@ def get_equipo_status(equipo_id):
         return None
     finally:
         connection.close()
+        if catalogo is not None and catalogo is not connection:
+            catalogo.close()
 
 
 def update_equipo_conexion(equipo_id):
@@ -461,25 +652,68 @@ def update_equipo_conexion(equipo_id):
         connection.close()
 
 
-def insert_sensor_reading_multi(equipo_id, temperature, humidity, current):
-    """Guarda una lectura de sensores con ID de equipo"""
+def update_equipos_conexion(equipo_ids):
+    """Actualiza la ultima conexion de varios equipos en un solo UPDATE"""
+    equipo_ids = list(equipo_ids)
+    if not equipo_ids:
+        return True
     connection = get_db_connection()
+    if not connection:
+        return False
+    
+    try:
+        with connection.cursor() as cursor:
+            marcadores = ', '.join(['%s'] * len(equipo_ids))
+            cursor.execute(
+                f"UPDATE equipos SET ultima_conexion = NOW() WHERE equipo_id IN ({marcadores})",
+                equipo_ids
+            )
+            connection.commit()
+            return True
+    except Exception as e:
+        print(f"Error actualizando conexion: {e}")
+        return False
+    finally:
+        connection.close()
+
+
+def insert_sensor_reading_multi(equipo_id, temperature, humidity, current, timestamp=None, seq=None):
+    """
+    Guarda una lectura de sensores con ID de equipo
+    (timestamp y numero de secuencia opcionales del dispositivo; con seq
+    la clave unica (sensor_id, seq, seq_ventana) rechaza los reenvios)
+    """
+    connection = get_db_connection(equipo_id=equipo_id)
     if not connection:
         return None
     
+    timestamp = timestamp or datetime.now()
     try:
         with connection.cursor() as cursor:
-            sql = """
-                INSERT INTO lecturas_sensores (sensor_id, temperatura, humedad, corriente, timestamp)
-                VALUES (%s, %s, %s, %s, %s)
-            """
-            cursor.execute(sql, (equipo_id, temperature, humidity, current, datetime.now()))
+            if seq is None:
+                sql = """
+                    INSERT INTO lecturas_sensores (sensor_id, temperatura, humedad, corriente, timestamp)
+                    VALUES (%s, %s, %s, %s, %s)
+                """
+                params = (equipo_id, temperature, humidity, current, timestamp)
+            else:
+                sql = """
+                    INSERT INTO lecturas_sensores (sensor_id, temperatura, humedad, corriente,
+                                                   timestamp, seq, seq_ventana)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                """
+                params = (equipo_id, temperature, humidity, current, timestamp, seq, dedup.ventana(timestamp))
+            cursor.execute(sql, params)
             connection.commit()
             
             # Actualizar ultima conexion del equipo
             update_equipo_conexion(equipo_id)
+            versiones.registrar_lectura(equipo_id, timestamp)
             
             return cursor.lastrowid
+    except pymysql.err.IntegrityError as e:
+        print(f"[Dedup] Lectura duplicada {equipo_id}/{seq}: {e}")
+        return None
     except Exception as e:
         print(f"Error insertando lectura: {e}")
         return None
@@ -487,9 +721,175 @@ def insert_sensor_reading_multi(equipo_id, temperature, humidity, current):
         connection.close()
 
 
+def get_reading_id_by_seq(equipo_id, seq, timestamp):
+    """Obtiene el id de una lectura ya guardada por su seq en la ventana de su timestamp"""
+    connection = get_db_connection(equipo_id=equipo_id)
+    if not connection:
+        return None
+    
+    try:
+        with connection.cursor() as cursor:
+            sql = """
+                SELECT id FROM lecturas_sensores
+                WHERE sensor_id = %s AND seq = %s AND seq_ventana = %s
+            """
+            cursor.execute(sql, (equipo_id, seq, dedup.ventana(timestamp)))
+            row = cursor.fetchone()
+            return row['id'] if row else None
+    except Exception as e:
+        print(f"Error buscando lectura por secuencia: {e}")
+        return None
+    finally:
+        connection.close()
+
+
+def insert_sensor_readings_bulk(lecturas):
+    """
+    Guarda en bloque lecturas: (equipo_id, t, h, c, timestamp, seq)
+    Las que traen seq van en un INSERT de varias filas; las que ya estaban
+    guardadas (misma clave unica) se ignoran y se informan, asi que se
+    puede reintentar el mismo bloque. Las que no traen seq se insertan en
+    la misma transaccion que las demas del shard
+    Retorna (ids, previas): los reading_id en el orden de lecturas (False
+    en las de un shard que no se pudo guardar) y los indices de las que ya
+    estaban guardadas; None si no se guardo ninguna
+    """
+    ids = [None] * len(lecturas)
+    previas = set()
+    guardado = False
+    indices = shards.agrupar(range(len(lecturas)), lambda i: lecturas[i][0], get_db_connection)
+    for shard, grupo in indices.items():
+        resultado = _insert_sensor_readings_bulk_shard([lecturas[i] for i in grupo], shard)
+        if resultado is None:
+            ids_shard, previas_shard = [False] * len(grupo), ()
+        else:
+            ids_shard, previas_shard = resultado
+            guardado = True
+        for i, reading_id in zip(grupo, ids_shard):
+            ids[i] = reading_id
+        previas.update(grupo[j] for j in previas_shard)
+    return (ids, previas) if guardado else None
+
+
+def _ids_por_seq(cursor, claves):
+    """(sensor_id, seq, seq_ventana) -> id de las lecturas ya guardadas con esas claves"""
+    if not claves:
+        return {}
+    marcadores = ', '.join(['(%s, %s, %s)'] * len(claves))
+    cursor.execute(
+        f"SELECT id, sensor_id, seq, seq_ventana FROM lecturas_sensores "
+        f"WHERE (sensor_id, seq, seq_ventana) IN ({marcadores})",
+        [v for clave in claves for v in clave]
+    )
+    return {(row['sensor_id'], row['seq'], row['seq_ventana']): row['id'] for row in cursor.fetchall()}
+
+
+def _insert_sensor_readings_bulk_shard(lecturas, shard):
+    connection = get_db_connection(shard=shard)
+    if not connection:
+        return None
+    
+    try:
+        with connection.cursor() as cursor:
+            claves = [(e, seq, dedup.ventana(ts)) if seq is not None else None
+                      for e, t, h, c, ts, seq in lecturas]
+            con_seq = list({clave for clave in claves if clave is not None})
+            existentes = _ids_por_seq(cursor, con_seq)
+            nuevas = [(e, t, h, c, ts, seq, clave[2])
+                      for (e, t, h, c, ts, seq), clave in zip(lecturas, claves)
+                      if clave is not None and clave not in existentes]
+            por_clave = dict(existentes)
+            if nuevas:
+                # executemany arma un solo INSERT de varias filas
+                cursor.executemany("""
+                    INSERT IGNORE INTO lecturas_sensores
+                        (sensor_id, temperatura, humedad, corriente, timestamp, seq, seq_ventana)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                """, nuevas)
+                por_clave.update(_ids_por_seq(cursor, [clave for clave in con_seq if clave not in existentes]))
+            
+            ids = []
+            previas = []
+            vistas = set()
+            for i, ((e, t, h, c, ts, seq), clave) in enumerate(zip(lecturas, claves)):
+                if clave is not None:
+                    ids.append(por_clave.get(clave))
+                    # Ya guardada antes o repetida dentro del mismo bloque
+                    if clave in existentes or clave in vistas:
+                        previas.append(i)
+                    vistas.add(clave)
+                    continue
+                # Sin clave para buscarla despues: id de cada INSERT
+                cursor.execute("""
+                    INSERT INTO lecturas_sensores (sensor_id, temperatura, humedad, corriente, timestamp)
+                    VALUES (%s, %s, %s, %s, %s)
+                """, (e, t, h, c, ts))
+                ids.append(cursor.lastrowid)
+            connection.commit()
+            
+            ultimas = {}
+            for e, t, h, c, ts, seq in lecturas:
+                ultimas[e] = max(ultimas.get(e, ts), ts)
+            for equipo_id, timestamp in ultimas.items():
+                versiones.registrar_lectura(equipo_id, timestamp)
+            return ids, previas
+    except Exception as e:
+        print(f"Error insertando lecturas en bloque: {e}")
+        return None
+    finally:
+        connection.close()
+
+
+def _columnas_factores(factors):
+    """Valores de las columnas factor_* a partir del dict de factores"""
+    return factors['Temperatura'], factors['Humedad'], factors['Corriente']
+
+
+def insert_predictions_bulk(predicciones):
+    """
+    Guarda en bloque predicciones: (lectura_id, equipo_id, nivel, riesgo,
+    factor_temperatura, factor_humedad, factor_corriente, timestamp)
+    Las lecturas que ya tienen prediccion se ignoran
+    Retorna {lectura_id: prediccion_id} de las que quedaron guardadas
+    """
+    ids = {}
+    for shard, grupo in shards.agrupar(predicciones, lambda p: p[1], get_db_connection).items():
+        ids.update(_insert_predictions_bulk_shard(grupo, shard) or {})
+    return ids
+
+
+def _insert_predictions_bulk_shard(predicciones, shard):
+    connection = get_db_connection(shard=shard)
+    if not connection:
+        return None
+    
+    try:
+        with connection.cursor() as cursor:
+            sql = """
+                INSERT IGNORE INTO predicciones (lectura_id, equipo_id, nivel_riesgo,
+                                              riesgo_predicho, factor_temperatura,
+                                              factor_humedad, factor_corriente, timestamp)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            """
+            cursor.executemany(sql, predicciones)
+            marcadores = ', '.join(['%s'] * len(predicciones))
+            cursor.execute(
+                f"SELECT id, lectura_id FROM predicciones WHERE lectura_id IN ({marcadores})",
+                [p[0] for p in predicciones]
+            )
+            ids = {row['lectura_id']: row['id'] for row in cursor.fetchall()}
+            connection.commit()
+            return ids
+    except Exception as e:
+        print(f"Error insertando predicciones en bloque: {e}")
+        return None
+    finally:
+        connection.close()
+
+
 def insert_prediction_multi(reading_id, equipo_id, risk_level, failure_probability, factors):
     """Guarda una prediccion con ID de equipo"""
-    connection = get_db_connection()
+    connection = get_db_connection(equipo_id=equipo_id)
     if not connection:
         return None
     
@@ -497,11 +897,12 @@ def insert_prediction_multi(reading_id, equipo_id, risk_level, failure_probabili
         with connection.cursor() as cursor:
             sql = """
                 INSERT INTO predicciones (lectura_id, equipo_id, nivel_riesgo, riesgo_predicho, 
-                                       factores, timestamp)
-                VALUES (%s, %s, %s, %s, %s, %s)
+                                       factor_temperatura, factor_humedad, factor_corriente,
+                                       timestamp)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
             """
             cursor.execute(sql, (reading_id, equipo_id, risk_level, failure_probability, 
-                                factors, datetime.now()))
+                                *_columnas_factores(factors), datetime.now()))
             connection.commit()
             return cursor.lastrowid
     except Exception as e:
@@ -513,7 +914,7 @@ def insert_prediction_multi(reading_id, equipo_id, risk_level, failure_probabili
 
 def insert_alert_multi(prediction_id, equipo_id, alert_type, message, severity):
     """Guarda una alerta con ID de equipo"""
-    connection = get_db_connection()
+    connection = get_db_connection(equipo_id=equipo_id)
     if not connection:
         return None
     
@@ -527,6 +928,7 @@ def insert_alert_multi(prediction_id, equipo_id, alert_type, message, severity):
             cursor.execute(sql, (prediction_id, equipo_id, alert_type, message, severity, 
                                 datetime.now()))
             connection.commit()
+            versiones.registrar_cambio_alertas(equipo_id)
             return cursor.lastrowid
     except Exception as e:
         print(f"Error insertando alerta: {e}")
@@ -554,9 +956,269 @@ def registrar_equipo(equipo_id, nombre, ubicacion, area=None, operador_id=None):
             """
             cursor.execute(sql, (equipo_id, nombre, ubicacion, area, operador_id))
             connection.commit()
+            versiones.registrar_cambio_equipos()
             return cursor.lastrowid
     except Exception as e:
         print(f"Error registrando equipo: {e}")
         return None
     finally:
-        connection.close()
\ No newline at end of file
+        connection.close()
+
+# =============================================
+# FUNCIONES PARA INCIDENTES (alertas agrupadas)
+# =============================================
+
+def abrir_incidente(prediction_id, equipo_id, alert_type, message, severity, valor, timestamp):
+    """
+    Suma una ocurrencia a la alerta abierta de (equipo_id, tipo) o la crea
+    si no hay ninguna. La BD decide si el incidente sigue abierto: otro
+    proceso pudo abrirlo o resolverlo
+    Retorna (alert_id, nueva) o None si fallo
+    """
+    connection = get_db_connection(equipo_id=equipo_id)
+    if not connection:
+        return None
+    
+    try:
+        for intento in range(2):
+            try:
+                return _abrir_incidente(connection, prediction_id, equipo_id, alert_type,
+                                        message, severity, valor, timestamp)
+            except pymysql.err.OperationalError as e:
+                connection.rollback()
+                # Dos procesos abriendo el mismo incidente: uno pierde el bloqueo y reintenta
+                if e.args[0] != 1213 or intento:
+                    raise
+    except Exception as e:
+        print(f"Error abriendo incidente: {e}")
+        return None
+    finally:
+        connection.close()
+
+
+def _abrir_incidente(connection, prediction_id, equipo_id, alert_type, message, severity, valor, timestamp):
+    with connection.cursor() as cursor:
+        # FOR UPDATE sobre idx_alertas_equipo_tipo_estado: quien llega segundo
+        # espera y encuentra la fila que abrio el primero
+        cursor.execute("""
+            SELECT id FROM alertas
+            WHERE equipo_id = %s AND tipo = %s
+            AND (estado != 'resuelto' OR estado IS NULL)
+            ORDER BY id DESC LIMIT 1
+            FOR UPDATE
+        """, (equipo_id, alert_type))
+        fila = cursor.fetchone()
+        if fila:
+            cursor.execute("""
+                UPDATE alertas
+                SET ocurrencias = ocurrencias + 1,
+                    ultima_vez = GREATEST(COALESCE(ultima_vez, %s), %s),
+                    valor_pico = COALESCE(GREATEST(valor_pico, %s), valor_pico, %s)
+                WHERE id = %s
+            """, (timestamp, timestamp, valor, valor, fila['id']))
+            alert_id, nueva = fila['id'], False
+        else:
+            cursor.execute("""
+                INSERT INTO alertas (prediccion_id, equipo_id, tipo, mensaje, severidad,
+                                  timestamp, leida, ocurrencias, primera_vez, ultima_vez, valor_pico)
+                VALUES (%s, %s, %s, %s, %s, %s, FALSE, 1, %s, %s, %s)
+            """, (prediction_id, equipo_id, alert_type, message, severity,
+                  timestamp, timestamp, timestamp, valor))
+            alert_id, nueva = cursor.lastrowid, True
+        connection.commit()
+        versiones.registrar_cambio_alertas(equipo_id)
+        return alert_id, nueva
+
+
+def update_incidentes(incidentes):
+    """
+    Suma en bloque las ocurrencias acumuladas de incidentes abiertos y
+    actualiza ultima vez y valor pico (las alertas ya resueltas no se tocan)
+    incidentes: lista de (alert_id, equipo_id, ocurrencias_nuevas, ultima_vez, valor_pico)
+    """
+    if not incidentes:
+        return True
+    
+    grupos = shards.agrupar(incidentes, lambda inc: inc[1], get_db_connection)
+    return all(_update_incidentes_shard(grupo, shard) for shard, grupo in grupos.items())
+
+
+def _update_incidentes_shard(incidentes, shard):
+    connection = get_db_connection(shard=shard)
+    if not connection:
+        return False
+    
+    try:
+        with connection.cursor() as cursor:
+            sql = """
+                UPDATE alertas
+                SET ocurrencias = ocurrencias + %s,
+                    ultima_vez = GREATEST(COALESCE(ultima_vez, %s), %s),
+                    valor_pico = COALESCE(GREATEST(valor_pico, %s), valor_pico, %s)
+                WHERE id = %s AND (estado != 'resuelto' OR estado IS NULL)
+            """
+            cursor.executemany(sql, [
+                (ocurrencias, ultima_vez, ultima_vez, valor_pico, valor_pico, alert_id)
+                for alert_id, _, ocurrencias, ultima_vez, valor_pico in incidentes
+            ])
+            connection.commit()
+            for equipo_id in {inc[1] for inc in incidentes}:
+                versiones.registrar_cambio_alertas(equipo_id)
+            return True
+    except Exception as e:
+        print(f"Error actualizando incidentes: {e}")
+        return False
+    finally:
+        connection.close()
+
+
+def get_incidentes_abiertos(alertas):
+    """
+    De las alertas dadas, las que siguen abiertas en la BD
+    alertas: lista de (alert_id, equipo_id)
+    Retorna el conjunto de alert_id abiertos, o None si algun shard fallo
+    """
+    abiertos = set()
+    grupos = shards.agrupar(alertas, lambda a: a[1], get_db_connection)
+    for shard, grupo in grupos.items():
+        connection = get_db_connection(shard=shard)
+        if not connection:
+            return None
+        try:
+            with connection.cursor() as cursor:
+                marcadores = ', '.join(['%s'] * len(grupo))
+                cursor.execute(f"""
+                    SELECT id FROM alertas
+                    WHERE id IN ({marcadores})
+                    AND (estado != 'resuelto' OR estado IS NULL)
+                """, [alert_id for alert_id, _ in grupo])
+                abiertos.update(row['id'] for row in cursor.fetchall())
+        except Exception as e:
+            print(f"Error verificando incidentes abiertos: {e}")
+            return None
+        finally:
+            connection.close()
+    return abiertos
+
+
+def resolve_incidentes(equipo_id, tipos):
+    """Marca como resueltas las alertas abiertas de un equipo para los tipos dados"""
+    if not tipos:
+        return True
+    
+    connection = get_db_connection(equipo_id=equipo_id)
+    if not connection:
+        return False
+    
+    try:
+        with connection.cursor() as cursor:
+            marcadores = ', '.join(['%s'] * len(tipos))
+            sql = f"""
+                UPDATE alertas
+                SET estado = 'resuelto', leida = TRUE
+                WHERE equipo_id = %s AND tipo IN ({marcadores})
+                AND (estado != 'resuelto' OR estado IS NULL)
+            """
+            cursor.execute(sql, (equipo_id, *tipos))
+            connection.commit()
+            if cursor.rowcount > 0:
+                versiones.registrar_cambio_alertas(equipo_id)
+                print(f"[Incidentes] {equipo_id}: {cursor.rowcount} alertas resueltas ({', '.join(tipos)})")
+            return True
+    except Exception as e:
+        print(f"Error resolviendo incidentes: {e}")
+        return False
+    finally:
+        connection.close()
+
+
+def get_alertas_abiertas():
+    """
+    Id, equipo, tipo y severidad de las alertas no resueltas (carga inicial de flota.py)
+    Retorna una lista de dicts o None si no hay conexion
+    """
+    try:
+        sql = """
+            SELECT id, equipo_id, tipo, severidad FROM alertas
+            WHERE estado != 'resuelto' OR estado IS NULL
+        """
+        return consultar_shards(sql, lectura=False)
+    except Exception as e:
+        print(f"Error obteniendo alertas abiertas: {e}")
+        return None
+
+
+def get_areas_equipos():
+    """Area de cada equipo del catalogo: {equipo_id: area} o None si no hay conexion"""
+    connection = get_db_connection(lectura=True)
+    if not connection:
+        return None
+    
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT equipo_id, area FROM equipos")
+            return {row['equipo_id']: row['area'] for row in cursor.fetchall()}
+    except Exception as e:
+        print(f"Error obteniendo areas de equipos: {e}")
+        return None
+    finally:
+        connection.close()
+
+
+# =============================================
+# FUNCIONES PARA PERFILES DE UMBRALES
+# =============================================
+
+PERFIL_CAMPOS = (
+    'temperature_max', 'humidity_max', 'current_max', 'risk_critical', 'risk_high',
+    'peso_temperatura', 'peso_humedad', 'peso_corriente'
+)
+
+
+def get_perfiles_umbral():
+    """
+    Obtiene los perfiles de umbrales y el area de cada equipo
+    Retorna (perfiles, {equipo_id: area}) o None si no hay conexion
+    """
+    connection = get_db_connection()
+    if not connection:
+        return None
+    
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT * FROM perfiles_umbral")
+            perfiles = cursor.fetchall()
+            cursor.execute("SELECT equipo_id, area FROM equipos")
+            areas = {row['equipo_id']: row['area'] for row in cursor.fetchall()}
+            return perfiles, areas
+    except Exception as e:
+        print(f"Error obteniendo perfiles de umbrales: {e}")
+        return None
+    finally:
+        connection.close()
+
+
+def upsert_perfil_umbral(valores, equipo_id=None, area=None):
+    """Crea o actualiza el perfil de umbrales de un equipo o de un area"""
+    connection = get_db_connection()
+    if not connection:
+        return False
+    
+    try:
+        with connection.cursor() as cursor:
+            columnas = ', '.join(PERFIL_CAMPOS)
+            marcadores = ', '.join(['%s'] * len(PERFIL_CAMPOS))
+            actualizar = ', '.join(f"{c} = VALUES({c})" for c in PERFIL_CAMPOS)
+            sql = f"""
+                INSERT INTO perfiles_umbral (equipo_id, area, {columnas})
+                VALUES (%s, %s, {marcadores})
+                ON DUPLICATE KEY UPDATE {actualizar}
+            """
+            cursor.execute(sql, (equipo_id, area, *(valores[c] for c in PERFIL_CAMPOS)))
+            connection.commit()
+            return True
+    except Exception as e:
+        print(f"Error guardando perfil de umbrales: {e}")
+        return False
+    finally:
+        connection.close()
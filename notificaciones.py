@@ -0,0 +1,286 @@
+"""
+Envio asincrono de notificaciones de alertas (webhook y correo SMTP).
+
+La ingesta solo encola (etapa 'notificar' de ingesta.py): encolar() nunca
+bloquea ni lanza errores, asi que un destino lento o caido no afecta la
+latencia de la ingesta.
+
+- Se notifican las alertas que abren un incidente nuevo (las repeticiones
+  de un incidente abierto no) con severidad en NOTIFY_CONFIG['severidades'].
+- Cada destino tiene su cola acotada ('max_cola'; si esta llena la alerta
+  se descarta y se cuenta) y su hilo de envio.
+- Las alertas se agrupan en un resumen: un mensaje cada 'lote' alertas o
+  cada 'intervalo' segundos desde la primera alerta pendiente.
+- Un envio fallido se reintenta 'reintentos' veces con espera exponencial
+  ('backoff' .. 'backoff_max'). Si sigue fallando el resumen se agrega al
+  archivo 'dead_letter' (una linea JSON por resumen).
+
+Prueba contra un servidor local:
+    NOTIFY_WEBHOOKS=http://127.0.0.1:8080/alertas python notificaciones.py --prueba
+    NOTIFY_SMTP_HOST=127.0.0.1 NOTIFY_SMTP_PORT=1025 NOTIFY_EMAIL_TO=ti@local python notificaciones.py --prueba
+"""
+import argparse
+import atexit
+import json
+import os
+import queue
+import random
+import smtplib
+import threading
+import time
+import urllib.request
+from datetime import datetime
+from email.message import EmailMessage
+
+from config import NOTIFY_CONFIG
+
+_FIN = object()
+_parar = threading.Event()
+_lock_dead_letter = threading.Lock()
+
+
+class Destino:
+    """Un destino de notificaciones con su cola y su hilo de envio"""
+
+    def __init__(self, nombre):
+        self.nombre = nombre
+        self.cola = queue.Queue(maxsize=NOTIFY_CONFIG['max_cola'])
+        self.enviados = 0        # resumenes enviados
+        self.alertas = 0         # alertas incluidas en ellos
+        self.reintentos = 0
+        self.fallidos = 0        # resumenes que terminaron en el dead letter
+        self.descartadas = 0     # alertas descartadas con la cola llena
+        self._lock = threading.Lock()
+        self._hilo = None
+        self._hilo_pid = None
+
+    def enviar(self, alertas):
+        """Envia un resumen; lanza una excepcion si falla"""
+        raise NotImplementedError
+
+    def encolar(self, alerta):
+        self._asegurar_hilo()
+        try:
+            self.cola.put_nowait(alerta)
+        except queue.Full:
+            with self._lock:
+                self.descartadas += 1
+                descartadas = self.descartadas
+            if descartadas % 100 == 1:
+                print(f"[Notificaciones] Cola de {self.nombre} llena, {descartadas} alertas descartadas")
+
+    def _asegurar_hilo(self):
+        """Arranca el hilo de envio en este proceso (los hilos no sobreviven a un fork)"""
+        if self._hilo_pid == os.getpid():
+            return
+        with self._lock:
+            if self._hilo_pid != os.getpid():
+                self._hilo = threading.Thread(
+                    target=self._trabajar, name=f'notificar-{self.nombre}', daemon=True
+                )
+                self._hilo.start()
+                self._hilo_pid = os.getpid()
+
+    def _trabajar(self):
+        """Junta alertas hasta 'lote' o 'intervalo' segundos y envia el resumen"""
+        pendientes = []
+        limite = None
+        while True:
+            espera = None if limite is None else max(0.0, limite - time.monotonic())
+            try:
+                alerta = self.cola.get(timeout=espera)
+            except queue.Empty:
+                alerta = None
+
+            fin = alerta is _FIN
+            if alerta is not None and not fin:
+                pendientes.append(alerta)
+                if limite is None:
+                    limite = time.monotonic() + NOTIFY_CONFIG['intervalo']
+
+            if pendientes and (fin or len(pendientes) >= NOTIFY_CONFIG['lote'] or
+                               time.monotonic() >= limite):
+                self._despachar(pendientes)
+                pendientes = []
+                limite = None
+            if fin:
+                return
+
+    def _despachar(self, alertas):
+        """Envia con reintentos; si no se puede, al dead letter"""
+        error = None
+        for intento in range(NOTIFY_CONFIG['reintentos'] + 1):
+            try:
+                self.enviar(alertas)
+                self.enviados += 1
+                self.alertas += len(alertas)
+                return
+            except Exception as e:
+                error = e
+            if intento == NOTIFY_CONFIG['reintentos']:
+                break
+            self.reintentos += 1
+            espera = min(NOTIFY_CONFIG['backoff'] * 2 ** intento, NOTIFY_CONFIG['backoff_max'])
+            # Al cerrar el proceso no se sigue esperando
+            if _parar.wait(espera * random.uniform(0.5, 1.0)):
+                break
+
+        self.fallidos += 1
+        print(f"[Notificaciones] No se pudo notificar a {self.nombre} ({len(alertas)} alertas): {error}")
+        _dead_letter(self.nombre, alertas, error)
+
+    def como_dict(self):
+        return {
+            'destino': self.nombre,
+            'en_cola': self.cola.qsize(),
+            'enviados': self.enviados,
+            'alertas': self.alertas,
+            'reintentos': self.reintentos,
+            'fallidos': self.fallidos,
+            'descartadas': self.descartadas
+        }
+
+
+class Webhook(Destino):
+    """POST JSON {'total': n, 'alertas': [...]} a una URL"""
+
+    def __init__(self, url):
+        super().__init__(url)
+        self.url = url
+
+    def enviar(self, alertas):
+        cuerpo = json.dumps({'total': len(alertas), 'alertas': alertas}).encode('utf-8')
+        peticion = urllib.request.Request(
+            self.url, data=cuerpo, method='POST',
+            headers={'Content-Type': 'application/json'}
+        )
+        # urlopen lanza HTTPError con respuestas 4xx/5xx
+        with urllib.request.urlopen(peticion, timeout=NOTIFY_CONFIG['timeout']) as respuesta:
+            respuesta.read()
+
+
+class Correo(Destino):
+    """Un correo de texto por resumen"""
+
+    def __init__(self):
+        super().__init__(f"smtp://{NOTIFY_CONFIG['smtp_host']}:{NOTIFY_CONFIG['smtp_port']}")
+
+    def enviar(self, alertas):
+        mensaje = EmailMessage()
+        if len(alertas) == 1:
+            asunto = f"[IoT] {alertas[0]['equipo_id']}: {alertas[0]['mensaje']}"
+        else:
+            equipos = len({a['equipo_id'] for a in alertas})
+            asunto = f"[IoT] {len(alertas)} alertas en {equipos} equipos"
+        mensaje['Subject'] = asunto
+        mensaje['From'] = NOTIFY_CONFIG['email_from']
+        mensaje['To'] = ', '.join(NOTIFY_CONFIG['email_to'])
+        mensaje.set_content('\n'.join(
+            f"{a['fecha']}  {a['equipo_id']}  {a['severidad'].upper()}  {a['tipo']}: {a['mensaje']}"
+            for a in alertas
+        ))
+
+        with smtplib.SMTP(NOTIFY_CONFIG['smtp_host'], NOTIFY_CONFIG['smtp_port'],
+                          timeout=NOTIFY_CONFIG['timeout']) as smtp:
+            if NOTIFY_CONFIG['smtp_starttls']:
+                smtp.starttls()
+            if NOTIFY_CONFIG['smtp_user']:
+                smtp.login(NOTIFY_CONFIG['smtp_user'], NOTIFY_CONFIG['smtp_password'])
+            smtp.send_message(mensaje)
+
+
+def _crear_destinos():
+    destinos = [Webhook(url) for url in NOTIFY_CONFIG['webhooks']]
+    if NOTIFY_CONFIG['smtp_host'] and NOTIFY_CONFIG['email_to']:
+        destinos.append(Correo())
+    return destinos
+
+
+_destinos = _crear_destinos()
+
+
+def _dead_letter(destino, alertas, error):
+    linea = json.dumps({
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'destino': destino,
+        'error': str(error),
+        'alertas': alertas
+    })
+    try:
+        with _lock_dead_letter:
+            with open(NOTIFY_CONFIG['dead_letter'], 'a', encoding='utf-8') as f:
+                f.write(linea + '\n')
+    except OSError as e:
+        print(f"[Notificaciones] Error escribiendo {NOTIFY_CONFIG['dead_letter']}: {e}")
+
+
+def activo():
+    """True si hay algun destino configurado"""
+    return bool(_destinos)
+
+
+def encolar(equipo_id, alerts, timestamp=None):
+    """Encola las alertas con severidad a notificar (no bloquea)"""
+    if not _destinos or _parar.is_set():
+        return
+    fecha = (timestamp or datetime.now()).isoformat(timespec='seconds')
+    for alert in alerts:
+        if alert['severity'] not in NOTIFY_CONFIG['severidades']:
+            continue
+        alerta = {
+            'equipo_id': equipo_id,
+            'tipo': alert['type'],
+            'severidad': alert['severity'],
+            'mensaje': alert['message'],
+            'valor': alert.get('value'),
+            'fecha': fecha
+        }
+        for destino in _destinos:
+            destino.encolar(alerta)
+
+
+def cerrar(espera=5.0):
+    """
+    Envia lo pendiente y detiene los hilos (al terminar el proceso)
+    Pasados espera segundos se cortan los reintentos: lo que falte va al dead letter
+    """
+    activos = [d for d in _destinos if d._hilo_pid == os.getpid()]
+    limite = time.monotonic() + espera
+    for destino in activos:
+        try:
+            destino.cola.put(_FIN, timeout=max(0.0, limite - time.monotonic()))
+        except queue.Full:
+            pass
+    for destino in activos:
+        destino._hilo.join(max(0.0, limite - time.monotonic()))
+    _parar.set()
+    for destino in activos:
+        destino._hilo.join(1.0)
+
+
+def estado():
+    """Contadores por destino para GET /api/metricas"""
+    return [d.como_dict() for d in _destinos]
+
+
+atexit.register(cerrar)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Envia una alerta de prueba a los destinos configurados')
+    parser.add_argument('--prueba', action='store_true', help='Encolar una alerta critica de prueba')
+    parser.add_argument('--equipo', default='ESP32_PRUEBA')
+    args = parser.parse_args()
+
+    if not activo():
+        parser.error('No hay destinos: configure NOTIFY_WEBHOOKS o NOTIFY_SMTP_HOST y NOTIFY_EMAIL_TO')
+    if args.prueba:
+        encolar(args.equipo, [{
+            'type': 'prueba',
+            'message': 'Notificacion de prueba',
+            'severity': NOTIFY_CONFIG['severidades'][0],
+            'value': None
+        }])
+        cerrar(espera=NOTIFY_CONFIG['timeout'] * (NOTIFY_CONFIG['reintentos'] + 1) + 5)
+        for d in estado():
+            print(d)
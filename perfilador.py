@@ -0,0 +1,258 @@
+"""
+Perfilado de requests en produccion con costo acotado.
+
+Un request se perfila si:
+- lo pide un rol de gestion con el encabezado "X-Perfilar: 1" o
+  ?perfilar=1 (o el modo: 'cprofile' o 'pila'), o
+- le toca en el muestreo: 1 de cada PROFILER_CONFIG['muestreo'] requests
+  (0 = solo a pedido), como maximo 'max_por_minuto' por proceso.
+
+Modos:
+- cprofile: cProfile del hilo del request; archivo .pstats
+  (python -m pstats archivo, snakeviz, etc.)
+- pila: un hilo toma la pila del request cada 'intervalo' segundos;
+  archivo .folded con pilas colapsadas ("a;b;c cuenta", para
+  flamegraph.pl o speedscope). Mas barato con handlers largos.
+
+Cada perfil anota en indice.jsonl la ruta, el status, el tiempo total y
+la espera de BD: el tiempo del hilo del request dentro de pymysql o
+esperando las consultas en paralelo a los shards (concurrent.futures).
+Cuando el directorio supera 'max_bytes' se borran los perfiles mas
+antiguos.
+
+Para que el costo quede acotado se perfila un solo request a la vez por
+proceso; mientras tanto los demas (pedidos o sorteados) no se perfilan.
+El perfil termina al cerrarse la respuesta (incluye las respuestas en
+streaming, como el historial con gzip), en el mismo hilo del request.
+"""
+import cProfile
+import itertools
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+
+from config import PROFILER_CONFIG
+
+MODOS = ('cprofile', 'pila')
+INDICE = 'indice.jsonl'
+
+_activo = threading.Lock()          # un perfil a la vez
+_lock = threading.Lock()
+_contador = itertools.count(1)      # requests vistos (muestreo)
+_numeros = itertools.count(1)       # perfiles iniciados (nombre de archivo)
+_recientes = deque()                # monotonic de los perfiles sorteados en el ultimo minuto
+_estado = {'perfilados': 0, 'ocupado': 0, 'limitados': 0, 'errores': 0}
+
+
+def _es_bd(archivo):
+    """True si el codigo es del cliente MySQL o de la espera de los shards en paralelo"""
+    return (f'{os.sep}pymysql{os.sep}' in archivo or
+            f'{os.sep}concurrent{os.sep}futures{os.sep}' in archivo)
+
+
+def _nombre_archivo(numero, metodo, ruta, extension):
+    ruta = re.sub(r'[^A-Za-z0-9]+', '_', ruta).strip('_')[:60] or 'raiz'
+    return f"{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}-{numero:06d}-{metodo}-{ruta}.{extension}"
+
+
+class _Muestreador(threading.Thread):
+    """Toma la pila de un hilo cada intervalo segundos"""
+
+    def __init__(self, hilo):
+        super().__init__(name='perfilador-pila', daemon=True)
+        self.hilo = hilo
+        self.pilas = Counter()
+        self.muestras_bd = 0
+        self._parar = threading.Event()
+
+    def run(self):
+        intervalo = PROFILER_CONFIG['intervalo']
+        while not self._parar.wait(intervalo):
+            frame = sys._current_frames().get(self.hilo)
+            if frame is None:
+                continue
+            marcos = []
+            bd = False
+            while frame is not None:
+                codigo = frame.f_code
+                bd = bd or _es_bd(codigo.co_filename)
+                marcos.append(f"{os.path.basename(codigo.co_filename)}:{codigo.co_name}")
+                frame = frame.f_back
+            self.pilas[';'.join(reversed(marcos))] += 1
+            self.muestras_bd += bd
+
+    def parar(self):
+        self._parar.set()
+        self.join()
+
+
+class Perfil:
+    """Un request en perfilado; terminar() lo cierra y escribe el archivo"""
+
+    def __init__(self, modo, numero):
+        self.modo = modo
+        self.numero = numero
+        self.hilo = threading.get_ident()
+        self.inicio = time.perf_counter()
+        if modo == 'cprofile':
+            self._perfil = cProfile.Profile()
+            self._perfil.enable()
+        else:
+            self._perfil = _Muestreador(self.hilo)
+            self._perfil.start()
+
+    def terminar(self, metodo, ruta, status):
+        """Escribe el perfil y su linea del indice; retorna el nombre del archivo o None"""
+        try:
+            if self.modo == 'cprofile' and self.hilo != threading.get_ident():
+                # cProfile solo se puede detener desde su hilo
+                print(f"[Perfilador] {metodo} {ruta}: la respuesta se cerro en otro hilo, perfil descartado")
+                with _lock:
+                    _estado['errores'] += 1
+                return None
+            if self.modo == 'cprofile':
+                self._perfil.disable()
+            else:
+                self._perfil.parar()
+            total = time.perf_counter() - self.inicio
+
+            os.makedirs(PROFILER_CONFIG['directorio'], exist_ok=True)
+            extension = 'pstats' if self.modo == 'cprofile' else 'folded'
+            archivo = _nombre_archivo(self.numero, metodo, ruta, extension)
+            path = os.path.join(PROFILER_CONFIG['directorio'], archivo)
+            if self.modo == 'cprofile':
+                self._perfil.dump_stats(path)
+                bd = self._espera_bd_cprofile()
+            else:
+                with open(path, 'w', encoding='utf-8') as f:
+                    for pila, cuenta in self._perfil.pilas.most_common():
+                        f.write(f"{pila} {cuenta}\n")
+                bd = self._perfil.muestras_bd * PROFILER_CONFIG['intervalo']
+
+            _indexar({
+                'fecha': datetime.now().isoformat(timespec='seconds'),
+                'metodo': metodo,
+                'ruta': ruta,
+                'status': status,
+                'modo': self.modo,
+                'total_ms': round(total * 1000, 2),
+                'bd_ms': round(min(bd, total) * 1000, 2),
+                'archivo': archivo
+            })
+            _rotar()
+            with _lock:
+                _estado['perfilados'] += 1
+            return archivo
+        except Exception as e:
+            print(f"[Perfilador] Error guardando el perfil de {metodo} {ruta}: {e}")
+            with _lock:
+                _estado['errores'] += 1
+            return None
+        finally:
+            _activo.release()
+
+    def _espera_bd_cprofile(self):
+        """Tiempo acumulado en funciones de BD llamadas desde codigo que no es de BD"""
+        self._perfil.create_stats()
+        total = 0.0
+        for (archivo, _, _), (_, _, _, _, llamadores) in self._perfil.stats.items():
+            if not _es_bd(archivo):
+                continue
+            for (archivo_llamador, _, _), datos in llamadores.items():
+                if not _es_bd(archivo_llamador):
+                    total += datos[3]
+        return total
+
+
+def _sorteado():
+    """True si a este request le toca por muestreo (respetando max_por_minuto)"""
+    cada = PROFILER_CONFIG['muestreo']
+    if cada <= 0 or next(_contador) % cada:
+        return False
+    ahora = time.monotonic()
+    with _lock:
+        while _recientes and ahora - _recientes[0] > 60:
+            _recientes.popleft()
+        if len(_recientes) >= PROFILER_CONFIG['max_por_minuto']:
+            _estado['limitados'] += 1
+            return False
+        _recientes.append(ahora)
+    return True
+
+
+def iniciar(modo=None):
+    """
+    Empieza a perfilar el request actual si corresponde
+    modo: el pedido explicito ('cprofile' o 'pila'); None para el muestreo
+    Retorna un Perfil (hay que llamar a terminar) o None
+    """
+    if modo is None:
+        if not _sorteado():
+            return None
+        modo = PROFILER_CONFIG['modo']
+    if not _activo.acquire(blocking=False):
+        with _lock:
+            _estado['ocupado'] += 1
+        return None
+    try:
+        return Perfil(modo, next(_numeros))
+    except Exception as e:
+        _activo.release()
+        print(f"[Perfilador] No se pudo iniciar el perfil: {e}")
+        return None
+
+
+def modo_pedido(valor):
+    """Modo de un encabezado X-Perfilar / ?perfilar=; None si no se pidio, ValueError si no es valido"""
+    if not valor or valor.lower() in ('0', 'false', 'no'):
+        return None
+    valor = valor.lower()
+    if valor in ('1', 'true', 'si'):
+        return PROFILER_CONFIG['modo']
+    if valor not in MODOS:
+        raise ValueError(f"perfilar debe ser 1 o uno de: {', '.join(MODOS)}")
+    return valor
+
+
+def _indexar(linea):
+    path = os.path.join(PROFILER_CONFIG['directorio'], INDICE)
+    with _lock:
+        # El indice tambien se rota: a lo sumo 1/20 del directorio
+        if os.path.exists(path) and os.path.getsize(path) > PROFILER_CONFIG['max_bytes'] // 20:
+            os.replace(path, path + '.1')
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(linea) + '\n')
+
+
+def _rotar():
+    """Borra los perfiles mas antiguos hasta que el directorio quede bajo max_bytes"""
+    archivos = []
+    total = 0
+    with os.scandir(PROFILER_CONFIG['directorio']) as entradas:
+        for entrada in entradas:
+            if entrada.is_file():
+                info = entrada.stat()
+                total += info.st_size
+                if not entrada.name.startswith(INDICE):
+                    archivos.append((info.st_mtime, info.st_size, entrada.path))
+    if total <= PROFILER_CONFIG['max_bytes']:
+        return
+    for _, tamano, path in sorted(archivos):
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= tamano
+        if total <= PROFILER_CONFIG['max_bytes']:
+            break
+
+
+def estado():
+    """Contadores para GET /api/metricas"""
+    with _lock:
+        return dict(_estado, muestreo=PROFILER_CONFIG['muestreo'], modo=PROFILER_CONFIG['modo'])
@@ -0,0 +1,283 @@
+"""
+Pipeline de etapas con medicion de tiempo por etapa.
+
+Una Pipeline es una lista ordenada de etapas; cada etapa es una funcion
+que recibe el contexto (un objeto Contexto) y lo modifica. Una etapa
+puede cortar el recorrido con ctx.terminar(resultado) (p. ej. una
+lectura duplicada).
+
+- Las etapas se agregan por nombre y posicion (antes/despues de otra), sin
+  tocar a quien ejecuta la pipeline.
+- ejecutar_lote recorre la pipeline con varios contextos; las etapas que
+  tienen version de lote (p. ej. un INSERT de varias filas) la reciben
+  una vez con todos.
+- Una etapa marcada en_hilo, y todas las que siguen, se ejecutan en un
+  pool de hilos: quien llama no espera por ellas. Si el pool tiene
+  PIPELINE_CONFIG['max_pendientes'] trabajos en cola se ejecutan en linea
+  (la cola no crece sin limite).
+- Cada etapa acumula cantidad, errores, tiempo total, maximo y un
+  histograma con el que se estiman p50/p95/p99 (ver metricas()).
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import PIPELINE_CONFIG
+
+# Limites superiores (ms) de los intervalos del histograma de tiempos
+LIMITES_MS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Contexto:
+    """Base de los contextos que recorren una pipeline"""
+    __slots__ = ('terminado', 'resultado')
+
+    def __init__(self):
+        self.terminado = False
+        self.resultado = None
+
+    def terminar(self, resultado=None):
+        """Corta la pipeline: las etapas siguientes no se ejecutan"""
+        self.terminado = True
+        self.resultado = resultado
+
+
+class Metricas:
+    """Tiempos acumulados de una etapa"""
+    __slots__ = ('n', 'errores', 'total', 'maximo', 'histograma', '_lock')
+
+    def __init__(self):
+        self.n = 0
+        self.errores = 0
+        self.total = 0.0
+        self.maximo = 0.0
+        self.histograma = [0] * (len(LIMITES_MS) + 1)
+        self._lock = threading.Lock()
+
+    def registrar(self, segundos, error=False):
+        ms = segundos * 1000
+        i = 0
+        while i < len(LIMITES_MS) and ms > LIMITES_MS[i]:
+            i += 1
+        with self._lock:
+            self.n += 1
+            self.total += ms
+            if ms > self.maximo:
+                self.maximo = ms
+            if error:
+                self.errores += 1
+            self.histograma[i] += 1
+
+    def _percentil(self, p):
+        """Limite superior del intervalo donde cae el percentil p"""
+        objetivo = p * self.n
+        acumulado = 0
+        for i, cantidad in enumerate(self.histograma):
+            acumulado += cantidad
+            if acumulado >= objetivo:
+                if i < len(LIMITES_MS):
+                    return min(LIMITES_MS[i], round(self.maximo, 3))
+                return round(self.maximo, 3)
+        return round(self.maximo, 3)
+
+    def como_dict(self):
+        with self._lock:
+            if not self.n:
+                return {'n': 0, 'errores': 0}
+            return {
+                'n': self.n,
+                'errores': self.errores,
+                'media_ms': round(self.total / self.n, 3),
+                'p50_ms': self._percentil(0.50),
+                'p95_ms': self._percentil(0.95),
+                'p99_ms': self._percentil(0.99),
+                'max_ms': round(self.maximo, 3)
+            }
+
+
+class Etapa:
+    __slots__ = ('nombre', 'funcion', 'en_hilo', 'lote', 'metricas')
+
+    def __init__(self, nombre, funcion, en_hilo=False, lote=None):
+        self.nombre = nombre
+        self.funcion = funcion
+        self.en_hilo = en_hilo
+        self.lote = lote
+        self.metricas = Metricas()
+
+
+class Pipeline:
+    """Secuencia de etapas con tiempos por etapa"""
+
+    def __init__(self, nombre):
+        self.nombre = nombre
+        self._etapas = []
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pool_pid = None
+        self._pendientes = 0
+        self.total = Metricas()
+        self.espera_hilo = Metricas()
+
+    def agregar(self, nombre, funcion, en_hilo=False, antes=None, despues=None, lote=None):
+        """
+        Agrega una etapa al final, o antes/despues de la etapa indicada
+        Si ya existe una etapa con ese nombre se reemplaza
+        lote: version opcional de la etapa que recibe una lista de
+        contextos (la usa ejecutar_lote)
+        """
+        with self._lock:
+            etapas = [e for e in self._etapas if e.nombre != nombre]
+            nombres = [e.nombre for e in etapas]
+            if antes is not None:
+                posicion = nombres.index(antes)
+            elif despues is not None:
+                posicion = nombres.index(despues) + 1
+            else:
+                posicion = len(etapas)
+            etapas.insert(posicion, Etapa(nombre, funcion, en_hilo, lote))
+            # Copia nueva: quien esta recorriendo la lista anterior no se ve afectado
+            self._etapas = etapas
+
+    def quitar(self, nombre):
+        with self._lock:
+            self._etapas = [e for e in self._etapas if e.nombre != nombre]
+
+    def nombres(self):
+        return [e.nombre for e in self._etapas]
+
+    def _correr(self, etapa, ctx):
+        inicio = time.perf_counter()
+        try:
+            etapa.funcion(ctx)
+        except Exception:
+            etapa.metricas.registrar(time.perf_counter() - inicio, error=True)
+            raise
+        etapa.metricas.registrar(time.perf_counter() - inicio)
+
+    def _ejecutor(self):
+        """Pool de hilos del proceso (se recrea despues de un fork)"""
+        if self._pool_pid != os.getpid():
+            with self._lock:
+                if self._pool_pid != os.getpid():
+                    self._pool = ThreadPoolExecutor(
+                        max_workers=PIPELINE_CONFIG['workers'],
+                        thread_name_prefix=f'pipeline-{self.nombre}'
+                    )
+                    self._pendientes = 0
+                    self._pool_pid = os.getpid()
+        return self._pool
+
+    def _continuar(self, etapas, ctx, encolado):
+        """Ejecuta en un hilo del pool las etapas restantes"""
+        self.espera_hilo.registrar(time.perf_counter() - encolado)
+        try:
+            for etapa in etapas:
+                if ctx.terminado:
+                    break
+                self._correr(etapa, ctx)
+        except Exception as e:
+            print(f"[Pipeline {self.nombre}] Error en segundo plano: {e}")
+        finally:
+            with self._lock:
+                self._pendientes -= 1
+
+    def ejecutar(self, ctx):
+        """Recorre las etapas con el contexto; retorna el contexto"""
+        etapas = self._etapas
+        inicio = time.perf_counter()
+        try:
+            for i, etapa in enumerate(etapas):
+                if ctx.terminado:
+                    break
+                if etapa.en_hilo and self._encolar(etapas[i:], ctx):
+                    break
+                self._correr(etapa, ctx)
+        except Exception:
+            self.total.registrar(time.perf_counter() - inicio, error=True)
+            raise
+        self.total.registrar(time.perf_counter() - inicio)
+        return ctx
+
+    def ejecutar_lote(self, contextos):
+        """
+        Recorre las etapas con varios contextos: una etapa con version de
+        lote la recibe con todos los que siguen activos, las demas se
+        ejecutan por contexto. Un error en un contexto lo termina con
+        resultado None sin cortar a los demas. Retorna los contextos
+        """
+        etapas = self._etapas
+        inicio = time.perf_counter()
+        activos = list(contextos)
+        for i, etapa in enumerate(etapas):
+            activos = [ctx for ctx in activos if not ctx.terminado]
+            if not activos:
+                break
+            if etapa.en_hilo:
+                for ctx in activos:
+                    if not self._encolar(etapas[i:], ctx):
+                        self._recorrer_aislado(etapas[i:], ctx)
+                break
+            if etapa.lote is not None:
+                self._correr_lote(etapa, activos)
+                continue
+            for ctx in activos:
+                self._recorrer_aislado((etapa,), ctx)
+        if contextos:
+            promedio = (time.perf_counter() - inicio) / len(contextos)
+            for _ in contextos:
+                self.total.registrar(promedio)
+        return contextos
+
+    def _recorrer_aislado(self, etapas, ctx):
+        """Etapas de un contexto de un lote; un error solo termina ese contexto"""
+        for etapa in etapas:
+            if ctx.terminado:
+                break
+            try:
+                self._correr(etapa, ctx)
+            except Exception as e:
+                print(f"[Pipeline {self.nombre}] Error en {etapa.nombre}: {e}")
+                ctx.terminar(None)
+
+    def _correr_lote(self, etapa, contextos):
+        """
+        Version de lote de una etapa; si falla termina los contextos que no
+        termino (no se reintenta por contexto: pudo haber guardado parte)
+        """
+        inicio = time.perf_counter()
+        error = False
+        try:
+            etapa.lote(contextos)
+        except Exception as e:
+            print(f"[Pipeline {self.nombre}] Error en {etapa.nombre} por lote: {e}")
+            error = True
+            for ctx in contextos:
+                if not ctx.terminado:
+                    ctx.terminar(None)
+        promedio = (time.perf_counter() - inicio) / len(contextos)
+        for _ in contextos:
+            etapa.metricas.registrar(promedio, error)
+
+    def _encolar(self, etapas, ctx):
+        """Pasa las etapas restantes al pool; False si esta lleno"""
+        pool = self._ejecutor()
+        with self._lock:
+            if self._pendientes >= PIPELINE_CONFIG['max_pendientes']:
+                return False
+            self._pendientes += 1
+        pool.submit(self._continuar, etapas, ctx, time.perf_counter())
+        return True
+
+    def metricas(self):
+        """Tiempos por etapa (en orden), del recorrido completo y de la espera en cola"""
+        return {
+            'etapas': [
+                {'nombre': e.nombre, 'en_hilo': e.en_hilo, **e.metricas.como_dict()}
+                for e in self._etapas
+            ],
+            'total': self.total.como_dict(),
+            'espera_hilo': self.espera_hilo.como_dict(),
+            'pendientes': self._pendientes
+        }
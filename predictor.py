@@ -1,112 +1,343 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
 import numpy as np
-from config import THRESHOLDS
+import modelo_riesgo
+import models
+import reglas
+from config import FORECAST_CONFIG
 
-def calculate_risk_score(temperature, humidity, current):
+# Version reportada cuando la prediccion sale de calculate_risk_score
+HEURISTIC_VERSION = 'heuristica-v1'
+
+def calculate_risk_score(temperature, humidity, current, perfil=None):
     """
     Calcula el puntaje de riesgo basado en los valores de sensores
     Retorna un valor entre 0 (sin riesgo) y 1 (riesgo crítico)
+    Usa los umbrales y pesos del perfil (global si no se indica)
     """
-    # Normalizar valores
-    temp_norm = min(temperature / THRESHOLDS['temperature_max'], 1.5)
-    humidity_norm = min(humidity / THRESHOLDS['humidity_max'], 1.5)
-    current_norm = min(abs(current) / THRESHOLDS['current_max'], 1.5)
-    
-    # Pesos para cada factor
-    weights = {
-        'temperature': 0.35,
-        'humidity': 0.25,
-        'current': 0.40
-    }
-    
-    # Calcular riesgo ponderado
-    risk_score = (
-        temp_norm * weights['temperature'] +
-        humidity_norm * weights['humidity'] +
-        current_norm * weights['current']
-    )
-    
-    # Limitar entre 0 y 1
-    return min(max(risk_score, 0), 1)
+    return (perfil or reglas.PERFIL_GLOBAL).puntaje(temperature, humidity, current)
 
-def determine_risk_level(risk_score):
+def determine_risk_level(risk_score, perfil=None):
     """Determina el nivel de riesgo basado en el puntaje"""
-    if risk_score >= THRESHOLDS['risk_critical']:
-        return 'critical'
-    elif risk_score >= THRESHOLDS['risk_high']:
-        return 'high'
-    elif risk_score >= 0.3:
-        return 'medium'
-    else:
-        return 'low'
+    return (perfil or reglas.PERFIL_GLOBAL).nivel(risk_score)
 
-def calculate_influential_factors(temperature, humidity, current):
+def calculate_influential_factors(temperature, humidity, current, perfil=None):
     """
     Calcula qué factores son más influyentes en el riesgo
-    Retorna un string JSON con los porcentajes
+    Retorna un diccionario con los porcentajes (se guardan en las columnas
+    factor_temperatura, factor_humedad y factor_corriente)
     """
-    import json
-    
-    # Calcular desviación de cada parámetro respecto al umbral
-    temp_impact = min((temperature / THRESHOLDS['temperature_max']) * 100, 100)
-    humidity_impact = min((humidity / THRESHOLDS['humidity_max']) * 100, 100)
-    current_impact = min((abs(current) / THRESHOLDS['current_max']) * 100, 100)
+    temp_impact, humidity_impact, current_impact = (
+        (perfil or reglas.PERFIL_GLOBAL).factores(temperature, humidity, current)
+    )
     
-    factors = {
-        'Temperatura': round(temp_impact, 1),
-        'Humedad': round(humidity_impact, 1),
-        'Corriente': round(current_impact, 1)
+    return {
+        'Temperatura': temp_impact,
+        'Humedad': humidity_impact,
+        'Corriente': current_impact
     }
-    
-    return json.dumps(factors)
 
-def make_prediction(temperature, humidity, current):
+def make_prediction(temperature, humidity, current, perfil=None):
     """
     Realiza una predicción completa basada en los datos de sensores
-    Retorna un diccionario con el nivel de riesgo, probabilidad y factores
+    Usa el modelo entrenado si hay uno cargado y la heuristica si no
+    Retorna un diccionario con el nivel de riesgo, probabilidad, factores
+    y la version del modelo que la genero
     """
-    risk_score = calculate_risk_score(temperature, humidity, current)
-    risk_level = determine_risk_level(risk_score)
-    factors = calculate_influential_factors(temperature, humidity, current)
+    perfil = perfil or reglas.PERFIL_GLOBAL
+    resultado_modelo = modelo_riesgo.predecir(temperature, humidity, current)
+    if resultado_modelo:
+        risk_score, model_version = resultado_modelo
+    else:
+        risk_score = perfil.puntaje(temperature, humidity, current)
+        model_version = HEURISTIC_VERSION
+    risk_level = perfil.nivel(risk_score)
+    factors = calculate_influential_factors(temperature, humidity, current, perfil)
     
     return {
         'risk_level': risk_level,
         'failure_probability': round(risk_score, 3),
-        'influential_factors': factors
+        'influential_factors': factors,
+        'model_version': model_version
     }
 
-def check_alerts(temperature, humidity, current, risk_level):
+def check_alerts(temperature, humidity, current, risk_level, perfil=None):
     """
     Verifica si se deben generar alertas basadas en los valores
     Retorna una lista de alertas
     """
-    alerts = []
+    return (perfil or reglas.PERFIL_GLOBAL).alertas(temperature, humidity, current, risk_level)
+
+def _tabla_perfiles(perfiles, n):
+    """
+    Matriz (n, 8) con los umbrales y pesos del perfil de cada fila:
+    temperature_max, humidity_max, current_max, pesos (3), risk_critical, risk_high
+    """
+    if perfiles is None:
+        perfiles = [reglas.PERFIL_GLOBAL]
+        indices = np.zeros(n, dtype=np.intp)
+    else:
+        # Tabla con un renglon por perfil distinto e indice por fila
+        unicos = {}
+        indices = np.fromiter(
+            (unicos.setdefault(id(p), (len(unicos), p))[0] for p in perfiles),
+            dtype=np.intp, count=len(perfiles)
+        )
+        perfiles = [p for _, p in sorted(unicos.values(), key=lambda x: x[0])]
     
-    if temperature > THRESHOLDS['temperature_max']:
-        alerts.append({
-            'type': 'high_temperature',
-            'message': f'Temperatura crítica: {temperature}°C',
-            'severity': 'critical'
-        })
+    return np.array([
+        [p.temperature_max, p.humidity_max, p.current_max,
+         p.peso_temperatura, p.peso_humedad, p.peso_corriente,
+         p.risk_critical, p.risk_high]
+        for p in perfiles
+    ])[indices]
+
+def calculate_risk_scores(temperatures, humidities, currents, perfiles=None):
+    """
+    Version vectorizada de calculate_risk_score para muchas lecturas
+    perfiles: None (global) o una lista con el Perfil de cada fila
+    Retorna (puntajes, niveles) como arreglos de NumPy
+    """
+    temperatures = np.asarray(temperatures, dtype=np.float64)
+    humidities = np.asarray(humidities, dtype=np.float64)
+    currents = np.abs(np.asarray(currents, dtype=np.float64))
+    tabla = _tabla_perfiles(perfiles, len(temperatures))
     
-    if humidity > THRESHOLDS['humidity_max']:
-        alerts.append({
-            'type': 'high_humidity',
-            'message': f'Humedad elevada: {humidity}%',
-            'severity': 'warning'
-        })
+    scores = (
+        np.minimum(temperatures / tabla[:, 0], reglas.NORM_MAX) * tabla[:, 3] +
+        np.minimum(humidities / tabla[:, 1], reglas.NORM_MAX) * tabla[:, 4] +
+        np.minimum(currents / tabla[:, 2], reglas.NORM_MAX) * tabla[:, 5]
+    )
+    scores = np.clip(scores, 0, 1)
+    return scores, determine_risk_levels(scores, perfiles, tabla)
+
+def determine_risk_levels(scores, perfiles=None, tabla=None):
+    """Version vectorizada de determine_risk_level"""
+    scores = np.asarray(scores, dtype=np.float64)
+    if tabla is None:
+        tabla = _tabla_perfiles(perfiles, len(scores))
+    return np.select(
+        [scores >= tabla[:, 6], scores >= tabla[:, 7], scores >= reglas.RISK_MEDIUM],
+        ['critical', 'high', 'medium'],
+        default='low'
+    )
+
+def calculate_influential_factors_batch(temperatures, humidities, currents, perfiles=None):
+    """
+    Version vectorizada de los porcentajes de calculate_influential_factors
+    Retorna una matriz (n, 3): Temperatura, Humedad, Corriente
+    """
+    temperatures = np.asarray(temperatures, dtype=np.float64)
+    humidities = np.asarray(humidities, dtype=np.float64)
+    currents = np.abs(np.asarray(currents, dtype=np.float64))
+    tabla = _tabla_perfiles(perfiles, len(temperatures))
     
-    if abs(current) > THRESHOLDS['current_max']:
-        alerts.append({
-            'type': 'high_current',
-            'message': f'Corriente anormal: {current}A',
-            'severity': 'critical'
-        })
+    factores = np.column_stack([
+        temperatures / tabla[:, 0],
+        humidities / tabla[:, 1],
+        currents / tabla[:, 2]
+    ]) * 100
+    return np.round(np.minimum(factores, 100), 1)
+
+# =============================================
+# PRONOSTICO DE TIEMPO HASTA EL UMBRAL
+# =============================================
+
+class TendenciaLineal:
+    """
+    Regresion lineal y = a + b*t sobre una ventana deslizante de lecturas
+    Las sumas suficientes se actualizan en O(1) por lectura; cada vez que
+    la ventana da una vuelta se recalculan con un origen de tiempo nuevo
+    para no perder precision
+    """
+    __slots__ = ('tamano', 'ts', 'ys', 'pos', 'n', 'origen',
+                 's_t', 's_y', 's_tt', 's_ty', 'vueltas')
+
+    def __init__(self, tamano):
+        self.tamano = tamano
+        self.ts = [0.0] * tamano
+        self.ys = [0.0] * tamano
+        self.pos = 0
+        self.n = 0
+        self.origen = None
+        self.s_t = self.s_y = self.s_tt = self.s_ty = 0.0
+        self.vueltas = 0
+
+    def agregar(self, t, y):
+        if self.origen is None:
+            self.origen = t
+        t -= self.origen
+        
+        if self.n == self.tamano:
+            t_viejo = self.ts[self.pos]
+            y_viejo = self.ys[self.pos]
+            self.s_t -= t_viejo
+            self.s_y -= y_viejo
+            self.s_tt -= t_viejo * t_viejo
+            self.s_ty -= t_viejo * y_viejo
+        else:
+            self.n += 1
+        
+        self.ts[self.pos] = t
+        self.ys[self.pos] = y
+        self.s_t += t
+        self.s_y += y
+        self.s_tt += t * t
+        self.s_ty += t * y
+        self.pos = (self.pos + 1) % self.tamano
+        
+        if self.pos == 0:
+            self._rebasar()
+
+    def _rebasar(self):
+        """Mueve el origen de tiempo a la lectura mas antigua y recalcula las sumas"""
+        desplazamiento = min(self.ts[:self.n])
+        self.origen += desplazamiento
+        self.s_t = self.s_y = self.s_tt = self.s_ty = 0.0
+        for i in range(self.n):
+            t = self.ts[i] - desplazamiento
+            self.ts[i] = t
+            self.s_t += t
+            self.s_y += self.ys[i]
+            self.s_tt += t * t
+            self.s_ty += t * self.ys[i]
+
+    def recta(self):
+        """Retorna (a, b, origen) o None si no hay datos suficientes"""
+        if self.n < 2:
+            return None
+        denominador = self.n * self.s_tt - self.s_t * self.s_t
+        if denominador <= 1e-9:
+            return None
+        b = (self.n * self.s_ty - self.s_t * self.s_y) / denominador
+        a = (self.s_y - b * self.s_t) / self.n
+        return a, b, self.origen
+
+
+class TendenciasEquipo:
+    """
+    Tendencias de temperatura y corriente de un equipo
+    desfase: reloj del servidor menos reloj de las lecturas (timestamp del
+    dispositivo), para extrapolar hasta "ahora" en el reloj de la recta
+    """
+    __slots__ = ('temperatura', 'corriente', 'desfase', 'cargado', 'actualizado')
+
+    def __init__(self):
+        self.temperatura = TendenciaLineal(FORECAST_CONFIG['window'])
+        self.corriente = TendenciaLineal(FORECAST_CONFIG['window'])
+        self.desfase = 0.0
+        self.cargado = False
+        self.actualizado = time.monotonic()
+
+    def agregar(self, t, temperature, current):
+        self.temperatura.agregar(t, temperature)
+        self.corriente.agregar(t, abs(current))
+
+
+# Las tendencias son de cada proceso: las lecturas de un equipo pueden
+# llegar a otro (servidor_ingesta.py, otro worker). El pronostico relee de
+# la BD la ventana del equipo si este proceso no lo cargo todavia o no
+# recibio lecturas suyas en FORECAST_CONFIG['refresh'] segundos.
+_tendencias_lock = threading.Lock()
+_tendencias = OrderedDict()   # equipo_id -> TendenciasEquipo, en orden de uso
+
+
+def _guardar_tendencias(equipo_id, tendencias):
+    """Guarda las tendencias del equipo descartando las menos usadas (llamar con el lock)"""
+    _tendencias[equipo_id] = tendencias
+    _tendencias.move_to_end(equipo_id)
+    while len(_tendencias) > FORECAST_CONFIG['max_equipos']:
+        _tendencias.popitem(last=False)
+
+
+def update_trend(equipo_id, temperature, current, timestamp=None):
+    """Agrega una lectura a la tendencia del equipo (O(1))"""
+    ahora = time.time()
+    t = timestamp.timestamp() if timestamp else ahora
+    with _tendencias_lock:
+        tendencias = _tendencias.get(equipo_id)
+        if tendencias is None:
+            tendencias = TendenciasEquipo()
+        _guardar_tendencias(equipo_id, tendencias)
+        tendencias.agregar(t, temperature, current)
+        tendencias.desfase = ahora - t
+        tendencias.actualizado = time.monotonic()
+
+
+def _cargar_tendencias(equipo_id):
+    """Reconstruye las tendencias del equipo con sus ultimas lecturas de la BD"""
+    lecturas = models.get_latest_readings(FORECAST_CONFIG['window'], equipo_id)
+    tendencias = TendenciasEquipo()
+    tendencias.cargado = True
+    for lectura in reversed(lecturas):
+        tendencias.agregar(
+            lectura.timestamp.timestamp(), float(lectura.temperatura), float(lectura.corriente)
+        )
+    with _tendencias_lock:
+        anterior = _tendencias.get(equipo_id)
+        if lecturas:
+            if anterior is not None:
+                tendencias.desfase = anterior.desfase
+            _guardar_tendencias(equipo_id, tendencias)
+        elif anterior is not None:
+            # Sin lecturas en la BD (o sin BD): se sigue con lo local hasta el proximo 'refresh'
+            anterior.cargado = True
+            anterior.actualizado = time.monotonic()
+
+
+def _pronostico_canal(tendencia, umbral, ahora):
+    recta = tendencia.recta() if tendencia.n >= FORECAST_CONFIG['min_points'] else None
+    if recta is None:
+        return None
+    
+    a, b, origen = recta
+    valor = a + b * (ahora - origen)
+    segundos = None
+    if valor >= umbral:
+        segundos = 0.0
+    elif b > 0:
+        segundos = (umbral - valor) / b
+        if segundos > FORECAST_CONFIG['horizon']:
+            segundos = None
+    
+    return {
+        'value': round(valor, 2),
+        'slope_per_min': round(b * 60, 4),
+        'threshold': umbral,
+        'seconds_to_threshold': round(segundos) if segundos is not None else None,
+        'eta': datetime.fromtimestamp(time.time() + segundos).isoformat() if segundos is not None else None
+    }
+
+def forecast_time_to_threshold(equipo_id, perfil=None):
+    """
+    Pronostica cuando la temperatura y la corriente del equipo cruzaran
+    sus umbrales, segun la tendencia lineal de la ventana reciente
+    Retorna None si el equipo no tiene lecturas suficientes
+    """
+    perfil = perfil or reglas.PERFIL_GLOBAL
+    with _tendencias_lock:
+        tendencias = _tendencias.get(equipo_id)
+    if tendencias is None or not tendencias.cargado or \
+            time.monotonic() - tendencias.actualizado > FORECAST_CONFIG['refresh']:
+        _cargar_tendencias(equipo_id)
+
+    with _tendencias_lock:
+        tendencias = _tendencias.get(equipo_id)
+        if tendencias is None:
+            return None
+        # "Ahora" en el reloj de las lecturas de la recta
+        ahora = time.time() - tendencias.desfase
+        temperatura = _pronostico_canal(tendencias.temperatura, perfil.temperature_max, ahora)
+        corriente = _pronostico_canal(tendencias.corriente, perfil.current_max, ahora)
+        puntos = tendencias.temperatura.n
     
-    if risk_level == 'critical':
-        alerts.append({
-            'type': 'system_failure_risk',
-            'message': 'Riesgo crítico de fallo del sistema',
-            'severity': 'critical'
-        })
+    if temperatura is None and corriente is None:
+        return None
     
-    return alerts
\ No newline at end of file
+    return {
+        'temperature': temperatura,
+        'current': corriente,
+        'points': puntos
+    }
@@ -0,0 +1,73 @@
+"""
+Protocolo binario compacto de ingesta para los ESP32.
+
+Cada trama tiene un formato fijo little-endian de 36 bytes:
+
+    offset  tipo        campo
+    0       char[16]    equipo_id (ASCII, relleno con bytes 0)
+    16      uint32      seq (numero de secuencia del dispositivo)
+    20      uint32      timestamp (epoch en segundos, 0 = hora del servidor)
+    24      float32     temperatura (°C)
+    28      float32     humedad (%)
+    32      float32     corriente (A)
+
+Un request puede llevar varias tramas concatenadas.
+"""
+import math
+import struct
+from datetime import datetime
+
+TRAMA = struct.Struct('<16sIIfff')
+TAMANO_TRAMA = TRAMA.size
+
+# Decimales con los que se guardan los float32 recibidos
+DECIMALES = 2
+
+# Cache de ids decodificados (los equipos se repiten en cada request)
+_ids = {}
+
+
+def _decodificar_id(crudo):
+    equipo_id = _ids.get(crudo)
+    if equipo_id is None:
+        equipo_id = crudo.rstrip(b'\0').decode('ascii')
+        if len(_ids) < 10000:
+            _ids[crudo] = equipo_id
+    return equipo_id
+
+
+def parsear_tramas(cuerpo):
+    """
+    Decodifica todas las tramas del cuerpo sin copiarlo
+    Retorna una lista de tuplas
+    (equipo_id, seq, timestamp, temperatura, humedad, corriente)
+    Lanza ValueError si el cuerpo es invalido (antes de procesar nada)
+    """
+    vista = memoryview(cuerpo)
+    if len(vista) == 0 or len(vista) % TAMANO_TRAMA != 0:
+        raise ValueError(
+            f'Largo invalido: {len(vista)} bytes (tramas de {TAMANO_TRAMA} bytes)'
+        )
+    
+    tramas = []
+    for crudo, seq, ts, temperatura, humedad, corriente in TRAMA.iter_unpack(vista):
+        if not (math.isfinite(temperatura) and math.isfinite(humedad) and math.isfinite(corriente)):
+            raise ValueError(f'Trama con valores no finitos (seq {seq})')
+        
+        tramas.append((
+            _decodificar_id(crudo),
+            seq,
+            datetime.fromtimestamp(ts) if ts else None,
+            round(temperatura, DECIMALES),
+            round(humedad, DECIMALES),
+            round(corriente, DECIMALES)
+        ))
+    return tramas
+
+
+def empaquetar_trama(equipo_id, seq, timestamp, temperatura, humedad, corriente):
+    """Arma una trama (util para clientes de prueba)"""
+    return TRAMA.pack(
+        equipo_id.encode('ascii'), seq, int(timestamp),
+        temperatura, humedad, corriente
+    )
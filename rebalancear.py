@@ -0,0 +1,213 @@
+"""
+Mueve los datos de un equipo (lecturas, predicciones y alertas) a otro shard.
+
+1. Copia por bloques de id del shard actual al destino. El destino asigna
+   ids nuevos; lectura_id y prediccion_id se remapean.
+2. Fija el equipo en ubicacion_equipos (shard 0): las escrituras nuevas
+   van al destino. Los demas workers lo ven al vencer SHARD_CONFIG['ttl'].
+3. Espera ese TTL, copia lo que siguio llegando al origen y actualiza el
+   estado de las alertas ya copiadas (estado, notas, conteos).
+4. Borra los datos del equipo en el origen (salvo --sin-borrar).
+
+Las alertas cambian de id: los incidentes abiertos que los workers tienen
+en memoria dejan de actualizarse y se abre uno nuevo en el destino.
+
+Uso:
+    python rebalancear.py --equipo ESP32_007 --destino 2
+    python rebalancear.py --plan      # shard de cada equipo (hash / fijado)
+"""
+import argparse
+import time
+
+from config import SHARD_CONFIG
+import models
+import shards
+import versiones
+
+# Columnas de alertas que pueden cambiar mientras se copia
+CAMPOS_ALERTA = ('estado', 'notas', 'leida', 'ocurrencias', 'ultima_vez', 'valor_pico')
+
+
+def _insertar(cursor, tabla, fila):
+    """Inserta una fila sin su id; retorna el id nuevo"""
+    columnas = [c for c in fila if c != 'id']
+    sql = f"""
+        INSERT INTO {tabla} ({', '.join(columnas)})
+        VALUES ({', '.join(['%s'] * len(columnas))})
+    """
+    cursor.execute(sql, [fila[c] for c in columnas])
+    return cursor.lastrowid
+
+
+def copiar(origen, destino, equipo_id, estado, tamano):
+    """
+    Copia lo que falta del equipo; estado guarda los mapas de ids y el
+    ultimo id copiado de cada tabla (para la segunda pasada)
+    """
+    copiadas = 0
+    while True:
+        with origen.cursor() as cursor:
+            cursor.execute("""
+                SELECT * FROM lecturas_sensores
+                WHERE sensor_id = %s AND id > %s
+                ORDER BY id LIMIT %s
+            """, (equipo_id, estado['ultima_lectura'], tamano))
+            lecturas = cursor.fetchall()
+            if not lecturas:
+                break
+            marcadores = ', '.join(['%s'] * len(lecturas))
+            cursor.execute(
+                f"SELECT * FROM predicciones WHERE lectura_id IN ({marcadores}) ORDER BY id",
+                [l['id'] for l in lecturas]
+            )
+            predicciones = cursor.fetchall()
+
+        with destino.cursor() as cursor:
+            for lectura in lecturas:
+                estado['lecturas'][lectura['id']] = _insertar(cursor, 'lecturas_sensores', lectura)
+            for prediccion in predicciones:
+                viejo = prediccion['id']
+                prediccion['lectura_id'] = estado['lecturas'][prediccion['lectura_id']]
+                estado['predicciones'][viejo] = _insertar(cursor, 'predicciones', prediccion)
+        destino.commit()
+
+        estado['ultima_lectura'] = lecturas[-1]['id']
+        copiadas += len(lecturas)
+        print(f"[Rebalanceo] {copiadas} lecturas copiadas")
+
+    with origen.cursor() as cursor:
+        cursor.execute("""
+            SELECT * FROM alertas
+            WHERE equipo_id = %s AND id > %s
+            ORDER BY id
+        """, (equipo_id, estado['ultima_alerta']))
+        alertas = cursor.fetchall()
+
+    with destino.cursor() as cursor:
+        for alerta in alertas:
+            viejo = alerta['id']
+            alerta['prediccion_id'] = estado['predicciones'].get(alerta['prediccion_id'])
+            estado['alertas'][viejo] = _insertar(cursor, 'alertas', alerta)
+    destino.commit()
+    if alertas:
+        estado['ultima_alerta'] = alertas[-1]['id']
+    print(f"[Rebalanceo] {len(alertas)} alertas copiadas")
+
+
+def sincronizar_alertas(origen, destino, equipo_id, estado):
+    """Lleva al destino los cambios de estado de las alertas ya copiadas"""
+    with origen.cursor() as cursor:
+        cursor.execute(
+            f"SELECT id, {', '.join(CAMPOS_ALERTA)} FROM alertas WHERE equipo_id = %s",
+            (equipo_id,)
+        )
+        alertas = [a for a in cursor.fetchall() if a['id'] in estado['alertas']]
+
+    with destino.cursor() as cursor:
+        cursor.executemany(
+            f"UPDATE alertas SET {', '.join(f'{c} = %s' for c in CAMPOS_ALERTA)} WHERE id = %s",
+            [[a[c] for c in CAMPOS_ALERTA] + [estado['alertas'][a['id']]] for a in alertas]
+        )
+    destino.commit()
+
+
+def fijar_shard(equipo_id, shard):
+    connection = models.get_db_connection()
+    if not connection:
+        raise RuntimeError('No hay conexion al shard 0')
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO ubicacion_equipos (equipo_id, shard) VALUES (%s, %s)
+                ON DUPLICATE KEY UPDATE shard = VALUES(shard)
+            """, (equipo_id, shard))
+        connection.commit()
+    finally:
+        connection.close()
+    shards.invalidar()
+
+
+def borrar(origen, equipo_id, tamano):
+    """Borra los datos del equipo en el origen por bloques"""
+    with origen.cursor() as cursor:
+        cursor.execute("DELETE FROM alertas WHERE equipo_id = %s", (equipo_id,))
+        cursor.execute("""
+            DELETE p FROM predicciones p
+            JOIN lecturas_sensores l ON p.lectura_id = l.id
+            WHERE l.sensor_id = %s
+        """, (equipo_id,))
+        origen.commit()
+        while cursor.execute(
+            "DELETE FROM lecturas_sensores WHERE sensor_id = %s LIMIT %s", (equipo_id, tamano)
+        ):
+            origen.commit()
+    origen.commit()
+
+
+def mover(equipo_id, destino_shard, tamano=5000, borrar_origen=True):
+    origen_shard = shards.shard_de(equipo_id, models.get_db_connection)
+    if origen_shard == destino_shard:
+        print(f"[Rebalanceo] {equipo_id} ya esta en el shard {destino_shard}")
+        return True
+
+    origen = models.get_db_connection(shard=origen_shard)
+    destino = models.get_db_connection(shard=destino_shard)
+    if not origen or not destino:
+        raise RuntimeError('No hay conexion a los shards de origen y destino')
+
+    print(f"[Rebalanceo] {equipo_id}: shard {origen_shard} -> {destino_shard}")
+    estado = {
+        'ultima_lectura': 0, 'ultima_alerta': 0,
+        'lecturas': {}, 'predicciones': {}, 'alertas': {}
+    }
+    try:
+        copiar(origen, destino, equipo_id, estado, tamano)
+
+        fijar_shard(equipo_id, destino_shard)
+        espera = SHARD_CONFIG['ttl'] + 1
+        print(f"[Rebalanceo] Esperando {espera:.0f}s a que los workers usen el shard nuevo")
+        time.sleep(espera)
+
+        copiar(origen, destino, equipo_id, estado, tamano)
+        sincronizar_alertas(origen, destino, equipo_id, estado)
+
+        if borrar_origen:
+            borrar(origen, equipo_id, tamano)
+            print(f"[Rebalanceo] Datos de {equipo_id} borrados del shard {origen_shard}")
+    finally:
+        origen.close()
+        destino.close()
+        versiones.registrar_cambio_general()
+
+    print(f"[Rebalanceo] {equipo_id} movido: {len(estado['lecturas'])} lecturas, "
+          f"{len(estado['alertas'])} alertas")
+    return True
+
+
+def plan():
+    """Muestra el shard de cada equipo del catalogo"""
+    for equipo in models.get_all_equipos():
+        equipo_id = equipo.equipo_id
+        actual = shards.shard_de(equipo_id, models.get_db_connection)
+        por_hash = shards.shard_de_hash(equipo_id)
+        nota = '' if actual == por_hash else f' (fijado; por hash: {por_hash})'
+        print(f"{equipo_id}: shard {actual}{nota}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Mueve un equipo a otro shard')
+    parser.add_argument('--equipo', help='equipo_id a mover')
+    parser.add_argument('--destino', type=int, help='Shard de destino')
+    parser.add_argument('--bloque', type=int, default=5000, help='Lecturas por bloque')
+    parser.add_argument('--sin-borrar', action='store_true', help='Conservar los datos en el origen')
+    parser.add_argument('--plan', action='store_true', help='Solo mostrar el shard de cada equipo')
+    args = parser.parse_args()
+
+    if args.plan:
+        plan()
+    elif args.equipo is None or args.destino is None:
+        parser.error('--equipo y --destino son requeridos')
+    elif not 0 <= args.destino < shards.TOTAL:
+        parser.error(f'--destino debe estar entre 0 y {shards.TOTAL - 1}')
+    else:
+        mover(args.equipo, args.destino, args.bloque, not args.sin_borrar)
@@ -0,0 +1,358 @@
+"""
+Recalcula las predicciones (y opcionalmente las alertas) de lecturas ya
+guardadas, por ejemplo despues de cambiar umbrales, perfiles o el modelo.
+
+- Recorre los shards uno por uno y lee su lecturas_sensores en bloques
+  por clave primaria (los ids no se repiten entre shards, asi --desde-id
+  vale para todos).
+- Puntua cada bloque en un pool de procesos con la version vectorizada
+  del predictor (o el modelo entrenado, si hay uno).
+- Escribe con upserts multi-fila sobre predicciones (clave unica
+  lectura_id, migracion 004).
+- Guarda un checkpoint con el ultimo id de cada shard despues de cada
+  bloque; --reanudar continua cada shard desde ahi, y --max-filas-seg
+  limita el ritmo para no saturar la BD.
+
+Con --alertas tambien regenera las alertas del bloque: se borran las
+ligadas a sus predicciones y se insertan incidentes nuevos (una fila por
+racha consecutiva de cada tipo por equipo, cortada en el borde del bloque).
+Las rachas que terminaron dentro del bloque quedan resueltas; las que
+siguen abiertas al final del bloque quedan pendientes.
+
+Uso:
+    python recalcular.py [--desde-id N] [--hasta-id N] [--bloque 5000]
+                         [--procesos 4] [--alertas] [--reanudar]
+                         [--checkpoint recalcular.checkpoint.json]
+                         [--max-filas-seg 20000] [--heuristica]
+"""
+import argparse
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import modelo_riesgo
+import models
+import predictor
+import reglas
+import shards
+import versiones
+
+# =============================================
+# LECTURA Y ESCRITURA
+# =============================================
+
+def leer_bloque(connection, desde_id, tamano, hasta_id=None):
+    """Lecturas con id > desde_id, en orden de id"""
+    with connection.cursor() as cursor:
+        sql = """
+            SELECT id, sensor_id, temperatura, humedad, corriente, timestamp
+            FROM lecturas_sensores
+            WHERE id > %s
+        """
+        params = [desde_id]
+        if hasta_id:
+            sql += " AND id <= %s"
+            params.append(hasta_id)
+        sql += " ORDER BY id LIMIT %s"
+        params.append(tamano)
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def escribir_predicciones(connection, filas):
+    """Upsert multi-fila de predicciones; retorna {lectura_id: prediccion_id}"""
+    with connection.cursor() as cursor:
+        sql = """
+            INSERT INTO predicciones (lectura_id, equipo_id, nivel_riesgo, riesgo_predicho,
+                                   factor_temperatura, factor_humedad, factor_corriente,
+                                   timestamp)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                nivel_riesgo = VALUES(nivel_riesgo),
+                riesgo_predicho = VALUES(riesgo_predicho),
+                factor_temperatura = VALUES(factor_temperatura),
+                factor_humedad = VALUES(factor_humedad),
+                factor_corriente = VALUES(factor_corriente)
+        """
+        cursor.executemany(sql, filas)
+
+        lecturas = [f[0] for f in filas]
+        marcadores = ', '.join(['%s'] * len(lecturas))
+        cursor.execute(
+            f"SELECT id, lectura_id FROM predicciones WHERE lectura_id IN ({marcadores})",
+            lecturas
+        )
+        return {row['lectura_id']: row['id'] for row in cursor.fetchall()}
+
+
+def escribir_alertas(connection, predicciones, incidentes):
+    """Reemplaza las alertas ligadas a las predicciones del bloque"""
+    with connection.cursor() as cursor:
+        ids = list(predicciones.values())
+        marcadores = ', '.join(['%s'] * len(ids))
+        cursor.execute(f"DELETE FROM alertas WHERE prediccion_id IN ({marcadores})", ids)
+
+        if incidentes:
+            sql = """
+                INSERT INTO alertas (prediccion_id, equipo_id, tipo, mensaje, severidad,
+                                  timestamp, leida, estado, ocurrencias, primera_vez,
+                                  ultima_vez, valor_pico)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """
+            cursor.executemany(sql, [
+                (predicciones[lectura_id], equipo_id, tipo, mensaje, severidad,
+                 primera, cerrado, 'resuelto' if cerrado else None,
+                 ocurrencias, primera, ultima, pico)
+                for lectura_id, equipo_id, tipo, mensaje, severidad,
+                    primera, ultima, ocurrencias, pico, cerrado in incidentes
+            ])
+
+
+# =============================================
+# PUNTUACION (en los procesos del pool)
+# =============================================
+
+def puntuar_bloque(bloque, usar_modelo=True):
+    """
+    Puntua un bloque de lecturas
+    bloque: dict con arreglos 'temperatura', 'humedad', 'corriente',
+            la lista de perfiles distintos y el indice de perfil por fila
+    Retorna (probabilidades, niveles, factores, alertas_por_tipo)
+    """
+    t = bloque['temperatura']
+    h = bloque['humedad']
+    c = bloque['corriente']
+    perfiles = [bloque['perfiles'][i] for i in bloque['indices']]
+
+    scores, niveles = predictor.calculate_risk_scores(t, h, c, perfiles)
+    if usar_modelo:
+        probabilidades = modelo_riesgo.predecir_lote(np.column_stack([t, h, np.abs(c)]))
+        if probabilidades is not None:
+            scores = probabilidades
+            niveles = predictor.determine_risk_levels(scores, perfiles)
+
+    factores = predictor.calculate_influential_factors_batch(t, h, c, perfiles)
+
+    alertas = reglas.alertas_lote(t, h, c, niveles, bloque['perfiles'], bloque['indices'])
+    return np.round(scores, 3), niveles, factores, alertas
+
+
+def _preparar_bloque(filas):
+    """Convierte filas de la BD en arreglos y resuelve el perfil de cada equipo"""
+    perfiles = []
+    indice_perfil = {}
+    indices = np.empty(len(filas), dtype=np.intp)
+    for i, f in enumerate(filas):
+        perfil = reglas.perfil_para(f['sensor_id'])
+        indices[i] = indice_perfil.setdefault(id(perfil), len(perfiles))
+        if indices[i] == len(perfiles):
+            perfiles.append(perfil)
+
+    return {
+        'temperatura': np.array([float(f['temperatura']) for f in filas]),
+        'humedad': np.array([float(f['humedad']) for f in filas]),
+        'corriente': np.array([float(f['corriente']) for f in filas]),
+        'perfiles': perfiles,
+        'indices': indices
+    }
+
+
+def _incidentes(filas, valores, alertas):
+    """Agrupa rachas consecutivas de cada tipo de alerta por equipo"""
+    incidentes = []
+    abiertos = {}   # (equipo_id, tipo) -> [lectura_id, primera, ultima, ocurrencias, pico, mensaje]
+
+    orden = sorted(range(len(filas)), key=lambda i: (filas[i]['sensor_id'], filas[i]['timestamp']))
+    for i in orden:
+        equipo_id = filas[i]['sensor_id']
+        for k, (tipo, severidad, plantilla) in enumerate(reglas.ALERTAS):
+            clave = (equipo_id, tipo)
+            if not alertas[i, k]:
+                if clave in abiertos:
+                    incidentes.append((abiertos.pop(clave), equipo_id, tipo, severidad, True))
+                continue
+            valor = valores[i][k] if k < 3 else None
+            abierto = abiertos.get(clave)
+            if abierto is None:
+                mensaje = plantilla.format(valor) if valor is not None else plantilla
+                abiertos[clave] = [filas[i]['id'], filas[i]['timestamp'], filas[i]['timestamp'], 1, valor, mensaje]
+            else:
+                abierto[2] = filas[i]['timestamp']
+                abierto[3] += 1
+                if valor is not None and valor > abierto[4]:
+                    abierto[4] = valor
+
+    for (equipo_id, tipo), abierto in abiertos.items():
+        severidad = next(s for t, s, _ in reglas.ALERTAS if t == tipo)
+        incidentes.append((abierto, equipo_id, tipo, severidad, False))
+
+    return [
+        (lectura_id, equipo_id, tipo, mensaje, severidad, primera, ultima, ocurrencias, pico, cerrado)
+        for (lectura_id, primera, ultima, ocurrencias, pico, mensaje), equipo_id, tipo, severidad, cerrado
+        in incidentes
+    ]
+
+
+# =============================================
+# CHECKPOINT
+# =============================================
+
+def leer_checkpoint(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        estado = json.load(f)
+    # Ultimo id de cada shard (JSON guarda las claves como texto); los
+    # checkpoints de antes de los shards tienen un solo ultimo_id
+    if 'shards' in estado:
+        estado['shards'] = {int(k): v for k, v in estado['shards'].items()}
+    else:
+        estado['shards'] = {shard: estado['ultimo_id'] for shard in range(shards.TOTAL)}
+    return estado
+
+
+def guardar_checkpoint(path, avance, procesadas):
+    temporal = path + '.tmp'
+    with open(temporal, 'w') as f:
+        json.dump({'shards': avance, 'procesadas': procesadas, 'actualizado': time.time()}, f)
+    os.replace(temporal, path)
+
+
+# =============================================
+# PROCESO PRINCIPAL
+# =============================================
+
+def _recalcular_shard(shard, pool, desde_id, hasta_id, tamano, procesos, con_alertas,
+                      usar_modelo, al_guardar):
+    """
+    Recalcula las lecturas de un shard; las predicciones y alertas se
+    escriben en el mismo shard que la lectura
+    al_guardar(shard, filas, maximo) se llama despues de cada commit
+    """
+    connection = models.get_db_connection(shard=shard)
+    if not connection:
+        raise RuntimeError(f'No hay conexion a la base de datos (shard {shard})')
+
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT MAX(id) AS maximo FROM lecturas_sensores")
+            maximo = hasta_id or (cursor.fetchone()['maximo'] or 0)
+
+        print(f"[Recalcular] Shard {shard}: desde id {desde_id} hasta {maximo}")
+
+        ultimo_id = desde_id
+        pendientes = deque()   # (filas, bloque, futuro) en orden de id
+        terminado = False
+        while not terminado or pendientes:
+            # Mantener el pool ocupado leyendo bloques por adelantado
+            while not terminado and len(pendientes) < procesos * 2:
+                filas = leer_bloque(connection, ultimo_id, tamano, hasta_id)
+                if not filas:
+                    terminado = True
+                    break
+                ultimo_id = filas[-1]['id']
+                bloque = _preparar_bloque(filas)
+                pendientes.append((filas, bloque, pool.submit(puntuar_bloque, bloque, usar_modelo)))
+
+            if not pendientes:
+                break
+
+            filas, bloque, futuro = pendientes.popleft()
+            scores, niveles, factores, alertas = futuro.result()
+
+            predicciones = escribir_predicciones(connection, [
+                (f['id'], f['sensor_id'], str(niveles[i]), float(scores[i]),
+                 float(factores[i, 0]), float(factores[i, 1]), float(factores[i, 2]),
+                 f['timestamp'])
+                for i, f in enumerate(filas)
+            ])
+            if con_alertas:
+                valores = np.column_stack([
+                    bloque['temperatura'], bloque['humedad'], np.abs(bloque['corriente'])
+                ]).tolist()
+                escribir_alertas(connection, predicciones, _incidentes(filas, valores, alertas))
+            connection.commit()
+            versiones.registrar_cambio_general()
+
+            al_guardar(shard, filas, maximo)
+    finally:
+        connection.close()
+
+
+def recalcular(desde_id=0, hasta_id=None, tamano=5000, procesos=None, con_alertas=False,
+               checkpoint=None, max_filas_seg=None, usar_modelo=True, avance=None):
+    """
+    Recalcula predicciones de todos los shards desde desde_id (exclusivo)
+    avance: {shard: ultimo_id} de un checkpoint; cada shard sigue desde ahi
+    Retorna las filas procesadas
+    """
+    avance = dict(avance or {})
+    procesos = procesos or os.cpu_count()
+    procesadas = 0
+    inicio = time.monotonic()
+
+    print(f"[Recalcular] {shards.TOTAL} shards, bloques de {tamano}, {procesos} procesos")
+
+    def al_guardar(shard, filas, maximo):
+        nonlocal procesadas
+        procesadas += len(filas)
+        avance[shard] = filas[-1]['id']
+        if checkpoint:
+            guardar_checkpoint(checkpoint, avance, procesadas)
+
+        transcurrido = time.monotonic() - inicio
+        ritmo = procesadas / transcurrido if transcurrido > 0 else 0
+        restantes = max(maximo - filas[-1]['id'], 0)
+        eta = f"{restantes / ritmo:.0f}s" if ritmo else '?'
+        print(f"[Recalcular] Shard {shard}: id {filas[-1]['id']}/{maximo} - {procesadas} filas, "
+              f"{ritmo:.0f} filas/s, ETA del shard {eta}")
+
+        if max_filas_seg and ritmo > max_filas_seg:
+            time.sleep(procesadas / max_filas_seg - transcurrido)
+
+    with ProcessPoolExecutor(max_workers=procesos) as pool:
+        for shard in range(shards.TOTAL):
+            _recalcular_shard(
+                shard, pool, max(desde_id, avance.get(shard, 0)), hasta_id, tamano,
+                procesos, con_alertas, usar_modelo, al_guardar
+            )
+
+    print(f"[Recalcular] Terminado: {procesadas} lecturas en {time.monotonic() - inicio:.1f}s")
+    return procesadas
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Recalcula predicciones de lecturas existentes')
+    parser.add_argument('--desde-id', type=int, default=0, help='Procesar lecturas con id mayor a este')
+    parser.add_argument('--hasta-id', type=int, help='Ultimo id a procesar')
+    parser.add_argument('--bloque', type=int, default=5000, help='Lecturas por bloque')
+    parser.add_argument('--procesos', type=int, help='Procesos del pool (por defecto, nucleos)')
+    parser.add_argument('--alertas', action='store_true', help='Regenerar tambien las alertas')
+    parser.add_argument('--checkpoint', default='recalcular.checkpoint.json')
+    parser.add_argument('--reanudar', action='store_true', help='Continuar desde el checkpoint')
+    parser.add_argument('--max-filas-seg', type=float, help='Limite de lecturas por segundo')
+    parser.add_argument('--heuristica', action='store_true', help='No usar el modelo entrenado')
+    args = parser.parse_args()
+
+    avance = None
+    if args.reanudar:
+        estado = leer_checkpoint(args.checkpoint)
+        if estado:
+            avance = estado['shards']
+            print(f"[Recalcular] Reanudando desde {avance} ({estado['procesadas']} ya procesadas)")
+
+    recalcular(
+        desde_id=args.desde_id,
+        hasta_id=args.hasta_id,
+        tamano=args.bloque,
+        procesos=args.procesos,
+        con_alertas=args.alertas,
+        checkpoint=args.checkpoint,
+        max_filas_seg=args.max_filas_seg,
+        usar_modelo=not args.heuristica,
+        avance=avance
+    )
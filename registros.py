@@ -0,0 +1,188 @@
+"""
+Filas tipadas y compactas para las consultas de listas grandes.
+
+En lugar de DictCursor (un dict nuevo por fila, con todas las columnas
+de SELECT *) se usa el cursor de tuplas y cada fila se convierte en un
+registro tipo namedtuple (sin __dict__, solo los campos declarados):
+
+    with connection.cursor(pymysql.cursors.Cursor) as cursor:
+        cursor.execute(sql, params)
+        lecturas = Lectura.desde_cursor(cursor)
+
+Los indices de las columnas se calculan una vez por forma de consulta
+(nombres de cursor.description) y quedan en cache. Las columnas que la
+consulta no trae quedan en None; las que sobran se ignoran. ALIAS mapea
+nombres de columna de la BD a campos (p. ej. sensor_id -> equipo_id).
+
+Cada registro tiene su serializador a JSON (como_json), con los nombres
+que ya usaba cada endpoint: los nombres de campo se revisan aqui, en un
+solo lugar.
+"""
+import threading
+from collections import namedtuple
+from operator import itemgetter
+
+from config import FLEET_CONFIG
+import formatos
+
+_lock = threading.Lock()
+_extractores = {}      # (clase, nombres de columnas) -> funcion fila -> tupla de campos
+
+
+def _iso(fecha):
+    return fecha.isoformat() if fecha else None
+
+
+class _Registro:
+    """Mezcla para los registros: construccion desde un cursor de tuplas"""
+    __slots__ = ()
+    ALIAS = {}
+
+    @classmethod
+    def _extractor(cls, columnas):
+        clave = (cls, columnas)
+        extractor = _extractores.get(clave)
+        if extractor is not None:
+            return extractor
+
+        posiciones = {}
+        for i, columna in enumerate(columnas):
+            campo = cls.ALIAS.get(columna, columna)
+            posiciones.setdefault(campo, i)
+        faltantes = [c for c in cls._fields if c not in posiciones]
+        # Las columnas faltantes se leen de un None agregado al final de la fila
+        indices = [posiciones.get(c, len(columnas)) for c in cls._fields]
+        obtener = itemgetter(*indices)
+        if faltantes:
+            def extractor(fila, obtener=obtener):
+                return obtener(fila + (None,))
+        else:
+            extractor = obtener
+
+        with _lock:
+            _extractores[clave] = extractor
+        return extractor
+
+    @classmethod
+    def desde_cursor(cls, cursor):
+        """Lista de registros con las filas pendientes de un cursor de tuplas"""
+        extractor = cls._extractor(tuple(d[0] for d in cursor.description))
+        nuevo = tuple.__new__
+        return [nuevo(cls, extractor(fila)) for fila in cursor.fetchall()]
+
+
+class Lectura(_Registro, namedtuple('Lectura', (
+    'id', 'equipo_id', 'temperatura', 'humedad', 'corriente', 'timestamp',
+    'nivel_riesgo', 'riesgo_predicho'
+))):
+    """Lectura de sensores con su prediccion (LEFT JOIN predicciones)"""
+    __slots__ = ()
+    ALIAS = {'sensor_id': 'equipo_id'}
+
+    def como_json(self, incluir_equipo=False):
+        datos = {
+            'id': self.id,
+            'temperature': self.temperatura,
+            'humidity': self.humedad,
+            'current': self.corriente,
+            'timestamp': _iso(self.timestamp),
+            'risk_level': self.nivel_riesgo,
+            'failure_probability': self.riesgo_predicho
+        }
+        if incluir_equipo:
+            datos['equipo_id'] = self.equipo_id
+            datos['equipo_nombre'] = formatos.nombre_equipo(self.equipo_id)
+        return datos
+
+
+class Prediccion(_Registro, namedtuple('Prediccion', (
+    'id', 'lectura_id', 'nivel_riesgo', 'riesgo_predicho',
+    'factor_temperatura', 'factor_humedad', 'factor_corriente', 'timestamp'
+))):
+    __slots__ = ()
+
+    def como_json(self):
+        return {
+            'id': self.id,
+            'reading_id': self.lectura_id,
+            'risk_level': self.nivel_riesgo,
+            'failure_probability': self.riesgo_predicho,
+            'influential_factors': {
+                'Temperatura': self.factor_temperatura,
+                'Humedad': self.factor_humedad,
+                'Corriente': self.factor_corriente
+            },
+            'timestamp': _iso(self.timestamp)
+        }
+
+
+class Alerta(_Registro, namedtuple('Alerta', (
+    'id', 'prediccion_id', 'equipo_id', 'tipo', 'mensaje', 'severidad',
+    'timestamp', 'leida', 'estado', 'notas'
+))):
+    __slots__ = ()
+
+    def como_json(self):
+        """Formato de /api/alertas/todas"""
+        return {
+            'id': self.id,
+            'tipo': self.tipo,
+            'mensaje': self.mensaje,
+            'severidad': self.severidad,
+            'timestamp': _iso(self.timestamp),
+            'estado': self.estado,
+            'notas': self.notas,
+            'leida': self.leida,
+            'equipo_id': self.equipo_id,
+            'equipo_nombre': formatos.nombre_equipo(self.equipo_id)
+        }
+
+    def como_json_dashboard(self):
+        """Formato de las alertas de /api/dashboard"""
+        return {
+            'id': self.id,
+            'alert_type': self.tipo,
+            'message': self.mensaje,
+            'severity': self.severidad,
+            'timestamp': _iso(self.timestamp),
+            'status': self.estado
+        }
+
+
+class Equipo(_Registro, namedtuple('Equipo', (
+    'id', 'equipo_id', 'nombre', 'ubicacion', 'area', 'activo', 'ultima_conexion',
+    'operador_nombre', 'operador_email', 'alertas_activas'
+))):
+    """Equipo del catalogo (alertas_activas se completa aparte, con _replace)"""
+    __slots__ = ()
+
+    def como_json(self, lectura=None, ahora=None):
+        """Formato de /api/equipos/todos; lectura es la ultima Lectura del equipo"""
+        datos = {
+            'id': self.id,
+            'equipo_id': self.equipo_id,
+            'nombre': self.nombre,
+            'ubicacion': self.ubicacion,
+            'area': self.area,
+            'operador': self.operador_nombre,
+            'alertas_activas': self.alertas_activas or 0,
+            'ultima_conexion': _iso(self.ultima_conexion),
+            'activo': self.activo
+        }
+        if lectura:
+            datos['temperatura'] = lectura.temperatura
+            datos['humedad'] = lectura.humedad
+            datos['corriente'] = lectura.corriente
+            datos['nivel_riesgo'] = lectura.nivel_riesgo
+            datos['riesgo_predicho'] = lectura.riesgo_predicho
+            # Online si la ultima lectura es reciente (el mismo criterio que versiones.token_conectados)
+            datos['online'] = bool(lectura.timestamp and ahora and
+                                   (ahora - lectura.timestamp).total_seconds() < FLEET_CONFIG['online_segundos'])
+        else:
+            datos['online'] = False
+            datos['temperatura'] = None
+            datos['humedad'] = None
+            datos['corriente'] = None
+            datos['nivel_riesgo'] = 'unknown'
+            datos['riesgo_predicho'] = 0
+        return datos
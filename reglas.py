@@ -0,0 +1,214 @@
+"""
+Perfiles de umbrales y pesos por equipo o por area.
+
+Cada perfil se compila en un objeto Perfil con los valores ya
+precalculados (inversos de los umbrales, pesos), de modo que evaluar una
+lectura no hace busquedas en diccionarios ni formatea texto hasta que una
+alerta realmente se dispara.
+
+Resolucion: perfil del equipo > perfil del area del equipo > perfil global
+(config.THRESHOLDS). Los perfiles se leen de la tabla perfiles_umbral y se
+guardan en cache; la cache se invalida al modificar un perfil y, para
+los demas workers, vence cada PROFILE_CONFIG['ttl'] segundos.
+"""
+import threading
+import time
+
+import numpy as np
+
+from config import THRESHOLDS, RISK_WEIGHTS, PROFILE_CONFIG
+import models
+
+# Limite inferior del nivel 'medium' (igual para todos los perfiles)
+RISK_MEDIUM = 0.3
+
+# Tope de cada valor normalizado
+NORM_MAX = 1.5
+
+# Tipos de alerta en el orden de alertas_lote: (tipo, severidad, mensaje);
+# el mensaje se completa con el valor leido
+ALERTAS = (
+    ('high_temperature', 'critical', 'Temperatura crítica: {}°C'),
+    ('high_humidity', 'warning', 'Humedad elevada: {}%'),
+    ('high_current', 'critical', 'Corriente anormal: {}A'),
+    ('system_failure_risk', 'critical', 'Riesgo crítico de fallo del sistema'),
+)
+
+
+def _alerta(indice, leido=None, valor=None):
+    tipo, severidad, mensaje = ALERTAS[indice]
+    return {
+        'type': tipo,
+        'message': mensaje.format(leido) if leido is not None else mensaje,
+        'severity': severidad,
+        'value': valor
+    }
+
+
+class Perfil:
+    """Umbrales y pesos compilados de un perfil"""
+    __slots__ = (
+        'nombre', 'temperature_max', 'humidity_max', 'current_max',
+        'risk_critical', 'risk_high',
+        'peso_temperatura', 'peso_humedad', 'peso_corriente',
+        '_inv_temp', '_inv_hum', '_inv_corr'
+    )
+
+    def __init__(self, nombre, umbrales, pesos):
+        self.nombre = nombre
+        self.temperature_max = float(umbrales['temperature_max'])
+        self.humidity_max = float(umbrales['humidity_max'])
+        self.current_max = float(umbrales['current_max'])
+        self.risk_critical = float(umbrales['risk_critical'])
+        self.risk_high = float(umbrales['risk_high'])
+        self.peso_temperatura = float(pesos['temperature'])
+        self.peso_humedad = float(pesos['humidity'])
+        self.peso_corriente = float(pesos['current'])
+        self._inv_temp = 1.0 / self.temperature_max
+        self._inv_hum = 1.0 / self.humidity_max
+        self._inv_corr = 1.0 / self.current_max
+
+    def puntaje(self, temperature, humidity, current):
+        """Puntaje de riesgo entre 0 y 1"""
+        score = (
+            min(temperature * self._inv_temp, NORM_MAX) * self.peso_temperatura +
+            min(humidity * self._inv_hum, NORM_MAX) * self.peso_humedad +
+            min(abs(current) * self._inv_corr, NORM_MAX) * self.peso_corriente
+        )
+        return min(max(score, 0), 1)
+
+    def nivel(self, risk_score):
+        """Nivel de riesgo de un puntaje"""
+        if risk_score >= self.risk_critical:
+            return 'critical'
+        if risk_score >= self.risk_high:
+            return 'high'
+        if risk_score >= RISK_MEDIUM:
+            return 'medium'
+        return 'low'
+
+    def factores(self, temperature, humidity, current):
+        """Porcentaje de cada valor respecto a su umbral (tope 100)"""
+        return (
+            round(min(temperature * self._inv_temp * 100, 100), 1),
+            round(min(humidity * self._inv_hum * 100, 100), 1),
+            round(min(abs(current) * self._inv_corr * 100, 100), 1)
+        )
+
+    def alertas(self, temperature, humidity, current, risk_level):
+        """Alertas que dispara una lectura (los mensajes se arman solo si se disparan)"""
+        alerts = []
+
+        if temperature > self.temperature_max:
+            alerts.append(_alerta(0, temperature, temperature))
+
+        if humidity > self.humidity_max:
+            alerts.append(_alerta(1, humidity, humidity))
+
+        if abs(current) > self.current_max:
+            alerts.append(_alerta(2, current, abs(current)))
+
+        if risk_level == 'critical':
+            alerts.append(_alerta(3))
+
+        return alerts
+
+    def como_dict(self):
+        return {
+            'nombre': self.nombre,
+            'temperature_max': self.temperature_max,
+            'humidity_max': self.humidity_max,
+            'current_max': self.current_max,
+            'risk_critical': self.risk_critical,
+            'risk_high': self.risk_high,
+            'weights': {
+                'temperature': self.peso_temperatura,
+                'humidity': self.peso_humedad,
+                'current': self.peso_corriente
+            }
+        }
+
+
+PERFIL_GLOBAL = Perfil('global', THRESHOLDS, RISK_WEIGHTS)
+
+
+def alertas_lote(temperature, humidity, current, niveles, perfiles, indices):
+    """
+    Version vectorizada de Perfil.alertas para arreglos de lecturas
+    perfiles: perfiles distintos; indices: el de cada lectura
+    Retorna una matriz booleana (lecturas x ALERTAS)
+    """
+    tabla = np.array([[p.temperature_max, p.humidity_max, p.current_max] for p in perfiles])[indices]
+    return np.column_stack([
+        temperature > tabla[:, 0],
+        humidity > tabla[:, 1],
+        np.abs(current) > tabla[:, 2],
+        niveles == 'critical'
+    ])
+
+
+def compilar_fila(fila):
+    """Compila una fila de perfiles_umbral"""
+    nombre = f"equipo:{fila['equipo_id']}" if fila.get('equipo_id') else f"area:{fila['area']}"
+    return Perfil(nombre, fila, {
+        'temperature': fila['peso_temperatura'],
+        'humidity': fila['peso_humedad'],
+        'current': fila['peso_corriente']
+    })
+
+
+_lock = threading.Lock()
+_por_equipo = {}     # perfiles definidos para un equipo
+_por_area = {}       # perfiles definidos para un area
+_area_equipo = {}    # equipo_id -> area
+_resueltos = {}      # equipo_id -> Perfil ya resuelto
+_cargado_en = None
+
+
+def _cargar():
+    """Lee perfiles y areas de la BD y reemplaza la cache"""
+    global _por_equipo, _por_area, _area_equipo, _resueltos, _cargado_en
+    datos = models.get_perfiles_umbral()
+    if datos is None:
+        # Sin BD: seguir con lo que haya y reintentar al vencer el TTL
+        _cargado_en = time.monotonic()
+        return
+
+    filas, areas = datos
+    por_equipo = {}
+    por_area = {}
+    for fila in filas:
+        perfil = compilar_fila(fila)
+        if fila.get('equipo_id'):
+            por_equipo[fila['equipo_id']] = perfil
+        elif fila.get('area'):
+            por_area[fila['area']] = perfil
+
+    _por_equipo = por_equipo
+    _por_area = por_area
+    _area_equipo = areas
+    _resueltos = {}
+    _cargado_en = time.monotonic()
+
+
+def perfil_para(equipo_id):
+    """Retorna el perfil compilado que aplica a un equipo"""
+    if _cargado_en is None or time.monotonic() - _cargado_en > PROFILE_CONFIG['ttl']:
+        with _lock:
+            if _cargado_en is None or time.monotonic() - _cargado_en > PROFILE_CONFIG['ttl']:
+                _cargar()
+
+    perfil = _resueltos.get(equipo_id)
+    if perfil is None:
+        perfil = _por_equipo.get(equipo_id)
+        if perfil is None:
+            perfil = _por_area.get(_area_equipo.get(equipo_id), PERFIL_GLOBAL)
+        _resueltos[equipo_id] = perfil
+    return perfil
+
+
+def invalidar():
+    """Descarta la cache (se recarga en la siguiente consulta)"""
+    global _cargado_en
+    with _lock:
+        _cargado_en = None
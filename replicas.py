@@ -0,0 +1,157 @@
+"""
+Enrutamiento de consultas de solo lectura a replicas de MySQL.
+
+Las funciones de models que solo leen (historial, alertas, equipos,
+dashboard) piden get_db_connection(lectura=True); las escrituras siempre
+van al primario. Con DB_REPLICAS vacio todo va al primario como antes.
+
+- Las replicas se usan por turnos. Cada una tiene su circuit breaker
+  (ver resiliencia.py): una replica caida se salta sin esperar el timeout.
+- Antes de usar una replica se revisa su retraso (SHOW REPLICA STATUS,
+  cacheado REPLICA_CONFIG['lag_check_interval'] segundos). Si supera
+  'max_lag' segundos, o la replicacion esta detenida, se usa la siguiente
+  o, si ninguna sirve, el primario.
+- Leer lo propio: despues de que un cliente modifica algo (p. ej. el
+  estado de una alerta) sus lecturas van al primario durante
+  'read_your_writes' segundos. La app marca el cliente por request
+  (contextvar), asi que models no depende de Flask. El registro de
+  clientes es por proceso.
+
+Los demas clientes pueden ver datos con hasta 'max_lag' segundos de atraso.
+"""
+import contextvars
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+import pymysql
+
+from config import DB_CONFIG, DB_REPLICAS, REPLICA_CONFIG
+import resiliencia
+
+# Clientes recordados para leer lo propio
+MAX_CLIENTES = 10000
+
+
+class Replica:
+    """Una replica de lectura y su estado"""
+    __slots__ = ('host', 'port', 'breaker', 'retraso', 'verificado_en')
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.breaker = resiliencia.CircuitBreaker(
+            f'replica {host}:{port}',
+            REPLICA_CONFIG['failure_threshold'],
+            REPLICA_CONFIG['cooldown']
+        )
+        self.retraso = None
+        self.verificado_en = None
+
+    def conectar(self):
+        return pymysql.connect(
+            host=self.host,
+            user=DB_CONFIG['user'],
+            password=DB_CONFIG['password'],
+            database=DB_CONFIG['database'],
+            port=self.port,
+            connect_timeout=REPLICA_CONFIG['connect_timeout'],
+            cursorclass=pymysql.cursors.DictCursor
+        )
+
+    def medir_retraso(self, connection):
+        """Segundos de atraso de la replica; None si la replicacion esta detenida"""
+        with connection.cursor() as cursor:
+            try:
+                cursor.execute("SHOW REPLICA STATUS")
+            except pymysql.err.MySQLError:
+                cursor.execute("SHOW SLAVE STATUS")   # MySQL < 8.0.22
+            row = cursor.fetchone()
+        if row is None:
+            # Instancia sin replicacion configurada (p. ej. una BD local de pruebas)
+            return 0
+        retraso = row.get('Seconds_Behind_Source', row.get('Seconds_Behind_Master'))
+        return None if retraso is None else int(retraso)
+
+    def al_dia(self, connection):
+        """True si el atraso de la replica esta dentro de REPLICA_CONFIG['max_lag']"""
+        ahora = time.monotonic()
+        if self.verificado_en is None or ahora - self.verificado_en > REPLICA_CONFIG['lag_check_interval']:
+            try:
+                self.retraso = self.medir_retraso(connection)
+            except Exception as e:
+                print(f"[Replicas] No se pudo medir el retraso de {self.host}:{self.port}: {e}")
+                self.retraso = None
+            self.verificado_en = ahora
+            if self.retraso is None or self.retraso > REPLICA_CONFIG['max_lag']:
+                print(f"[Replicas] {self.host}:{self.port} atrasada ({self.retraso}s), se usa otra")
+        return self.retraso is not None and self.retraso <= REPLICA_CONFIG['max_lag']
+
+    def como_dict(self):
+        return {
+            'host': f'{self.host}:{self.port}',
+            'retraso': self.retraso,
+            'circuito': self.breaker.estado
+        }
+
+
+_replicas = [Replica(host, port) for host, port in DB_REPLICAS]
+_turno = itertools.count()
+
+_lock = threading.Lock()
+_escrituras = OrderedDict()      # cliente -> monotonic hasta el que lee del primario
+_solo_primario = contextvars.ContextVar('solo_primario', default=False)
+
+
+def registrar_escritura(cliente):
+    """El cliente leera del primario durante REPLICA_CONFIG['read_your_writes'] segundos"""
+    if not _replicas or cliente is None:
+        return
+    with _lock:
+        _escrituras[cliente] = time.monotonic() + REPLICA_CONFIG['read_your_writes']
+        _escrituras.move_to_end(cliente)
+        if len(_escrituras) > MAX_CLIENTES:
+            _escrituras.popitem(last=False)
+
+
+def iniciar_request(cliente):
+    """Decide, al inicio de cada request, si las lecturas del cliente van al primario"""
+    solo_primario = False
+    if _replicas and cliente is not None:
+        with _lock:
+            hasta = _escrituras.get(cliente)
+            if hasta is not None:
+                if time.monotonic() < hasta:
+                    solo_primario = True
+                else:
+                    del _escrituras[cliente]
+    _solo_primario.set(solo_primario)
+
+
+def conexion_lectura():
+    """Conexion a una replica al dia; None si hay que usar el primario"""
+    if not _replicas or _solo_primario.get():
+        return None
+
+    inicio = next(_turno)
+    for i in range(len(_replicas)):
+        replica = _replicas[(inicio + i) % len(_replicas)]
+        if not replica.breaker.permitir():
+            continue
+        try:
+            connection = replica.conectar()
+        except Exception as e:
+            print(f"[Replicas] Error conectando a {replica.host}:{replica.port}: {e}")
+            replica.breaker.fallo()
+            continue
+        replica.breaker.exito()
+        if replica.al_dia(connection):
+            return connection
+        connection.close()
+    return None
+
+
+def estado():
+    """Estado de las replicas configuradas"""
+    return [r.como_dict() for r in _replicas]
@@ -0,0 +1,79 @@
+"""
+Circuit breaker de la conexion a MySQL.
+
+Tras RESILIENCE_CONFIG['failure_threshold'] conexiones fallidas seguidas
+el circuito se abre y get_db_connection retorna None de inmediato, sin
+esperar el timeout de conexion, durante RESILIENCE_CONFIG['cooldown']
+segundos. Despues deja pasar un solo intento de prueba (semiabierto): si
+conecta se cierra, si falla vuelve a abrirse.
+
+Mientras el circuito esta abierto la ingesta guarda las lecturas en el
+spool local (ver spool.py).
+"""
+import threading
+import time
+
+from config import RESILIENCE_CONFIG
+
+CERRADO = 'cerrado'
+ABIERTO = 'abierto'
+SEMIABIERTO = 'semiabierto'
+
+
+class CircuitBreaker:
+    """Estado del circuito de un recurso externo (compartido por los hilos del proceso)"""
+
+    def __init__(self, nombre, umbral_fallos, espera):
+        self.nombre = nombre
+        self.umbral_fallos = umbral_fallos
+        self.espera = espera
+        self.estado = CERRADO
+        self.fallos = 0
+        self.abierto_en = 0.0
+        self._lock = threading.Lock()
+
+    def permitir(self):
+        """True si se puede intentar usar el recurso"""
+        if self.estado == CERRADO:
+            return True
+        with self._lock:
+            if self.estado == ABIERTO and time.monotonic() - self.abierto_en >= self.espera:
+                # Un solo intento de prueba; los demas siguen fallando rapido
+                self.estado = SEMIABIERTO
+                return True
+            return self.estado == CERRADO
+
+    def exito(self):
+        if self.estado == CERRADO and self.fallos == 0:
+            return
+        with self._lock:
+            if self.estado != CERRADO:
+                print(f"[Circuito {self.nombre}] Cerrado, el recurso respondio")
+            self.estado = CERRADO
+            self.fallos = 0
+
+    def fallo(self):
+        with self._lock:
+            self.fallos += 1
+            if self.estado == SEMIABIERTO or (
+                self.estado == CERRADO and self.fallos >= self.umbral_fallos
+            ):
+                self.estado = ABIERTO
+                self.abierto_en = time.monotonic()
+                print(f"[Circuito {self.nombre}] Abierto por {self.espera}s tras {self.fallos} fallos")
+
+    def disponible(self):
+        """True si el circuito no esta abierto (no consume el intento de prueba)"""
+        return self.estado == CERRADO
+
+    def como_dict(self):
+        return {
+            'nombre': self.nombre,
+            'estado': self.estado,
+            'fallos': self.fallos,
+            'reintento_en': round(max(self.espera - (time.monotonic() - self.abierto_en), 0), 1)
+                            if self.estado == ABIERTO else None
+        }
+
+
+bd = CircuitBreaker('mysql', RESILIENCE_CONFIG['failure_threshold'], RESILIENCE_CONFIG['cooldown'])
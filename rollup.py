@@ -0,0 +1,147 @@
+"""
+Rollup por equipo y minuto de los factores influyentes de cada prediccion.
+
+La ingesta (etapa 'acumular' de ingesta.py) suma en memoria, por equipo
+y minuto, la cantidad de lecturas, los factores que calculo el predictor
+y el riesgo. Cada ROLLUP_CONFIG['flush_interval'] segundos los
+acumulados se suman a la tabla rollup_factores (INSERT ... ON DUPLICATE
+KEY UPDATE x = x + VALUES(x)), sin leer las predicciones.
+
+Con esa tabla una ventana se explica en O(minutos) en lugar de
+O(lecturas):
+- ventana_minutos(n): suma de los minutos de la ventana,
+- ventana_lecturas(n): suma de los minutos mas recientes hasta juntar n
+  lecturas (del minuto mas antiguo se toma la fraccion que falta).
+
+Lo acumulado en este proceso y aun no escrito se suma al resultado.
+Las predicciones que no pasan por la ingesta (recalcular.py) no
+actualizan el rollup: la migracion 008 lo arma desde predicciones y
+`python migraciones.py --rollup` lo rearma.
+"""
+import atexit
+import threading
+import time
+from datetime import datetime, timedelta
+
+from config import ROLLUP_CONFIG
+import models
+
+_lock = threading.Lock()
+_pendientes = {}      # (equipo_id, minuto) -> [lecturas, temperatura, humedad, corriente, riesgo]
+_ultimo_flush = time.monotonic()
+
+
+def _minuto(fecha):
+    return fecha.replace(second=0, microsecond=0)
+
+
+def registrar(equipo_id, timestamp, factores, riesgo):
+    """Acumula los factores de una prediccion en su minuto"""
+    clave = (equipo_id, _minuto(timestamp or datetime.now()))
+    with _lock:
+        acumulado = _pendientes.get(clave)
+        if acumulado is None:
+            acumulado = _pendientes[clave] = [0, 0.0, 0.0, 0.0, 0.0]
+        acumulado[0] += 1
+        acumulado[1] += factores['Temperatura']
+        acumulado[2] += factores['Humedad']
+        acumulado[3] += factores['Corriente']
+        acumulado[4] += riesgo
+
+    if time.monotonic() - _ultimo_flush >= ROLLUP_CONFIG['flush_interval']:
+        flush()
+
+
+def flush():
+    """Suma a la BD lo acumulado; lo que no se pudo escribir queda para la proxima"""
+    global _ultimo_flush
+    with _lock:
+        _ultimo_flush = time.monotonic()
+        filas = [(e, m, *a) for (e, m), a in _pendientes.items()]
+        _pendientes.clear()
+    if not filas:
+        return
+
+    fallidas = models.upsert_rollup_factores(filas)
+    if fallidas:
+        with _lock:
+            for equipo_id, minuto, *valores in fallidas:
+                acumulado = _pendientes.setdefault((equipo_id, minuto), [0, 0.0, 0.0, 0.0, 0.0])
+                for i, v in enumerate(valores):
+                    acumulado[i] += v
+
+
+def _locales(equipo_id, desde=None):
+    """Acumulados de este proceso aun no escritos: {minuto: [lecturas, ...]}"""
+    por_minuto = {}
+    with _lock:
+        for (e, minuto), acumulado in _pendientes.items():
+            if (equipo_id and e != equipo_id) or (desde and minuto < desde):
+                continue
+            total = por_minuto.setdefault(minuto, [0, 0.0, 0.0, 0.0, 0.0])
+            for i, v in enumerate(acumulado):
+                total[i] += v
+    return por_minuto
+
+
+def _buckets(equipo_id, desde=None, limite=None):
+    """Minutos de la BD mas los locales, del mas reciente al mas antiguo; None sin conexion"""
+    filas = models.get_rollup_buckets(equipo_id, desde, limite)
+    if filas is None:
+        return None
+    por_minuto = _locales(equipo_id, desde)
+    for f in filas:
+        total = por_minuto.setdefault(f['minuto'], [0, 0.0, 0.0, 0.0, 0.0])
+        total[0] += int(f['lecturas'])
+        total[1] += float(f['suma_temperatura'])
+        total[2] += float(f['suma_humedad'])
+        total[3] += float(f['suma_corriente'])
+        total[4] += float(f['suma_riesgo'])
+    return [por_minuto[m] for m in sorted(por_minuto, reverse=True)]
+
+
+def _resumen(sumas, minutos):
+    """Promedios a partir de las sumas [lecturas, temperatura, humedad, corriente, riesgo]"""
+    n = sumas[0]
+    if not n:
+        return {'lecturas': 0, 'minutos': minutos}
+    return {
+        'lecturas': round(n),
+        'minutos': minutos,
+        'Temperatura': round(sumas[1] / n, 1),
+        'Humedad': round(sumas[2] / n, 1),
+        'Corriente': round(sumas[3] / n, 1),
+        'riesgo': round(sumas[4] / n, 3)
+    }
+
+
+def ventana_minutos(minutos, equipo_id=None):
+    """Factores y riesgo promedio de los ultimos minutos; None si no hay conexion"""
+    desde = _minuto(datetime.now() - timedelta(minutes=minutos))
+    buckets = _buckets(equipo_id, desde)
+    if buckets is None:
+        return None
+    sumas = [sum(b[i] for b in buckets) for i in range(5)]
+    return _resumen(sumas, len(buckets))
+
+
+def ventana_lecturas(lecturas, equipo_id=None):
+    """Factores y riesgo promedio de las ultimas lecturas; None si no hay conexion"""
+    # Cada minuto guardado tiene al menos una lectura
+    buckets = _buckets(equipo_id, limite=min(lecturas, ROLLUP_CONFIG['max_buckets']))
+    if buckets is None:
+        return None
+    sumas = [0, 0.0, 0.0, 0.0, 0.0]
+    usados = 0
+    for bucket in buckets:
+        if sumas[0] >= lecturas:
+            break
+        usados += 1
+        # Del minuto mas antiguo solo la parte que completa la ventana
+        fraccion = min(1.0, (lecturas - sumas[0]) / bucket[0])
+        for i in range(5):
+            sumas[i] += bucket[i] * fraccion
+    return _resumen(sumas, usados)
+
+
+atexit.register(flush)
@@ -0,0 +1,277 @@
+"""
+Servidor de ingesta asyncio (UDP y TCP) que corre junto a la app Flask.
+
+Protocolo de lineas (texto, una lectura por linea):
+
+    equipo_id,temperatura,humedad,corriente[,timestamp[,seq]]
+
+El timestamp es opcional (epoch en segundos, con decimales) y seq es el
+numero de secuencia del dispositivo con el que se descartan los
+reenvios. La linea se valida (valores finitos, equipo_id) antes de
+responder. Por TCP cada linea recibe una respuesta: "OK", "BUSY" (cola
+llena o equipo sobre su limite de lecturas) o "ERR <motivo>". Por UDP un
+datagrama puede traer varias lineas y no hay respuesta.
+
+Las lecturas se encolan y se procesan por lotes con la misma logica que
+la ruta /api/ingest/v2 (ingesta.procesar_lote: una escritura de varias
+filas por lote). Hasta 'workers' lotes se procesan a la vez en el pool
+de hilos.
+
+Uso:
+    python servidor_ingesta.py                      # servidor
+    python servidor_ingesta.py cliente --udp        # dispositivo de prueba
+"""
+import argparse
+import asyncio
+import random
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from config import INGEST_SERVER_CONFIG
+import ingesta
+import limites
+
+
+def parsear_linea(linea):
+    """
+    Convierte una linea del protocolo en
+    (equipo_id, temperatura, humedad, corriente, timestamp, seq)
+    Lanza ValueError si la linea es invalida
+    """
+    partes = [p.strip() for p in linea.strip().split(',')]
+    if not 4 <= len(partes) <= 6:
+        raise ValueError('se esperaban de 4 a 6 campos')
+
+    try:
+        lectura = ingesta.Lectura(partes[0], float(partes[1]), float(partes[2]), float(partes[3]))
+        if len(partes) >= 5 and partes[4]:
+            lectura.timestamp = datetime.fromtimestamp(float(partes[4]))
+        if len(partes) == 6 and partes[5]:
+            lectura.seq = int(partes[5])
+    except (OverflowError, OSError) as e:
+        raise ValueError(f'timestamp invalido: {e}')
+    # Mismas reglas que la pipeline (equipo_id, valores finitos): el OK se responde antes
+    ingesta.validar(lectura)
+
+    return (lectura.equipo_id, lectura.temperature, lectura.humidity, lectura.current,
+            lectura.timestamp, lectura.seq)
+
+
+class ServidorIngesta:
+    """Recibe lecturas por UDP/TCP y las procesa por lotes"""
+
+    def __init__(self, config=INGEST_SERVER_CONFIG, procesar=ingesta.procesar_lote):
+        self.config = config
+        self.procesar = procesar
+        self.cola = None
+        self.executor = ThreadPoolExecutor(max_workers=config['workers'])
+        self.en_curso = set()
+        self.estadisticas = {'recibidas': 0, 'procesadas': 0, 'descartadas': 0,
+                             'limitadas': 0, 'invalidas': 0, 'errores': 0}
+
+    def encolar_linea(self, linea):
+        """Parsea y encola una linea; retorna la respuesta del protocolo"""
+        if not linea.strip():
+            return None
+        try:
+            lectura = parsear_linea(linea)
+        except ValueError as e:
+            self.estadisticas['invalidas'] += 1
+            return f'ERR {e}'
+
+        permitido, _ = limites.permitir(lectura[0])
+        if not permitido:
+            self.estadisticas['limitadas'] += 1
+            return 'BUSY'
+
+        try:
+            self.cola.put_nowait(lectura)
+        except asyncio.QueueFull:
+            self.estadisticas['descartadas'] += 1
+            return 'BUSY'
+
+        self.estadisticas['recibidas'] += 1
+        return 'OK'
+
+    def _procesar_lote(self, lote):
+        """Procesa un lote en un hilo del pool (llamadas bloqueantes a la BD)"""
+        try:
+            return sum(1 for resultado in self.procesar(lote) if resultado)
+        except Exception as e:
+            print(f"[Ingesta asyncio] Error procesando un lote de {len(lote)}: {e}")
+            return 0
+
+    async def _procesar_en_pool(self, lote, lugares=None):
+        """Envia un lote al pool; las estadisticas se actualizan en el loop"""
+        loop = asyncio.get_running_loop()
+        try:
+            procesadas = await loop.run_in_executor(self.executor, self._procesar_lote, lote)
+        finally:
+            if lugares is not None:
+                lugares.release()
+        self.estadisticas['procesadas'] += procesadas
+        self.estadisticas['errores'] += len(lote) - procesadas
+
+    async def _consumir(self):
+        """Arma lotes por tamaño o por tiempo; hasta 'workers' lotes en el pool a la vez"""
+        loop = asyncio.get_running_loop()
+        tamano = self.config['batch_size']
+        intervalo = self.config['batch_interval']
+        lugares = asyncio.Semaphore(self.config['workers'])
+
+        while True:
+            lote = [await self.cola.get()]
+            limite = loop.time() + intervalo
+            while len(lote) < tamano:
+                restante = limite - loop.time()
+                if restante <= 0:
+                    break
+                try:
+                    lote.append(await asyncio.wait_for(self.cola.get(), restante))
+                except asyncio.TimeoutError:
+                    break
+
+            # Sin lugar en el pool se espera aca: la cola absorbe y luego responde BUSY
+            await lugares.acquire()
+            tarea = asyncio.create_task(self._procesar_en_pool(lote, lugares))
+            self.en_curso.add(tarea)
+            tarea.add_done_callback(self.en_curso.discard)
+
+    async def _atender_tcp(self, reader, writer):
+        """Atiende una conexion TCP de un dispositivo"""
+        try:
+            while True:
+                linea = await reader.readline()
+                if not linea:
+                    break
+                respuesta = self.encolar_linea(linea.decode('utf-8', 'replace'))
+                if respuesta:
+                    writer.write(respuesta.encode() + b'\n')
+                    await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def iniciar(self):
+        """Abre los sockets UDP y TCP y arranca el consumidor"""
+        loop = asyncio.get_running_loop()
+        self.cola = asyncio.Queue(maxsize=self.config['queue_max'])
+
+        servidor = self
+
+        class ProtocoloUDP(asyncio.DatagramProtocol):
+            def datagram_received(self, data, addr):
+                for linea in data.decode('utf-8', 'replace').splitlines():
+                    servidor.encolar_linea(linea)
+
+        self.transporte_udp, _ = await loop.create_datagram_endpoint(
+            ProtocoloUDP, local_addr=(self.config['host'], self.config['udp_port'])
+        )
+        self.servidor_tcp = await asyncio.start_server(
+            self._atender_tcp, self.config['host'], self.config['tcp_port']
+        )
+        self.consumidor = asyncio.create_task(self._consumir())
+
+        print(f"[Ingesta asyncio] UDP {self.config['host']}:{self.config['udp_port']}, "
+              f"TCP {self.config['host']}:{self.config['tcp_port']}")
+
+    async def detener(self):
+        """Cierra los sockets y procesa lo que quede en la cola"""
+        self.transporte_udp.close()
+        self.servidor_tcp.close()
+        await self.servidor_tcp.wait_closed()
+
+        pendientes = []
+        while not self.cola.empty():
+            pendientes.append(self.cola.get_nowait())
+        self.consumidor.cancel()
+        if self.en_curso:
+            await asyncio.gather(*self.en_curso, return_exceptions=True)
+        if pendientes:
+            await self._procesar_en_pool(pendientes)
+        self.executor.shutdown(wait=True)
+
+    async def correr(self):
+        """Corre el servidor hasta que se interrumpa"""
+        await self.iniciar()
+        try:
+            while True:
+                await asyncio.sleep(60)
+                print(f"[Ingesta asyncio] {self.estadisticas}")
+        finally:
+            await self.detener()
+
+
+# =============================================
+# CLIENTE DE PRUEBA (dispositivo simulado)
+# =============================================
+
+_seq_simulada = {}
+
+
+def _linea_simulada(equipo_id):
+    # seq por equipo y timestamp en ms, como el firmware del ESP32
+    seq = _seq_simulada[equipo_id] = _seq_simulada.get(equipo_id, -1) + 1
+    return (f"{equipo_id},{random.uniform(20, 40):.2f},{random.uniform(30, 85):.2f},"
+            f"{random.uniform(0, 18):.2f},{time.time():.3f},{seq}\n")
+
+
+def cliente_udp(host, port, equipos=3, lecturas=10, intervalo=0.0):
+    """Envia lecturas simuladas por UDP"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        for _ in range(lecturas):
+            for i in range(equipos):
+                sock.sendto(_linea_simulada(f'ESP32_{i + 1:03d}').encode(), (host, port))
+            if intervalo:
+                time.sleep(intervalo)
+    finally:
+        sock.close()
+
+
+def cliente_tcp(host, port, equipos=3, lecturas=10, intervalo=0.0):
+    """Envia lecturas simuladas por TCP y retorna las respuestas del servidor"""
+    respuestas = []
+    with socket.create_connection((host, port)) as sock:
+        archivo = sock.makefile('rw', encoding='utf-8', newline='\n')
+        for _ in range(lecturas):
+            for i in range(equipos):
+                archivo.write(_linea_simulada(f'ESP32_{i + 1:03d}'))
+                archivo.flush()
+                respuestas.append(archivo.readline().strip())
+            if intervalo:
+                time.sleep(intervalo)
+    return respuestas
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Servidor de ingesta UDP/TCP')
+    sub = parser.add_subparsers(dest='comando')
+    cliente = sub.add_parser('cliente', help='Dispositivo de prueba')
+    cliente.add_argument('--host', default='127.0.0.1')
+    cliente.add_argument('--udp', action='store_true', help='Usar UDP en lugar de TCP')
+    cliente.add_argument('--equipos', type=int, default=3)
+    cliente.add_argument('--lecturas', type=int, default=10)
+    cliente.add_argument('--intervalo', type=float, default=0.0)
+    args = parser.parse_args()
+
+    if args.comando == 'cliente':
+        if args.udp:
+            cliente_udp(args.host, INGEST_SERVER_CONFIG['udp_port'],
+                        args.equipos, args.lecturas, args.intervalo)
+            print(f"[Cliente] {args.equipos * args.lecturas} lecturas enviadas por UDP")
+        else:
+            respuestas = cliente_tcp(args.host, INGEST_SERVER_CONFIG['tcp_port'],
+                                     args.equipos, args.lecturas, args.intervalo)
+            print(f"[Cliente] {len(respuestas)} respuestas, {respuestas.count('OK')} OK")
+    else:
+        print("=" * 50)
+        print("SERVIDOR DE INGESTA UDP/TCP")
+        print("=" * 50)
+        try:
+            asyncio.run(ServidorIngesta().correr())
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,133 @@
+"""
+Sesiones sin estado con tokens firmados (HMAC-SHA256).
+
+/api/login entrega un token con el id del usuario, su rol, su equipo y
+el vencimiento. Cada request lo manda en "Authorization: Bearer <token>"
+y se verifica en memoria, sin consultar la BD.
+
+El rol y el equipo asignado pueden cambiar despues del login: se leen
+de una cache por usuario de SESSION_CONFIG['cache_ttl'] segundos (una
+consulta por usuario y por periodo, no por request). Un usuario borrado
+pierde el acceso al vencer la cache; si la BD no responde se usan los
+datos del token.
+
+Todos los workers deben firmar con el mismo SESSION_SECRET: sin el, con
+mas de un worker (WEB_CONCURRENCY) el proceso no arranca.
+
+Token: base64url(json).base64url(firma)
+"""
+import base64
+import hashlib
+import hmac
+import json
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from config import SERVER_CONFIG, SESSION_CONFIG
+import models
+
+# Usuarios recordados en la cache de rol/equipo
+MAX_USUARIOS = 10000
+
+if SESSION_CONFIG['secret']:
+    _secreto = SESSION_CONFIG['secret'].encode('utf-8')
+elif SERVER_CONFIG['workers'] > 1:
+    # Cada worker tendria su propio secreto: un token solo valdria en el que lo emitio
+    raise RuntimeError(
+        f"SESSION_SECRET es obligatorio con {SERVER_CONFIG['workers']} workers (WEB_CONCURRENCY)"
+    )
+else:
+    _secreto = secrets.token_bytes(32)
+    print("[Sesiones] SESSION_SECRET no configurado, se usa un secreto temporal del proceso")
+
+_lock = threading.Lock()
+_usuarios = OrderedDict()      # usuario_id -> (monotonic de vencimiento, rol, equipo_id)
+
+
+def _b64(datos):
+    return base64.urlsafe_b64encode(datos).rstrip(b'=').decode('ascii')
+
+
+def _de_b64(texto):
+    return base64.urlsafe_b64decode(texto + '=' * (-len(texto) % 4))
+
+
+def _firma(contenido):
+    return hmac.new(_secreto, contenido.encode('ascii'), hashlib.sha256).digest()
+
+
+def crear_token(usuario_id, rol, equipo_id=None):
+    """Token firmado con vencimiento en SESSION_CONFIG['ttl'] segundos"""
+    contenido = _b64(json.dumps({
+        'uid': usuario_id,
+        'rol': rol,
+        'eq': equipo_id,
+        'exp': int(time.time()) + SESSION_CONFIG['ttl']
+    }, separators=(',', ':')).encode('utf-8'))
+    return f'{contenido}.{_b64(_firma(contenido))}'
+
+
+def recordar(usuario_id, rol, equipo_id=None):
+    """Guarda en la cache el rol y el equipo de un usuario (p. ej. al hacer login)"""
+    with _lock:
+        _usuarios[usuario_id] = (time.monotonic() + SESSION_CONFIG['cache_ttl'], rol, equipo_id)
+        _usuarios.move_to_end(usuario_id)
+        if len(_usuarios) > MAX_USUARIOS:
+            _usuarios.popitem(last=False)
+
+
+def invalidar(usuario_id=None):
+    """Descarta de la cache un usuario (o todos): se relee de la BD en su proximo request"""
+    with _lock:
+        if usuario_id is None:
+            _usuarios.clear()
+        else:
+            _usuarios.pop(usuario_id, None)
+
+
+def _rol_y_equipo(usuario_id, rol, equipo_id):
+    """
+    Rol y equipo vigentes; los del token si no se pudieron consultar
+    Retorna None si el usuario ya no existe
+    """
+    with _lock:
+        guardado = _usuarios.get(usuario_id)
+    if guardado is not None and time.monotonic() < guardado[0]:
+        return guardado[1], guardado[2]
+
+    fila = models.get_usuario_sesion(usuario_id)
+    if fila is None:
+        return rol, equipo_id
+    if fila is False:
+        invalidar(usuario_id)
+        return None
+    recordar(usuario_id, fila['rol'], fila['equipo_id'])
+    return fila['rol'], fila['equipo_id']
+
+
+def verificar(token):
+    """
+    Verifica firma y vencimiento de un token
+    Retorna {'id', 'rol', 'equipo_id'} o None si no es valido
+    """
+    contenido, _, firma = token.partition('.')
+    try:
+        if not hmac.compare_digest(_de_b64(firma), _firma(contenido)):
+            return None
+        datos = json.loads(_de_b64(contenido))
+    except (ValueError, UnicodeError):
+        return None
+    if datos.get('exp', 0) < time.time():
+        return None
+
+    vigentes = _rol_y_equipo(datos['uid'], datos.get('rol'), datos.get('eq'))
+    if vigentes is None:
+        return None
+    return {'id': datos['uid'], 'rol': vigentes[0], 'equipo_id': vigentes[1]}
+
+
+def puede_gestionar(sesion):
+    """True si el rol puede ver toda la flota y modificar alertas, equipos y perfiles"""
+    return sesion is not None and sesion['rol'] in SESSION_CONFIG['roles_gestion']
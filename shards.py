@@ -0,0 +1,220 @@
+"""
+Reparto de los datos de cada equipo entre varias bases MySQL (shards).
+
+- Shard 0 es DB_CONFIG: guarda ademas las tablas comunes (equipos,
+  usuarios, perfiles_umbral, ubicacion_equipos). MYSQL_SHARDS agrega los
+  demas. Sin MYSQL_SHARDS hay un solo shard y todo queda como antes.
+- Las lecturas, predicciones y alertas de un equipo viven en el shard que
+  le asigna un hash consistente de equipo_id (anillo con nodos virtuales:
+  al agregar un shard solo se mueve la parte de equipos que le toca).
+- ubicacion_equipos (en shard 0) fija el shard de un equipo y tiene
+  prioridad sobre el hash; la escribe rebalancear.py al mover un equipo.
+  Se lee con cache de SHARD_CONFIG['ttl'] segundos.
+- Con mas de un shard, cada conexion usa auto_increment_increment =
+  SHARD_CONFIG['id_stride'] y auto_increment_offset = shard + 1, asi los
+  ids no se repiten entre shards y del id se deduce el shard
+  (shard_de_id). Las filas anteriores a activar los shards quedan en el
+  shard 0 con sus ids originales: SHARD_CONFIG['id_base'] debe ser al
+  menos el mayor id de esas tablas, los ids hasta la base son del shard 0
+  y los demas shards empiezan por encima (migracion 010).
+- Las consultas de toda la flota se ejecutan en paralelo en todos los
+  shards y se mezclan ordenadas (en_paralelo + mezclar). Cada tarea
+  corre con una copia del contexto del request (contextvars), asi la
+  lectura desde el primario de replicas.py sigue valiendo.
+"""
+import bisect
+import contextvars
+import hashlib
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pymysql
+
+from config import DB_CONFIG, DB_SHARDS, SHARD_CONFIG
+import resiliencia
+
+
+def _hash(texto):
+    return int.from_bytes(hashlib.blake2b(texto.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class Anillo:
+    """Hash consistente de claves a shards con nodos virtuales"""
+
+    def __init__(self, shards, nodos_virtuales):
+        puntos = sorted(
+            (_hash(f'shard-{shard}#{v}'), shard)
+            for shard in range(shards)
+            for v in range(nodos_virtuales)
+        )
+        self.hashes = [h for h, _ in puntos]
+        self.shards = [s for _, s in puntos]
+
+    def shard(self, clave):
+        i = bisect.bisect(self.hashes, _hash(clave))
+        return self.shards[i % len(self.shards)]
+
+
+TOTAL = 1 + len(DB_SHARDS)
+_anillo = Anillo(TOTAL, SHARD_CONFIG['vnodes'])
+
+_breakers = [resiliencia.bd] + [
+    resiliencia.CircuitBreaker(
+        f"shard {i} {c['host']}:{c['port']}",
+        SHARD_CONFIG['failure_threshold'],
+        SHARD_CONFIG['cooldown']
+    )
+    for i, c in enumerate(DB_SHARDS, start=1)
+]
+
+_lock = threading.Lock()
+_ubicaciones = {}      # equipo_id -> shard fijado en ubicacion_equipos
+_cargado_en = None
+
+_pool = ThreadPoolExecutor(max_workers=max(TOTAL, 1), thread_name_prefix='shards') if TOTAL > 1 else None
+
+
+def activo():
+    """True si hay mas de un shard"""
+    return TOTAL > 1
+
+
+def config_shard(shard):
+    """Parametros de conexion de un shard"""
+    return DB_CONFIG if shard == 0 else DB_SHARDS[shard - 1]
+
+
+def conectar(shard):
+    """
+    Conexion a un shard distinto del 0 (el shard 0 lo maneja
+    models.get_db_connection, con replicas); None si no esta disponible
+    """
+    breaker = _breakers[shard]
+    if not breaker.permitir():
+        return None
+    cfg = config_shard(shard)
+    try:
+        connection = pymysql.connect(
+            host=cfg['host'],
+            user=cfg['user'],
+            password=cfg['password'],
+            database=cfg['database'],
+            port=cfg['port'],
+            connect_timeout=SHARD_CONFIG['connect_timeout'],
+            cursorclass=pymysql.cursors.DictCursor
+        )
+        breaker.exito()
+        preparar(connection, shard)
+        return connection
+    except Exception as e:
+        print(f"Error conectando al shard {shard}: {e}")
+        breaker.fallo()
+        return None
+
+
+def preparar(connection, shard):
+    """Ids intercalados por shard (solo con mas de un shard)"""
+    if activo():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SET SESSION auto_increment_increment = %s, auto_increment_offset = %s",
+                (SHARD_CONFIG['id_stride'], shard + 1)
+            )
+
+
+def _cargar_ubicaciones(conexion_catalogo):
+    """Lee ubicacion_equipos del shard 0 (conexion_catalogo() da la conexion)"""
+    global _ubicaciones, _cargado_en
+    _cargado_en = time.monotonic()
+    connection = conexion_catalogo()
+    if not connection:
+        return
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT equipo_id, shard FROM ubicacion_equipos")
+            _ubicaciones = {row['equipo_id']: int(row['shard']) for row in cursor.fetchall()}
+    except Exception as e:
+        print(f"Error leyendo ubicacion_equipos: {e}")
+    finally:
+        connection.close()
+
+
+def shard_de(equipo_id, conexion_catalogo=None):
+    """Shard que guarda los datos de un equipo"""
+    if not activo() or equipo_id is None:
+        return 0
+    if conexion_catalogo is not None and (
+        _cargado_en is None or time.monotonic() - _cargado_en > SHARD_CONFIG['ttl']
+    ):
+        with _lock:
+            if _cargado_en is None or time.monotonic() - _cargado_en > SHARD_CONFIG['ttl']:
+                _cargar_ubicaciones(conexion_catalogo)
+
+    shard = _ubicaciones.get(equipo_id)
+    if shard is None or shard >= TOTAL:
+        shard = _anillo.shard(equipo_id)
+    return shard
+
+
+def breaker_de(equipo_id, conexion_catalogo=None):
+    """Circuit breaker del shard de un equipo (el del shard 0 es resiliencia.bd)"""
+    return _breakers[shard_de(equipo_id, conexion_catalogo)]
+
+
+def estado():
+    """Circuitos de los shards para el endpoint de metricas"""
+    return [b.como_dict() for b in _breakers]
+
+
+def shard_de_hash(equipo_id):
+    """Shard que asigna el hash, sin tener en cuenta ubicacion_equipos"""
+    return _anillo.shard(equipo_id) if activo() else 0
+
+
+def shard_de_id(fila_id):
+    """Shard de una fila a partir de su id (ids intercalados por encima de id_base)"""
+    if not activo() or int(fila_id) <= SHARD_CONFIG['id_base']:
+        return 0
+    shard = (int(fila_id) - 1) % SHARD_CONFIG['id_stride']
+    return shard if shard < TOTAL else 0
+
+
+def invalidar():
+    """Descarta la cache de ubicacion_equipos"""
+    global _cargado_en
+    with _lock:
+        _cargado_en = None
+
+
+def agrupar(filas, equipo_de, conexion_catalogo=None):
+    """Agrupa filas por shard; retorna {shard: [filas]}"""
+    grupos = {}
+    for fila in filas:
+        grupos.setdefault(shard_de(equipo_de(fila), conexion_catalogo), []).append(fila)
+    return grupos
+
+
+def en_paralelo(funcion, shards=None):
+    """
+    Ejecuta funcion(shard) en todos los shards a la vez
+    Retorna la lista de resultados en orden de shard
+    """
+    shards = list(range(TOTAL)) if shards is None else list(shards)
+    if len(shards) == 1 or _pool is None:
+        return [funcion(s) for s in shards]
+    # Un contexto no se puede usar en dos hilos a la vez: una copia por tarea
+    tareas = [_pool.submit(contextvars.copy_context().run, funcion, s) for s in shards]
+    return [tarea.result() for tarea in tareas]
+
+
+def mezclar(listas, clave, descendente=True, limite=None):
+    """Mezcla listas ya ordenadas por clave (merge sort de k vias)"""
+    listas = [l for l in listas if l]
+    if len(listas) == 1:
+        mezcla = iter(listas[0])
+    else:
+        mezcla = heapq.merge(*listas, key=clave, reverse=descendente)
+    return list(itertools.islice(mezcla, limite))
@@ -0,0 +1,315 @@
+"""
+Spool local de lecturas para cuando MySQL no esta disponible.
+
+Mientras el circuito del shard de un equipo esta abierto (ver
+resiliencia.py y shards.py) la ingesta agrega sus lecturas como lineas
+JSON a un archivo del proceso (spool/lecturas.<pid>.jsonl); los equipos
+de los demas shards siguen guardandose. El fsync se hace por lotes: cada
+RESILIENCE_CONFIG['fsync_every'] lecturas o cada 'fsync_interval'
+segundos, no por lectura.
+
+Un hilo de reenvio prueba los shards cada 'replay_interval' segundos. Cuando
+responde, renombra el spool (las lecturas nuevas van a un archivo nuevo)
+y lo vuelca en bloques: un INSERT de lecturas y uno de predicciones por
+bloque, en una transaccion por shard. Las lecturas con seq tienen clave
+unica, asi que reenviar dos veces el mismo bloque no las duplica; las que
+no lo traen se guardan en la misma transaccion y no quedan a medias si
+el bloque falla. Las de un shard que sigue caido vuelven al spool nuevo y
+el resto del bloque se guarda. Tambien reenvia los archivos de
+procesos que ya no existen (worker reiniciado).
+
+Las alertas de las lecturas del spool no se generan al reenviarlas (los
+incidentes siguen con las lecturas en vivo); para regenerarlas:
+python recalcular.py --desde-id <id> --alertas
+"""
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from config import RESILIENCE_CONFIG
+import dedup
+import modelo_riesgo
+import models
+import predictor
+import reglas
+import rollup
+import shards
+
+_lock = threading.Lock()
+_archivo = None
+_sin_fsync = 0
+_ultimo_fsync = 0.0
+_hilo_pid = None
+
+
+def _ruta_spool(pid):
+    return os.path.join(RESILIENCE_CONFIG['spool_dir'], f'lecturas.{pid}.jsonl')
+
+
+def _sincronizar():
+    """fsync de lo escrito (llamar con _lock tomado)"""
+    global _sin_fsync, _ultimo_fsync
+    if _archivo is not None and _sin_fsync:
+        _archivo.flush()
+        os.fsync(_archivo.fileno())
+    _sin_fsync = 0
+    _ultimo_fsync = time.monotonic()
+
+
+def guardar(equipo_id, temperature, humidity, current, timestamp=None, seq=None):
+    """Agrega una lectura al spool del proceso"""
+    global _archivo, _sin_fsync
+    timestamp = timestamp or datetime.now()
+    linea = json.dumps([equipo_id, temperature, humidity, current, timestamp.timestamp(), seq])
+
+    with _lock:
+        if _archivo is None:
+            os.makedirs(RESILIENCE_CONFIG['spool_dir'], exist_ok=True)
+            _archivo = open(_ruta_spool(os.getpid()), 'a', encoding='utf-8')
+        _archivo.write(linea + '\n')
+        _sin_fsync += 1
+        if (_sin_fsync >= RESILIENCE_CONFIG['fsync_every'] or
+                time.monotonic() - _ultimo_fsync >= RESILIENCE_CONFIG['fsync_interval']):
+            _sincronizar()
+
+    _asegurar_hilo()
+    print(f"[Spool] Lectura de {equipo_id} guardada localmente (shard no disponible)")
+
+
+def _proceso_vivo(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+def _reclamar():
+    """
+    Renombra a reenvio.<pid>.*.jsonl el spool del proceso y los de procesos
+    que ya no existen; retorna los archivos a reenviar en orden
+    """
+    global _archivo
+    directorio = RESILIENCE_CONFIG['spool_dir']
+    pid = os.getpid()
+
+    def destino():
+        return os.path.join(directorio, f'reenvio.{pid}.{time.time_ns()}.jsonl')
+
+    with _lock:
+        # Dentro del lock: ninguna lectura nueva se escribe en el archivo renombrado
+        if _archivo is not None:
+            _sincronizar()
+            _archivo.close()
+            _archivo = None
+        if os.path.exists(_ruta_spool(pid)):
+            os.rename(_ruta_spool(pid), destino())
+
+    for ruta in glob.glob(os.path.join(directorio, 'lecturas.*.jsonl')) + \
+            glob.glob(os.path.join(directorio, 'reenvio.*.jsonl')):
+        duenio = int(os.path.basename(ruta).split('.')[1])
+        if duenio == pid or _proceso_vivo(duenio):
+            continue
+        try:
+            os.rename(ruta, destino())
+        except FileNotFoundError:
+            pass   # otro proceso lo reclamo primero
+
+    return sorted(glob.glob(os.path.join(directorio, f'reenvio.{pid}.*.jsonl')))
+
+
+def _reenviar_bloque(filas):
+    """Guarda un bloque de lecturas del spool con sus predicciones"""
+    lecturas = [(e, t, h, c, datetime.fromtimestamp(ts), seq) for e, t, h, c, ts, seq in filas]
+    resultado = models.insert_sensor_readings_bulk(lecturas)
+    if resultado is None:
+        return False
+    ids, previas = resultado
+    # Las de un shard caido vuelven al spool; el resto del bloque sigue
+    for l, reading_id in zip(lecturas, ids):
+        if reading_id is False:
+            guardar(*l)
+
+    # Las que ya estaban guardadas ya tienen su prediccion
+    guardadas = [(l, reading_id) for i, (l, reading_id) in enumerate(zip(lecturas, ids))
+                 if reading_id and i not in previas]
+    if not guardadas:
+        return True
+    ids = [reading_id for _, reading_id in guardadas]
+    guardadas = [l for l, _ in guardadas]
+
+    t = np.array([l[1] for l in guardadas], dtype=np.float64)
+    h = np.array([l[2] for l in guardadas], dtype=np.float64)
+    c = np.array([l[3] for l in guardadas], dtype=np.float64)
+    perfiles = [reglas.perfil_para(l[0]) for l in guardadas]
+
+    scores, niveles = predictor.calculate_risk_scores(t, h, c, perfiles)
+    probabilidades = modelo_riesgo.predecir_lote(np.column_stack([t, h, np.abs(c)]))
+    if probabilidades is not None:
+        scores = probabilidades
+        niveles = predictor.determine_risk_levels(scores, perfiles)
+    factores = predictor.calculate_influential_factors_batch(t, h, c, perfiles)
+
+    predicciones = []
+    for i, (equipo_id, _, _, _, timestamp, seq) in enumerate(guardadas):
+        reading_id = ids[i]
+        if seq is not None:
+            dedup.registrar(equipo_id, seq, reading_id)
+        predicciones.append((
+            reading_id, equipo_id, str(niveles[i]), round(float(scores[i]), 3),
+            float(factores[i, 0]), float(factores[i, 1]), float(factores[i, 2]),
+            timestamp
+        ))
+    if len(models.insert_predictions_bulk(predicciones)) < len(predicciones):
+        # Reintentar el bloque duplicaria las lecturas sin seq: quedan sin prediccion
+        print(f"[Spool] Lecturas guardadas sin prediccion; "
+              f"para calcularlas: python recalcular.py --desde-id {min(ids)}")
+        return True
+
+    for _, equipo_id, _, riesgo, ft, fh, fc, timestamp in predicciones:
+        rollup.registrar(equipo_id, timestamp, {'Temperatura': ft, 'Humedad': fh, 'Corriente': fc}, riesgo)
+    return True
+
+
+def _conservar_desde(ruta, offset):
+    """Deja en el archivo solo lo que sigue a offset (lo anterior ya se guardo)"""
+    temporal = ruta + '.tmp'
+    with open(ruta, 'rb') as origen, open(temporal, 'wb') as destino:
+        origen.seek(offset)
+        while True:
+            datos = origen.read(1024 * 1024)
+            if not datos:
+                break
+            destino.write(datos)
+        destino.flush()
+        os.fsync(destino.fileno())
+    os.replace(temporal, ruta)
+
+
+def _reenviar_archivo(ruta):
+    """
+    Reenvia un archivo completo; si la BD falla a mitad, el archivo se
+    recorta a los bloques no enviados y queda para el siguiente intento
+    (reenviar de nuevo los ya guardados duplicaria las lecturas sin seq)
+    """
+    tamano = RESILIENCE_CONFIG['replay_batch']
+    total = 0
+    bloque = []
+    inicio_bloque = 0
+    offset = 0
+    with open(ruta, 'rb') as f:
+        for linea in f:
+            offset += len(linea)
+            try:
+                bloque.append(json.loads(linea))
+            except ValueError:
+                continue   # linea truncada por un corte durante la escritura
+            if len(bloque) >= tamano:
+                if not _reenviar_bloque(bloque):
+                    break
+                total += len(bloque)
+                bloque = []
+                inicio_bloque = offset
+        else:
+            if not bloque or _reenviar_bloque(bloque):
+                total += len(bloque)
+                inicio_bloque = offset
+
+    if inicio_bloque < offset:
+        if inicio_bloque:
+            _conservar_desde(ruta, inicio_bloque)
+            print(f"[Spool] {total} lecturas reenviadas desde {os.path.basename(ruta)}, el resto queda pendiente")
+        return False
+
+    os.remove(ruta)
+    print(f"[Spool] {total} lecturas reenviadas desde {os.path.basename(ruta)}")
+    return True
+
+
+def reenviar():
+    """Vuelca a la BD las lecturas pendientes; retorna True si no quedo nada"""
+    # Alguno tiene que responder; los que siguen caidos devuelven sus lecturas al spool
+    for shard in range(shards.TOTAL):
+        connection = models.get_db_connection(shard=shard)
+        if connection:
+            connection.close()
+            break
+    else:
+        return False
+
+    for ruta in _reclamar():
+        if not _reenviar_archivo(ruta):
+            return False
+    return True
+
+
+def _pendientes():
+    return bool(glob.glob(os.path.join(RESILIENCE_CONFIG['spool_dir'], '*.jsonl')))
+
+
+def _reenviador():
+    """Hilo que hace fsync periodico del spool y lo reenvia cuando vuelve la BD"""
+    ultimo_intento = 0.0
+    while True:
+        time.sleep(RESILIENCE_CONFIG['fsync_interval'])
+        with _lock:
+            _sincronizar()
+
+        if time.monotonic() - ultimo_intento < RESILIENCE_CONFIG['replay_interval']:
+            continue
+        ultimo_intento = time.monotonic()
+        try:
+            if _pendientes():
+                reenviar()
+        except Exception as e:
+            print(f"[Spool] Error reenviando lecturas: {e}")
+
+
+def _asegurar_hilo():
+    """Arranca el hilo de reenvio en este proceso (los hilos no sobreviven a un fork)"""
+    global _hilo_pid
+    if _hilo_pid == os.getpid():
+        return
+    with _lock:
+        if _hilo_pid != os.getpid():
+            threading.Thread(target=_reenviador, name='spool-reenvio', daemon=True).start()
+            _hilo_pid = os.getpid()
+
+
+def cerrar():
+    """fsync y cierre del spool al terminar el proceso"""
+    global _archivo
+    with _lock:
+        if _archivo is not None:
+            _sincronizar()
+            _archivo.close()
+            _archivo = None
+
+
+def reanudar():
+    """Al arrancar: si quedaron lecturas en el spool, arranca el reenvio"""
+    if os.path.isdir(RESILIENCE_CONFIG['spool_dir']) and _pendientes():
+        _asegurar_hilo()
+
+
+def estado():
+    """Resumen del spool para el endpoint de salud"""
+    archivos = glob.glob(os.path.join(RESILIENCE_CONFIG['spool_dir'], '*.jsonl'))
+    total = 0
+    for ruta in archivos:
+        try:
+            total += os.path.getsize(ruta)
+        except OSError:
+            pass   # reenviado mientras se listaba
+    return {'archivos': len(archivos), 'bytes': total}
+
+
+atexit.register(cerrar)
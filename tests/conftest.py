@@ -0,0 +1,29 @@
+import os
+import sys
+import time
+
+import pytest
+
+# Los modulos del proyecto estan en la raiz del repositorio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Baldes de limites.py del proceso y sin ETag: las pruebas no crean
+# limites_ingesta.bin ni versiones_etag.bin
+os.environ.setdefault('INGEST_LIMITS_FILE', '')
+os.environ.setdefault('ETAG_FILE', '')
+
+
+class Reloj:
+    """time.monotonic falso: avanza solo al sumarle a ahora"""
+    def __init__(self):
+        self.ahora = 1000.0
+
+    def __call__(self):
+        return self.ahora
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    reloj = Reloj()
+    monkeypatch.setattr(time, 'monotonic', reloj)
+    return reloj
@@ -0,0 +1,131 @@
+import pytest
+
+import app as aplicacion
+import protocolo_binario
+
+
+@pytest.fixture
+def cliente():
+    aplicacion.app.config['TESTING'] = True
+    with aplicacion.app.test_client() as cliente:
+        yield cliente
+
+
+def test_metricas(cliente):
+    respuesta = cliente.get('/api/metricas')
+    assert respuesta.status_code == 200
+    datos = respuesta.get_json()
+    assert {'ingesta', 'bd', 'shards', 'spool', 'replicas', 'notificaciones', 'perfilador'} <= set(datos)
+    assert [e['nombre'] for e in datos['ingesta']['etapas']][:3] == ['parsear', 'validar', 'deduplicar']
+    respuesta.close()
+
+
+def test_ingesta_binaria_rechaza_el_lote_con_una_trama_invalida(cliente, monkeypatch):
+    guardadas = []
+    monkeypatch.setattr(aplicacion.ingesta, 'procesar_lectura', lambda *a: guardadas.append(a))
+    cuerpo = (
+        protocolo_binario.empaquetar_trama('EQ_1', 1, 1700000000, 25.0, 50.0, 1.0)
+        + protocolo_binario.empaquetar_trama('', 2, 1700000000, 25.0, 50.0, 1.0)
+        + protocolo_binario.empaquetar_trama('\0\0\0', 3, 1700000000, 25.0, 50.0, 1.0)
+    )
+    respuesta = cliente.post('/api/ingest/bin', data=cuerpo,
+                             content_type='application/octet-stream')
+    assert respuesta.status_code == 400
+    assert respuesta.get_json()['error'].startswith('Trama 1:')
+    assert guardadas == []
+    respuesta.close()
+
+
+def test_dashboard_responde_304_sin_consultar_la_bd(cliente, monkeypatch, tmp_path):
+    versiones = aplicacion.versiones
+    compartidas = versiones._Compartidas(str(tmp_path / 'versiones.bin'), 4)
+    monkeypatch.setattr(versiones, '_compartidas', compartidas)
+    monkeypatch.setitem(aplicacion.SESSION_CONFIG, 'requerida', False)
+    consultas = []
+    monkeypatch.setattr(aplicacion.models, 'consultar_shards', lambda *a, **k: consultas.append(a))
+    try:
+        etag = versiones.etag('dashboard', versiones.token_lecturas('EQ_1'), versiones.token_alertas('EQ_1'))
+        cabeceras = {'If-None-Match': f'"{etag}"'}
+
+        respuesta = cliente.get('/api/dashboard?equipo_id=EQ_1', headers=cabeceras)
+        assert respuesta.status_code == 304
+        assert respuesta.headers['ETag'] == f'"{etag}"'
+        assert consultas == []
+        respuesta.close()
+
+        versiones.registrar_lectura('EQ_1')
+        respuesta = cliente.get('/api/dashboard?equipo_id=EQ_1', headers=cabeceras)
+        assert respuesta.status_code != 304
+        assert consultas
+        respuesta.close()
+    finally:
+        compartidas.cerrar()
+
+
+@pytest.fixture
+def sesion(monkeypatch):
+    """Tokens con el rol y el equipo del token (sin BD)"""
+    monkeypatch.setattr(aplicacion.sesiones.models, 'get_usuario_sesion', lambda usuario_id: None)
+    monkeypatch.setitem(aplicacion.SESSION_CONFIG, 'requerida', True)
+    aplicacion.sesiones.invalidar()
+    yield lambda rol, equipo_id=None: {
+        'Authorization': f'Bearer {aplicacion.sesiones.crear_token(1, rol, equipo_id)}'
+    }
+    aplicacion.sesiones.invalidar()
+
+
+@pytest.fixture
+def alertas(monkeypatch):
+    pedidas = []
+
+    def get_recent_alerts(limit=10, equipo_id=None):
+        pedidas.append(equipo_id)
+        return []
+
+    monkeypatch.setattr(aplicacion.models, 'get_recent_alerts', get_recent_alerts)
+    return pedidas
+
+
+def _estado(cliente, ruta, cabeceras=None):
+    respuesta = cliente.get(ruta, headers=cabeceras or {})
+    respuesta.close()
+    return respuesta.status_code
+
+
+def test_token_alterado_o_vencido_da_401(cliente, sesion, alertas, monkeypatch):
+    cabeceras = sesion('admin')
+    assert _estado(cliente, '/api/alertas', {'Authorization': cabeceras['Authorization'] + 'x'}) == 401
+
+    ahora = aplicacion.sesiones.time.time()
+    monkeypatch.setattr(aplicacion.sesiones.time, 'time',
+                        lambda: ahora + aplicacion.SESSION_CONFIG['ttl'] + 1)
+    assert _estado(cliente, '/api/alertas', cabeceras) == 401
+    assert alertas == []
+
+
+def test_rutas_de_gestion_segun_rol(cliente, sesion, monkeypatch):
+    monkeypatch.setattr(aplicacion.models, 'get_all_equipos', lambda: [])
+    monkeypatch.setattr(aplicacion.models, 'get_ultimas_lecturas', lambda: {})
+    assert _estado(cliente, '/api/equipos/todos') == 401
+    assert _estado(cliente, '/api/equipos/todos', sesion('operador', 'EQ_1')) == 403
+    assert _estado(cliente, '/api/equipos/todos', sesion('admin')) == 200
+
+
+def test_sin_rol_de_gestion_solo_ve_su_equipo(cliente, sesion, alertas):
+    operador = sesion('operador', 'EQ_1')
+    assert _estado(cliente, '/api/alertas?equipo_id=EQ_2', operador) == 403
+    assert _estado(cliente, '/api/alertas', operador) == 200
+    assert _estado(cliente, '/api/alertas?equipo_id=EQ_1', operador) == 200
+    assert _estado(cliente, '/api/alertas', sesion('operador')) == 403
+    assert _estado(cliente, '/api/alertas?equipo_id=EQ_2', sesion('ti')) == 200
+    # Sin equipo en la consulta, el operador recibe el suyo
+    assert alertas == ['EQ_1', 'EQ_1', 'EQ_2']
+
+
+def test_sesion_requerida(cliente, sesion, alertas, monkeypatch):
+    assert _estado(cliente, '/api/alertas?equipo_id=EQ_2') == 401
+    monkeypatch.setitem(aplicacion.SESSION_CONFIG, 'requerida', False)
+    assert _estado(cliente, '/api/alertas?equipo_id=EQ_2') == 200
+    # Un token invalido se rechaza aunque la sesion no sea obligatoria
+    assert _estado(cliente, '/api/alertas', {'Authorization': 'Bearer x.y'}) == 401
+    assert alertas == ['EQ_2']
@@ -0,0 +1,71 @@
+from datetime import datetime
+
+import pytest
+
+import dedup
+
+
+@pytest.fixture(autouse=True)
+def ventanas(monkeypatch):
+    monkeypatch.setattr(dedup, '_ventanas', dedup.OrderedDict())
+    monkeypatch.setitem(dedup.DEDUP_CONFIG, 'ventana_segundos', 60)
+    monkeypatch.setitem(dedup.DEDUP_CONFIG, 'window', 3)
+    monkeypatch.setitem(dedup.DEDUP_CONFIG, 'max_equipos', 2)
+
+
+def test_encuentra_lo_registrado(reloj):
+    dedup.registrar('E1', 5, 100)
+    assert dedup.buscar('E1', 5) == 100
+    assert dedup.buscar('E1', 6) is None
+    assert dedup.buscar('E2', 5) is None
+
+
+def test_vence_con_el_tiempo(reloj):
+    dedup.registrar('E1', 5, 100)
+    reloj.ahora += 60
+    assert dedup.buscar('E1', 5) == 100
+    reloj.ahora += 1
+    # Pasada la ventana la misma seq es otra lectura (el ESP32 se reinicio)
+    assert dedup.buscar('E1', 5) is None
+
+
+def test_registrar_descarta_lo_vencido(reloj):
+    dedup.registrar('E1', 1, 100)
+    reloj.ahora += 30
+    dedup.registrar('E1', 2, 101)
+    reloj.ahora += 31
+    dedup.registrar('E1', 3, 102)
+    assert list(dedup._ventanas['E1']) == [2, 3]
+
+
+def test_tamano_maximo_por_equipo(reloj):
+    for seq in range(5):
+        dedup.registrar('E1', seq, 100 + seq)
+    assert list(dedup._ventanas['E1']) == [2, 3, 4]
+    assert dedup.buscar('E1', 1) is None
+    assert dedup.buscar('E1', 4) == 104
+
+
+def test_reregistrar_mueve_al_final(reloj):
+    for seq in range(3):
+        dedup.registrar('E1', seq, 100 + seq)
+    dedup.registrar('E1', 0, 200)
+    dedup.registrar('E1', 3, 103)
+    assert list(dedup._ventanas['E1']) == [2, 0, 3]
+    assert dedup.buscar('E1', 0) == 200
+
+
+def test_descarta_el_equipo_menos_reciente(reloj):
+    dedup.registrar('E1', 1, 100)
+    dedup.registrar('E2', 1, 200)
+    dedup.registrar('E1', 2, 101)
+    dedup.registrar('E3', 1, 300)
+    assert list(dedup._ventanas) == ['E1', 'E3']
+    assert dedup.buscar('E2', 1) is None
+
+
+def test_ventana_de_la_clave_unica(reloj):
+    base = datetime.fromtimestamp(60 * 1000)
+    assert dedup.ventana(base) == 1000
+    assert dedup.ventana(datetime.fromtimestamp(60 * 1000 + 59.9)) == 1000
+    assert dedup.ventana(datetime.fromtimestamp(60 * 1001)) == 1001
@@ -0,0 +1,94 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+import flota
+
+
+@pytest.fixture
+def bd(monkeypatch):
+    """Estado vacio del modulo y una BD falsa que arma cada recarga"""
+    monkeypatch.setattr(flota, '_estado', flota._Estado())
+    monkeypatch.setattr(flota, '_cargado_en', None)
+    monkeypatch.setattr(flota, '_diario', None)
+    datos = SimpleNamespace(
+        areas={'EQ_1': 'norte', 'EQ_2': 'sur'},
+        ultimas={'EQ_1': SimpleNamespace(equipo_id='EQ_1', nivel_riesgo='high',
+                                         riesgo_predicho=0.7, timestamp=datetime.now())},
+        alertas=[{'id': 1, 'equipo_id': 'EQ_1', 'tipo': 'high_temperature', 'severidad': 'critical'}],
+        durante=None
+    )
+
+    def get_areas_equipos():
+        if datos.durante:
+            datos.durante()
+        return datos.areas
+
+    monkeypatch.setattr(flota.models, 'get_areas_equipos', get_areas_equipos)
+    monkeypatch.setattr(flota.models, 'get_ultimas_lecturas', lambda: datos.ultimas)
+    monkeypatch.setattr(flota.models, 'get_alertas_abiertas', lambda: datos.alertas)
+    return datos
+
+
+def _recargar():
+    """Recarga como _asegurar_cargado, pero en linea"""
+    with flota._lock:
+        flota._diario = []
+    flota._cargar()
+
+
+def test_resumen_desde_la_bd(bd):
+    datos = flota.resumen()
+    assert datos['equipos'] == 2
+    assert datos['online'] == 1
+    assert datos['por_nivel'] == {'high': 1, flota.SIN_NIVEL: 1}
+    assert datos['alertas_por_area'] == {'norte': 1}
+    assert [e['equipo_id'] for e in datos['top_riesgo']] == ['EQ_1']
+
+
+def test_contadores_en_memoria(bd):
+    flota.resumen()
+    flota.registrar_lectura('EQ_2', 'critical', 0.9)
+    flota.abrir_alerta(2, 'EQ_2', 'high_current', 'critical')
+    flota.cerrar_tipos('EQ_1', ['high_temperature'])
+    datos = flota.resumen()
+    assert datos['online'] == 2
+    assert datos['alertas_por_area'] == {'sur': 1}
+    assert [e['equipo_id'] for e in datos['top_riesgo']] == ['EQ_2', 'EQ_1']
+
+
+def test_equipos_sin_lecturas_recientes_quedan_offline(bd, monkeypatch):
+    flota.resumen()
+    ahora = flota.time.time()
+    monkeypatch.setattr(flota.time, 'time', lambda: ahora + flota.FLEET_CONFIG['online_segundos'] + 1)
+    assert flota.resumen()['online'] == 0
+
+
+def test_cambios_durante_la_recarga_se_reaplican(bd):
+    flota.resumen()
+    bd.durante = lambda: flota.abrir_alerta(2, 'EQ_2', 'high_current', 'critical')
+    _recargar()
+    assert flota.resumen()['alertas_abiertas'] == 2
+    assert flota._diario is None
+
+
+def test_error_en_la_recarga_cierra_el_diario(bd):
+    flota.resumen()
+    bd.alertas = [{'id': 3}]    # fila incompleta: falla al armar el estado
+    _recargar()
+    assert flota._diario is None
+    assert flota.resumen()['alertas_abiertas'] == 1   # sigue el estado anterior
+
+    # La siguiente recarga vuelve a funcionar
+    bd.alertas = []
+    _recargar()
+    assert flota.resumen()['alertas_abiertas'] == 0
+
+
+def test_sin_bd_sigue_el_estado_actual(bd):
+    flota.resumen()
+    bd.areas = None
+    _recargar()
+    assert flota._diario is None
+    assert flota.resumen()['equipos'] == 2
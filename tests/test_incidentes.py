@@ -0,0 +1,110 @@
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+import incidentes
+
+T0 = datetime(2024, 1, 1, 12, 0)
+
+# El fixture lo reemplaza para que las pruebas no arranquen el hilo
+_asegurar_hilo = incidentes._asegurar_hilo
+
+
+def _alerta(tipo, valor=None):
+    return {'type': tipo, 'message': tipo, 'severity': 'critical', 'value': valor}
+
+
+@pytest.fixture
+def bd(monkeypatch):
+    """BD y flota falsas; los incidentes se guardan en bd.abiertas"""
+    bd = SimpleNamespace(abiertas={}, ocurrencias=[], resueltos=[], siguiente=1)
+
+    def abrir_incidente(prediction_id, equipo_id, tipo, mensaje, severidad, valor, ahora):
+        clave = (equipo_id, tipo)
+        if clave in bd.abiertas:
+            return bd.abiertas[clave], False
+        bd.abiertas[clave] = bd.siguiente
+        bd.siguiente += 1
+        return bd.abiertas[clave], True
+
+    def resolve_incidentes(equipo_id, tipos):
+        bd.resueltos.append((equipo_id, sorted(tipos)))
+        for tipo in tipos:
+            bd.abiertas.pop((equipo_id, tipo), None)
+
+    monkeypatch.setattr(incidentes.models, 'abrir_incidente', abrir_incidente)
+    monkeypatch.setattr(incidentes.models, 'update_incidentes', bd.ocurrencias.extend)
+    monkeypatch.setattr(incidentes.models, 'resolve_incidentes', resolve_incidentes)
+    monkeypatch.setattr(incidentes.models, 'get_incidentes_abiertos',
+                        lambda cargados: set(bd.abiertas.values()))
+    for funcion in ('abrir_alerta', 'cerrar_tipos'):
+        monkeypatch.setattr(incidentes.flota, funcion, lambda *a: None)
+    monkeypatch.setattr(incidentes, '_asegurar_hilo', lambda: None)
+    monkeypatch.setattr(incidentes, '_abiertos', {})
+    monkeypatch.setattr(incidentes, '_ultimo_flush', time.monotonic())
+    return bd
+
+
+def test_alertas_repetidas_se_agrupan(bd):
+    assert [a['type'] for a in incidentes.procesar('EQ_1', 1, [_alerta('high_temperature', 80)], T0)] == \
+        ['high_temperature']
+    for i, valor in enumerate((85, 82), start=1):
+        assert incidentes.procesar('EQ_1', 1 + i, [_alerta('high_temperature', valor)],
+                                   T0 + timedelta(seconds=i)) == []
+    assert bd.abiertas == {('EQ_1', 'high_temperature'): 1}
+    assert bd.ocurrencias == []   # pendientes en memoria hasta el flush
+
+    incidentes.flush()
+    assert bd.ocurrencias == [(1, 'EQ_1', 2, T0 + timedelta(seconds=2), 85)]
+
+
+def test_incidente_se_resuelve_al_normalizarse(bd):
+    incidentes.procesar('EQ_1', 1, [_alerta('high_temperature', 80), _alerta('high_current', 12)], T0)
+    incidentes.procesar('EQ_1', 2, [_alerta('high_current', 15)], T0 + timedelta(seconds=1))
+    incidentes.procesar('EQ_1', 3, [_alerta('high_current', 13)], T0 + timedelta(seconds=2))
+    assert bd.resueltos == [('EQ_1', ['high_temperature'])]
+
+    incidentes.procesar('EQ_1', 4, [], T0 + timedelta(seconds=3))
+    # Las ocurrencias pendientes se escriben antes de resolver
+    assert bd.ocurrencias == [(2, 'EQ_1', 2, T0 + timedelta(seconds=2), 15)]
+    assert bd.resueltos[-1] == ('EQ_1', ['high_current'])
+    assert bd.abiertas == {}
+
+
+def test_flush_olvida_lo_que_resolvio_otro_proceso(bd):
+    incidentes.procesar('EQ_1', 1, [_alerta('high_temperature', 80)], T0)
+    bd.abiertas.clear()   # otro proceso lo resolvio
+    incidentes.flush()
+    nuevas = incidentes.procesar('EQ_1', 2, [_alerta('high_temperature', 81)], T0 + timedelta(seconds=1))
+    assert [a['type'] for a in nuevas] == ['high_temperature']
+    assert bd.abiertas == {('EQ_1', 'high_temperature'): 2}
+
+
+def test_olvidar_alerta_escribe_lo_pendiente(bd):
+    incidentes.procesar('EQ_1', 1, [_alerta('high_temperature', 80)], T0)
+    incidentes.procesar('EQ_1', 2, [_alerta('high_temperature', 90)], T0 + timedelta(seconds=1))
+    assert incidentes.olvidar_alerta(1)
+    assert bd.ocurrencias == [(1, 'EQ_1', 1, T0 + timedelta(seconds=1), 90)]
+    assert not incidentes.olvidar_alerta(1)
+
+
+def test_la_ingesta_dispara_el_flush_por_intervalo(bd, monkeypatch):
+    monkeypatch.setitem(incidentes.INCIDENT_CONFIG, 'flush_interval', 0)
+    incidentes.procesar('EQ_1', 1, [_alerta('high_temperature', 80)], T0)
+    incidentes.procesar('EQ_1', 2, [_alerta('high_temperature', 85)], T0 + timedelta(seconds=1))
+    assert bd.ocurrencias == [(1, 'EQ_1', 1, T0 + timedelta(seconds=1), 85)]
+
+
+def test_hilo_escribe_sin_nuevas_lecturas(bd, monkeypatch):
+    incidentes.procesar('EQ_1', 1, [_alerta('high_temperature', 80)], T0)
+    incidentes.procesar('EQ_1', 2, [_alerta('high_temperature', 85)], T0 + timedelta(seconds=1))
+    monkeypatch.setitem(incidentes.INCIDENT_CONFIG, 'flush_interval', 0.01)
+    monkeypatch.setattr(incidentes, '_hilo_pid', None)
+    _asegurar_hilo()
+
+    limite = time.monotonic() + 5
+    while not bd.ocurrencias and time.monotonic() < limite:
+        time.sleep(0.01)
+    assert bd.ocurrencias == [(1, 'EQ_1', 1, T0 + timedelta(seconds=1), 85)]
@@ -0,0 +1,101 @@
+import multiprocessing
+
+import pytest
+
+import limites
+
+pytestmark = pytest.mark.skipif(limites.fcntl is None, reason='baldes compartidos requieren fcntl')
+
+# Conjunto 0: balde global; las claves pares van al conjunto 1 y las impares al 2
+CONJUNTOS = 3
+
+
+@pytest.fixture
+def abrir(tmp_path):
+    ruta = str(tmp_path / 'limites.bin')
+    abiertos = []
+
+    def abrir():
+        compartidos = limites._Compartidos(ruta, CONJUNTOS)
+        abiertos.append(compartidos)
+        return compartidos
+
+    yield abrir
+    for compartidos in abiertos:
+        compartidos.cerrar()
+
+
+def test_limite_compartido_entre_handles(abrir, reloj):
+    a, b = abrir(), abrir()
+    for _ in range(3):
+        assert a.tomar(2, 1, tasa=1.0, capacidad=3) == 0
+    assert b.tomar(2, 1, tasa=1.0, capacidad=3) == pytest.approx(1.0)
+    reloj.ahora += 1
+    assert b.tomar(2, 1, tasa=1.0, capacidad=3) == 0
+    assert a.tomar(2, 1, tasa=1.0, capacidad=3) > 0
+
+
+def test_clave_nueva_reemplaza_a_la_menos_reciente(abrir, reloj):
+    a = abrir()
+    claves = [2, 4, 6, 8]   # llenan el conjunto 1
+    for clave in claves:
+        assert a.tomar(clave, 3, tasa=0.001, capacidad=3) == 0
+        reloj.ahora += 1
+    assert a.tomar(4, 1, tasa=0.001, capacidad=3) > 0   # el 4 pasa a ser reciente
+
+    assert a.tomar(10, 3, tasa=0.001, capacidad=3) == 0   # reemplaza al 2
+    assert a.tomar(2, 3, tasa=0.001, capacidad=3) == 0    # vuelve lleno, reemplaza al 6
+    for clave in (4, 8, 10):
+        assert a.tomar(clave, 1, tasa=0.001, capacidad=3) > 0
+    assert a.tomar(6, 3, tasa=0.001, capacidad=3) == 0
+
+
+def test_conjuntos_independientes(abrir, reloj):
+    a = abrir()
+    for clave in (2, 4, 6, 8, 10):
+        a.tomar(clave, 3, tasa=0.001, capacidad=3)
+    # El conjunto 2 no se ve afectado por los reemplazos del 1
+    assert a.tomar(3, 3, tasa=0.001, capacidad=3) == 0
+    assert a.tomar(3, 1, tasa=0.001, capacidad=3) > 0
+
+
+def test_denegado_por_el_global_devuelve_las_fichas_del_equipo(abrir, reloj, monkeypatch):
+    compartidos = abrir()
+    monkeypatch.setattr(limites, '_compartidos', compartidos)
+    monkeypatch.setitem(limites.RATE_LIMIT_CONFIG, 'rate', 0.001)
+    monkeypatch.setitem(limites.RATE_LIMIT_CONFIG, 'burst', 2)
+    monkeypatch.setitem(limites.RATE_LIMIT_CONFIG, 'global_rate', 0.001)
+    monkeypatch.setitem(limites.RATE_LIMIT_CONFIG, 'global_burst', 1)
+
+    assert limites.permitir('EQ_1')[0]
+    # La flota se quedo sin fichas: EQ_2 se rechaza sin gastar las suyas
+    assert not limites.permitir('EQ_2')[0]
+    assert not limites.permitir('EQ_2')[0]
+    assert compartidos.tomar(limites._clave('EQ_2'), 2, tasa=0.001, capacidad=2) == 0
+    assert compartidos.tomar(limites._clave('EQ_1'), 2, tasa=0.001, capacidad=2) > 0
+
+
+def _consumir(ruta, veces, resultados):
+    compartidos = limites._Compartidos(ruta, CONJUNTOS)
+    permitidas = sum(
+        compartidos.tomar(2, 1, tasa=1e-9, capacidad=veces) == 0 for _ in range(veces)
+    )
+    compartidos.cerrar()
+    resultados.put(permitidas)
+
+
+def test_procesos_no_pierden_actualizaciones(tmp_path):
+    # fcntl.lockf es por proceso: solo dos procesos prueban el bloqueo
+    ruta = str(tmp_path / 'limites.bin')
+    limites._Compartidos(ruta, CONJUNTOS).cerrar()
+    contexto = multiprocessing.get_context('fork')
+    resultados = contexto.Queue()
+    veces = 2000
+    procesos = [contexto.Process(target=_consumir, args=(ruta, veces, resultados)) for _ in range(2)]
+    for proceso in procesos:
+        proceso.start()
+    permitidas = [resultados.get(timeout=60) for _ in procesos]
+    for proceso in procesos:
+        proceso.join()
+    # Entre los dos gastan exactamente la capacidad del balde
+    assert sum(permitidas) == veces
@@ -0,0 +1,143 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import notificaciones
+
+
+class Servidor:
+    """Webhook local: responde con los codigos de 'respuestas' (200 cuando se acaban)"""
+
+    def __init__(self, respuestas=()):
+        self.respuestas = list(respuestas)
+        self.recibidos = []
+        self.intentos = 0
+        servidor = self
+
+        class Manejador(BaseHTTPRequestHandler):
+            def do_POST(self):
+                cuerpo = self.rfile.read(int(self.headers['Content-Length']))
+                servidor.intentos += 1
+                codigo = servidor.respuestas.pop(0) if servidor.respuestas else 200
+                if codigo == 200:
+                    servidor.recibidos.append(json.loads(cuerpo))
+                self.send_response(codigo)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.http = ThreadingHTTPServer(('127.0.0.1', 0), Manejador)
+        self.url = f'http://127.0.0.1:{self.http.server_address[1]}/alertas'
+        threading.Thread(target=self.http.serve_forever, daemon=True).start()
+
+    def cerrar(self):
+        self.http.shutdown()
+        self.http.server_close()
+
+
+@pytest.fixture
+def config(monkeypatch, tmp_path):
+    for clave, valor in {
+        'lote': 3,
+        'intervalo': 0.2,
+        'reintentos': 2,
+        'backoff': 0.01,
+        'backoff_max': 0.02,
+        'timeout': 2.0,
+        'max_cola': 100,
+        'dead_letter': str(tmp_path / 'fallidas.jsonl'),
+    }.items():
+        monkeypatch.setitem(notificaciones.NOTIFY_CONFIG, clave, valor)
+    return notificaciones.NOTIFY_CONFIG
+
+
+@pytest.fixture
+def servidor():
+    servidores = []
+
+    def crear(respuestas=()):
+        servidores.append(Servidor(respuestas))
+        return servidores[-1]
+
+    yield crear
+    for s in servidores:
+        s.cerrar()
+
+
+def _alerta(i):
+    return {'equipo_id': f'E{i}', 'tipo': 'temperatura', 'severidad': 'critical',
+            'mensaje': f'alerta {i}', 'valor': i, 'fecha': '2024-01-01T00:00:00'}
+
+
+def _terminar(destino):
+    """Envia lo pendiente y espera al hilo del destino"""
+    destino.cola.put(notificaciones._FIN)
+    destino._hilo.join(10)
+    assert not destino._hilo.is_alive()
+
+
+def test_agrupa_por_lote(config, servidor):
+    webhook = servidor()
+    destino = notificaciones.Webhook(webhook.url)
+    for i in range(7):
+        destino.encolar(_alerta(i))
+    _terminar(destino)
+
+    # Dos resumenes llenos y el resto al cerrar
+    assert [r['total'] for r in webhook.recibidos] == [3, 3, 1]
+    assert [a['equipo_id'] for r in webhook.recibidos for a in r['alertas']] == [f'E{i}' for i in range(7)]
+    assert (destino.enviados, destino.alertas, destino.fallidos) == (3, 7, 0)
+
+
+def test_envia_por_intervalo(config, servidor):
+    webhook = servidor()
+    destino = notificaciones.Webhook(webhook.url)
+    destino.encolar(_alerta(1))
+    destino._hilo.join(1.0)   # el hilo sigue vivo; se espera mas que 'intervalo'
+    assert [r['total'] for r in webhook.recibidos] == [1]
+    _terminar(destino)
+    assert destino.enviados == 1
+
+
+def test_reintenta_hasta_que_responde(config, servidor):
+    webhook = servidor([500, 503])
+    destino = notificaciones.Webhook(webhook.url)
+    for i in range(3):
+        destino.encolar(_alerta(i))
+    _terminar(destino)
+
+    assert webhook.intentos == 3
+    assert [r['total'] for r in webhook.recibidos] == [3]
+    assert (destino.enviados, destino.reintentos, destino.fallidos) == (1, 2, 0)
+
+
+def test_dead_letter_si_sigue_fallando(config, servidor):
+    webhook = servidor([500] * 10)
+    destino = notificaciones.Webhook(webhook.url)
+    for i in range(2):
+        destino.encolar(_alerta(i))
+    _terminar(destino)
+
+    assert webhook.intentos == config['reintentos'] + 1
+    assert (destino.enviados, destino.fallidos) == (0, 1)
+    with open(config['dead_letter'], encoding='utf-8') as f:
+        lineas = [json.loads(l) for l in f]
+    assert len(lineas) == 1
+    assert lineas[0]['destino'] == webhook.url
+    assert '500' in lineas[0]['error']
+    assert lineas[0]['alertas'] == [_alerta(0), _alerta(1)]
+
+
+def test_cola_llena_descarta(config, monkeypatch):
+    monkeypatch.setitem(config, 'max_cola', 2)
+    destino = notificaciones.Webhook('http://127.0.0.1:9/sin-uso')
+    # Sin hilo de envio: la cola solo se llena
+    monkeypatch.setattr(destino, '_asegurar_hilo', lambda: None)
+    for i in range(5):
+        destino.encolar(_alerta(i))
+    assert destino.cola.qsize() == 2
+    assert destino.descartadas == 3
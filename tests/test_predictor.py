@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+import predictor
+
+
+def _recta_numpy(ts, ys):
+    pendiente, ordenada = np.polyfit(ts, ys, 1)
+    return pendiente, ordenada
+
+
+@pytest.mark.parametrize('n', [2, 7, 20, 21, 53, 200])
+def test_tendencia_lineal_contra_polyfit(n):
+    rng = np.random.default_rng(n)
+    tamano = 20
+    # Epoch real y paso irregular: la precision depende del cambio de origen
+    ts = 1.7e9 + np.cumsum(rng.uniform(1, 30, n))
+    ys = 25 + 0.01 * (ts - ts[0]) + rng.normal(0, 0.5, n)
+
+    tendencia = predictor.TendenciaLineal(tamano)
+    for t, y in zip(ts, ys):
+        tendencia.agregar(float(t), float(y))
+
+    ventana_t = ts[-tamano:]
+    ventana_y = ys[-tamano:]
+    a, b, origen = tendencia.recta()
+    pendiente, ordenada = _recta_numpy(ventana_t - origen, ventana_y)
+    assert tendencia.n == min(n, tamano)
+    assert b == pytest.approx(pendiente, rel=1e-6, abs=1e-9)
+    assert a == pytest.approx(ordenada, rel=1e-6, abs=1e-6)
+    assert a + b * (ts[-1] - origen) == pytest.approx(np.polyval((pendiente, ordenada), ts[-1] - origen))
+
+
+def test_tendencia_sin_datos_suficientes():
+    tendencia = predictor.TendenciaLineal(10)
+    assert tendencia.recta() is None
+    tendencia.agregar(1.7e9, 20.0)
+    assert tendencia.recta() is None
+    # Todos los puntos en el mismo instante: pendiente indefinida
+    tendencia.agregar(1.7e9, 21.0)
+    assert tendencia.recta() is None
+
+
+def test_pronostico_en_el_reloj_de_las_lecturas(monkeypatch):
+    monkeypatch.setattr(predictor, '_tendencias', predictor.OrderedDict())
+    monkeypatch.setitem(predictor.FORECAST_CONFIG, 'min_points', 5)
+    # La BD no tiene mas lecturas que las recibidas
+    monkeypatch.setattr(predictor.models, 'get_latest_readings', lambda limit, equipo_id=None: [])
+
+    # Reloj del dispositivo una hora atrasado; sube 1 grado por minuto
+    inicio = datetime.now() - timedelta(hours=1, seconds=10)
+    for i in range(10):
+        predictor.update_trend('E1', 20.0 + i / 60, 1.0, inicio + timedelta(seconds=i))
+
+    pronostico = predictor.forecast_time_to_threshold('E1')['temperature']
+    # Se extrapola desde la ultima lectura, no una hora de mas
+    assert pronostico['value'] == pytest.approx(20.15, abs=0.05)
+    assert pronostico['slope_per_min'] == pytest.approx(1.0, rel=1e-3)
+
+
+def test_tendencias_acotadas(monkeypatch):
+    monkeypatch.setattr(predictor, '_tendencias', predictor.OrderedDict())
+    monkeypatch.setitem(predictor.FORECAST_CONFIG, 'max_equipos', 2)
+    for equipo in ('E1', 'E2', 'E1', 'E3'):
+        predictor.update_trend(equipo, 20.0, 1.0)
+    assert list(predictor._tendencias) == ['E1', 'E3']
@@ -0,0 +1,52 @@
+import math
+import struct
+from datetime import datetime
+
+import pytest
+
+import protocolo_binario
+
+
+def test_ida_y_vuelta():
+    ts = datetime(2024, 5, 1, 12, 30, 15)
+    cuerpo = (
+        protocolo_binario.empaquetar_trama('ESP32_001', 7, ts.timestamp(), 25.5, 60.25, -3.75) +
+        protocolo_binario.empaquetar_trama('ESP32_002', 2 ** 32 - 1, 0, 30.0, 45.5, 12.0)
+    )
+    assert len(cuerpo) == 2 * protocolo_binario.TAMANO_TRAMA
+
+    assert protocolo_binario.parsear_tramas(cuerpo) == [
+        ('ESP32_001', 7, ts, 25.5, 60.25, -3.75),
+        ('ESP32_002', 2 ** 32 - 1, None, 30.0, 45.5, 12.0),
+    ]
+
+
+def test_redondea_los_float32():
+    cuerpo = protocolo_binario.empaquetar_trama('E', 1, 0, 21.1, 33.3, 0.7)
+    _, _, _, temperatura, humedad, corriente = protocolo_binario.parsear_tramas(cuerpo)[0]
+    assert (temperatura, humedad, corriente) == (21.1, 33.3, 0.7)
+
+
+def test_id_de_16_bytes_sin_relleno():
+    cuerpo = protocolo_binario.empaquetar_trama('A' * 16, 1, 0, 1.0, 2.0, 3.0)
+    assert protocolo_binario.parsear_tramas(cuerpo)[0][0] == 'A' * 16
+
+
+def test_acepta_bytearray_y_memoryview():
+    cuerpo = protocolo_binario.empaquetar_trama('E', 1, 0, 1.0, 2.0, 3.0)
+    assert protocolo_binario.parsear_tramas(bytearray(cuerpo)) == protocolo_binario.parsear_tramas(cuerpo)
+    assert protocolo_binario.parsear_tramas(memoryview(cuerpo)) == protocolo_binario.parsear_tramas(cuerpo)
+
+
+@pytest.mark.parametrize('largo', [0, 1, protocolo_binario.TAMANO_TRAMA + 1])
+def test_largo_invalido(largo):
+    with pytest.raises(ValueError):
+        protocolo_binario.parsear_tramas(b'\0' * largo)
+
+
+@pytest.mark.parametrize('valor', [math.nan, math.inf, -math.inf])
+def test_valores_no_finitos(valor):
+    buena = protocolo_binario.empaquetar_trama('E', 1, 0, 1.0, 2.0, 3.0)
+    mala = struct.pack('<16sIIfff', b'E', 2, 0, 1.0, valor, 3.0)
+    with pytest.raises(ValueError):
+        protocolo_binario.parsear_tramas(buena + mala)
@@ -0,0 +1,35 @@
+import numpy as np
+
+import reglas
+
+
+def test_alertas_lote_coincide_con_perfil_alertas():
+    estricto = reglas.Perfil('estricto', {
+        'temperature_max': 40, 'humidity_max': 60, 'current_max': 5,
+        'risk_critical': 0.8, 'risk_high': 0.6
+    }, {'temperature': 0.4, 'humidity': 0.2, 'current': 0.4})
+    perfiles = [reglas.PERFIL_GLOBAL, estricto]
+    rng = np.random.default_rng(1)
+    t = rng.uniform(20, 90, 200)
+    h = rng.uniform(30, 95, 200)
+    c = rng.uniform(-20, 20, 200)
+    indices = rng.integers(0, 2, 200)
+    niveles = np.array([
+        perfiles[i].nivel(perfiles[i].puntaje(t[k], h[k], c[k])) for k, i in enumerate(indices)
+    ])
+
+    matriz = reglas.alertas_lote(t, h, c, niveles, perfiles, indices)
+
+    tipos = [tipo for tipo, _, _ in reglas.ALERTAS]
+    for k, i in enumerate(indices):
+        alertas = perfiles[i].alertas(t[k], h[k], c[k], niveles[k])
+        assert [tipos[j] for j in np.flatnonzero(matriz[k])] == [a['type'] for a in alertas]
+
+
+def test_mensajes_de_la_tabla_de_alertas():
+    alertas = reglas.PERFIL_GLOBAL.alertas(1000, 0, -1000, 'critical')
+    assert [(a['type'], a['severity'], a['message'], a['value']) for a in alertas] == [
+        ('high_temperature', 'critical', 'Temperatura crítica: 1000°C', 1000),
+        ('high_current', 'critical', 'Corriente anormal: -1000A', 1000),
+        ('system_failure_risk', 'critical', 'Riesgo crítico de fallo del sistema', None),
+    ]
@@ -0,0 +1,108 @@
+import pytest
+
+import replicas
+
+
+class Cursor:
+    def __init__(self, fila):
+        self.fila = fila
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql):
+        pass
+
+    def fetchone(self):
+        return self.fila
+
+
+class Conexion:
+    def __init__(self, replica, fila):
+        self.replica = replica
+        self.fila = fila
+        self.cerrada = False
+
+    def cursor(self):
+        return Cursor(self.fila)
+
+    def close(self):
+        self.cerrada = True
+
+
+@pytest.fixture(autouse=True)
+def escrituras(monkeypatch):
+    monkeypatch.setattr(replicas, '_escrituras', replicas.OrderedDict())
+    monkeypatch.setitem(replicas.REPLICA_CONFIG, 'read_your_writes', 10)
+    monkeypatch.setitem(replicas.REPLICA_CONFIG, 'max_lag', 5)
+
+
+def _con_replicas(monkeypatch, retrasos):
+    """Replicas falsas; retrasos: Seconds_Behind_Source de cada una (None = detenida)"""
+    lista = [replicas.Replica(f'r{i}', 3306) for i in range(len(retrasos))]
+    abiertas = []
+
+    def conectar(replica):
+        retraso = retrasos[lista.index(replica)]
+        conexion = Conexion(replica, {'Seconds_Behind_Source': retraso})
+        abiertas.append(conexion)
+        return conexion
+
+    monkeypatch.setattr(replicas.Replica, 'conectar', conectar)
+    monkeypatch.setattr(replicas, '_replicas', lista)
+    monkeypatch.setattr(replicas, '_turno', replicas.itertools.count())
+    return lista, abiertas
+
+
+def test_lee_lo_propio_desde_el_primario(monkeypatch, reloj):
+    _con_replicas(monkeypatch, [0])
+    replicas.registrar_escritura('cliente')
+
+    replicas.iniciar_request('cliente')
+    assert replicas.conexion_lectura() is None
+
+    replicas.iniciar_request('otro')
+    assert replicas.conexion_lectura() is not None
+
+    reloj.ahora += 11
+    replicas.iniciar_request('cliente')
+    assert replicas.conexion_lectura() is not None
+    assert 'cliente' not in replicas._escrituras
+
+
+def test_sin_replicas_no_registra(monkeypatch, reloj):
+    monkeypatch.setattr(replicas, '_replicas', [])
+    replicas.registrar_escritura('cliente')
+    assert not replicas._escrituras
+    replicas.iniciar_request('cliente')
+    assert replicas.conexion_lectura() is None
+
+
+def test_salta_replicas_atrasadas_o_detenidas(monkeypatch, reloj):
+    lista, abiertas = _con_replicas(monkeypatch, [None, 30, 1])
+    replicas.iniciar_request(None)
+
+    conexion = replicas.conexion_lectura()
+    assert conexion.replica is lista[2]
+    assert [c.cerrada for c in abiertas] == [True, True, False]
+    assert [r.retraso for r in lista] == [None, 30, 1]
+
+
+def test_todas_atrasadas_va_al_primario(monkeypatch, reloj):
+    _, abiertas = _con_replicas(monkeypatch, [30, 30])
+    replicas.iniciar_request(None)
+    assert replicas.conexion_lectura() is None
+    assert all(c.cerrada for c in abiertas)
+
+
+def test_por_turnos_y_sin_la_caida(monkeypatch, reloj):
+    lista, _ = _con_replicas(monkeypatch, [0, 0, 0])
+    replicas.iniciar_request(None)
+    assert [replicas.conexion_lectura().replica for _ in range(3)] == lista
+
+    for _ in range(replicas.REPLICA_CONFIG['failure_threshold']):
+        lista[1].breaker.fallo()
+    assert [replicas.conexion_lectura().replica for _ in range(3)] == [lista[0], lista[2], lista[2]]
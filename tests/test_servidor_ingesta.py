@@ -0,0 +1,85 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import servidor_ingesta
+
+
+@pytest.mark.parametrize('linea', [
+    'E1,20.5,60,1.5',
+    'E1,20.5,60,1.5,',
+    ' E1 , 20.5 , 60 , 1.5 \n',
+])
+def test_parsear_linea(linea):
+    assert servidor_ingesta.parsear_linea(linea) == ('E1', 20.5, 60.0, 1.5, None, None)
+
+
+def test_parsear_linea_con_timestamp_y_seq():
+    equipo, _, _, _, timestamp, seq = servidor_ingesta.parsear_linea('E1,1,2,3,1700000000.250,42')
+    assert equipo == 'E1'
+    assert timestamp.timestamp() == pytest.approx(1700000000.25)
+    assert seq == 42
+
+
+@pytest.mark.parametrize('linea', [
+    'E1,1,2',
+    'E1,1,2,3,4,5,6',
+    ',1,2,3',
+    'E' * 51 + ',1,2,3',
+    'E1,nan,2,3',
+    'E1,1,inf,3',
+    'E1,1,2,-inf',
+    'E1,1,2,abc',
+    'E1,1,2,3,1e20',
+    'E1,1,2,3,nan',
+    'E1,1,2,3,1700000000,siete',
+])
+def test_parsear_linea_invalida(linea):
+    with pytest.raises(ValueError):
+        servidor_ingesta.parsear_linea(linea)
+
+
+def test_responde_err_sin_encolar():
+    servidor = servidor_ingesta.ServidorIngesta(dict(servidor_ingesta.INGEST_SERVER_CONFIG))
+    servidor.cola = asyncio.Queue()
+    assert servidor.encolar_linea('E1,nan,2,3').startswith('ERR')
+    assert servidor.cola.empty()
+    assert servidor.estadisticas['invalidas'] == 1
+
+
+def test_lotes_en_paralelo(monkeypatch):
+    monkeypatch.setattr(servidor_ingesta.limites, 'permitir', lambda equipo_id, n=1: (True, 0.0))
+    config = dict(servidor_ingesta.INGEST_SERVER_CONFIG, host='127.0.0.1', udp_port=0, tcp_port=0,
+                  workers=4, batch_size=5, batch_interval=0.05)
+    lotes = []
+    hilos = set()
+    lock = threading.Lock()
+
+    def procesar(lote):
+        time.sleep(0.3)
+        with lock:
+            lotes.append(len(lote))
+            hilos.add(threading.get_ident())
+        return [{'ok': True}] * (len(lote) - 1) + [None]
+
+    async def correr():
+        servidor = servidor_ingesta.ServidorIngesta(config, procesar)
+        await servidor.iniciar()
+        inicio = time.monotonic()
+        for i in range(20):
+            assert servidor.encolar_linea(f'E{i},1,2,3,,{i}') == 'OK'
+        while servidor.estadisticas['procesadas'] + servidor.estadisticas['errores'] < 20:
+            await asyncio.sleep(0.01)
+        transcurrido = time.monotonic() - inicio
+        await servidor.detener()
+        return servidor.estadisticas, transcurrido
+
+    estadisticas, transcurrido = asyncio.run(asyncio.wait_for(correr(), 10))
+    assert lotes == [5, 5, 5, 5]
+    # Cuatro lotes de 0.3s a la vez, no uno detras de otro (1.2s)
+    assert transcurrido < 0.9
+    assert len(hilos) == 4
+    assert estadisticas['procesadas'] == 16
+    assert estadisticas['errores'] == 4
@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+import sesiones
+
+
+@pytest.fixture(autouse=True)
+def sin_bd(monkeypatch):
+    # Sin BD se usan el rol y el equipo del token
+    monkeypatch.setattr(sesiones.models, 'get_usuario_sesion', lambda usuario_id: None)
+    sesiones.invalidar()
+    yield
+    sesiones.invalidar()
+
+
+def test_token_valido():
+    token = sesiones.crear_token(7, 'operador', 'EQ_1')
+    assert sesiones.verificar(token) == {'id': 7, 'rol': 'operador', 'equipo_id': 'EQ_1'}
+
+
+def test_token_con_contenido_alterado():
+    contenido, _, firma = sesiones.crear_token(7, 'operador', 'EQ_1').partition('.')
+    datos = json.loads(sesiones._de_b64(contenido))
+    datos['rol'] = 'admin'
+    falso = sesiones._b64(json.dumps(datos).encode('utf-8'))
+    assert sesiones.verificar(f'{falso}.{firma}') is None
+
+
+def test_token_firmado_con_otro_secreto(monkeypatch):
+    monkeypatch.setattr(sesiones, '_secreto', b'otro secreto')
+    token = sesiones.crear_token(7, 'admin')
+    monkeypatch.undo()
+    assert sesiones.verificar(token) is None
+
+
+@pytest.mark.parametrize('token', ['', 'sin-punto', 'a.b', '%%%.%%%'])
+def test_token_mal_formado(token):
+    assert sesiones.verificar(token) is None
+
+
+def test_token_vencido(monkeypatch):
+    token = sesiones.crear_token(7, 'admin')
+    ahora = sesiones.time.time()
+    monkeypatch.setattr(sesiones.time, 'time', lambda: ahora + sesiones.SESSION_CONFIG['ttl'] + 1)
+    assert sesiones.verificar(token) is None
+
+
+def test_rol_vigente_de_la_bd(monkeypatch):
+    token = sesiones.crear_token(7, 'admin', None)
+    monkeypatch.setattr(sesiones.models, 'get_usuario_sesion',
+                        lambda usuario_id: {'rol': 'operador', 'equipo_id': 'EQ_2'})
+    assert sesiones.verificar(token) == {'id': 7, 'rol': 'operador', 'equipo_id': 'EQ_2'}
+
+
+def test_usuario_borrado(monkeypatch):
+    token = sesiones.crear_token(7, 'admin')
+    monkeypatch.setattr(sesiones.models, 'get_usuario_sesion', lambda usuario_id: False)
+    assert sesiones.verificar(token) is None
+
+
+def test_puede_gestionar():
+    assert sesiones.puede_gestionar({'rol': 'admin'})
+    assert not sesiones.puede_gestionar({'rol': 'operador'})
+    assert not sesiones.puede_gestionar(None)
@@ -0,0 +1,93 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import replicas
+import shards
+
+
+@pytest.fixture
+def tres_shards(monkeypatch):
+    monkeypatch.setattr(shards, 'TOTAL', 3)
+    monkeypatch.setattr(shards, '_anillo', shards.Anillo(3, 64))
+    monkeypatch.setattr(shards, '_ubicaciones', {})
+    monkeypatch.setitem(shards.SHARD_CONFIG, 'id_stride', 16)
+    monkeypatch.setitem(shards.SHARD_CONFIG, 'id_base', 0)
+
+
+EQUIPOS = [f'ESP32_{i:04d}' for i in range(3000)]
+
+
+def test_un_shard_todo_al_cero():
+    if shards.activo():
+        pytest.skip('MYSQL_SHARDS configurado')
+    assert shards.shard_de('ESP32_001') == 0
+    assert shards.shard_de_id(12345) == 0
+
+
+def test_shard_de_es_estable_y_reparte(tres_shards):
+    asignados = [shards.shard_de(e) for e in EQUIPOS]
+    assert asignados == [shards.shard_de(e) for e in EQUIPOS]
+    for shard in range(3):
+        # Con 64 nodos virtuales ningun shard queda lejos de un tercio
+        assert 0.2 < asignados.count(shard) / len(EQUIPOS) < 0.47
+    assert shards.shard_de(None) == 0
+
+
+def test_agregar_un_shard_solo_mueve_hacia_el_nuevo():
+    antes = shards.Anillo(3, 64)
+    despues = shards.Anillo(4, 64)
+    movidos = [e for e in EQUIPOS if antes.shard(e) != despues.shard(e)]
+    assert all(despues.shard(e) == 3 for e in movidos)
+    assert 0.1 < len(movidos) / len(EQUIPOS) < 0.4
+
+
+def test_ubicacion_fijada_tiene_prioridad(tres_shards, monkeypatch):
+    equipo = EQUIPOS[0]
+    otro = (shards.shard_de_hash(equipo) + 1) % 3
+    monkeypatch.setattr(shards, '_ubicaciones', {equipo: otro, EQUIPOS[1]: 9})
+    assert shards.shard_de(equipo) == otro
+    # Un shard que ya no existe se ignora
+    assert shards.shard_de(EQUIPOS[1]) == shards.shard_de_hash(EQUIPOS[1])
+
+
+def _ids_de(shard, base, stride, cantidad):
+    """Ids que genera MySQL con auto_increment_increment=stride y offset=shard+1 desde base"""
+    primero = base + 1 + (shard - base) % stride
+    return [primero + k * stride for k in range(cantidad)]
+
+
+@pytest.mark.parametrize('base', [0, 1000, 1005])
+def test_ids_intercalados(tres_shards, monkeypatch, base):
+    monkeypatch.setitem(shards.SHARD_CONFIG, 'id_base', base)
+    vistos = set()
+    for shard in range(3):
+        ids = _ids_de(shard, base, 16, 50)
+        assert all(i > base for i in ids)
+        assert [shards.shard_de_id(i) for i in ids] == [shard] * 50
+        assert not vistos & set(ids)
+        vistos.update(ids)
+    # Lo anterior a los shards queda en el shard 0 aunque el resto no coincida
+    assert [shards.shard_de_id(i) for i in range(1, base + 1)] == [0] * base
+
+
+def test_id_de_un_shard_inexistente(tres_shards):
+    assert shards.shard_de_id(10) == 0      # offset 10: no hay shard 9
+
+
+def test_mezclar_ordenado_y_con_limite():
+    listas = [[9, 5, 1], [8, 2], [], [7, 6, 3]]
+    assert shards.mezclar(listas, clave=lambda x: x) == [9, 8, 7, 6, 5, 3, 2, 1]
+    assert shards.mezclar(listas, clave=lambda x: x, limite=3) == [9, 8, 7]
+    assert shards.mezclar([[1, 4], [2, 3]], clave=lambda x: x, descendente=False) == [1, 2, 3, 4]
+
+
+def test_en_paralelo_conserva_el_contexto(tres_shards, monkeypatch):
+    monkeypatch.setattr(shards, '_pool', ThreadPoolExecutor(max_workers=3))
+    token = replicas._solo_primario.set(True)
+    try:
+        resultado = shards.en_paralelo(lambda shard: (shard, replicas._solo_primario.get()))
+    finally:
+        replicas._solo_primario.reset(token)
+        shards._pool.shutdown()
+    assert resultado == [(0, True), (1, True), (2, True)]
@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+import spool
+
+
+@pytest.fixture
+def archivo(tmp_path, monkeypatch):
+    monkeypatch.setitem(spool.RESILIENCE_CONFIG, 'replay_batch', 2)
+    ruta = tmp_path / 'reenvio.1.1.jsonl'
+    with open(ruta, 'w', encoding='utf-8') as f:
+        for i in range(5):
+            f.write(json.dumps({'equipo_id': 'eq', 'temperature': i}) + '\n')
+    return ruta
+
+
+def _temperaturas(ruta):
+    with open(ruta, encoding='utf-8') as f:
+        return [json.loads(linea)['temperature'] for linea in f]
+
+
+def test_reenvio_completo_borra_el_archivo(archivo, monkeypatch):
+    enviados = []
+    monkeypatch.setattr(spool, '_reenviar_bloque', lambda filas: enviados.extend(filas) or True)
+    assert spool._reenviar_archivo(str(archivo))
+    assert [f['temperature'] for f in enviados] == [0, 1, 2, 3, 4]
+    assert not archivo.exists()
+
+
+def test_fallo_a_mitad_conserva_solo_lo_no_enviado(archivo, monkeypatch):
+    enviados = []
+
+    def reenviar_bloque(filas):
+        if filas[0]['temperature'] == 2:
+            return False
+        enviados.extend(filas)
+        return True
+
+    monkeypatch.setattr(spool, '_reenviar_bloque', reenviar_bloque)
+    assert not spool._reenviar_archivo(str(archivo))
+    assert _temperaturas(archivo) == [2, 3, 4]
+
+    # El siguiente intento no repite los bloques ya guardados
+    monkeypatch.setattr(spool, '_reenviar_bloque', lambda filas: enviados.extend(filas) or True)
+    assert spool._reenviar_archivo(str(archivo))
+    assert [f['temperature'] for f in enviados] == [0, 1, 2, 3, 4]
+
+
+def test_fallo_en_el_ultimo_bloque(archivo, monkeypatch):
+    monkeypatch.setattr(spool, '_reenviar_bloque', lambda filas: filas[0]['temperature'] != 4)
+    assert not spool._reenviar_archivo(str(archivo))
+    assert _temperaturas(archivo) == [4]
@@ -0,0 +1,73 @@
+import pytest
+
+import versiones
+
+
+@pytest.fixture
+def compartidas(tmp_path, monkeypatch):
+    ruta = str(tmp_path / 'versiones.bin')
+    abiertas = []
+
+    def abrir(conjuntos=4):
+        c = versiones._Compartidas(ruta, conjuntos)
+        abiertas.append(c)
+        return c
+
+    monkeypatch.setattr(versiones, '_compartidas', abrir())
+    yield abrir
+    for c in abiertas:
+        c.cerrar()
+
+
+def test_sin_archivo_no_hay_etag(monkeypatch):
+    monkeypatch.setattr(versiones, '_compartidas', None)
+    versiones.registrar_lectura('EQ_1')
+    assert versiones.etag('dashboard', versiones.token_lecturas('EQ_1')) is None
+
+
+def test_escrituras_cambian_solo_el_etag_del_equipo(compartidas):
+    antes_1 = versiones.etag('dashboard', versiones.token_lecturas('EQ_1'), versiones.token_alertas('EQ_1'))
+    antes_2 = versiones.etag('dashboard', versiones.token_lecturas('EQ_2'), versiones.token_alertas('EQ_2'))
+    versiones.registrar_lectura('EQ_1')
+    versiones.registrar_cambio_alertas('EQ_1')
+    assert versiones.etag('dashboard', versiones.token_lecturas('EQ_1'), versiones.token_alertas('EQ_1')) != antes_1
+    assert versiones.etag('dashboard', versiones.token_lecturas('EQ_2'), versiones.token_alertas('EQ_2')) == antes_2
+
+
+def test_alertas_sin_equipo_cambian_todos(compartidas):
+    antes = versiones.token_alertas('EQ_1')
+    versiones.registrar_cambio_alertas()
+    assert versiones.token_alertas('EQ_1') != antes
+
+
+def test_contadores_compartidos_entre_procesos(compartidas):
+    otro = compartidas()   # otro proceso abre el mismo archivo
+    antes = versiones.etag('alertas', versiones.token_alertas('EQ_1'))
+    otro.registrar((versiones.ALERTAS,), versiones._clave('EQ_1'), alertas=1)
+    assert versiones.etag('alertas', versiones.token_alertas('EQ_1')) != antes
+
+
+def test_etag_sobrevive_a_un_reinicio(compartidas, monkeypatch):
+    versiones.registrar_lectura('EQ_1')
+    antes = versiones.etag('dashboard', versiones.token_lecturas('EQ_1'))
+    monkeypatch.setattr(versiones, '_compartidas', compartidas())
+    assert versiones.etag('dashboard', versiones.token_lecturas('EQ_1')) == antes
+
+
+def test_reemplazar_un_equipo_cambia_todos_los_etag(compartidas, monkeypatch):
+    monkeypatch.setattr(versiones, '_compartidas', compartidas(conjuntos=1))
+    for i in range(versiones.POR_CONJUNTO):
+        versiones.registrar_lectura(f'EQ_{i}')
+    antes = versiones.etag('dashboard', versiones.token_lecturas('EQ_1'))
+    versiones.registrar_lectura('EQ_nuevo')
+    assert versiones.etag('dashboard', versiones.token_lecturas('EQ_1')) != antes
+
+
+def test_conectados_cuenta_lecturas_recientes(compartidas, monkeypatch):
+    monkeypatch.setitem(versiones.FLEET_CONFIG, 'online_segundos', 30)
+    ahora = versiones.time.time()
+    versiones.registrar_lectura('EQ_1', ahora)
+    versiones.registrar_lectura('EQ_2', ahora - 60)
+    assert versiones.token_conectados() == 'c1'
+    monkeypatch.setattr(versiones.time, 'time', lambda: ahora + 31)
+    assert versiones.token_conectados() == 'c0'
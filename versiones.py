@@ -0,0 +1,249 @@
+"""
+Tokens de version para respuestas condicionales (ETag).
+
+Las rutas de escritura (ingesta, alertas, equipos) incrementan contadores
+que viven en un archivo mapeado en memoria (ETAG_CONFIG['archivo']), como
+los baldes de limites.py: los comparten todos los procesos del host
+(workers de gunicorn, servidor_ingesta.py, reenvio del spool) y
+sobreviven a los reinicios, asi que un ETag vale igual en cualquier
+worker y una ruta responde 304 sin consultar la BD.
+
+El archivo tiene:
+- una cabecera con una epoca aleatoria (se elige al crear el archivo: si
+  se borra, los ETag anteriores dejan de coincidir), los contadores de la
+  flota y un contador general que cambia todos los ETag (lo incrementan
+  recalcular.py, rebalancear.py y datos_sinteticos.py, que escriben en la
+  BD por su cuenta),
+- una entrada por equipo (asociativa de a 4, como limites.py) con sus
+  contadores y la hora de su ultima lectura; al reemplazar la entrada de
+  un equipo se incrementa el contador general, para que sus contadores
+  vuelvan a empezar sin repetir un ETag.
+
+Lo que depende del reloj se deriva de la hora de la ultima lectura: el
+campo 'online' de /api/equipos/todos entra en su ETag como la cantidad de
+equipos con lecturas en FLEET_CONFIG['online_segundos']. El pronostico
+del dashboard cambia con las lecturas; entre lecturas el cliente
+descuenta el tiempo transcurrido.
+
+Sin fcntl (Windows) o sin el archivo no hay ETag: las rutas responden
+siempre completo. Las escrituras de otro host no se ven en este archivo.
+"""
+import hashlib
+import mmap
+import os
+import secrets
+import struct
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:     # Windows: sin ETag
+    fcntl = None
+
+from config import ETAG_CONFIG, FLEET_CONFIG
+
+# Cabecera: epoca, lecturas, alertas, equipos, alertas sin equipo, general
+CABECERA = struct.Struct('<QQQQQQ')
+LECTURAS, ALERTAS, EQUIPOS, ALERTAS_SIN_EQUIPO, GENERAL = range(1, 6)
+
+# Entrada de un equipo: (clave, lecturas, alertas, ultima lectura); clave 0 = libre
+ENTRADA = struct.Struct('<QQQd')
+POR_CONJUNTO = 4
+CONJUNTO = ENTRADA.size * POR_CONJUNTO
+_TIPO_ENTRADA = np.dtype([('clave', '<u8'), ('lecturas', '<u8'), ('alertas', '<u8'), ('ultima', '<f8')])
+
+
+class _Compartidas:
+    """Contadores de version en un archivo mapeado, compartidos por los procesos del host"""
+
+    def __init__(self, ruta, conjuntos):
+        self.conjuntos = conjuntos
+        tamano = CABECERA.size + CONJUNTO * conjuntos
+        self.fd = os.open(ruta, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.lockf(self.fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self.fd).st_size < tamano:
+                os.ftruncate(self.fd, tamano)
+            self.memoria = mmap.mmap(self.fd, tamano)
+            if not CABECERA.unpack_from(self.memoria, 0)[0]:
+                struct.pack_into('<Q', self.memoria, 0, secrets.randbits(63) + 1)
+        finally:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN)
+        # lockf bloquea entre procesos; los hilos del mismo proceso lo comparten
+        self.hilos = threading.Lock()
+
+    def _incrementar(self, *campos):
+        """Incrementa campos de la cabecera (con self.hilos tomado)"""
+        fcntl.lockf(self.fd, fcntl.LOCK_EX, CABECERA.size, 0)
+        try:
+            valores = list(CABECERA.unpack_from(self.memoria, 0))
+            for campo in campos:
+                valores[campo] += 1
+            CABECERA.pack_into(self.memoria, 0, *valores)
+        finally:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN, CABECERA.size, 0)
+
+    def _entrada(self, clave, lecturas=0, alertas=0, ultima=None):
+        """
+        Suma a los contadores de la entrada de la clave (la crea si falta)
+        y retorna (lecturas, alertas); sin incrementos no crea la entrada
+        """
+        inicio = CABECERA.size + (clave % self.conjuntos) * CONJUNTO
+        crear = bool(lecturas or alertas)
+        fcntl.lockf(self.fd, fcntl.LOCK_EX, CONJUNTO, inicio)
+        try:
+            candidato = None
+            for offset in range(inicio, inicio + CONJUNTO, ENTRADA.size):
+                guardada, l, a, u = ENTRADA.unpack_from(self.memoria, offset)
+                if guardada == clave:
+                    break
+                # Para una clave nueva: una entrada libre o la de ultima lectura mas vieja
+                orden = -1.0 if guardada == 0 else u
+                if candidato is None or orden < candidato[2]:
+                    candidato = (offset, guardada, orden)
+            else:
+                if not crear:
+                    return 0, 0
+                offset, l, a, u = candidato[0], 0, 0, 0.0
+                if candidato[1]:
+                    # Los contadores del equipo reemplazado se pierden
+                    self._incrementar(GENERAL)
+            l += lecturas
+            a += alertas
+            if ultima is not None:
+                u = max(u, ultima)
+            if crear:
+                ENTRADA.pack_into(self.memoria, offset, clave, l, a, u)
+            return l, a
+        finally:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN, CONJUNTO, inicio)
+
+    def registrar(self, campos, clave=None, lecturas=0, alertas=0, ultima=None):
+        with self.hilos:
+            if clave is not None:
+                self._entrada(clave, lecturas, alertas, ultima)
+            if campos:
+                self._incrementar(*campos)
+
+    def cabecera(self):
+        with self.hilos:
+            return CABECERA.unpack_from(self.memoria, 0)
+
+    def equipo(self, clave):
+        with self.hilos:
+            return self._entrada(clave)
+
+    def conectados(self, desde):
+        """Cantidad de equipos con una lectura posterior a desde"""
+        entradas = np.frombuffer(self.memoria, dtype=_TIPO_ENTRADA, offset=CABECERA.size)
+        try:
+            return int(np.count_nonzero((entradas['clave'] != 0) & (entradas['ultima'] > desde)))
+        finally:
+            del entradas   # el mmap no se puede cerrar con vistas vivas
+
+    def cerrar(self):
+        self.memoria.close()
+        os.close(self.fd)
+
+
+def _abrir_compartidas():
+    if fcntl is None or not ETAG_CONFIG['archivo']:
+        return None
+    try:
+        conjuntos = max(1, ETAG_CONFIG['max_equipos'] // POR_CONJUNTO)
+        return _Compartidas(ETAG_CONFIG['archivo'], conjuntos)
+    except OSError as e:
+        print(f"[Versiones] Sin contadores compartidos ({e}), no se emiten ETag")
+        return None
+
+
+_compartidas = _abrir_compartidas()
+
+
+def _clave(equipo_id):
+    clave = int.from_bytes(hashlib.blake2b(equipo_id.encode('utf-8'), digest_size=8).digest(), 'little')
+    return clave or 1
+
+
+def _segundos(timestamp):
+    if timestamp is None:
+        return time.time()
+    if isinstance(timestamp, datetime):
+        return timestamp.timestamp()
+    return float(timestamp)
+
+
+def registrar_lectura(equipo_id, timestamp=None):
+    """Marca que el equipo recibio una lectura nueva (timestamp: hora de la lectura)"""
+    if _compartidas is not None:
+        _compartidas.registrar((LECTURAS,), _clave(equipo_id), lecturas=1, ultima=_segundos(timestamp))
+
+
+def registrar_cambio_alertas(equipo_id=None):
+    """Marca un cambio en las alertas de un equipo (o de todos si es None)"""
+    if _compartidas is None:
+        return
+    if equipo_id is None:
+        _compartidas.registrar((ALERTAS, ALERTAS_SIN_EQUIPO))
+    else:
+        _compartidas.registrar((ALERTAS,), _clave(equipo_id), alertas=1)
+
+
+def registrar_cambio_equipos():
+    """Marca un cambio en el registro de equipos"""
+    if _compartidas is not None:
+        _compartidas.registrar((EQUIPOS,))
+
+
+def registrar_cambio_general():
+    """Invalida todos los ETag (escrituras que no pasan por las rutas de arriba)"""
+    if _compartidas is not None:
+        _compartidas.registrar((GENERAL,))
+
+
+def token_lecturas(equipo_id=None):
+    """Version de las lecturas de un equipo o de toda la flota"""
+    if _compartidas is None:
+        return None
+    if equipo_id is None:
+        return f"l{_compartidas.cabecera()[LECTURAS]}"
+    return f"l{_compartidas.equipo(_clave(equipo_id))[0]}"
+
+
+def token_alertas(equipo_id=None):
+    """Version de las alertas de un equipo o de toda la flota"""
+    if _compartidas is None:
+        return None
+    cabecera = _compartidas.cabecera()
+    if equipo_id is None:
+        return f"a{cabecera[ALERTAS]}"
+    return f"a{cabecera[ALERTAS_SIN_EQUIPO]}.{_compartidas.equipo(_clave(equipo_id))[1]}"
+
+
+def token_equipos():
+    """Version del registro de equipos"""
+    if _compartidas is None:
+        return None
+    return f"e{_compartidas.cabecera()[EQUIPOS]}"
+
+
+def token_conectados():
+    """Cantidad de equipos online (cambia cuando uno deja de enviar lecturas)"""
+    if _compartidas is None:
+        return None
+    return f"c{_compartidas.conectados(time.time() - FLEET_CONFIG['online_segundos'])}"
+
+
+def etag(recurso, *tokens):
+    """
+    Construye el ETag de un recurso a partir de sus tokens de version
+    Retorna None si no hay contadores compartidos
+    """
+    if _compartidas is None:
+        return None
+    cabecera = _compartidas.cabecera()
+    return '-'.join((f"{cabecera[0]:x}", recurso, f"g{cabecera[GENERAL]}") + tuple(str(t) for t in tokens))